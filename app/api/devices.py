@@ -4,9 +4,13 @@ from django.urls import reverse
 from constance import config
 from django.http import JsonResponse, HttpResponseBadRequest
 from django.views.decorators.csrf import csrf_exempt
+import bisect
+import datetime
 import json
 from ..models import BeerLogPoint, BrewPiDevice
+from .. import binary_log
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from app.models import BrewPiDevice
 
@@ -79,3 +83,174 @@ def create_beer_log_point(request):
             return HttpResponseBadRequest(str(e))
     else:
         return JsonResponse({'status': 'method not allowed'}, status=405)
+
+
+# Points in the same window for a device (by log_time) share a single gravity enrichment
+GRAVITY_ENRICHMENT_WINDOW = 60  # seconds
+# Points older than GRAVITY_ENRICHMENT_WINDOW (e.g. sent from a spool) are enriched with the gravity reading logged
+# nearest to them rather than the sensor's latest reading - or with nothing, if no reading was logged this close to them
+GRAVITY_LOOKUP_LIMIT = 30 * 60  # seconds
+MAX_POINTS_PER_REQUEST = 10000
+
+
+def parse_log_time(value):
+    """Accepts ms since the epoch or an ISO 8601 string (assumed to be UTC if no timezone is given)"""
+    if value is None:
+        return timezone.now()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return binary_log.from_epoch_ms(value)
+    if isinstance(value, str):
+        log_time = parse_datetime(value)
+        if log_time is not None:
+            if timezone.is_naive(log_time):
+                log_time = timezone.make_aware(log_time, datetime.timezone.utc)
+            return log_time
+    raise ValueError("Invalid log_time '{}'".format(value))
+
+
+def logged_gravity_readings(beer, device_points: list) -> list:
+    """Returns the readings logged by a beer's gravity sensor around the time of a batch of points"""
+    if not beer.gravity_enabled or not beer.can_log_gravity():
+        return []
+    log_times = [point['log_time'] for point in device_points]
+    limit = datetime.timedelta(seconds=GRAVITY_LOOKUP_LIMIT)
+    return beer.device.gravity_sensor.retrieve_logged_readings(min(log_times) - limit, max(log_times) + limit)
+
+
+def nearest_gravity_reading(readings: list, log_time: datetime.datetime) -> tuple:
+    """
+    Returns the (gravity, temp, temp_format) of the reading nearest to log_time from a list of logged readings (see
+    GravitySensor.retrieve_logged_readings), or all None if there isn't one within GRAVITY_LOOKUP_LIMIT
+    """
+    index = bisect.bisect_left([reading[0] for reading in readings], log_time)
+    candidates = readings[max(index - 1, 0):index + 1]
+    if candidates:
+        nearest = min(candidates, key=lambda reading: abs(reading[0] - log_time))
+        if abs(nearest[0] - log_time).total_seconds() <= GRAVITY_LOOKUP_LIMIT:
+            return nearest[1:]
+    return None, None, None
+
+
+def build_beer_log_points(points_by_device: dict) -> (list, dict):
+    """
+    Turns validated points (grouped by BrewPiDevice ID, each with a parsed log_time) into unsaved BeerLogPoints for
+    each device's active beer, enriched with gravity data. Returns the list of points along with a per-device result
+    dict. Used by both create_beer_log_points and the log stream consumer (see app/log_stream.py).
+    """
+    # One lookup for all of the devices in the batch
+    devices = BrewPiDevice.objects.select_related('active_beer').in_bulk(list(points_by_device))
+
+    results = {}
+    to_save = []
+    now = timezone.now()
+    for device_id, device_points in points_by_device.items():
+        brewpi_device = devices.get(device_id)
+        if brewpi_device is None:
+            results[str(device_id)] = {'status': 'device not found', 'saved': 0}
+            continue
+        if brewpi_device.active_beer is None:
+            # Same as a single point - accepted, but there is nothing to log it to
+            results[str(device_id)] = {'status': 'not logging', 'saved': 0}
+            continue
+
+        gravity_by_window = {}
+        readings = None  # Only looked up if there are points too old for the sensor's latest reading
+        device_batch = []
+        try:
+            for point in device_points:
+                beer_log_point = BeerLogPoint(
+                    beer_temp=point.get('beer_temp'),
+                    beer_set=point.get('beer_set'),
+                    beer_ann=point.get('beer_ann'),
+                    fridge_temp=point.get('fridge_temp'),
+                    fridge_set=point.get('fridge_set'),
+                    fridge_ann=point.get('fridge_ann'),
+                    room_temp=point.get('room_temp'),
+                    state=point.get('state'),
+                    log_time=point['log_time'],
+                    temp_format=brewpi_device.temp_format,
+                    associated_beer=brewpi_device.active_beer,
+                )
+                window = int(point['log_time'].timestamp()) // GRAVITY_ENRICHMENT_WINDOW
+                if window not in gravity_by_window:
+                    if (now - point['log_time']).total_seconds() <= GRAVITY_ENRICHMENT_WINDOW:
+                        beer_log_point.enrich_gravity_data()
+                    else:
+                        if readings is None:
+                            readings = logged_gravity_readings(brewpi_device.active_beer, device_points)
+                        beer_log_point.enrich_gravity_data(nearest_gravity_reading(readings, point['log_time']))
+                    gravity_by_window[window] = (beer_log_point.gravity, beer_log_point.gravity_temp)
+                else:
+                    beer_log_point.gravity, beer_log_point.gravity_temp = gravity_by_window[window]
+                device_batch.append(beer_log_point)
+        except Exception as e:
+            results[str(device_id)] = {'status': str(e), 'saved': 0}
+            continue
+
+        to_save += device_batch
+        results[str(device_id)] = {'status': 'success', 'saved': len(device_batch)}
+
+    return to_save, results
+
+
+@csrf_exempt
+def create_beer_log_points(request):
+    """
+    Bulk version of create_beer_log_point, used by controllers to catch up after being offline (or to log more often
+    than one request per point allows). Accepts a JSON list of points - either as the body itself or as
+    {"points": [...]} - each with the same fields as a single point plus an optional log_time. Points for any number
+    of devices can be included, and are written out in the order they are given.
+
+    Responds with 201 if every point was saved (or the device isn't logging). Otherwise it responds with 207 along with
+    the indexes of the points that weren't saved: "failed" for those that can be sent again, and "rejected" for those
+    that can't (because their device doesn't exist).
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'method not allowed'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid JSON")
+    if isinstance(data, dict):
+        data = data.get('points')
+    if not isinstance(data, list) or not all(isinstance(point, dict) for point in data):
+        return HttpResponseBadRequest("Expected a list of points")
+    if not data:
+        return HttpResponseBadRequest("No points to save")
+    if len(data) > MAX_POINTS_PER_REQUEST:
+        return JsonResponse({'status': 'too many points', 'max_points': MAX_POINTS_PER_REQUEST}, status=413)
+
+    # Validate everything up front so that a bad point doesn't leave the batch half written
+    points_by_device, indexes_by_device = {}, {}
+    for index, point in enumerate(data):
+        try:
+            point['log_time'] = parse_log_time(point.get('log_time'))
+            device_id = int(point.get('brewpi_device_id'))
+        except (TypeError, ValueError) as e:
+            return HttpResponseBadRequest("Point {}: {}".format(index, e))
+        points_by_device.setdefault(device_id, []).append(point)
+        indexes_by_device.setdefault(device_id, []).append(index)
+
+    to_save, results = build_beer_log_points(points_by_device)
+
+    if not any(result['status'] != 'device not found' for result in results.values()):
+        return JsonResponse({'status': 'device not found', 'devices': results}, status=404)
+
+    try:
+        saved = BeerLogPoint.save_points(to_save)
+    except Exception as e:
+        return HttpResponseBadRequest(str(e))
+
+    failed, rejected = [], []
+    for device_id, indexes in indexes_by_device.items():
+        device_status = results[str(device_id)]['status']
+        if device_status == 'device not found':
+            rejected += indexes
+        elif device_status not in ['success', 'not logging']:
+            failed += indexes
+
+    if failed or rejected:
+        return JsonResponse({'status': 'partial', 'saved': saved, 'devices': results, 'failed': sorted(failed),
+                             'rejected': sorted(rejected)}, status=207)
+    return JsonResponse({'status': 'success', 'saved': saved, 'devices': results}, status=201)
@@ -12,7 +12,9 @@ def getLCDs(req):
         ret.append({"device_name": dev.device_name, "lcd_data": dev.read_lcd(),
                     'device_url': reverse('device_dashboard', kwargs={'device_id': dev.id,}),
                     'backlight_url': reverse('device_toggle_backlight', kwargs={'device_id': dev.id,}),
-                    'modal_name': '#tempControl{}'.format(dev.id)})
+                    'modal_name': '#tempControl{}'.format(dev.id),
+                    # Seconds since BrewPi-Script published the data (None if it was read from the script directly)
+                    'data_age': dev.state_snapshot_age()})
     return JsonResponse(ret, safe=False, json_dumps_params={'indent': 4})
 
 
@@ -23,7 +25,8 @@ def getLCD(req, device_id):
         ret.append({"device_name": dev.device_name, "lcd_data": dev.read_lcd(),
                     'device_url': reverse('device_dashboard', kwargs={'device_id': device_id, }),
                     'backlight_url': reverse('device_toggle_backlight', kwargs={'device_id': device_id, }),
-                    'modal_name': f'#tempControl{device_id}'})
+                    'modal_name': f'#tempControl{device_id}',
+                    'data_age': dev.state_snapshot_age()})
     except BrewPiDevice.DoesNotExist:
         ret.append({"device_name": "N/A", "lcd_data": ["Device is no longer", "installed or ID is", "invalid. Please",
                                                        "refresh this page"],
@@ -48,14 +51,14 @@ def getPanel(req, device_id):
         # We were given an invalid panel number - Just send back the equivalent of null data
         null_temp = temp_text(0, config.TEMPERATURE_FORMAT)
         ret.append({'beer_temp': null_temp, 'fridge_temp': null_temp, 'room_temp': null_temp, 'control_mode': "--",
-                    'log_interval': 0})
+                    'log_interval': 0, 'spooled_points': 0, 'data_age': None})
         return JsonResponse(ret, safe=False, json_dumps_params={'indent': 4})
 
     if device_info is None:
         # We were unable to communicate with the device (get_dashpanel_info returned None)
         null_temp = temp_text(0, config.TEMPERATURE_FORMAT)
         ret.append({'beer_temp': null_temp, 'fridge_temp': null_temp, 'room_temp': null_temp, 'control_mode': "--",
-                    'log_interval': 0})
+                    'log_interval': 0, 'spooled_points': 0, 'data_age': None})
         return JsonResponse(ret, safe=False, json_dumps_params={'indent': 4})
 
     if device_info['Mode'] == "o":
@@ -83,6 +86,10 @@ def getPanel(req, device_id):
                 'fridge_temp': temp_text(device_info['FridgeTemp'], dev.temp_format),
                 'room_temp': temp_text(device_info['RoomTemp'], dev.temp_format),
                 'control_mode': device_mode,
-                'log_interval': interval_text})
+                'log_interval': interval_text,
+                # Log points BrewPi-Script is holding on to until they can be saved (older versions don't report this)
+                'spooled_points': device_info.get('SpoolDepth', 0),
+                # Seconds since BrewPi-Script published the data (None if it was read from the script directly)
+                'data_age': dev.state_snapshot_age()})
 
     return JsonResponse(ret, safe=False, json_dumps_params={'indent': 4})
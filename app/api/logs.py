@@ -0,0 +1,185 @@
+import re
+
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, StreamingHttpResponse, \
+    JsonResponse
+
+from app.models import Beer
+from app import binary_log, log_archive, log_index, log_rollups, tasks
+
+
+def log_csv_export_response(log, columns: list = None):
+    """
+    Streams a CSV generated on demand from the binary log for a Beer or GravityLog. Logs that predate the binary store
+    are converted in the background, and a 503 is returned in the meantime.
+    """
+    if not binary_log.exists(log):
+        if not log_archive.exists(log.log_file_paths()['base_csv']):
+            return HttpResponse("No data has been logged", status=404, content_type="text/plain")
+        tasks.schedule_log_build(log)
+        response = HttpResponse("This log is being prepared for export - try again shortly", status=503,
+                                content_type="text/plain")
+        response['Retry-After'] = "30"
+        return response
+    response = StreamingHttpResponse(binary_log.export_csv(log, columns), content_type="text/csv")
+    response['Content-Disposition'] = 'attachment; filename="{}.csv"'.format(log.base_filename())
+    return response
+
+
+def _int_param(req, name: str, default=None):
+    try:
+        return int(req.GET[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def log_graph_response(req, log):
+    """
+    Returns graph data (matching the base CSV) for a Beer or GravityLog at the resolution that best fits the pixel width
+    and time window requested. Accepts width, start & end (ms since the epoch) and bars (for Dygraph's customBars).
+    """
+    width = min(max(_int_param(req, 'width', 1000), 100), 10000)
+    if not log_rollups.rollups_exist(log.log_file_paths()):
+        tasks.schedule_log_build(log)  # The whole base CSV is returned in the meantime
+    rows = log_rollups.graph_rows(log, width, start=_int_param(req, 'start'), end=_int_param(req, 'end'),
+                                  bars=req.GET.get('bars', '') == '1')
+    return StreamingHttpResponse(rows, content_type="text/csv")
+
+
+def log_range_response(req, log, which: str):
+    """
+    Streams the rows of one of the CSVs for a Beer or GravityLog between start and end (ms since the epoch, either of
+    which can be omitted) using the log's time index rather than reading the whole file
+    """
+    if not log_archive.exists(log.log_file_paths()[which]):
+        return HttpResponse("No data has been logged", status=404, content_type="text/plain")
+    if not log_index.has_index(log, which):
+        tasks.schedule_log_build(log)  # The whole CSV is scanned in the meantime
+    rows = log.read_range(_int_param(req, 'start'), _int_param(req, 'end'), which=which, include_header=True)
+    response = StreamingHttpResponse(rows, content_type="text/csv")
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(log.full_filename(which))
+    return response
+
+
+def log_rows_response(req, log):
+    """
+    Returns just the rows appended to one of the CSVs (?which=base_csv|full_csv) for a Beer or GravityLog since either a
+    byte offset (?offset=) or a timestamp (?since=, in ms since the epoch) so that live graphs don't need to re-download
+    the entire log each time they refresh. The offset to use for the next request is returned in X-Log-Offset.
+
+    Standard HTTP caching/partial content requests are also supported - an If-None-Match matching the ETag returns 304
+    if nothing has been logged since, and a Range header returns the requested bytes of the underlying file.
+    """
+    which = req.GET.get('which', 'base_csv')
+    if which not in log_index.INDEX_FILES:
+        return HttpResponseBadRequest("Invalid log file type")
+
+    path = log.log_file_paths()[which]
+    try:
+        file_size = log_archive.size(path)
+        # The inode is included so that a log that is deleted & recreated (or restored from a backup) gets a new ETag
+        etag = '"{}-{}"'.format(which, log_archive.stat_tag(path))
+    except OSError:
+        return HttpResponse("No data has been logged", status=404, content_type="text/plain")
+
+    if req.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    range_match = re.match(r'^bytes=(\d+)-(\d*)$', req.headers.get('Range', ''))
+    if range_match:
+        range_start = int(range_match.group(1))
+        range_end = min(int(range_match.group(2)), file_size - 1) if range_match.group(2) else \
+            file_size - 1
+        if range_start >= file_size or range_end < range_start:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(file_size)
+            return response
+        with log_archive.open_log_file(path, 'rb') as f:
+            f.seek(range_start)
+            data = f.read(range_end - range_start + 1)
+        response = HttpResponse(data, status=206, content_type="text/csv")
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(range_start, range_end, file_size)
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        return response
+
+    offset = _int_param(req, 'offset')
+    since = _int_param(req, 'since')
+    if offset is None and since is not None:
+        offset = log_index.offset_after(log, since, which)
+
+    with log_archive.open_log_file(path, 'rb') as f:
+        header = f.readline()
+        if offset is None:
+            offset = len(header)  # Everything but the header
+        elif offset > file_size:
+            # The log was replaced out from under the client - have it start over
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(file_size)
+            return response
+        f.seek(offset)
+        data = f.read(file_size - offset)
+
+    # Only return complete rows - anything after the last newline is still being written
+    data = data[:data.rfind(b"\n") + 1]
+
+    response = HttpResponse(data, content_type="text/csv")
+    response['X-Log-Offset'] = offset + len(data)
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def log_stats_response(log):
+    """Returns the running statistics for a Beer or GravityLog (see log_stats.py) without reading the log itself"""
+    stats = log.stats()
+    if stats is None:
+        if log_archive.exists(log.log_file_paths()['base_csv']):
+            tasks.schedule_log_build(log)  # The log predates the stats sidecar
+        return HttpResponse("No data has been logged", status=404, content_type="text/plain")
+    return JsonResponse(stats)
+
+
+def export_beer_csv(req, beer_id):
+    try:
+        beer = Beer.objects.get(id=beer_id)
+    except Beer.DoesNotExist:
+        return HttpResponse("Beer not found", status=404, content_type="text/plain")
+
+    # An optional comma-separated list of columns can be provided to limit the export (e.g. ?columns=beer_temp,state)
+    columns = req.GET.get('columns', None)
+    return log_csv_export_response(beer, columns.split(",") if columns else None)
+
+
+def beer_graph_csv(req, beer_id):
+    try:
+        beer = Beer.objects.get(id=beer_id)
+    except Beer.DoesNotExist:
+        return HttpResponse("Beer not found", status=404, content_type="text/plain")
+    return log_graph_response(req, beer)
+
+
+def beer_range_csv(req, beer_id, which):
+    try:
+        beer = Beer.objects.get(id=beer_id)
+    except Beer.DoesNotExist:
+        return HttpResponse("Beer not found", status=404, content_type="text/plain")
+    return log_range_response(req, beer, which)
+
+
+def beer_rows(req, beer_id):
+    try:
+        beer = Beer.objects.get(id=beer_id)
+    except Beer.DoesNotExist:
+        return HttpResponse("Beer not found", status=404, content_type="text/plain")
+    return log_rows_response(req, beer)
+
+
+def beer_stats(req, beer_id):
+    try:
+        beer = Beer.objects.get(id=beer_id)
+    except Beer.DoesNotExist:
+        return HttpResponse("Beer not found", status=404, content_type="text/plain")
+    return log_stats_response(beer)
@@ -0,0 +1,106 @@
+"""
+Runtime metrics for each BrewPi-Script instance, in the Prometheus text format
+
+Each active device's script is asked for its metrics (the getMetrics message - see BrewPiEngine.metrics in
+brewpi-script/brewpi.py) and they are rendered with the device as labels. brewpi_up is 0 for a device whose script
+didn't answer. Latencies are reported as summaries (_sum and _count since the script started, from which a rate can be
+taken) along with a gauge of the longest one seen.
+"""
+
+from django.http import HttpResponse
+
+from app.models import BrewPiDevice
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# name -> (type, help)
+METRICS = {
+    'brewpi_up': ('gauge', "Whether BrewPi-Script answered the request for its metrics"),
+    'brewpi_uptime_seconds': ('gauge', "Time since BrewPi-Script started"),
+    'brewpi_loop_lag_seconds': ('summary', "How late the script's event loop was in waking up a timer"),
+    'brewpi_loop_lag_max_seconds': ('gauge', "Longest loop lag since the script started"),
+    'brewpi_seconds_since_temperatures': ('gauge', "Time since the controller last sent temperatures"),
+    'brewpi_serial_received_bytes_total': ('counter', "Bytes received from the controller"),
+    'brewpi_serial_sent_bytes_total': ('counter', "Bytes sent to the controller"),
+    'brewpi_serial_queue_depth': ('gauge', "Lines and log messages from the controller waiting to be processed"),
+    'brewpi_message_seconds': ('summary', "Time taken to handle messages from Fermentrack, by message type"),
+    'brewpi_message_max_seconds': ('gauge', "Longest time taken to handle a message, by message type"),
+    'brewpi_point_post_seconds': ('summary', "Time taken to save a batch of log points"),
+    'brewpi_point_post_max_seconds': ('gauge', "Longest time taken to save a batch of log points"),
+    'brewpi_point_queue_depth': ('gauge', "Log points waiting to be saved"),
+    'brewpi_point_spool_depth': ('gauge', "Log points spooled to disk while they couldn't be saved"),
+    'brewpi_points_dropped_total': ('counter', "Log points that were dropped without being saved"),
+    'brewpi_error_count': ('gauge', "Consecutive errors (the script restarts once there are too many)"),
+}
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def device_samples(device: BrewPiDevice, metrics: dict or None) -> list:
+    """Returns the samples for a device as a list of (name, labels, value)"""
+    labels = {'device_id': device.id, 'device_name': device.device_name}
+    samples = [('brewpi_up', labels, 0 if metrics is None else 1)]
+    if metrics is None:
+        return samples
+
+    def latency(name, stats, extra_labels=None):
+        stat_labels = dict(labels, **(extra_labels or {}))
+        samples.append((name + '_sum', stat_labels, stats['total']))
+        samples.append((name + '_count', stat_labels, stats['count']))
+        samples.append((name[:-len('_seconds')] + '_max_seconds', stat_labels, stats['max']))
+
+    samples.append(('brewpi_uptime_seconds', labels, metrics['uptime']))
+    latency('brewpi_loop_lag_seconds', metrics['loop_lag'])
+    if metrics['since_temperatures'] is not None:
+        samples.append(('brewpi_seconds_since_temperatures', labels, metrics['since_temperatures']))
+
+    serial = metrics['serial']
+    if serial:
+        samples.append(('brewpi_serial_received_bytes_total', labels, serial['bytes_in']))
+        samples.append(('brewpi_serial_sent_bytes_total', labels, serial['bytes_out']))
+        samples.append(('brewpi_serial_queue_depth', dict(labels, queue="lines"), serial['lines_queued']))
+        samples.append(('brewpi_serial_queue_depth', dict(labels, queue="messages"), serial['messages_queued']))
+
+    for message_type, stats in sorted(metrics['messages'].items()):
+        latency('brewpi_message_seconds', stats, {'message_type': message_type})
+
+    sender = metrics['sender']
+    if sender:
+        latency('brewpi_point_post_seconds', sender['post_latency'])
+        samples.append(('brewpi_point_queue_depth', labels, sender['queued']))
+        samples.append(('brewpi_point_spool_depth', labels, sender['spooled']))
+        samples.append(('brewpi_points_dropped_total', labels, sender['dropped']))
+
+    samples.append(('brewpi_error_count', labels, metrics['error_count']))
+    return samples
+
+
+def render(samples: list) -> str:
+    # Prometheus expects all the samples for a metric to be together, under its HELP & TYPE
+    by_metric = {name: [] for name in METRICS}
+    for name, labels, value in samples:
+        for metric in METRICS:
+            if name == metric or (METRICS[metric][0] == 'summary' and name in [metric + '_sum', metric + '_count']):
+                by_metric[metric].append((name, labels, value))
+                break
+
+    lines = []
+    for metric, metric_samples in by_metric.items():
+        if not metric_samples:
+            continue
+        metric_type, metric_help = METRICS[metric]
+        lines.append(f"# HELP {metric} {metric_help}")
+        lines.append(f"# TYPE {metric} {metric_type}")
+        for name, labels, value in metric_samples:
+            label_text = ",".join(f'{key}="{escape_label(label)}"' for key, label in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def get_metrics(req):
+    samples = []
+    for device in BrewPiDevice.objects.filter(status=BrewPiDevice.STATUS_ACTIVE).order_by('id'):
+        samples += device_samples(device, device.retrieve_metrics())
+    return HttpResponse(render(samples), content_type=CONTENT_TYPE)
@@ -0,0 +1,335 @@
+"""
+Compact, append-only binary storage for beer & gravity logs
+
+Each log gets a "_data.bin" file alongside its CSVs consisting of a fixed-size header followed by fixed-width records
+(one per point). The layout is described by a numpy-compatible dtype stored in the header, so the whole log can be
+mapped into memory without any parsing:
+
+    header = binary_log.read_header(path)
+    data = numpy.memmap(path, dtype=numpy.dtype(header['dtype']), mode='r', offset=header['data_offset'])
+    data['beer_temp']  # zero-copy view of the beer temp column
+
+(or just use binary_log.load(), which does exactly that). numpy is optional - without it, load() falls back to
+unpacking the records with the struct module.
+
+Annotations are variable-length, so they are stored in a side table ("_annotations.jsonl") with one JSON object per
+line, each pointing at the index of the record it belongs to.
+
+The CSVs remain the canonical format for the dashboards, downloads and backups. Logs created before the binary store
+existed are converted from their base CSV (and annotation file) by ensure_exists(), under the log's lock - at startup
+or in the background (see log_writer.build_derived_files()), or by the log writer before it appends to the log. Readers
+never convert a log themselves: until it has been converted, there is no binary log to read.
+"""
+
+import csv
+import datetime
+import json
+import math
+import mmap
+import os
+import struct
+import tempfile
+
+from . import log_archive
+
+try:
+    import numpy
+    NUMPY_ENABLED = True
+except ImportError:
+    NUMPY_ENABLED = False
+
+
+MAGIC = b"FTLOG\x00\x01\x00"
+HEADER_SIZE = 1024
+
+# (column name, struct format code, numpy dtype string) - everything is stored little-endian and unaligned
+BEER_COLUMNS = [
+    ('log_time', 'q', '<i8'),  # Milliseconds since the (UTC) epoch
+    ('beer_temp', 'f', '<f4'),
+    ('beer_set', 'f', '<f4'),
+    ('fridge_temp', 'f', '<f4'),
+    ('fridge_set', 'f', '<f4'),
+    ('room_temp', 'f', '<f4'),
+    ('state', 'q', '<i8'),
+    ('gravity', 'f', '<f4'),
+    ('grav_temp', 'f', '<f4'),
+]
+
+GRAVITY_COLUMNS = [
+    ('log_time', 'q', '<i8'),
+    ('gravity', 'f', '<f4'),
+    ('temp', 'f', '<f4'),
+]
+
+NAN = float('nan')
+
+
+class BinaryLogError(Exception):
+    pass
+
+
+class RecordLayout:
+    """Precompiled struct for a set of columns"""
+
+    def __init__(self, columns: list):
+        self.columns = columns
+        self.names = [name for name, _, _ in columns]
+        self.struct = struct.Struct("<" + "".join(fmt for _, fmt, _ in columns))
+        self.record_size = self.struct.size
+
+    @property
+    def dtype(self) -> list:
+        return [[name, dtype] for name, _, dtype in self.columns]
+
+    def header(self) -> bytes:
+        header = json.dumps({'version': 1, 'dtype': self.dtype, 'record_size': self.record_size,
+                             'data_offset': HEADER_SIZE})
+        header = MAGIC + header.encode('utf-8')
+        if len(header) >= HEADER_SIZE:
+            raise BinaryLogError("Binary log header is too large")
+        return header.ljust(HEADER_SIZE - 1, b' ') + b'\n'
+
+    def unpack(self, record: bytes) -> dict:
+        return dict(zip(self.names, self.struct.unpack(record)))
+
+    def pack(self, values: dict) -> bytes:
+        # Integer columns that are missing are stored as 0, float columns as NaN
+        return self.struct.pack(*[_int_or_zero(values.get(name)) if fmt == 'q' else _float_or_nan(values.get(name))
+                                  for name, fmt, _ in self.columns])
+
+
+BEER_LAYOUT = RecordLayout(BEER_COLUMNS)
+GRAVITY_LAYOUT = RecordLayout(GRAVITY_COLUMNS)
+
+
+def _float_or_nan(value) -> float:
+    if value is None or value == '':
+        return NAN
+    return float(value)
+
+
+def _int_or_zero(value) -> int:
+    if value is None or value == '':
+        return 0
+    return int(value)
+
+
+def to_epoch_ms(log_time: datetime.datetime) -> int:
+    return int(round(log_time.timestamp() * 1000))
+
+
+def from_epoch_ms(epoch_ms: int) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(epoch_ms / 1000, tz=datetime.timezone.utc)
+
+
+def read_header(path) -> dict:
+    with open(path, 'rb') as f:
+        raw = f.read(HEADER_SIZE)
+    if len(raw) < HEADER_SIZE or not raw.startswith(MAGIC):
+        raise BinaryLogError("{} is not a binary log file".format(path))
+    return json.loads(raw[len(MAGIC):].decode('utf-8'))
+
+
+def record_count(path, header: dict = None) -> int:
+    """Number of complete records in the file (a torn trailing record is ignored)"""
+    if header is None:
+        header = read_header(path)
+    return max(os.path.getsize(path) - header['data_offset'], 0) // header['record_size']
+
+
+def load(path):
+    """
+    Returns the records in a binary log. With numpy available this is a read-only numpy.memmap structured array (column
+    access like data['beer_temp'] doesn't copy). Without numpy, a list of dicts is returned instead.
+    """
+    header = read_header(path)
+    count = record_count(path, header)
+
+    if NUMPY_ENABLED:
+        dtype = numpy.dtype([tuple(x) for x in header['dtype']])
+        if count == 0:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.memmap(path, dtype=dtype, mode='r', offset=header['data_offset'], shape=(count,))
+
+    return list(iter_records(path, header))
+
+
+def iter_records(path, header: dict = None, start: int = 0):
+    """Yields each record (from index start onwards) as a dict, without requiring numpy"""
+    if header is None:
+        header = read_header(path)
+    names = [name for name, _ in header['dtype']]
+    fmt = struct.Struct("<" + "".join('q' if dtype == '<i8' else 'f' for _, dtype in header['dtype']))
+    count = record_count(path, header)
+    if start >= count:
+        return
+
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            data_offset = header['data_offset']
+            end = data_offset + count * fmt.size
+            for values in fmt.iter_unpack(mapped[data_offset + start * fmt.size:end]):
+                yield dict(zip(names, values))
+
+
+def last_log_time(path):
+    """The log_time (epoch milliseconds) of the last complete record in a binary log, or None if it has no records"""
+    if not os.path.isfile(path):
+        return None
+    header = read_header(path)
+    count = record_count(path, header)
+    for record in iter_records(path, header, start=count - 1):
+        return record['log_time']
+    return None
+
+
+def read_annotations(path) -> list:
+    """Reads the annotation side table for a binary log"""
+    annotations = []
+    if not os.path.isfile(path):
+        return annotations
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                annotations.append(json.loads(line))
+            except ValueError:
+                continue  # Partially written line
+    return annotations
+
+
+def format_annotations(row_index: int, annotations: list) -> bytes:
+    return "".join(json.dumps({'row': row_index, 'series': this_annotation['series'],
+                               'shortText': this_annotation['shortText'], 'text': this_annotation['text']}) + "\n"
+                   for this_annotation in annotations).encode('utf-8')
+
+
+def parse_csv_time(time_value: str) -> datetime.datetime:
+    return datetime.datetime.strptime(time_value, '%Y/%m/%d %H:%M:%SZ').replace(tzinfo=datetime.timezone.utc)
+
+
+def format_csv_time(epoch_ms: int) -> str:
+    return from_epoch_ms(epoch_ms).strftime('%Y/%m/%d %H:%M:%SZ')
+
+
+def read_csv_annotations(path) -> list:
+    """Reads a log's (almost JSON) annotation file, returning an empty list if it's missing or can't be parsed"""
+    if not log_archive.exists(path):
+        return []
+    with log_archive.open_log_file(path, 'r') as f:
+        text = f.read()
+    try:
+        # As with AlmostJsonWrapper, the list is closed before it's parsed
+        annotations = json.loads(text + "\r\n]") if text.strip() else []
+    except ValueError:
+        return []
+    return annotations if isinstance(annotations, list) else []
+
+
+def _tmp_path(path) -> str:
+    """Creates a uniquely named temporary file alongside path, so that concurrent builds can't write over each other"""
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path))
+    os.close(fd)
+    return tmp_path
+
+
+def build_annotations(annotation_path, bin_path, out_path):
+    """
+    Builds the annotation side table for a binary log from the log's annotation file. Annotations are timed to the
+    second, so each is attached to the first record logged within its second.
+    """
+    row_by_time = {}
+    for row_index, record in enumerate(iter_records(bin_path)):
+        row_by_time.setdefault(record['log_time'], row_index)
+
+    tmp_path = _tmp_path(out_path)
+    try:
+        with open(tmp_path, 'wb') as out_f:
+            for this_annotation in read_csv_annotations(annotation_path):
+                try:
+                    row_index = row_by_time.get(to_epoch_ms(parse_csv_time(this_annotation['x'])))
+                    if row_index is not None:
+                        out_f.write(format_annotations(row_index, [this_annotation]))
+                except (KeyError, TypeError, ValueError):
+                    continue
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def build_from_csv(csv_path, bin_path, layout: RecordLayout, annotation_path=None, binary_annotation_path=None):
+    """
+    Converts a (base) CSV log into a binary log. Columns not present in the CSV are stored as missing. If
+    annotation_path & binary_annotation_path are given, the log's annotations are converted as well (before the binary
+    log is put in place, so that a binary log never exists without them). The caller must hold the log's lock (see
+    log_journal.lock) so that nothing is appended to the log while it's converted.
+    """
+    tmp_path = _tmp_path(bin_path)
+    try:
+        with log_archive.open_log_file(csv_path, 'r') as in_f, open(tmp_path, 'wb') as out_f:
+            reader = csv.reader(in_f)
+            headers = next(reader, None)
+            if headers is None:
+                raise BinaryLogError("{} is empty".format(csv_path))
+            # Gravity logs call the gravity sensor temp "temp" in their CSVs, which is also what the binary layout uses
+            out_f.write(layout.header())
+            for row in reader:
+                if len(row) != len(headers):
+                    continue  # Skip torn/malformed rows
+                values = dict(zip(headers, row))
+                try:
+                    values['log_time'] = to_epoch_ms(parse_csv_time(values['log_time']))
+                    out_f.write(layout.pack(values))
+                except ValueError:
+                    continue
+        if annotation_path is not None and binary_annotation_path is not None:
+            build_annotations(annotation_path, tmp_path, binary_annotation_path)
+        os.replace(tmp_path, bin_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def exists(log) -> bool:
+    """Whether the binary log for a Beer or GravityLog has been built"""
+    return os.path.isfile(log.log_file_paths()['binary'])
+
+
+def ensure_exists(log) -> bool:
+    """
+    Makes sure a binary log exists for a Beer or GravityLog, converting it from the base CSV if it was created before
+    the binary store existed. Returns False if there is no data for the log at all. This reads the whole log, and the
+    caller must hold the log's lock - see log_writer.build_derived_files().
+    """
+    paths = log.log_file_paths()
+    if os.path.isfile(paths['binary']):
+        return True
+    if not log_archive.exists(paths['base_csv']):
+        return False
+    build_from_csv(paths['base_csv'], paths['binary'], log.binary_layout(), paths['annotation_json'],
+                   paths['binary_annotations'])
+    return True
+
+
+def export_csv(log, columns: list = None):
+    """
+    Generates CSV lines (as strings) for a Beer or GravityLog from its binary log, optionally limited to a subset of
+    columns. log_time is always the first column, formatted the same way as the flat-file CSVs. Nothing is generated if
+    the binary log hasn't been built yet.
+    """
+    path = log.log_file_paths()['binary']
+    if not os.path.isfile(path):
+        return
+
+    header = read_header(path)
+    available = [name for name, _ in header['dtype']]
+    if columns is None:
+        columns = available
+    columns = [name for name in columns if name in available and name != 'log_time']
+
+    yield ",".join(['log_time'] + columns) + "\r\n"
+    for record in iter_records(path, header):
+        yield ",".join([format_csv_time(record['log_time'])] +
+                       ["" if isinstance(record[name], float) and math.isnan(record[name]) else
+                        "{:g}".format(record[name]) if isinstance(record[name], float) else str(record[name])
+                        for name in columns]) + "\r\n"
@@ -0,0 +1,37 @@
+"""
+Notifications to BrewPi-Script of changes made in Fermentrack
+
+When a BrewPiDevice is saved, the names of the fields that changed are published (as a JSON list) on the device's
+channel, and when a fermentation profile (or one of its points) is edited, the profile's ID is published on
+PROFILE_CHANNEL. BrewPi-Script subscribes to both (see brewpi-script/scriptlibs/changeListener.py), re-reads only
+the fields that changed and drops its compiled copy of the profile, rather than reloading the whole device whenever it
+is sent a message. If Redis is unavailable nothing is published, and the script falls back to reloading the device.
+"""
+
+import json
+
+import redis
+
+from . import brewpi_state
+
+DEVICE_CHANNEL = "fermentrack:brewpi_changes:{}"
+PROFILE_CHANNEL = "fermentrack:profile_changes"
+
+
+def device_channel(device_id: int) -> str:
+    return DEVICE_CHANNEL.format(device_id)
+
+
+def publish(channel: str, message: str):
+    try:
+        brewpi_state.connect().publish(channel, message)
+    except redis.exceptions.RedisError:
+        pass
+
+
+def publish_device_change(device_id: int, fields: list):
+    publish(device_channel(device_id), json.dumps(fields))
+
+
+def publish_profile_change(profile_id: int):
+    publish(PROFILE_CHANNEL, str(profile_id))
@@ -0,0 +1,151 @@
+"""
+Client for the socket BrewPi-Script listens on for messages from Fermentrack.
+
+Rather than connecting for every message, each device has a small pool of long-lived connections. Messages are sent
+as frames - a header (MAGIC, request ID, flags, payload length) followed by the message - and the script answers each
+one with a frame carrying the same request ID, so responses of any size are read in full. The framing is implemented
+on the script side in brewpi-script/scriptlibs/messageFraming.py - keep the two in step.
+"""
+
+import itertools
+import os
+import select
+import socket
+import struct
+import threading
+
+
+MAGIC = b'BPF1'
+HEADER = struct.Struct(">4sIBI")  # magic, request ID, flags, payload length
+MAX_PAYLOAD = 16 * 1024 * 1024
+
+FLAG_NO_REPLY = 0x01  # Request: don't send a response
+FLAG_NO_RESPONSE = 0x02  # Response: the message doesn't have a response (rather than having an empty one)
+
+MAX_IDLE_CONNECTIONS = 4  # Per device. More connections than this are opened if needed, but not kept.
+TIMEOUT = 10  # seconds to wait for the script to connect or respond
+
+
+class ConnectionLost(ConnectionError):
+    pass
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionLost("Connection closed by BrewPi-Script")
+        data += chunk
+    return bytes(data)
+
+
+class ConnectionPool:
+    def __init__(self, family: int, address):
+        self.family = family
+        self.address = address
+        self.idle = []
+        self.lock = threading.Lock()
+        self.request_ids = itertools.count(1)
+
+    def connect(self) -> socket.socket:
+        sock = socket.socket(self.family, socket.SOCK_STREAM)
+        sock.settimeout(TIMEOUT)
+        try:
+            sock.connect(self.address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def checkout(self):
+        """Returns an idle connection (and True) if one is available, or a new connection (and False) if not"""
+        with self.lock:
+            while self.idle:
+                sock = self.idle.pop()
+                # An idle connection shouldn't have anything to read - if it does, the script has closed it (e.g.
+                # because it was restarted)
+                readable, _, _ = select.select([sock], [], [], 0)
+                if not readable:
+                    return sock, True
+                sock.close()
+        return self.connect(), False
+
+    def checkin(self, sock: socket.socket):
+        with self.lock:
+            if len(self.idle) < MAX_IDLE_CONNECTIONS:
+                self.idle.append(sock)
+                return
+        sock.close()
+
+    def exchange(self, sock: socket.socket, message: bytes, read_response: bool):
+        request_id = next(self.request_ids) & 0xFFFFFFFF
+        flags = 0 if read_response else FLAG_NO_REPLY
+        sock.sendall(HEADER.pack(MAGIC, request_id, flags, len(message)) + message)
+        if not read_response:
+            return None
+
+        while True:
+            magic, response_id, flags, length = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+            if magic != MAGIC or length > MAX_PAYLOAD:
+                raise ConnectionLost("Invalid response frame from BrewPi-Script")
+            payload = _recv_exactly(sock, length)
+            if response_id == request_id:
+                return "" if flags & FLAG_NO_RESPONSE else payload.decode(encoding="cp437")
+            # Otherwise it's a response to an earlier request that was given up on - skip it
+
+    def request(self, message: str, read_response: bool = True):
+        """
+        Sends a message, returning the response (if read_response) or None. Raises OSError if the script can't be
+        reached.
+        """
+        encoded_message = message.encode(encoding="cp437")
+        sock, reused = self.checkout()
+        try:
+            response = self.exchange(sock, encoded_message, read_response)
+        except (ConnectionLost, BrokenPipeError, ConnectionResetError):
+            sock.close()
+            if not reused:
+                raise
+            # The script closed the idle connection (e.g. it restarted) before the message reached it - try once more
+            # on a new connection
+            sock = self.connect()
+            try:
+                response = self.exchange(sock, encoded_message, read_response)
+            except OSError:
+                sock.close()
+                raise
+        except OSError:
+            sock.close()  # Including timeouts - a late response would confuse the next request on this connection
+            raise
+        self.checkin(sock)
+        return response
+
+    def close(self):
+        with self.lock:
+            for sock in self.idle:
+                sock.close()
+            self.idle = []
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = None
+
+
+def get_pool(family: int, address) -> ConnectionPool:
+    global _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # Connections can't be shared with a parent process (e.g. across a gunicorn or huey fork)
+            _pools.clear()
+            _pools_pid = os.getpid()
+        key = (family, address)
+        if key not in _pools:
+            _pools[key] = ConnectionPool(family, address)
+        return _pools[key]
+
+
+def send_message(family: int, address, message: str, read_response: bool = True):
+    """Sends a message to BrewPi-Script, returning the response (or None if read_response is False)"""
+    return get_pool(family, address).request(message, read_response)
@@ -0,0 +1,64 @@
+"""
+Snapshots of each controller's state, published to Redis by BrewPi-Script
+
+BrewPi-Script writes the values Fermentrack would otherwise ask it for over its socket (the LCD, temperatures,
+control settings/constants...) to a hash per device whenever they change, along with an "updated_at" timestamp that
+is refreshed every few seconds while the script is running (see brewpi-script/scriptlibs/statePublisher.py). Reads
+are served from the snapshot while it is fresh, and only fall back to asking the script directly when it isn't (e.g.
+the script has stopped, or Redis is unavailable). Commands are always sent over the socket.
+"""
+
+import time
+
+import redis
+from django.conf import settings
+
+STATE_KEY = "fermentrack:brewpi_state:{}"
+MAX_AGE = 15  # seconds - a snapshot that hasn't been updated in this long is stale (the script has likely stopped)
+TTL = 60  # seconds - a snapshot that hasn't been updated in this long is removed altogether
+
+# Fields in the snapshot, and the socket message each one answers
+LCD = "lcd"  # lcd
+DASH_INFO = "dash"  # getDashInfo
+MODE = "mode"  # getMode
+BEER_SET = "beer_set"  # getBeer
+FRIDGE_SET = "fridge_set"  # getFridge
+CONTROL_SETTINGS = "cs"  # getControlSettings
+CONTROL_CONSTANTS = "cc"  # getControlConstants
+EXTENDED_SETTINGS = "es"  # getExtendedSettings
+CONTROL_VARIABLES = "cv"  # getControlVariables
+
+_client = None
+
+
+def state_key(device_id: int) -> str:
+    return STATE_KEY.format(device_id)
+
+
+def connect() -> redis.Redis:
+    global _client
+    if _client is None:
+        # A short timeout, as the socket is there to fall back on
+        _client = redis.Redis.from_url(url=settings.REDIS_URL, socket_timeout=1, socket_connect_timeout=1)
+    return _client
+
+
+def load(device_id: int) -> dict or None:
+    """
+    Returns the snapshot for a device as a dict of field -> value (as it would have been returned over the socket),
+    along with "age" (seconds since it was last updated) and "stale". Returns None if there's no snapshot.
+    """
+    try:
+        raw = connect().hgetall(state_key(device_id))
+    except redis.exceptions.RedisError:
+        return None
+    if not raw or b'updated_at' not in raw:
+        return None
+
+    state = {field.decode(encoding="utf-8"): value.decode(encoding="utf-8") for field, value in raw.items()}
+    try:
+        state['age'] = max(time.time() - float(state.pop('updated_at')), 0)
+    except ValueError:
+        return None
+    state['stale'] = state['age'] > MAX_AGE
+    return state
@@ -0,0 +1,197 @@
+"""
+Compressed archival of the flat-file logs for beers & gravity logs that are no longer being logged to
+
+Once logging stops, the CSVs & annotation file for a log are compressed (by the archive_log Huey task in app/tasks.py)
+into "<file>.xz". The data is compressed in independent frames of FRAME_SIZE bytes, each of which is a complete xz
+stream - so the archive is still a normal .xz file that `xz -d` can decompress - along with a small "<file>.xz.idx"
+listing the uncompressed & compressed offset of each frame. That lets ArchiveReader seek to any point in the file by
+decompressing a single frame, so the time index (log_index.py) & byte offsets used by the APIs keep working unchanged.
+
+Everything that reads the log files goes through open_log_file()/exists()/size() so that archived logs are handled
+transparently. If logging is resumed to an archived log, the log writer restores the files first.
+"""
+
+import bisect
+import io
+import lzma
+import os
+import struct
+import time
+
+
+ARCHIVED_FILES = ['base_csv', 'full_csv', 'annotation_json']
+FRAME_SIZE = 1024 * 1024
+ENTRY = struct.Struct("<qq")  # (uncompressed offset, compressed offset) of the start of each frame
+
+
+def archive_path(path) -> str:
+    return str(path) + ".xz"
+
+
+def frame_index_path(path) -> str:
+    return str(path) + ".xz.idx"
+
+
+def is_archived(path) -> bool:
+    return not os.path.isfile(path) and os.path.isfile(archive_path(path)) and os.path.isfile(frame_index_path(path))
+
+
+def exists(path) -> bool:
+    return os.path.isfile(path) or is_archived(path)
+
+
+def _read_frame_index(path) -> list:
+    with open(frame_index_path(path), 'rb') as f:
+        return list(ENTRY.iter_unpack(f.read()))
+
+
+def size(path) -> int:
+    """Returns the (uncompressed) size of a log file, whether or not it has been archived"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    # The last entry in the frame index marks the end of the data
+    return _read_frame_index(path)[-1][0]
+
+
+def stat_tag(path) -> str:
+    """Returns a string that changes whenever the file is replaced or appended to (for use in ETags)"""
+    if os.path.isfile(path):
+        file_stat = os.stat(path)
+    else:
+        file_stat = os.stat(archive_path(path))
+    return "{}-{}".format(file_stat.st_ino, size(path))
+
+
+class ArchiveReader(io.RawIOBase):
+    """Read-only, seekable file-like access to the uncompressed contents of an archived log file"""
+
+    def __init__(self, path):
+        super().__init__()
+        self.frames = _read_frame_index(path)
+        self.frame_starts = [uncompressed for uncompressed, _ in self.frames]
+        self.size = self.frames[-1][0]
+        self._f = open(archive_path(path), 'rb')
+        self._pos = 0
+        self._frame_number = None
+        self._frame_data = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("Negative seek position {}".format(offset))
+        self._pos = offset
+        return self._pos
+
+    def _load_frame(self, frame_number: int):
+        if frame_number != self._frame_number:
+            compressed_start = self.frames[frame_number][1]
+            compressed_end = self.frames[frame_number + 1][1]
+            self._f.seek(compressed_start)
+            self._frame_data = lzma.decompress(self._f.read(compressed_end - compressed_start), format=lzma.FORMAT_XZ)
+            self._frame_number = frame_number
+
+    def readinto(self, buffer) -> int:
+        if self._pos >= self.size:
+            return 0
+        frame_number = bisect.bisect_right(self.frame_starts, self._pos) - 1
+        self._load_frame(frame_number)
+        start = self._pos - self.frame_starts[frame_number]
+        chunk = self._frame_data[start:start + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def close(self):
+        if not self.closed:
+            self._f.close()
+        super().close()
+
+
+def open_log_file(path, mode: str = 'rb'):
+    """Opens a log file for reading (in 'rb' or 'r' mode), decompressing it on the fly if it has been archived"""
+    if os.path.isfile(path) or not is_archived(path):
+        return open(path, mode, **({} if 'b' in mode else {'newline': ''}))
+    reader = io.BufferedReader(ArchiveReader(path))
+    if 'b' in mode:
+        return reader
+    return io.TextIOWrapper(reader, newline='')
+
+
+def archive_file(path, frame_size: int = FRAME_SIZE) -> bool:
+    """Compresses a single log file, removing the uncompressed copy. Returns False if there was nothing to archive."""
+    if not os.path.isfile(path):
+        return False
+
+    tmp_archive, tmp_index = archive_path(path) + ".tmp", frame_index_path(path) + ".tmp"
+    with open(path, 'rb') as in_f, open(tmp_archive, 'wb') as out_f, open(tmp_index, 'wb') as index_f:
+        uncompressed_offset, compressed_offset = 0, 0
+        while True:
+            chunk = in_f.read(frame_size)
+            if not chunk:
+                break
+            compressed = lzma.compress(chunk, format=lzma.FORMAT_XZ)
+            index_f.write(ENTRY.pack(uncompressed_offset, compressed_offset))
+            out_f.write(compressed)
+            uncompressed_offset += len(chunk)
+            compressed_offset += len(compressed)
+        index_f.write(ENTRY.pack(uncompressed_offset, compressed_offset))
+        for f in [out_f, index_f]:
+            f.flush()
+            os.fsync(f.fileno())
+
+    # Readers prefer the uncompressed file while it still exists, so it's only removed once the archive is in place
+    os.replace(tmp_index, frame_index_path(path))
+    os.replace(tmp_archive, archive_path(path))
+    os.remove(path)
+    return True
+
+
+def restore_file(path) -> bool:
+    """Decompresses an archived log file back to its original location (so that it can be appended to again)"""
+    if not is_archived(path):
+        return False
+    tmp_path = str(path) + ".tmp"
+    with open_log_file(path, 'rb') as in_f, open(tmp_path, 'wb') as out_f:
+        while True:
+            chunk = in_f.read(FRAME_SIZE)
+            if not chunk:
+                break
+            out_f.write(chunk)
+    os.replace(tmp_path, path)
+    remove_archive(path)
+    return True
+
+
+def remove_archive(path):
+    for archived_path in [archive_path(path), frame_index_path(path)]:
+        try:
+            os.remove(archived_path)
+        except OSError:
+            pass
+
+
+def is_idle(paths: dict, min_age: float) -> bool:
+    """Returns True if none of a log's files (given log.log_file_paths()) were written to in the last min_age seconds"""
+    cutoff = time.time() - min_age
+    return not any(os.path.isfile(path) and os.path.getmtime(path) > cutoff for path in paths.values())
+
+
+def archive_log_files(paths: dict) -> int:
+    """Archives the CSVs & annotations for a log (given log.log_file_paths()). Returns the number of files compressed."""
+    return sum(1 for which in ARCHIVED_FILES if archive_file(paths[which]))
+
+
+def restore_log_files(paths: dict) -> int:
+    return sum(1 for which in ARCHIVED_FILES if restore_file(paths[which]))
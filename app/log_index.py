@@ -0,0 +1,183 @@
+"""
+Sparse time indexes for the CSV logs
+
+Alongside each CSV (base & full) we keep a small index file of fixed-width (log_time, byte_offset) entries, written by
+the log writer every LOG_INDEX_INTERVAL rows. Reading a time range then only needs to bisect the index, seek to the
+nearest preceding entry, and scan forward at most LOG_INDEX_INTERVAL rows to find the start of the range - rather than
+reading the CSV from the top.
+
+Times in the CSVs are written as fixed-width, UTC "%Y/%m/%d %H:%M:%SZ" strings, which sort the same way as the times
+themselves, so the scan compares strings rather than parsing every timestamp. As the times only have one-second
+precision, the bounds of a range are truncated to the whole second before they are compared.
+"""
+
+import datetime
+import os
+import struct
+
+from django.conf import settings
+
+from . import binary_log, log_archive, log_rows
+
+
+INDEX_FILES = {
+    'base_csv': 'base_csv_index',
+    'full_csv': 'full_csv_index',
+}
+
+ENTRY = struct.Struct("<qq")  # (log_time in ms since the epoch, byte offset of the start of the row)
+TIME_FORMAT = '%Y/%m/%d %H:%M:%SZ'
+TIME_LENGTH = len("2000/01/01 00:00:00Z")
+
+
+def format_entry(log_time_ms: int, offset: int) -> bytes:
+    return ENTRY.pack(log_time_ms, offset)
+
+
+def build_index(csv_path, index_path, interval: int = None):
+    """(Re)builds the index for an existing CSV by scanning it once"""
+    interval = interval or settings.LOG_INDEX_INTERVAL
+    tmp_path = str(index_path) + ".tmp"
+    with log_archive.open_log_file(csv_path, 'rb') as in_f, open(tmp_path, 'wb') as out_f:
+        in_f.readline()  # Skip the header row
+        offset = in_f.tell()
+        row_number = 0
+        for line in in_f:
+            if row_number % interval == 0:
+                try:
+                    log_time = binary_log.parse_csv_time(line[:TIME_LENGTH].decode('utf-8'))
+                except (ValueError, UnicodeDecodeError):
+                    log_time = None
+                if log_time is not None:
+                    out_f.write(format_entry(binary_log.to_epoch_ms(log_time), offset))
+                else:
+                    row_number -= 1  # Try again with the next row
+            row_number += 1
+            offset += len(line)
+    os.replace(tmp_path, index_path)
+
+
+def index_is_valid(index_path) -> bool:
+    """Indexes that are missing or were torn mid-write (by a crash, for example) need to be rebuilt"""
+    try:
+        return os.path.getsize(index_path) % ENTRY.size == 0
+    except OSError:
+        return False
+
+
+def has_index(log, which: str = 'full_csv') -> bool:
+    return index_is_valid(log.log_file_paths()[INDEX_FILES[which]])
+
+
+def ensure_index(log, which: str = 'full_csv') -> bool:
+    """
+    Makes sure the index for one of a log's CSVs exists. Returns False if the CSV itself doesn't exist. Building an
+    index reads the whole CSV, and the caller must hold the log's lock - see log_writer.build_derived_files().
+    """
+    paths = log.log_file_paths()
+    if not log_archive.exists(paths[which]):
+        return False
+    if not index_is_valid(paths[INDEX_FILES[which]]):
+        build_index(paths[which], paths[INDEX_FILES[which]])
+    return True
+
+
+def find_offset(index_path, log_time_ms: int) -> int or None:
+    """
+    Returns the byte offset of the last indexed row at or before log_time_ms, or None if log_time_ms is before the first
+    indexed row (in which case reading should start from the top of the file)
+    """
+    entry_count = os.path.getsize(index_path) // ENTRY.size
+    with open(index_path, 'rb') as f:
+        lo, hi = 0, entry_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            f.seek(mid * ENTRY.size)
+            entry_time, _ = ENTRY.unpack(f.read(ENTRY.size))
+            if entry_time <= log_time_ms:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        f.seek((lo - 1) * ENTRY.size)
+        return ENTRY.unpack(f.read(ENTRY.size))[1]
+
+
+def _bound(value) -> datetime.datetime or None:
+    """Normalises a bound (a datetime or ms since the epoch) to the one-second precision of the times in the CSVs"""
+    if value is None:
+        return None
+    if not isinstance(value, datetime.datetime):
+        value = binary_log.from_epoch_ms(value)
+    return value.astimezone(datetime.timezone.utc).replace(microsecond=0)
+
+
+def read_range(log, start=None, end=None, which: str = 'full_csv', include_header: bool = False):
+    """
+    Yields the raw lines (as bytes, including line endings) from one of a log's CSVs with start <= log_time < end.
+    start & end may be datetimes or ms since the epoch, and either can be None for an open-ended range.
+
+    Rows are only logged to the second, so start & end are truncated to the whole second and compared with that: a row
+    written as 12:00:00 is returned for a start of 12:00:00.750, but not for an end of 12:00:00.750.
+
+    If the index hasn't been built yet (see log_writer.build_derived_files) the CSV is scanned from the top instead.
+    """
+    paths = log.log_file_paths()
+    if not log_archive.exists(paths[which]):
+        return
+    start, end = _bound(start), _bound(end)
+    start_string = log_rows.format_log_time(start) if start is not None else None
+    end_string = log_rows.format_log_time(end) if end is not None else None
+
+    with log_archive.open_log_file(paths[which], 'rb') as f:
+        header = f.readline()
+        if include_header:
+            yield header
+
+        offset = None
+        if start is not None and has_index(log, which):
+            # Start from the last indexed row before start's second, as rows earlier in that second can come before an
+            # indexed row logged in it
+            offset = find_offset(paths[INDEX_FILES[which]], binary_log.to_epoch_ms(start) - 1)
+        if offset is not None:
+            f.seek(offset)
+
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # Don't return a row that is still being written
+            time_string = line[:TIME_LENGTH].decode('utf-8', errors='replace')
+            if start_string is not None and time_string < start_string:
+                continue
+            if end_string is not None and time_string >= end_string:
+                break
+            yield line
+
+
+def offset_after(log, log_time, which: str = 'base_csv') -> int or None:
+    """
+    Returns the byte offset of the first complete row in one of a log's CSVs logged after log_time (a datetime or ms
+    since the epoch, truncated to the second as in read_range), or the offset of the end of the last complete row if
+    there is nothing newer. Returns None if the CSV doesn't exist. As with read_range, the CSV is scanned from the top
+    if it hasn't been indexed yet.
+    """
+    paths = log.log_file_paths()
+    if not log_archive.exists(paths[which]):
+        return None
+
+    log_time = _bound(log_time)
+    after_string = log_rows.format_log_time(log_time)
+
+    with log_archive.open_log_file(paths[which], 'rb') as f:
+        f.readline()  # Header
+        offset = None
+        if has_index(log, which):
+            offset = find_offset(paths[INDEX_FILES[which]], binary_log.to_epoch_ms(log_time))
+        if offset is None:
+            offset = f.tell()
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n") or line[:TIME_LENGTH].decode('utf-8', errors='replace') > after_string:
+                break
+            offset += len(line)
+    return offset
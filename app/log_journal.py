@@ -0,0 +1,274 @@
+"""
+Write-ahead journal & crash recovery for the log files
+
+Each point saved to a log is appended to several files (the CSVs, annotations, binary log, rollups & indexes). If the
+power is cut part way through, the files can end up disagreeing with each other - or with a torn last line, which
+breaks Dygraph's CSV parsing. To guard against that, LogWriter stages every append for a point and writes the whole
+batch to the log's journal ("_journal.bin") in a single write before applying it to the files themselves.
+
+Each journal record is a length & CRC32 prefixed payload listing, for each file touched by the point, the size of the
+file before the point was written and the bytes that were appended. When a log is next opened for writing (or when
+`manage.py recover_logs` runs at startup) recover() replays any journaled appends that didn't fully make it into the
+files, then repairs anything the journal can't account for:
+
+    * CSVs are truncated back to the end of the last complete line
+    * The annotation file is truncated back to the end of the last complete entry
+    * Binary logs, rollups & indexes are truncated back to the last complete record
+
+The journal is removed whenever a writer closes cleanly, and is cut back to empty once it grows past
+LOG_JOURNAL_MAX_BYTES (after the files have been synced), so it only ever holds the most recent points.
+
+Several processes can write to the same log (the web server, `manage.py consume_log_points` and the Tilt monitor), so
+anything that changes a log's files - committing a point, flushing, recovering, archiving or rebuilding a derived file
+- must hold the log's lock (an exclusive flock on its "_write.lock" file) while it does so. See lock().
+"""
+
+import binascii
+import fcntl
+import logging
+import os
+import struct
+import threading
+
+from . import binary_log, log_index, log_rollups
+
+logger = logging.getLogger(__name__)
+
+
+RECORD_HEADER = struct.Struct("<II")  # (payload length, CRC32 of the payload)
+ENTRY_HEADER = struct.Struct("<HqI")  # (length of the file type name, file size before the append, data length)
+
+TEXT_FILES = ['base_csv', 'full_csv']
+BINARY_FILES = ['binary'] + log_rollups.LEVEL_NAMES
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+class LogLock:
+    """
+    An exclusive lock on a log's files, shared with other processes through flock(). Reentrant, so that code holding
+    the lock can call anything else that takes it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.depth = 0
+        self._fd = None
+        self._thread_lock = threading.RLock()  # flock() doesn't exclude other threads using the same descriptor
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self.depth == 0:
+            try:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except OSError:
+                if self._fd is not None:
+                    os.close(self._fd)
+                    self._fd = None
+                self._thread_lock.release()
+                raise
+        self.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.depth -= 1
+        if self.depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+
+
+def lock(paths: dict) -> LogLock:
+    """Returns the lock for a log. Every caller in this process shares the same LogLock, so nesting them is safe."""
+    path = str(paths['lock'])
+    with _locks_lock:
+        if path not in _locks:
+            _locks[path] = LogLock(path)
+        return _locks[path]
+
+
+def format_record(appends: list) -> bytes:
+    """Formats a journal record for a list of (which_file, size before the append, data) tuples"""
+    payload = b"".join(ENTRY_HEADER.pack(len(which.encode('utf-8')), size_before, len(data)) + which.encode('utf-8') +
+                       data for which, size_before, data in appends)
+    return RECORD_HEADER.pack(len(payload), binascii.crc32(payload)) + payload
+
+
+def read_records(path):
+    """Yields the list of (which_file, size before the append, data) for each complete record in a journal"""
+    try:
+        with open(path, 'rb') as f:
+            journal = f.read()
+    except OSError:
+        return
+
+    position = 0
+    while position + RECORD_HEADER.size <= len(journal):
+        length, crc = RECORD_HEADER.unpack_from(journal, position)
+        payload = journal[position + RECORD_HEADER.size:position + RECORD_HEADER.size + length]
+        if len(payload) < length or binascii.crc32(payload) != crc:
+            return  # The last record was torn - it was never applied, so it can be ignored
+        position += RECORD_HEADER.size + length
+
+        appends, entry_position = [], 0
+        while entry_position < len(payload):
+            name_length, size_before, data_length = ENTRY_HEADER.unpack_from(payload, entry_position)
+            entry_position += ENTRY_HEADER.size
+            which = payload[entry_position:entry_position + name_length].decode('utf-8')
+            entry_position += name_length
+            appends.append((which, size_before, payload[entry_position:entry_position + data_length]))
+            entry_position += data_length
+        yield appends
+
+
+def _replay(paths: dict, journal_path) -> int:
+    replayed = 0
+    for appends in read_records(journal_path):
+        for which, size_before, data in appends:
+            path = paths.get(which)
+            if path is None:
+                continue
+            size = os.path.getsize(path) if os.path.isfile(path) else 0
+            if size < size_before or size >= size_before + len(data):
+                # Either the append made it to disk, or the file lost data from before this point (which the journal
+                # no longer has). In both cases there is nothing to replay.
+                continue
+            with open(path, 'r+b' if os.path.isfile(path) else 'wb') as f:
+                f.truncate(size_before)
+                f.seek(size_before)
+                f.write(data)
+            replayed += 1
+    return replayed
+
+
+def _truncate(path, size: int):
+    with open(path, 'r+b') as f:
+        f.truncate(size)
+    logger.warning("Truncated torn log file {} to {} bytes".format(path, size))
+
+
+def _last_index(path, target: bytes, end: int) -> int:
+    """Returns the index of the last occurrence of target before end within a file, or -1"""
+    block_size = 64 * 1024
+    with open(path, 'rb') as f:
+        position = end
+        while position > 0:
+            start = max(position - block_size, 0)
+            f.seek(start)
+            # Read enough of the following block that a match spanning the two blocks isn't missed
+            block = f.read(position - start + len(target) - 1)[:end - start]
+            found = block.rfind(target)
+            if found >= 0:
+                return start + found
+            position = start
+    return -1
+
+
+def repair_text_tail(path, terminator: bytes) -> bool:
+    """Truncates a file back to just after the last occurrence of terminator (e.g. the end of the last full line)"""
+    if not os.path.isfile(path):
+        return False
+    size = os.path.getsize(path)
+    if size == 0:
+        return False
+    with open(path, 'rb') as f:
+        f.seek(size - len(terminator))
+        if f.read(len(terminator)) == terminator:
+            return False
+    _truncate(path, _last_index(path, terminator, size) + len(terminator) if size >= len(terminator) else 0)
+    return True
+
+
+def repair_annotations(path) -> bool:
+    """
+    The annotation file is never closed, so rather than ending with a newline a complete file ends with the closing
+    brace of the last entry. A torn entry is cut back to the previous one (or the file is emptied if there is none,
+    so that the opening bracket is written again along with the next annotation).
+    """
+    if not os.path.isfile(path):
+        return False
+    size = os.path.getsize(path)
+    if size == 0:
+        return False
+    with open(path, 'rb') as f:
+        f.seek(size - 1)
+        if f.read(1) == b"}":
+            return False
+    last_brace = _last_index(path, b"}", size)
+    _truncate(path, last_brace + 1 if last_brace >= 0 else 0)
+    return True
+
+
+def repair_records(path, record_size: int, data_offset: int = 0) -> bool:
+    """Truncates a fixed-width record file back to the end of the last complete record"""
+    if not os.path.isfile(path):
+        return False
+    size = os.path.getsize(path)
+    if size < data_offset:
+        _truncate(path, 0)  # Torn header - the file is rewritten from scratch
+        return True
+    if (size - data_offset) % record_size == 0:
+        return False
+    _truncate(path, size - (size - data_offset) % record_size)
+    return True
+
+
+def repair(paths: dict) -> int:
+    """Repairs any torn writes the journal couldn't account for. Returns the number of files that were changed."""
+    repaired = 0
+    for which in TEXT_FILES:
+        repaired += repair_text_tail(paths[which], b"\n")
+    repaired += repair_annotations(paths['annotation_json'])
+    for which in BINARY_FILES:
+        try:
+            header = binary_log.read_header(paths[which])
+        except OSError:
+            continue
+        except binary_log.BinaryLogError:
+            repaired += repair_records(paths[which], 1, binary_log.HEADER_SIZE)
+            continue
+        repaired += repair_records(paths[which], header['record_size'], header['data_offset'])
+    for which in log_index.INDEX_FILES.values():
+        repaired += repair_records(paths[which], log_index.ENTRY.size)
+    # Lines in the binary annotation table are independent JSON objects, so a torn one is simply skipped when read
+    repaired += repair_text_tail(paths['binary_annotations'], b"\n")
+    return repaired
+
+
+def sync_files(paths: dict):
+    """
+    fsync()s every file belonging to a log - including any written by other processes - so that the journal records
+    covering them can be dropped
+    """
+    for which, path in paths.items():
+        if which in ['journal', 'lock'] or not os.path.isfile(path):
+            continue
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def recover(paths: dict) -> bool:
+    """
+    Brings a log's files back to a consistent state after a crash. Takes the log's lock, so that nothing is part way
+    through writing to the log while it is checked. Returns True if anything needed to be fixed.
+    """
+    journal_path = paths['journal']
+    with lock(paths):
+        replayed = _replay(paths, journal_path) if os.path.isfile(journal_path) else 0
+        repaired = repair(paths)
+        if os.path.isfile(journal_path):
+            sync_files(paths)
+            try:
+                os.remove(journal_path)
+            except OSError:
+                pass
+    if replayed or repaired:
+        logger.warning("Recovered log files in {} ({} journaled appends replayed, {} files repaired)".format(
+            os.path.dirname(journal_path), replayed, repaired))
+    return bool(replayed or repaired)
@@ -0,0 +1,355 @@
+"""
+Multi-resolution rollups of the binary logs, used to graph long logs without shipping every point to the browser
+
+Each log has one rollup file per level (1 minute, 10 minute & 1 hour buckets). Every bucket stores the number of points
+it contains along with the min/max/mean of each reading (and the last value of integer columns such as state). The
+files use the same self-describing layout as the binary log (see binary_log.py) and are maintained incrementally by
+the log writer - a bucket is written out as soon as a point arrives for a later bucket. Points in the current (still
+open) bucket are read directly from the binary log when graphing.
+
+graph_rows() picks whichever resolution best fits the requested time window & pixel width.
+"""
+
+import math
+import mmap
+import os
+import struct
+
+from . import binary_log, log_archive
+
+
+# (which_file name, bucket size in seconds)
+LEVELS = [
+    ('rollup_1m', 60),
+    ('rollup_10m', 600),
+    ('rollup_1h', 3600),
+]
+LEVEL_NAMES = [name for name, _ in LEVELS]
+
+
+def rollup_layout(layout: binary_log.RecordLayout) -> binary_log.RecordLayout:
+    """Generates the rollup record layout for a binary log layout"""
+    columns = [('log_time', 'q', '<i8'), ('count', 'q', '<i8')]
+    for name, fmt, dtype in layout.columns:
+        if name == 'log_time':
+            continue
+        if fmt == 'q':
+            columns.append((name, 'q', '<i8'))  # Last value within the bucket
+        else:
+            columns += [(name + '_min', 'f', '<f4'), (name + '_max', 'f', '<f4'), (name + '_mean', 'f', '<f4')]
+    return binary_log.RecordLayout(columns)
+
+
+class Bucket:
+    """Running aggregates for the points within a single (open) bucket"""
+
+    def __init__(self, start: int, layout: binary_log.RecordLayout):
+        self.start = start
+        self.count = 0
+        self.float_columns = [name for name, fmt, _ in layout.columns if fmt == 'f']
+        self.int_columns = [name for name, fmt, _ in layout.columns if fmt == 'q' and name != 'log_time']
+        self.mins = {}
+        self.maxs = {}
+        self.sums = {name: 0.0 for name in self.float_columns}
+        self.counts = {name: 0 for name in self.float_columns}
+        self.lasts = {name: 0 for name in self.int_columns}
+
+    def add(self, record: dict):
+        self.count += 1
+        for name in self.float_columns:
+            value = record[name]
+            if value is None or math.isnan(value):
+                continue
+            if name not in self.mins or value < self.mins[name]:
+                self.mins[name] = value
+            if name not in self.maxs or value > self.maxs[name]:
+                self.maxs[name] = value
+            self.sums[name] += value
+            self.counts[name] += 1
+        for name in self.int_columns:
+            self.lasts[name] = record[name]
+
+    def values(self) -> dict:
+        values = {'log_time': self.start, 'count': self.count}
+        for name in self.float_columns:
+            if self.counts[name] > 0:
+                values[name + '_min'] = self.mins[name]
+                values[name + '_max'] = self.maxs[name]
+                values[name + '_mean'] = self.sums[name] / self.counts[name]
+        values.update(self.lasts)
+        return values
+
+
+def bucket_start(log_time: int, seconds: int) -> int:
+    bucket_ms = seconds * 1000
+    return log_time - (log_time % bucket_ms)
+
+
+def _last_record(path, layout: binary_log.RecordLayout):
+    count = binary_log.record_count(path)
+    if count == 0:
+        return None
+    with open(path, 'rb') as f:
+        f.seek(binary_log.HEADER_SIZE + (count - 1) * layout.record_size)
+        return layout.unpack(f.read(layout.record_size))
+
+
+def find_time_index(path, target: int, header: dict = None) -> int:
+    """
+    Returns the index of the first record in a binary/rollup file with log_time >= target (in ms), bisecting the file
+    rather than reading it. Relies on log_time being the first column and records being appended in time order.
+    """
+    if header is None:
+        header = binary_log.read_header(path)
+    count = binary_log.record_count(path, header)
+    if count == 0:
+        return 0
+    record_size, data_offset = header['record_size'], header['data_offset']
+    time_struct = struct.Struct("<q")
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            lo, hi = 0, count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if time_struct.unpack_from(mapped, data_offset + mid * record_size)[0] < target:
+                    lo = mid + 1
+                else:
+                    hi = mid
+    return lo
+
+
+class RollupLevel:
+    def __init__(self, name: str, seconds: int, path, layout: binary_log.RecordLayout):
+        self.name = name
+        self.seconds = seconds
+        self.path = path
+        self.source_layout = layout
+        self.layout = rollup_layout(layout)
+        self.bucket = None
+
+    def add(self, record: dict):
+        """Adds a record to the level, returning the packed bucket that was closed as a result (if any)"""
+        start = bucket_start(record['log_time'], self.seconds)
+        closed = None
+        if self.bucket is not None and start != self.bucket.start:
+            if start < self.bucket.start:
+                return None  # Out of order points (e.g. the clock went backwards) don't get rolled up
+            closed = self.layout.pack(self.bucket.values())
+            self.bucket = None
+        if self.bucket is None:
+            self.bucket = Bucket(start, self.source_layout)
+        self.bucket.add(record)
+        return closed
+
+    def rebuild(self, bin_path):
+        """Regenerates the entire level from the binary log, leaving the last bucket open"""
+        self.bucket = None
+        tmp_path = str(self.path) + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self.layout.header())
+            for record in binary_log.iter_records(bin_path):
+                closed = self.add(record)
+                if closed is not None:
+                    f.write(closed)
+        os.replace(tmp_path, self.path)
+
+    def resume(self, bin_path):
+        """
+        Picks up where a previous writer left off, reloading the open bucket from the tail of the binary log. If the
+        rollup file doesn't agree with the binary log (it doesn't exist, or a bucket wasn't written out) the level is
+        rebuilt instead.
+        """
+        if not os.path.isfile(bin_path) or os.path.getsize(bin_path) < binary_log.HEADER_SIZE:
+            last = None
+        else:
+            last = _last_record(bin_path, self.source_layout)
+        if last is None:
+            self.bucket = None
+            with open(self.path, 'wb') as f:
+                f.write(self.layout.header())
+            return
+
+        open_start = bucket_start(last['log_time'], self.seconds)
+        first_open_index = find_time_index(bin_path, open_start)
+
+        expected_last_bucket = None
+        if first_open_index > 0:
+            with open(bin_path, 'rb') as f:
+                f.seek(binary_log.HEADER_SIZE + (first_open_index - 1) * self.source_layout.record_size)
+                previous_time = struct.unpack("<q", f.read(8))[0]
+            expected_last_bucket = bucket_start(previous_time, self.seconds)
+
+        try:
+            rollup_last = _last_record(self.path, self.layout)
+        except (OSError, binary_log.BinaryLogError):
+            rollup_last = None
+            expected_last_bucket = -1  # Force a rebuild
+
+        if (rollup_last['log_time'] if rollup_last else None) != expected_last_bucket:
+            self.rebuild(bin_path)
+            return
+
+        self.bucket = None
+        for record in binary_log.iter_records(bin_path, start=first_open_index):
+            self.add(record)
+
+
+class RollupWriter:
+    """Maintains all of the rollup levels for a log. Used by LogWriter."""
+
+    def __init__(self, paths: dict, layout: binary_log.RecordLayout):
+        self.levels = [RollupLevel(name, seconds, paths[name], layout) for name, seconds in LEVELS]
+        self.resumed = False
+
+    def resume(self, bin_path):
+        for level in self.levels:
+            level.resume(bin_path)
+        self.resumed = True
+
+    def add(self, record: dict) -> dict:
+        """Returns a dict of {level name: packed bucket} for each bucket closed by this record"""
+        closed = {}
+        for level in self.levels:
+            packed = level.add(record)
+            if packed is not None:
+                closed[level.name] = packed
+        return closed
+
+
+def rollups_exist(paths: dict) -> bool:
+    return all(os.path.isfile(paths[name]) for name in ['binary'] + LEVEL_NAMES)
+
+
+def ensure_rollups(log):
+    """
+    Builds any rollup levels that are missing for a log (e.g. logs written before rollups existed). The caller must
+    hold the log's lock - see log_writer.build_derived_files().
+    """
+    paths = log.log_file_paths()
+    for name, seconds in LEVELS:
+        if not os.path.isfile(paths[name]):
+            RollupLevel(name, seconds, paths[name], log.binary_layout()).rebuild(paths['binary'])
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        return "" if math.isnan(value) else "{:g}".format(value)
+    return str(value)
+
+
+def _window(path, header: dict, start: int = None, end: int = None) -> tuple:
+    """Returns the (first, last) record indices (last being exclusive) within the time window [start, end)"""
+    first = find_time_index(path, start, header) if start is not None else 0
+    last = find_time_index(path, end, header) if end is not None else binary_log.record_count(path, header)
+    return first, last
+
+
+def annotation_times(path) -> list:
+    """Returns the times (in ms since the epoch, in order) of the points in a log's annotation file"""
+    times = set()
+    for annotation in binary_log.read_csv_annotations(path):
+        try:
+            times.add(binary_log.to_epoch_ms(binary_log.parse_csv_time(annotation['x'])))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return sorted(times)
+
+
+def _annotated_records(paths: dict, start: int = None, end: int = None) -> list:
+    """
+    Returns the raw records for the annotated points within [start, end). Annotations are timed to the second, so the
+    first point logged within the annotation's second is the one it belongs to.
+    """
+    header = binary_log.read_header(paths['binary'])
+    count = binary_log.record_count(paths['binary'], header)
+    records = []
+    for annotation_time in annotation_times(paths['annotation_json']):
+        if (start is not None and annotation_time < start - 999) or (end is not None and annotation_time >= end):
+            continue
+        index = find_time_index(paths['binary'], annotation_time, header)
+        if index >= count:
+            continue
+        record = next(binary_log.iter_records(paths['binary'], header, start=index))
+        if record['log_time'] - annotation_time < 1000 and (start is None or record['log_time'] >= start):
+            records.append(record)
+    return records
+
+
+def graph_rows(log, width: int, start: int = None, end: int = None, bars: bool = False):
+    """
+    Generates CSV lines (matching log.column_headers('base_csv')) for graphing a Beer or GravityLog, using the
+    finest data that still provides at most one point per pixel of width within the time window [start, end) (in ms
+    since the epoch). With bars=True, values are emitted as "min;mean;max" for Dygraph's customBars.
+
+    Dygraph only draws an annotation on a row with exactly the annotation's time, so when the data is rolled up, the
+    raw row for each annotated point is included after the bucket it falls in.
+
+    Nothing is built here - until the binary log & rollups have been built (see log_writer.build_derived_files) the
+    whole base CSV is returned instead.
+    """
+    paths = log.log_file_paths()
+    if not rollups_exist(paths):
+        if log_archive.exists(paths['base_csv']):
+            with log_archive.open_log_file(paths['base_csv'], 'r') as f:
+                yield from f
+        return
+
+    headers = log.column_headers('base_csv')
+    columns = [name for name in headers if name != 'log_time']
+
+    def format_raw(record):
+        row = [binary_log.format_csv_time(record['log_time'])]
+        for column in columns:
+            value = _format_value(record.get(column, float('nan')))
+            row.append(";".join([value] * 3) if bars else value)
+        return ",".join(row) + "\r\n"
+
+    def format_bucket(record):
+        row = [binary_log.format_csv_time(record['log_time'])]
+        for column in columns:
+            if column in record:  # Integer columns (state) store the last value
+                value = _format_value(record[column])
+                row.append(";".join([value] * 3) if bars else value)
+            elif bars:
+                row.append(";".join(_format_value(record[column + suffix]) for suffix in ['_min', '_mean', '_max']))
+            else:
+                row.append(_format_value(record[column + '_mean']))
+        return ",".join(row) + "\r\n"
+
+    # Sources are ordered from finest (the raw points) to coarsest. Use the first one that fits.
+    sources = [('binary', 0)] + LEVELS
+    chosen = len(sources) - 1
+    for index, (name, seconds) in enumerate(sources):
+        first, last = _window(paths[name], binary_log.read_header(paths[name]), start, end)
+        if last - first <= width:
+            chosen = index
+            break
+
+    yield ",".join(headers) + "\r\n"
+
+    annotated = _annotated_records(paths, start, end) if chosen > 0 else []
+
+    # The most recent points are still in buckets that haven't been closed yet, so once the chosen level runs out we
+    # cascade down through the finer levels (and finally the raw points) to fill in the end of the graph.
+    cursor = start
+    for name, seconds in reversed(sources[:chosen + 1]):
+        header = binary_log.read_header(paths[name])
+        first, last = _window(paths[name], header, cursor, end)
+        for record in binary_log.iter_records(paths[name], header, start=first):
+            if first >= last:
+                break
+            first += 1
+            if name == 'binary':
+                yield format_raw(record)
+            else:
+                # Annotated points before this bucket (e.g. in a partial bucket at the start of the window)
+                while annotated and annotated[0]['log_time'] < record['log_time']:
+                    yield format_raw(annotated.pop(0))
+                yield format_bucket(record)
+                cursor = record['log_time'] + seconds * 1000
+                # Then those within it - any after it are either in a later bucket, or are raw rows at the end
+                bucket_time = binary_log.format_csv_time(record['log_time'])
+                while annotated and annotated[0]['log_time'] < cursor:
+                    raw = annotated.pop(0)
+                    if binary_log.format_csv_time(raw['log_time']) != bucket_time:
+                        yield format_raw(raw)
@@ -0,0 +1,51 @@
+"""
+Precompiled row layouts for writing beer & gravity log points
+
+Everything about how a point is written out that depends only on the log (the file paths, the CSV headers, which
+optional columns are included, the binary layout) is worked out once per log and cached here, rather than being
+recomputed - including foreign key lookups - for each of the CSVs every time a point is saved. Each layout carries
+the signature of the log fields it was built from, so editing the log (renaming it, enabling gravity, etc.) causes it
+to be rebuilt the next time a point is written.
+
+See Beer.row_layout()/BeerLogPoint.log_rows() and GravityLog.row_layout()/GravityLogPoint.log_rows().
+"""
+
+import datetime
+import threading
+
+
+class RowLayout:
+    def __init__(self, log, signature: tuple, **options):
+        self.signature = signature
+        self.key = log.log_key()
+        self.paths = log.log_file_paths()
+        self.headers = {'base_csv': log.column_headers('base_csv'), 'full_csv': log.column_headers('full_csv')}
+        self.binary_layout = log.binary_layout()
+        self.__dict__.update(options)
+
+
+_layouts = {}
+_lock = threading.Lock()
+
+
+def layout_for(log, signature: tuple, **options) -> RowLayout:
+    """Returns the cached layout for a Beer/GravityLog, building it if it is missing or the signature changed"""
+    key = log.log_key()
+    this_layout = _layouts.get(key)
+    if this_layout is None or this_layout.signature != signature:
+        this_layout = RowLayout(log, signature, **options)
+        with _lock:
+            _layouts[key] = this_layout
+    return this_layout
+
+
+def forget(key: str):
+    with _lock:
+        _layouts.pop(key, None)
+
+
+def format_log_time(log_time: datetime.datetime) -> str:
+    """Formats a time as it's written to the CSVs ('%Y/%m/%d %H:%M:%SZ' in UTC) without going through strftime"""
+    utc_time = log_time.astimezone(datetime.timezone.utc)
+    return "%04d/%02d/%02d %02d:%02d:%02dZ" % (utc_time.year, utc_time.month, utc_time.day, utc_time.hour,
+                                               utc_time.minute, utc_time.second)
@@ -0,0 +1,187 @@
+"""
+Running statistics for beer & gravity logs
+
+Rather than re-reading the whole log every time something wants a summary of a fermentation, LogWriter keeps a set of
+running aggregates up to date as each point is written and persists them in a small JSON sidecar ("_stats.json").
+The sidecar records how many points of the binary log it covers, so that when a writer picks a log back up it can
+tell if the sidecar is behind (e.g. a crash lost the last update) and catch up from the binary log rather than
+starting over. Readers only ever read the sidecar, so it can trail the log by the points written since the writer last
+flushed.
+
+summary() turns the aggregates into the values used by the API, the beer list and the push targets - min/max/mean of
+each reading, the time spent in each controller state, how far the beer temp strayed from its setpoint, and the
+gravity drop & apparent attenuation.
+"""
+
+import json
+import math
+import os
+
+from . import binary_log
+
+
+# Gaps between points longer than this (e.g. logging was paused) aren't counted towards the time spent in a state
+MAX_STATE_GAP_MS = 10 * 60 * 1000
+
+# Controller states (see BeerLogPoint.STATE_CHOICES) counted as heating or cooling
+HEATING_STATES = [3, 9]  # HEATING, HEATING_MIN_TIME
+COOLING_STATES = [4, 8]  # COOLING, COOLING_MIN_TIME
+
+
+def _is_missing(value) -> bool:
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _round(value):
+    return None if value is None else round(value, 4)
+
+
+class LogStats:
+    def __init__(self, layout: binary_log.RecordLayout, data: dict = None):
+        self.layout = layout
+        self.float_columns = [name for name, fmt, _ in layout.columns if fmt == 'f']
+        self.has_state = 'state' in layout.names
+        self.has_setpoint = 'beer_temp' in layout.names and 'beer_set' in layout.names
+        self.has_gravity = 'gravity' in layout.names
+        self.data = data if data is not None else {
+            'records': 0,
+            'first_time': None,
+            'last_time': None,
+            'last_state': None,
+            'columns': {name: {'min': None, 'max': None, 'sum': 0.0, 'count': 0} for name in self.float_columns},
+            'state_ms': {},
+            'setpoint_deviation': {'sum': 0.0, 'count': 0, 'max': None},
+            'gravity': {'first': None, 'last': None},
+        }
+
+    @property
+    def records(self) -> int:
+        return self.data['records']
+
+    def add(self, record: dict):
+        data = self.data
+        log_time = record['log_time']
+
+        if self.has_state:
+            if data['last_time'] is not None and 0 < log_time - data['last_time'] <= MAX_STATE_GAP_MS:
+                # The time since the last point is attributed to the state the controller was in at the last point
+                state = str(data['last_state'])
+                data['state_ms'][state] = data['state_ms'].get(state, 0) + log_time - data['last_time']
+            data['last_state'] = record['state']
+
+        if data['first_time'] is None:
+            data['first_time'] = log_time
+        data['last_time'] = log_time
+        data['records'] += 1
+
+        for name in self.float_columns:
+            value = record[name]
+            if _is_missing(value):
+                continue
+            column = data['columns'][name]
+            if column['min'] is None or value < column['min']:
+                column['min'] = value
+            if column['max'] is None or value > column['max']:
+                column['max'] = value
+            column['sum'] += value
+            column['count'] += 1
+
+        if self.has_setpoint and not _is_missing(record['beer_temp']) and not _is_missing(record['beer_set']):
+            deviation = abs(record['beer_temp'] - record['beer_set'])
+            data['setpoint_deviation']['sum'] += deviation
+            data['setpoint_deviation']['count'] += 1
+            if data['setpoint_deviation']['max'] is None or deviation > data['setpoint_deviation']['max']:
+                data['setpoint_deviation']['max'] = deviation
+
+        if self.has_gravity and not _is_missing(record['gravity']):
+            if data['gravity']['first'] is None:
+                data['gravity']['first'] = record['gravity']
+            data['gravity']['last'] = record['gravity']
+
+    def catch_up(self, bin_path):
+        """Adds any records in the binary log that the stats don't cover yet"""
+        for record in binary_log.iter_records(bin_path, start=self.records):
+            self.add(record)
+
+    def save(self, path):
+        tmp_path = str(path) + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, layout: binary_log.RecordLayout):
+        try:
+            with open(path, 'r') as f:
+                return cls(layout, json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def resume(cls, path, bin_path, layout: binary_log.RecordLayout):
+        """
+        Loads the stats for a log so that they can be added to, bringing them up to date with the binary log first. If
+        the sidecar is missing or covers more records than the binary log has, the stats are rebuilt from scratch.
+        """
+        stats = cls.load(path, layout)
+        count = binary_log.record_count(bin_path) if os.path.isfile(bin_path) and \
+            os.path.getsize(bin_path) >= binary_log.HEADER_SIZE else 0
+        if stats is None or stats.records > count:
+            stats = cls(layout)
+        if stats.records < count:
+            stats.catch_up(bin_path)
+        return stats
+
+    def summary(self) -> dict:
+        data = self.data
+        summary = {
+            'points': data['records'],
+            'first_log_time': data['first_time'],
+            'last_log_time': data['last_time'],
+            'duration_seconds': (data['last_time'] - data['first_time']) // 1000 if data['records'] else 0,
+            'columns': {name: {'min': _round(column['min']), 'max': _round(column['max']),
+                               'mean': _round(column['sum'] / column['count']) if column['count'] else None}
+                        for name, column in data['columns'].items()},
+        }
+
+        if self.has_state:
+            summary['state_seconds'] = {state: ms // 1000 for state, ms in data['state_ms'].items()}
+            summary['heating_seconds'] = sum(data['state_ms'].get(str(state), 0) for state in HEATING_STATES) // 1000
+            summary['cooling_seconds'] = sum(data['state_ms'].get(str(state), 0) for state in COOLING_STATES) // 1000
+
+        if self.has_setpoint:
+            deviation = data['setpoint_deviation']
+            summary['setpoint_deviation'] = {
+                'mean': _round(deviation['sum'] / deviation['count']) if deviation['count'] else None,
+                'max': _round(deviation['max']),
+            }
+
+        if self.has_gravity:
+            original, current = data['gravity']['first'], data['gravity']['last']
+            summary['gravity'] = {
+                'original': _round(original),
+                'current': _round(current),
+                'drop': _round(original - current) if original is not None else None,
+                # Apparent attenuation is only meaningful for specific gravity readings above that of water
+                'apparent_attenuation': _round((original - current) / (original - 1) * 100)
+                if original is not None and original > 1 else None,
+            }
+        return summary
+
+
+def ensure_stats(paths: dict, layout: binary_log.RecordLayout):
+    """
+    Builds the sidecar for a log that doesn't have one (e.g. it was written before the stats existed). The caller must
+    hold the log's lock - see log_writer.build_derived_files().
+    """
+    if not os.path.isfile(paths['stats']):
+        LogStats.resume(paths['stats'], paths['binary'], layout).save(paths['stats'])
+
+
+def summary(log) -> dict or None:
+    """
+    Returns the stats summary for a Beer or GravityLog, or None if nothing has been logged or its sidecar hasn't been
+    built yet. This only reads the sidecar, so it's cheap enough to call for every beer in a list.
+    """
+    stats = LogStats.load(log.log_file_paths()['stats'], log.binary_layout())
+    return stats.summary() if stats is not None else None
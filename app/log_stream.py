@@ -0,0 +1,188 @@
+"""
+Redis stream transport for beer log points
+
+By default BrewPi-Script saves each log point by posting it to the Fermentrack API, so every point waits on a web
+server worker. With BREWPI_LOG_TRANSPORT set to "redis", BrewPi-Script instead adds each point to a Redis stream
+(STREAM_KEY) and the `manage.py consume_log_points` process reads them back in batches, enriches them with gravity
+data and writes them to the logs.
+
+The consumer reads through a consumer group, and only acknowledges (and deletes) entries once the points in them have
+been written. Anything that was read but not acknowledged when the consumer was stopped is read again - before any
+new entries - when it restarts. As a batch may have been partly written before it failed, the consumer skips any point
+for a beer that isn't newer than the last one in that beer's log, so retrying a batch doesn't log points twice. The
+first time the consumer sees a beer it reads the log_time of the last point in the beer's binary log, so this holds
+across a crash or restart between writing a batch and acknowledging it, too.
+
+Entries that can't be written - because they are invalid, are for a device that doesn't exist, or keep failing - are
+moved to a dead-letter stream (DEAD_LETTER_KEY) along with the error, rather than blocking the stream or being lost.
+They can be inspected with `XRANGE fermentrack:beer_log_points:dead - +`.
+
+Each stream entry has a single "point" field holding the JSON for the point, in the same format accepted by
+/api/save_points/ (including log_time, as epoch milliseconds).
+"""
+
+import json
+import logging
+import time
+
+import redis
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import binary_log, log_writer
+from .api.devices import build_beer_log_points, parse_log_time
+from .models import BeerLogPoint
+
+logger = logging.getLogger(__name__)
+
+
+STREAM_KEY = "fermentrack:beer_log_points"
+DEAD_LETTER_KEY = STREAM_KEY + ":dead"
+GROUP_NAME = "log_writers"
+
+BATCH_SIZE = 500
+BLOCK_MS = 5000  # How long a read waits for new entries before the consumer checks in on the open log files
+MAX_ATTEMPTS = 3  # Times a batch is retried before it's dead-lettered, so one bad entry can't block the stream
+
+
+def connect() -> redis.Redis:
+    return redis.Redis.from_url(url=settings.REDIS_URL, socket_timeout=(BLOCK_MS / 1000) + 5)
+
+
+def ensure_group(r: redis.Redis):
+    try:
+        r.xgroup_create(STREAM_KEY, GROUP_NAME, id="0", mkstream=True)
+    except redis.exceptions.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise  # Anything other than the group already existing
+
+
+def parse_entries(entries: list) -> (dict, dict):
+    """
+    Parses a list of (entry ID, fields) from the stream into points grouped by device. Returns the points along with the
+    entries they came from, also grouped by device - with any that couldn't be parsed under None, paired with the error.
+    """
+    points_by_device, entries_by_device = {}, {}
+    for entry in entries:
+        entry_id, fields = entry
+        try:
+            point = json.loads(fields[b'point'])
+            point['log_time'] = parse_log_time(point.get('log_time'))
+            device_id = int(point.get('brewpi_device_id'))
+        except (KeyError, TypeError, ValueError) as e:
+            # There is nothing to be gained by retrying a point that can't be parsed
+            logger.error("Invalid log point {} in {}: {}".format(entry_id, STREAM_KEY, e))
+            entries_by_device.setdefault(None, []).append((entry, str(e)))
+            continue
+        points_by_device.setdefault(device_id, []).append(point)
+        entries_by_device.setdefault(device_id, []).append(entry)
+    return points_by_device, entries_by_device
+
+
+def acknowledge(r: redis.Redis, entries: list, dead_letters: list = None):
+    """
+    Acknowledges (and deletes) a batch of entries, first moving dead_letters - a list of (entry, error) - to the
+    dead-letter stream. It's all done in a single transaction so that an entry is never lost between the two.
+    """
+    entry_ids = [entry_id for entry_id, _ in entries]
+    pipe = r.pipeline(transaction=True)
+    for (entry_id, fields), error in dead_letters or []:
+        pipe.xadd(DEAD_LETTER_KEY, dict(fields, entry_id=entry_id, error=error))
+    pipe.xack(STREAM_KEY, GROUP_NAME, *entry_ids)
+    pipe.xdel(STREAM_KEY, *entry_ids)
+    pipe.execute()
+
+
+def process_entries(r: redis.Redis, entries: list, written_until: dict) -> int:
+    """
+    Writes out the points in a batch of entries, then acknowledges them. written_until holds the log_time (as epoch
+    milliseconds) of the last point logged for each beer - read from the beer's log the first time the beer is seen -
+    and is updated as each beer's points are written. Returns the number of points written.
+    """
+    points_by_device, entries_by_device = parse_entries(entries)
+    to_save, results = build_beer_log_points(points_by_device)
+
+    points_by_beer = {}
+    for point in to_save:
+        beer_id = point.associated_beer_id
+        if beer_id not in written_until:
+            written_until[beer_id] = binary_log.last_log_time(point.associated_beer.log_file_paths()['binary'])
+        if written_until[beer_id] is not None and binary_log.to_epoch_ms(point.log_time) <= written_until[beer_id]:
+            continue  # Already written by an earlier attempt at this batch
+        points_by_beer.setdefault(beer_id, []).append(point)
+
+    saved = 0
+    for beer_id, beer_points in points_by_beer.items():
+        saved += BeerLogPoint.save_points(beer_points)
+        written_until[beer_id] = max(binary_log.to_epoch_ms(point.log_time) for point in beer_points)
+
+    dead_letters = entries_by_device.get(None, [])
+    for device_id, result in results.items():
+        if result['status'] not in ['success', 'not logging']:
+            logger.warning("Unable to log points for BrewPiDevice {}: {}".format(device_id, result['status']))
+            dead_letters += [(entry, result['status']) for entry in entries_by_device[int(device_id)]]
+
+    acknowledge(r, entries, dead_letters)
+    return saved
+
+
+def read_entries(r: redis.Redis, consumer_name: str, pending: bool) -> list:
+    """
+    Reads the next batch of entries for this consumer - either those it has already been given but hasn't acknowledged
+    (pending=True) or new ones
+    """
+    response = r.xreadgroup(GROUP_NAME, consumer_name, {STREAM_KEY: "0" if pending else ">"}, count=BATCH_SIZE,
+                            block=None if pending else BLOCK_MS)
+    if not response:
+        return []
+    return response[0][1]
+
+
+def consume(consumer_name: str, should_stop=lambda: False):
+    """Reads & writes out points from the stream until should_stop() returns True"""
+    r = connect()
+    ensure_group(r)
+    pending = True  # Start by finishing anything the last run of this consumer didn't acknowledge
+    failed_entry, attempts = None, 0
+    written_until = {}
+
+    while not should_stop():
+        entries = []
+        try:
+            close_old_connections()  # This is a long running process - don't hang on to a connection the DB dropped
+            entries = read_entries(r, consumer_name, pending)
+            if pending and not entries:
+                pending = False
+                continue
+            if entries:
+                saved = process_entries(r, entries, written_until)
+                logger.debug("Wrote {} log points from {} stream entries".format(saved, len(entries)))
+        except redis.exceptions.ResponseError as e:
+            if "NOGROUP" not in str(e):
+                logger.exception("Unable to read log points from {}".format(STREAM_KEY))
+                time.sleep(5)
+            else:
+                # The stream was removed out from under us (e.g. Redis was flushed) - start over
+                ensure_group(r)
+        except redis.exceptions.ConnectionError:
+            logger.warning("Lost connection to Redis at {} - retrying".format(settings.REDIS_URL))
+            time.sleep(5)
+        except Exception as e:
+            # The entries weren't acknowledged, so they'll be retried once the pending entries are read again
+            logger.exception("Unable to write log points from {}".format(STREAM_KEY))
+            if entries:
+                attempts = attempts + 1 if entries[0][0] == failed_entry else 1
+                failed_entry = entries[0][0]
+                if attempts >= MAX_ATTEMPTS:
+                    logger.error("Moving {} stream entries to {} after {} failed attempts".format(
+                        len(entries), DEAD_LETTER_KEY, attempts))
+                    try:
+                        acknowledge(r, entries, [(entry, str(e)) for entry in entries])
+                        failed_entry, attempts = None, 0
+                    except redis.exceptions.RedisError:
+                        logger.exception("Unable to move stream entries to {}".format(DEAD_LETTER_KEY))
+            pending = True
+            time.sleep(5)
+
+        # Let idle logs be flushed & closed even when no points are coming in
+        log_writer.registry.sweep()
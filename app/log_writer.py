@@ -0,0 +1,491 @@
+"""
+Long-lived, buffered append handles for the flat-file logs written by BeerLogPoint and GravityLogPoint.
+
+Previously every saved point checked for (and opened/closed) each of a log's files individually. Instead, the
+registry below keeps the files for recently written logs open and flushes them according to a configurable policy.
+Each point is handed to the OS as soon as it has been journaled - flushing saves the stats sidecar, and fsync()s the
+files if LOG_WRITER_FSYNC is set:
+
+    LOG_WRITER_FLUSH_ROWS     Flush once this many points have been written to a log (1 = flush every point)
+    LOG_WRITER_FLUSH_SECONDS  Flush any log whose oldest unflushed point is older than this many seconds
+    LOG_WRITER_FSYNC          Additionally fsync() the files on every flush
+    LOG_WRITER_MAX_OPEN_LOGS  Maximum number of logs to hold open before the least recently used is evicted
+    LOG_WRITER_IDLE_SECONDS   Logs that haven't been written to in this long are flushed & closed
+
+Each point is also appended to the log's binary store (see binary_log.py) when the caller provides binary values,
+which also keeps the log's rollups (log_rollups.py) and running statistics (log_stats.py) up to date.
+
+Everything appended for a point is staged and written to the log's journal in a single write before being applied
+to the files themselves, so that a crash part way through a point can be recovered from (see log_journal.py).
+
+More than one process can write to the same log (e.g. the web server and the Tilt monitor), so each point is staged,
+journaled and handed to the OS while holding the log's lock, and flushing & closing take the lock as well. A writer
+that finds another process has written to the log since it last held the lock starts over from what is on disk.
+
+Handles are released (flushed & closed) when logging stops or a log is deleted via release_log() so that nothing
+continues to write to a file that is about to be removed, archived, or restored from a backup. If a log that has been
+archived (see log_archive.py) is written to again, its files are decompressed before anything is appended.
+"""
+
+import atexit
+import collections
+import csv
+import io
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from . import binary_log, log_archive, log_index, log_journal, log_rollups, log_stats
+
+logger = logging.getLogger(__name__)
+
+
+# The file types each log can write out. These match the "which_file" keys used by Beer/GravityLog.full_filename()
+CSV_FILES = ('base_csv', 'full_csv')
+ANNOTATION_FILE = 'annotation_json'
+BINARY_FILE = 'binary'
+BINARY_ANNOTATION_FILE = 'binary_annotations'
+JOURNAL_FILE = 'journal'
+STATS_FILE = 'stats'
+LOCK_FILE = 'lock'
+
+# Files that are generated from the CSVs and can be regenerated if they go missing (e.g. after restoring a backup)
+DERIVED_FILES = [BINARY_FILE, BINARY_ANNOTATION_FILE, STATS_FILE] + log_rollups.LEVEL_NAMES + \
+    list(log_index.INDEX_FILES.values())
+LOG_FILES = list(CSV_FILES) + [ANNOTATION_FILE] + DERIVED_FILES + [JOURNAL_FILE, LOCK_FILE]
+
+
+def beer_log_key(beer_id: int) -> str:
+    return "beer-{}".format(beer_id)
+
+
+def gravity_log_key(log_id: int) -> str:
+    return "gravity-{}".format(log_id)
+
+
+class LogFile:
+    """
+    A single append-only file, opened in binary mode so that we always know how large it is. Writes are staged (and
+    included in size) until apply() is called so that they can be journaled first.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.pending = bytearray()
+        self._f = None
+
+    def open(self):
+        if self._f is None:
+            self._f = open(self.path, 'ab')
+            self.size = self._f.seek(0, os.SEEK_END)
+        return self
+
+    @property
+    def is_open(self) -> bool:
+        return self._f is not None
+
+    def changed(self) -> bool:
+        """Whether the file on disk is no longer the one we have open, or is a different size than we think it is"""
+        if self._f is None:
+            return False
+        try:
+            on_disk = os.stat(self.path)
+        except OSError:
+            return True
+        opened = os.fstat(self._f.fileno())
+        return (on_disk.st_dev, on_disk.st_ino) != (opened.st_dev, opened.st_ino) or on_disk.st_size != self.size
+
+    def write(self, data: bytes):
+        self.pending += data
+        self.size += len(data)
+
+    def staged(self) -> tuple:
+        """Returns (size before the staged writes, staged data)"""
+        return self.size - len(self.pending), bytes(self.pending)
+
+    def apply(self):
+        if self.pending:
+            self._f.write(self.pending)
+            self._f.flush()  # Before the lock is released, so that other processes writing the log append after it
+            self.pending = bytearray()
+
+    def truncate(self):
+        self._f.truncate(0)
+        self.size = 0
+
+    def flush(self, fsync: bool = False):
+        if self._f is not None:
+            self._f.flush()
+            if fsync:
+                os.fsync(self._f.fileno())
+
+    def close(self, fsync: bool = False):
+        if self._f is not None:
+            try:
+                self.flush(fsync)
+            finally:
+                self._f.close()
+                self._f = None
+                self.pending = bytearray()
+
+
+class LogWriter:
+    """Writes points out to the CSV and annotation files belonging to a single beer or gravity log"""
+
+    def __init__(self, key: str, paths: dict, layout: binary_log.RecordLayout = None):
+        self.key = key
+        self.paths = paths
+        self.layout = layout
+        self.lock = log_journal.lock(paths)
+        self.rollups = None
+        self.stats = None
+        self.stats_changed = False
+        self.rows_since_index = {}
+        self.files = {}
+        self.journal = None
+        self.pending_rows = 0
+        self.first_pending_at = None
+        self.last_write_at = time.monotonic()
+
+        # A single csv.writer is reused for every row written by this log
+        self._csv_buffer = io.StringIO()
+        self._csv_writer = csv.writer(self._csv_buffer)
+
+    def file(self, which: str) -> LogFile:
+        if which not in self.files:
+            self.files[which] = LogFile(self.paths[which])
+        return self.files[which].open()
+
+    def format_csv_row(self, row: list) -> bytes:
+        self._csv_buffer.seek(0)
+        self._csv_buffer.truncate()
+        self._csv_writer.writerow(row)
+        return self._csv_buffer.getvalue().encode('utf-8')
+
+    @staticmethod
+    def format_annotations(annotations: list, file_is_new: bool) -> bytes:
+        # The annotation file is "almost" JSON - it's a list that is never closed (AlmostJsonWrapper adds the closing
+        # bracket when it is served) so that we can keep appending to it
+        out = "[\r\n" if file_is_new else ",\r\n"
+        out += ",\r\n".join('  {{"series": "{}", "x": "{}", "shortText": "{}", "text": "{}"}}'.format(
+            this_annotation['series'], this_annotation['x'], this_annotation['shortText'], this_annotation['text'])
+            for this_annotation in annotations)
+        return out.encode('utf-8')
+
+    def binary_file(self) -> LogFile:
+        if BINARY_FILE not in self.files and not os.path.exists(self.paths[BINARY_FILE]):
+            # Logs that were started before the binary store existed get converted from their base CSV (and annotations)
+            # first so that the binary log is complete
+            if os.path.isfile(self.paths['base_csv']) and os.path.getsize(self.paths['base_csv']) > 0:
+                binary_log.build_from_csv(self.paths['base_csv'], self.paths[BINARY_FILE], self.layout,
+                                          self.paths[ANNOTATION_FILE], self.paths[BINARY_ANNOTATION_FILE])
+        return self.file(BINARY_FILE)
+
+    def index_file(self, which: str) -> LogFile:
+        index_name = log_index.INDEX_FILES[which]
+        if index_name not in self.files and not os.path.exists(self.paths[index_name]):
+            # As with the binary log, index any rows that were written before the index existed
+            if os.path.isfile(self.paths[which]) and os.path.getsize(self.paths[which]) > 0:
+                log_index.build_index(self.paths[which], self.paths[index_name])
+        return self.file(index_name)
+
+    def write_point(self, rows: dict, headers: dict, annotations: list = None, binary_values: dict = None,
+                    commit: bool = True):
+        """
+        Append a single point to the log. rows & headers are dicts keyed by file type (e.g. 'base_csv') - headers are
+        only written out if the file is new (empty). binary_values (if provided) are appended to the binary log. With
+        commit=False the point is only staged, so that a batch of points can be journaled & written out together.
+        """
+        if binary_values is not None:
+            this_file = self.binary_file()
+            if self.rollups is None:
+                # Pick up the rollups where the last writer for this log left off before we append anything
+                self.rollups = log_rollups.RollupWriter(self.paths, self.layout)
+                self.rollups.resume(self.paths[BINARY_FILE])
+            if self.stats is None:
+                self.stats = log_stats.LogStats.resume(self.paths[STATS_FILE], self.paths[BINARY_FILE], self.layout)
+            if this_file.size == 0:
+                this_file.write(self.layout.header())
+            row_index = (this_file.size - binary_log.HEADER_SIZE) // self.layout.record_size
+            record = self.layout.pack(binary_values)
+            this_file.write(record)
+            if annotations:
+                self.file(BINARY_ANNOTATION_FILE).write(binary_log.format_annotations(row_index, annotations))
+            unpacked = self.layout.unpack(record)
+            for level_name, bucket in self.rollups.add(unpacked).items():
+                self.file(level_name).write(bucket)
+            self.stats.add(unpacked)
+            self.stats_changed = True
+
+        log_time = binary_values['log_time'] if binary_values is not None else None
+        index_interval = settings.LOG_INDEX_INTERVAL
+        for which, row in rows.items():
+            this_file = self.file(which)
+            if this_file.size == 0:
+                this_file.write(self.format_csv_row(headers[which]))
+            if log_time is not None and which in log_index.INDEX_FILES:
+                # The first row written by each writer is always indexed, then every index_interval rows after that
+                if self.rows_since_index.get(which, index_interval) >= index_interval:
+                    self.index_file(which).write(log_index.format_entry(log_time, this_file.size))
+                    self.rows_since_index[which] = 0
+                self.rows_since_index[which] += 1
+            this_file.write(self.format_csv_row(row))
+
+        if annotations:
+            this_file = self.file(ANNOTATION_FILE)
+            this_file.write(self.format_annotations(annotations, this_file.size == 0))
+
+        if commit:
+            self.commit()
+
+        self.pending_rows += 1
+        self.last_write_at = time.monotonic()
+        if self.first_pending_at is None:
+            self.first_pending_at = self.last_write_at
+
+    def commit(self):
+        """Journals everything staged for the current point, then applies it to the files"""
+        appends = [(which, *this_file.staged()) for which, this_file in self.files.items() if this_file.pending]
+        if not appends:
+            return
+        if self.journal is None:
+            self.journal = LogFile(self.paths[JOURNAL_FILE]).open()
+        self.journal.write(log_journal.format_record(appends))
+        self.journal.apply()
+        self.journal.flush(settings.LOG_WRITER_FSYNC)
+        for this_file in self.files.values():
+            this_file.apply()
+
+    def sync(self) -> bool:
+        """
+        Checks whether another process has written to (or archived) the log since this writer last held the lock. If
+        so, everything held about the files (their sizes, the open rollup buckets, the stats...) is stale, so they are
+        closed to be reopened - and the rollups & stats resumed from disk - on the next write. Before the files are
+        (re)opened, any that were archived are restored and anything left in the journal is recovered. Must be called
+        holding the lock. Returns True if the writer had to start over.
+        """
+        open_files = list(self.files.values()) + ([self.journal] if self.journal is not None else [])
+        reset = any(this_file.changed() for this_file in open_files)
+        if reset:
+            self._close(False, clean=False)
+        if not self.files:
+            if log_archive.restore_log_files(self.paths) > 0:
+                logger.info("Restored archived log files for {} so that logging can resume".format(self.key))
+            # Anything left in the journal means the last writer for this log didn't shut down cleanly
+            log_journal.recover(self.paths)
+        return reset
+
+    def flush_due(self, now: float, flush_rows: int, flush_seconds: float) -> bool:
+        if self.pending_rows == 0:
+            return False
+        return self.pending_rows >= flush_rows or (now - self.first_pending_at) >= flush_seconds
+
+    def save_stats(self):
+        # The stats sidecar is rewritten (rather than appended to) so it is saved after the files it summarizes
+        if self.stats_changed:
+            self.stats.save(self.paths[STATS_FILE])
+            self.stats_changed = False
+
+    def flush(self, fsync: bool = False):
+        with self.lock:
+            if not self.files or self.sync():
+                return  # Nothing left to flush - and the stats are out of date
+            # Once the journal grows too large, make sure everything it covers is on disk and start it over
+            trim_journal = self.journal is not None and self.journal.size >= settings.LOG_JOURNAL_MAX_BYTES
+            for this_file in self.files.values():
+                this_file.flush(fsync)
+            if trim_journal:
+                log_journal.sync_files(self.paths)
+                self.journal.truncate()
+            self.save_stats()
+        self.pending_rows = 0
+        self.first_pending_at = None
+
+    def close(self, fsync: bool = False, clean: bool = True):
+        """
+        Closes the log's files. Unless clean is False (e.g. after a write failed), the journal is then removed as
+        everything it covers has been written out.
+        """
+        with self.lock:
+            if clean and self.files and self.sync():
+                return
+            self._close(fsync, clean)
+
+    def _close(self, fsync: bool, clean: bool):
+        for this_file in self.files.values():
+            try:
+                this_file.close(fsync or clean)
+            except OSError:
+                clean = False
+                logger.exception("Unable to close log file {}".format(this_file.path))
+        if clean and self.stats is not None:
+            try:
+                self.save_stats()
+            except OSError:
+                logger.exception("Unable to save the stats for log {}".format(self.key))
+        if self.journal is not None:
+            try:
+                self.journal.close()
+                if clean:
+                    log_journal.sync_files(self.paths)
+                    os.remove(self.journal.path)
+            except OSError:
+                logger.exception("Unable to close log journal {}".format(self.journal.path))
+            self.journal = None
+        self.files = {}
+        self.rollups = None
+        self.stats = None
+        self.stats_changed = False
+        self.rows_since_index = {}
+        self.pending_rows = 0
+        self.first_pending_at = None
+
+
+class LogWriterRegistry:
+    """Process-wide LRU cache of open LogWriters, keyed by log (see beer_log_key/gravity_log_key)"""
+
+    def __init__(self):
+        self._writers = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    @property
+    def flush_rows(self) -> int:
+        return max(settings.LOG_WRITER_FLUSH_ROWS, 1)
+
+    @property
+    def flush_seconds(self) -> float:
+        return settings.LOG_WRITER_FLUSH_SECONDS
+
+    @property
+    def fsync(self) -> bool:
+        return settings.LOG_WRITER_FSYNC
+
+    @property
+    def max_open_logs(self) -> int:
+        return max(settings.LOG_WRITER_MAX_OPEN_LOGS, 1)
+
+    @property
+    def idle_seconds(self) -> float:
+        return settings.LOG_WRITER_IDLE_SECONDS
+
+    def writer(self, key: str, paths: dict, layout: binary_log.RecordLayout = None) -> LogWriter:
+        """Returns the (open) writer for a log, creating it (and evicting the least recently used log) if needed"""
+        with self._lock:
+            this_writer = self._writers.get(key)
+            if this_writer is not None and this_writer.paths != paths:
+                # The log was renamed (or moved) out from under us - start over with the new paths
+                self._close(key)
+                this_writer = None
+
+            if this_writer is None:
+                while len(self._writers) >= self.max_open_logs:
+                    self._close(next(iter(self._writers)))
+                this_writer = LogWriter(key, paths, layout)
+                self._writers[key] = this_writer
+            else:
+                self._writers.move_to_end(key)
+            return this_writer
+
+    def write_point(self, key: str, paths: dict, rows: dict, headers: dict, annotations: list = None,
+                    layout: binary_log.RecordLayout = None, binary_values: dict = None):
+        with self._lock:
+            this_writer = self.writer(key, paths, layout)
+            with this_writer.lock:
+                this_writer.sync()
+                try:
+                    this_writer.write_point(rows, headers, annotations, binary_values)
+                except Exception:
+                    # Don't hold on to a writer that is in a bad state (or has a partially staged point) - the next
+                    # point will reopen the files after recovering from the journal
+                    self._close(key, clean=False)
+                    raise
+            # Outside of the lock, as sweeping takes the locks of other logs
+            self.sweep()
+
+    def write_points(self, key: str, paths: dict, points: list, headers: dict, layout: binary_log.RecordLayout = None):
+        """
+        Writes a batch of points to a log with a single journal record & a single append per file. points is a list of
+        (rows, annotations, binary_values) tuples in the order they should be written.
+        """
+        with self._lock:
+            this_writer = self.writer(key, paths, layout)
+            with this_writer.lock:
+                this_writer.sync()
+                try:
+                    for rows, annotations, binary_values in points:
+                        this_writer.write_point(rows, headers, annotations, binary_values, commit=False)
+                    this_writer.commit()
+                except Exception:
+                    self._close(key, clean=False)
+                    raise
+            self.sweep()
+
+    def sweep(self):
+        """Flushes any logs due to be flushed under the configured policy, and closes logs that have gone idle"""
+        now = time.monotonic()
+        flush_rows, flush_seconds, fsync, idle_seconds = self.flush_rows, self.flush_seconds, self.fsync, self.idle_seconds
+        with self._lock:
+            for key, this_writer in list(self._writers.items()):
+                if (now - this_writer.last_write_at) >= idle_seconds:
+                    self._close(key)
+                elif this_writer.flush_due(now, flush_rows, flush_seconds):
+                    this_writer.flush(fsync)
+
+    def flush(self, key: str):
+        with self._lock:
+            if key in self._writers:
+                self._writers[key].flush(self.fsync)
+
+    def release(self, key: str):
+        """Flushes and closes the files for a log. Called when a log is stopped, deleted, or restored."""
+        with self._lock:
+            self._close(key)
+
+    def release_all(self):
+        with self._lock:
+            for key in list(self._writers):
+                self._close(key)
+
+    def _close(self, key: str, clean: bool = True):
+        this_writer = self._writers.pop(key, None)
+        if this_writer is not None:
+            this_writer.close(self.fsync, clean)
+
+
+registry = LogWriterRegistry()
+atexit.register(registry.release_all)
+
+
+def write_point(key: str, paths: dict, rows: dict, headers: dict, annotations: list = None,
+                layout: binary_log.RecordLayout = None, binary_values: dict = None):
+    registry.write_point(key, paths, rows, headers, annotations, layout, binary_values)
+
+
+def write_points(key: str, paths: dict, points: list, headers: dict, layout: binary_log.RecordLayout = None):
+    registry.write_points(key, paths, points, headers, layout)
+
+
+def release_log(key: str):
+    registry.release(key)
+
+
+def build_derived_files(log) -> bool:
+    """
+    Builds the binary log, rollups, stats sidecar & CSV indexes for a Beer or GravityLog if they're missing (e.g. the
+    log was written before they existed, or was restored from a backup). This reads the whole log, so it's done in the
+    background (see tasks.schedule_log_build) or at startup - never while serving a request. Returns False if nothing
+    has been logged.
+    """
+    paths = log.log_file_paths()
+    with log_journal.lock(paths):
+        if not binary_log.ensure_exists(log):
+            return False
+        log_rollups.ensure_rollups(log)
+        log_stats.ensure_stats(paths, log.binary_layout())
+        for which in log_index.INDEX_FILES:
+            log_index.ensure_index(log, which)
+    return True
@@ -0,0 +1,94 @@
+import datetime
+import timeit
+
+import pytz
+from django.core.management.base import BaseCommand
+
+from app.models import Beer, BeerLogPoint
+
+
+def legacy_data_point(point, data_format='base_csv'):
+    """The per-file serialization used before BeerLogPoint.log_rows() existed, kept here for comparison"""
+    utc_tz = pytz.timezone("UTC")
+    time_value = point.log_time.astimezone(utc_tz).strftime('%Y/%m/%d %H:%M:%SZ')
+
+    beerTemp = point.beer_temp or 0
+    fridgeTemp = point.fridge_temp or 0
+    roomTemp = point.room_temp or 0
+    beerSet = point.beer_set or 0
+    fridgeSet = point.fridge_set or 0
+    gravity_log = point.gravity or 0
+    gravity_temp = point.gravity_temp or 0
+
+    if data_format == 'base_csv':
+        if not point.has_gravity_enabled():
+            if point.associated_beer.model_version > 1:
+                return [time_value, beerTemp, beerSet, fridgeTemp, fridgeSet, roomTemp, point.state]
+            else:
+                return [time_value, beerTemp, beerSet, fridgeTemp, fridgeSet, roomTemp]
+        else:
+            if point.associated_beer.model_version > 1:
+                return [time_value, beerTemp, beerSet, fridgeTemp, fridgeSet, roomTemp, gravity_log, gravity_temp,
+                        point.state]
+            else:
+                return [time_value, beerTemp, beerSet, fridgeTemp, fridgeSet, roomTemp, gravity_log, gravity_temp]
+    elif data_format == 'full_csv':
+        if not point.has_gravity_enabled():
+            return [time_value, beerTemp, beerSet, point.beer_ann, fridgeTemp, fridgeSet, point.fridge_ann,
+                    roomTemp, point.state, point.temp_format, point.associated_beer_id]
+        else:
+            return [time_value, beerTemp, beerSet, point.beer_ann, fridgeTemp, fridgeSet, point.fridge_ann,
+                    roomTemp, point.state, point.temp_format, point.associated_beer_id, gravity_log, gravity_temp]
+    else:
+        retval = []
+        if point.beer_ann is not None:
+            retval.append({'series': 'beer_temp', 'x': time_value, 'shortText': point.beer_ann[:1],
+                           'text': point.beer_ann})
+        if point.fridge_ann is not None:
+            retval.append({'series': 'beer_temp', 'x': time_value, 'shortText': point.fridge_ann[:1],
+                           'text': point.fridge_ann})
+        return retval
+
+
+def legacy_save_arguments(point):
+    beer = point.associated_beer
+    return (beer.log_key(), beer.log_file_paths(),
+            {'base_csv': legacy_data_point(point, 'base_csv'), 'full_csv': legacy_data_point(point, 'full_csv')},
+            {'base_csv': beer.column_headers('base_csv'), 'full_csv': beer.column_headers('full_csv')},
+            legacy_data_point(point, 'annotation_json'), beer.binary_layout(), point.binary_values())
+
+
+def save_arguments(point):
+    layout = point.associated_beer.row_layout()
+    rows, annotations = point.log_rows(layout)
+    return (layout.key, layout.paths, rows, layout.headers, annotations, layout.binary_layout, point.binary_values())
+
+
+class Command(BaseCommand):
+    help = "Measures the per-point cost of preparing a BeerLogPoint to be written out, before and after the rows " \
+           "were generated from a precompiled layout. Nothing is written to disk or the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=20000, help="Number of points to time")
+        parser.add_argument('--gravity', action='store_true', help="Benchmark a beer with gravity logging enabled")
+
+    def handle(self, *args, **options):
+        beer = Beer(id=1, name="Benchmark", device_id=1, gravity_enabled=options['gravity'], model_version=2)
+        point = BeerLogPoint(beer_temp=64.2, beer_set=64.0, fridge_temp=60.1, fridge_set=58.0, room_temp=70.3,
+                             state=4, temp_format='F', gravity=1.045, gravity_temp=64.1, associated_beer=beer,
+                             log_time=datetime.datetime(2024, 1, 1, 12, 30, tzinfo=pytz.utc))
+
+        if legacy_save_arguments(point) != save_arguments(point):
+            self.stderr.write("The precompiled layout produced different output than the legacy serialization")
+            return
+
+        points = options['points']
+        results = {}
+        for label, function in [('before (legacy data_point)', legacy_save_arguments),
+                                ('after (precompiled layout)', save_arguments)]:
+            seconds = min(timeit.repeat(lambda: function(point), number=points, repeat=3))
+            results[label] = seconds / points * 1e6
+            self.stdout.write("{:<30} {:8.2f} us/point".format(label, results[label]))
+
+        before, after = results.values()
+        self.stdout.write("Speedup: {:.1f}x".format(before / after))
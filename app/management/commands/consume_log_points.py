@@ -0,0 +1,29 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from app import log_stream
+
+
+class Command(BaseCommand):
+    help = "Reads beer log points that BrewPi-Script added to the Redis log stream and writes them to the logs. Only " \
+           "used when BREWPI_LOG_TRANSPORT is set to \"redis\" (see app/log_stream.py)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--name', default="fermentrack", help="Consumer name within the consumer group. Entries "
+                                                                  "left unacknowledged are only retried by a "
+                                                                  "consumer with the same name.")
+
+    def handle(self, *args, **options):
+        stopping = []
+
+        def stop(signum, frame):
+            stopping.append(signum)
+
+        # Finish writing out the current batch (rather than being killed part way through it) when asked to stop
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        self.stdout.write(f"Consuming log points from {log_stream.STREAM_KEY} as {options['name']}")
+        log_stream.consume(options['name'], should_stop=lambda: bool(stopping))
+        self.stdout.write("Stopped consuming log points")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from app.models import Beer
+from gravity.models import GravityLog
+from app import log_journal, log_writer
+
+
+class Command(BaseCommand):
+    help = "Replays the write-ahead journals & repairs torn writes for all beer & gravity logs, then builds any " \
+           "derived files (binary logs, rollups, stats) they're missing. Typically run at startup - each log is " \
+           "locked while it is checked, so it is also safe to run while logging."
+
+    def handle(self, *args, **options):
+        recovered = 0
+        for cls in [Beer, GravityLog]:
+            for obj in cls.objects.all():
+                if log_journal.recover(obj.log_file_paths()):
+                    recovered += 1
+                    print(f"Recovered log files for {obj}")
+                log_writer.build_derived_files(obj)
+        print(f"Done checking log files - {recovered} logs needed to be recovered")
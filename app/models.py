@@ -5,8 +5,9 @@ import uuid
 from django.db import models, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
-from django.db.models.signals import pre_delete
+from django.db.models.signals import pre_delete, post_save, post_delete
 from django.dispatch import receiver
+from django.urls import reverse
 
 from django.core.exceptions import ObjectDoesNotExist
 
@@ -19,6 +20,9 @@ import re
 from decimal import Decimal
 
 from . import udev_integration
+from . import brewpi_changes, brewpi_socket, brewpi_state
+from . import binary_log, log_archive, log_index, log_rollups, log_rows, log_stats, log_writer
+from . import profile_cache
 
 from fermentrack_django.settings import USE_DOCKER
 
@@ -585,6 +589,34 @@ class BrewPiDevice(models.Model):
     uuid = models.UUIDField(unique=True, default=uuid.uuid4, editable=False,
                             help_text="Universally unique identifier for this temperature controller")
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep the values as loaded, so that save() can tell BrewPi-Script which fields have changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+
+        loaded_values = getattr(self, '_loaded_values', None)
+        if loaded_values is None:
+            return  # A new device - there isn't a script running for it yet
+        update_fields = kwargs.get('update_fields')
+        changed_fields = []
+        for field in self._meta.concrete_fields:
+            if update_fields is not None and field.name not in update_fields and field.attname not in update_fields:
+                continue
+            value = getattr(self, field.attname)
+            if field.attname in loaded_values and loaded_values[field.attname] != value:
+                changed_fields.append(field.attname)
+                loaded_values[field.attname] = value
+
+        if changed_fields:
+            # Tell BrewPi-Script which fields to reload (see brewpi_changes.py) once they're actually in the database
+            device_id = self.id
+            transaction.on_commit(lambda: brewpi_changes.publish_device_change(device_id, changed_fields))
+
     def is_temp_controller(self):  # This is a hack used in the site template so we can display relevant functionality
         return True
 
@@ -605,7 +637,7 @@ class BrewPiDevice(models.Model):
             return None
 
         # self.sync_temp_format()  # Before we update the profile temp, make sure our math is consistent
-        return self.active_profile.past_end_of_profile(self.time_profile_started)
+        return self.active_profile.past_end_of_profile(self.time_profile_started, self.temp_format)
 
     # Other things that aren't persisted in the database
     # available_devices = []
@@ -627,57 +659,56 @@ class BrewPiDevice(models.Model):
 
     # I'm torn as to whether or not to move all of this out to another class. Leaving everything socket-related here
     # for now.
-    def open_socket(self):
+    def socket_address(self):
+        """Returns the (family, address) of the socket BrewPi-Script listens on for this device"""
         if self.useInetSocket:
-            this_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.SOL_TCP)
-        else:
-            this_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            return socket.AF_INET, (self.socketHost, self.socketPort)
+        return socket.AF_UNIX, self.socket_name
 
-        if this_socket:
-            try:
-                if self.useInetSocket:
-                    this_socket.connect((self.socketHost, self.socketPort))
-                else:
-                    this_socket.connect(self.socket_name)
-            except:
-                this_socket.close()
-
-        return this_socket
-
-    @staticmethod
-    def write_to_socket(this_socket, message):
+    def send_message(self, message, message_extended=None, read_response=False):
+        message_to_send = message
+        if message_extended is not None:
+            message_to_send += "=" + message_extended
+        family, address = self.socket_address()
         try:
-            # Python 3 readiness
-            encoded_message=message.encode(encoding="cp437")
-            this_socket.sendall(encoded_message)
-            return True
-        except:
+            response = brewpi_socket.send_message(family, address, message_to_send, read_response)
+        except OSError:
             return False
+        if read_response:
+            return response
+        return True
 
-    @staticmethod
-    def read_from_socket(this_socket):
-        try:
-            encoded_message = this_socket.recv(65536)
-            return encoded_message.decode(encoding="cp437")
-        except:
+    def load_state_snapshot(self) -> dict or None:
+        """
+        Returns the state BrewPi-Script last published for this device (see brewpi_state.py), or None if it's missing or
+        stale. The snapshot is held for a second, so that the several reads a single page makes all share one lookup.
+        """
+        cached_at, state = getattr(self, '_state_snapshot', (0, None))
+        if time.time() - cached_at > 1:
+            state = brewpi_state.load(self.id)
+            self._state_snapshot = (time.time(), state)
+        if state is None or state['stale']:
             return None
+        return state
 
-    def send_message(self, message, message_extended=None, read_response=False):
-        message_to_send = message
-        if message_extended is not None:
-            message_to_send += "=" + message_extended
-        this_socket = self.open_socket()
-        if this_socket:
-            if self.write_to_socket(this_socket, message_to_send):
-                if read_response:
-                    return self.read_from_socket(this_socket)
-                else:
-                    return True
-        return False
+    def state_snapshot_age(self) -> float or None:
+        """Returns how old (in seconds) the snapshot that reads are being served from is, or None if they're live"""
+        state = self.load_state_snapshot()
+        return None if state is None else round(state['age'], 1)
+
+    def read_state(self, field, message):
+        """
+        Reads a value from BrewPi-Script's published state if it's current, and only asks the script for it (by sending
+        message) if it isn't
+        """
+        state = self.load_state_snapshot()
+        if state is not None and field in state:
+            return state[field]
+        return self.send_message(message, read_response=True)
 
     def read_lcd(self):
         try:
-            lcd_text = json.loads(self.send_message("lcd", read_response=True))
+            lcd_text = json.loads(self.read_state(brewpi_state.LCD, "lcd"))
         except:
             lcd_text = ["Cannot receive", "LCD text from", "Controller/Script"]
 
@@ -692,7 +723,7 @@ class BrewPiDevice(models.Model):
     def is_connected(self):
         # Tests if we're connected to the device via BrewPi-Script
         try:
-            _ = json.loads(self.send_message("lcd", read_response=True))
+            _ = json.loads(self.read_state(brewpi_state.LCD, "lcd"))
         except:
             return False
         return True
@@ -704,6 +735,13 @@ class BrewPiDevice(models.Model):
             return None
         return version_data
 
+    def retrieve_metrics(self):
+        # Runtime metrics from BrewPi-Script (see BrewPiEngine.metrics), or None if the script isn't answering
+        try:
+            return json.loads(self.send_message("getMetrics", read_response=True))
+        except:
+            return None
+
     def is_legacy(self, version=None):
         if version == None:
             version = self.retrieve_version()
@@ -851,7 +889,7 @@ class BrewPiDevice(models.Model):
         return False
 
     def get_temp_control_status(self):
-        device_mode = self.send_message("getMode", read_response=True)
+        device_mode = self.read_state(brewpi_state.MODE, "getMode")
 
         control_status = {}
         if (device_mode is None) or (not device_mode):  # We were unable to read from the device
@@ -866,11 +904,11 @@ class BrewPiDevice(models.Model):
 
         elif device_mode == 'b':  # Device mode is beer constant
             control_status['device_mode'] = "beer_constant"
-            control_status['set_temp'] = self.send_message("getBeer", read_response=True)
+            control_status['set_temp'] = self.read_state(brewpi_state.BEER_SET, "getBeer")
 
         elif device_mode == 'f':  # Device mode is fridge constant
             control_status['device_mode'] = "fridge_constant"
-            control_status['set_temp'] = self.send_message("getFridge", read_response=True)
+            control_status['set_temp'] = self.read_state(brewpi_state.FRIDGE_SET, "getFridge")
 
         elif device_mode == 'p':  # Device mode is beer profile
             control_status['device_mode'] = "beer_profile"
@@ -947,10 +985,20 @@ class BrewPiDevice(models.Model):
 
     def manage_logging(self, status):
         if status == 'stop':
+            from app import tasks  # Imported here as app.tasks depends on this module
+
             if hasattr(self, 'gravity_sensor') and self.gravity_sensor is not None:
                 # If there is a linked gravity log, stop that as well
+                gravity_log_id = self.gravity_sensor.active_log_id
+                if gravity_log_id is not None:
+                    log_writer.release_log(log_writer.gravity_log_key(gravity_log_id))
+                    transaction.on_commit(lambda: tasks.schedule_log_archive(tasks.archive_gravity_log, gravity_log_id))
                 self.gravity_sensor.active_log = None
                 self.gravity_sensor.save()
+            if self.active_beer_id is not None:
+                beer_id = self.active_beer_id
+                log_writer.release_log(log_writer.beer_log_key(beer_id))
+                transaction.on_commit(lambda: tasks.schedule_log_archive(tasks.archive_beer_log, beer_id))
             self.active_beer = None
             self.logging_status = self.DATA_LOGGING_STOPPED
             self.save()
@@ -981,20 +1029,20 @@ class BrewPiDevice(models.Model):
         return True
 
     def get_control_constants(self):
-        return json.loads(self.send_message("getControlConstants", read_response=True))
+        return json.loads(self.read_state(brewpi_state.CONTROL_CONSTANTS, "getControlConstants"))
 
     def set_parameters(self, parameters):
         return self.send_message("setParameters", json.dumps(parameters))
 
     def get_extended_settings(self):
-        return json.loads(self.send_message("getExtendedSettings", read_response=True))
+        return json.loads(self.read_state(brewpi_state.EXTENDED_SETTINGS, "getExtendedSettings"))
 
     def set_extended_settings(self, parameters):
         return self.send_message("setExtendedSettings", json.dumps(parameters))
 
     def get_dashpanel_info(self):
         try:  # This is apparently failing when being called in a loop for external_push - Wrapping in a try/except so the loop doesn't die
-            return json.loads(self.send_message("getDashInfo", read_response=True))
+            return json.loads(self.read_state(brewpi_state.DASH_INFO, "getDashInfo"))
         except TypeError:
             return None
 
@@ -1289,20 +1337,69 @@ class Beer(models.Model):
             return base_name + "_full.csv"
         elif which_file == 'annotation_json':
             return base_name + "_annotations.almost_json"
+        elif which_file == 'binary':
+            return base_name + "_data.bin"
+        elif which_file == 'binary_annotations':
+            return base_name + "_annotations.jsonl"
+        elif which_file in log_rollups.LEVEL_NAMES:
+            return base_name + "_{}.bin".format(which_file)
+        elif which_file in log_index.INDEX_FILES.values():
+            return base_name + "_{}.idx".format(which_file)
+        elif which_file == 'journal':
+            return base_name + "_journal.bin"
+        elif which_file == 'stats':
+            return base_name + "_stats.json"
+        elif which_file == 'lock':
+            return base_name + "_write.lock"
         else:
             return None
 
     def data_file_url(self, which_file):
         return settings.DATA_URL + self.full_filename(which_file)
 
+    def log_file_paths(self) -> dict:
+        """Returns the paths to each of the log files for this beer, keyed by file type"""
+        file_name_base = settings.ROOT_DIR / settings.DATA_ROOT
+        return {which_file: file_name_base / self.full_filename(which_file)
+                for which_file in log_writer.LOG_FILES}
+
+    def log_key(self) -> str:
+        return log_writer.beer_log_key(self.id)
+
+    def binary_layout(self) -> binary_log.RecordLayout:
+        return binary_log.BEER_LAYOUT
+
+    def read_range(self, start=None, end=None, which: str = 'full_csv', include_header: bool = False):
+        """Yields the raw CSV lines logged between start (inclusive) and end (exclusive). See log_index.read_range."""
+        return log_index.read_range(self, start, end, which, include_header)
+
+    def load_binary_log(self):
+        """
+        Returns the binary log for this beer (see binary_log.load), or None if nothing has been logged yet or the log
+        hasn't been converted to the binary store yet (see log_writer.build_derived_files)
+        """
+        if not binary_log.exists(self):
+            return None
+        return binary_log.load(self.log_file_paths()['binary'])
+
+    def row_layout(self) -> log_rows.RowLayout:
+        """Returns the precompiled layout used to write points to this beer's logs (see log_rows.py)"""
+        return log_rows.layout_for(self, (self.name, self.device_id, self.gravity_enabled, self.model_version),
+                                   gravity_enabled=self.gravity_enabled, base_has_state=self.model_version > 1)
+
+    def stats(self) -> dict or None:
+        """Returns the running statistics for this beer (see log_stats.LogStats.summary), or None if nothing was logged"""
+        return log_stats.summary(self)
+
     def full_csv_url(self):
-        return self.data_file_url('full_csv')
+        # Served through the range API rather than directly from DATA_URL so that archived logs are decompressed
+        return reverse('beer_range_csv', kwargs={'beer_id': self.id, 'which': 'full_csv'})
 
     def full_csv_exists(self) -> bool:
         # This is so that we can test if the log exists before presenting the user the option to download it
         file_name_base = settings.ROOT_DIR / settings.DATA_ROOT
         full_csv_file = file_name_base / self.full_filename('full_csv')
-        return os.path.isfile(full_csv_file)
+        return log_archive.exists(full_csv_file)
 
     def can_log_gravity(self):
         if self.gravity_enabled is False:
@@ -1367,17 +1464,16 @@ class Beer(models.Model):
 # When the user attempts to delete a beer, also delete the log files associated with it.
 @receiver(pre_delete, sender=Beer)
 def delete_beer(sender, instance, **kwargs):
-    file_name_base = settings.ROOT_DIR / settings.DATA_ROOT
-
-    base_csv_file = file_name_base / instance.full_filename('base_csv')
-    full_csv_file = file_name_base / instance.full_filename('full_csv')
-    annotation_json = file_name_base / instance.full_filename('annotation_json')
+    # Make sure we're not holding the files open (and don't write anything buffered back out after they're deleted)
+    log_writer.release_log(instance.log_key())
+    log_rows.forget(instance.log_key())
 
-    for this_filepath in [base_csv_file, full_csv_file, annotation_json]:
+    for this_filepath in instance.log_file_paths().values():
         try:
             os.remove(this_filepath)
         except OSError:
             pass
+        log_archive.remove_archive(this_filepath)
 
 
 
@@ -1441,17 +1537,22 @@ class BeerLogPoint(models.Model):
         else:
             return False
 
-    def enrich_gravity_data(self):
+    def enrich_gravity_data(self, reading: tuple = None):
         # enrich_gravity_data is called to enrich this data point with the relevant gravity data
         # Only relevant if self.has_gravity_enabled is true (The associated_beer has gravity logging enabled)
+        # reading is an optional (gravity, temp, temp_format) to use in place of the sensor's latest reading - for
+        # points that are saved long after they were taken (see GravitySensor.retrieve_logged_readings)
         if self.has_gravity_enabled():
             if not self.can_log_gravity():
                 # We have gravity enabled, but we can't actually log gravity. Stop logging, as this is an issue.
                 self.associated_beer.device.manage_logging(status='stop')
                 raise RuntimeError("Gravity enabled, but gravity sensor doesn't exist")
 
-            self.gravity = self.associated_beer.device.gravity_sensor.retrieve_loggable_gravity()
-            temp, temp_format = self.associated_beer.device.gravity_sensor.retrieve_loggable_temp()
+            if reading is not None:
+                self.gravity, temp, temp_format = reading
+            else:
+                self.gravity = self.associated_beer.device.gravity_sensor.retrieve_loggable_gravity()
+                temp, temp_format = self.associated_beer.device.gravity_sensor.retrieve_loggable_temp()
 
             if self.temp_format != temp_format:
                 if temp_format is None:
@@ -1469,106 +1570,63 @@ class BeerLogPoint(models.Model):
             self.gravity_temp = temp
 
 
-    def data_point(self, data_format='base_csv', set_defaults=True):
+    def log_rows(self, layout: log_rows.RowLayout, set_defaults=True) -> tuple:
+        """
+        Generates the base & full CSV rows and the annotations for this point in a single pass, using the precompiled
+        layout for the associated beer (see Beer.row_layout). Returns ({'base_csv': row, 'full_csv': row}, annotations)
+        """
         # Everything gets stored in UTC and then converted back on the fly
+        time_value = log_rows.format_log_time(self.log_time)  # Includes the 'Zulu' designation
 
-        utc_tz = pytz.timezone("UTC")
-        time_value = self.log_time.astimezone(utc_tz).strftime('%Y/%m/%d %H:%M:%SZ')  # Adding 'Zulu' designation
-
-        if set_defaults:
-            beerTemp = self.beer_temp or 0
-            fridgeTemp = self.fridge_temp or 0
-            roomTemp = self.room_temp or 0
-            beerSet = self.beer_set or 0
-            fridgeSet = self.fridge_set or 0
-            gravity_log = self.gravity or 0  # We'll set this just in case
-            gravity_temp = self.gravity_temp or 0  # We'll set this just in case
-        else:
-            beerTemp = self.beer_temp or None
-            fridgeTemp = self.fridge_temp or None
-            roomTemp = self.room_temp or None
-            beerSet = self.beer_set or None
-            fridgeSet = self.fridge_set or None
-            gravity_log = self.gravity or None  # We'll set this just in case
-            gravity_temp = self.gravity_temp or None  # We'll set this just in case
+        default = 0 if set_defaults else None
+        beerTemp = self.beer_temp or default
+        fridgeTemp = self.fridge_temp or default
+        roomTemp = self.room_temp or default
+        beerSet = self.beer_set or default
+        fridgeSet = self.fridge_set or default
 
+        base_row = [time_value, beerTemp, beerSet, fridgeTemp, fridgeSet, roomTemp]
+        full_row = [time_value, beerTemp, beerSet, self.beer_ann, fridgeTemp, fridgeSet, self.fridge_ann, roomTemp,
+                    self.state, self.temp_format, self.associated_beer_id]
 
-        if self.beer_ann is not None:
-            combined_annotation = self.beer_ann
-        elif self.fridge_ann is not None:
-            combined_annotation = self.fridge_ann
-        else:
-            combined_annotation = ""
+        if layout.gravity_enabled:
+            gravity_log = self.gravity or default
+            gravity_temp = self.gravity_temp or default
+            base_row += [gravity_log, gravity_temp]
+            full_row += [gravity_log, gravity_temp]
 
-        if data_format == 'base_csv':
-            if not self.has_gravity_enabled():
-                if self.associated_beer.model_version > 1:
-                    return [time_value, beerTemp, beerSet, fridgeTemp, fridgeSet, roomTemp, self.state]
-                else:
-                    return [time_value, beerTemp, beerSet, fridgeTemp, fridgeSet, roomTemp]
+        if layout.base_has_state:
+            base_row.append(self.state)
 
-            else:
-                if self.associated_beer.model_version > 1:
-                    return [time_value, beerTemp, beerSet, fridgeTemp, fridgeSet, roomTemp, gravity_log, gravity_temp,
-                            self.state]
-                else:
-                    return [time_value, beerTemp, beerSet, fridgeTemp, fridgeSet, roomTemp, gravity_log, gravity_temp]
+        annotations = []
+        if self.beer_ann is not None:
+            annotations.append({'series': 'beer_temp', 'x': time_value, 'shortText': self.beer_ann[:1],
+                                'text': self.beer_ann})
+        if self.fridge_ann is not None:
+            annotations.append({'series': 'beer_temp', 'x': time_value, 'shortText': self.fridge_ann[:1],
+                                'text': self.fridge_ann})
 
-        elif data_format == 'full_csv':
-            if not self.has_gravity_enabled():
-                return [time_value, beerTemp, beerSet, self.beer_ann, fridgeTemp, fridgeSet, self.fridge_ann,
-                        roomTemp, self.state, self.temp_format, self.associated_beer_id]
-            else:
-                return [time_value, beerTemp, beerSet, self.beer_ann, fridgeTemp, fridgeSet, self.fridge_ann,
-                        roomTemp, self.state, self.temp_format, self.associated_beer_id, gravity_log, gravity_temp]
-
-        elif data_format == 'annotation_json':
-            retval = []
-            if self.beer_ann is not None:
-                retval.append({'series': 'beer_temp', 'x': time_value, 'shortText': self.beer_ann[:1],
-                               'text': self.beer_ann})
-            if self.fridge_ann is not None:
-                retval.append({'series': 'beer_temp', 'x': time_value, 'shortText': self.fridge_ann[:1],
-                               'text': self.fridge_ann})
-            return retval
+        return {'base_csv': base_row, 'full_csv': full_row}, annotations
+
+    def data_point(self, data_format='base_csv', set_defaults=True):
+        rows, annotations = self.log_rows(self.associated_beer.row_layout(), set_defaults)
+        if data_format == 'annotation_json':
+            return annotations
+        elif data_format in rows:
+            return rows[data_format]
         else:
             # Should never hit this
             logger.warning("Invalid data format '{}' provided to BeerLogPoint.data_point".format(data_format))
 
-    def save(self, *args, **kwargs):
-        # Don't repeat yourself
-        def check_and_write_headers(path, col_headers):
-            if not os.path.exists(path):
-                with open(path, 'w') as f:
-                    writer = csv.writer(f)
-                    writer.writerow(col_headers)
-
-        def write_data(path, row_data):
-            with open(path, 'a') as f:
-                writer = csv.writer(f)
-                writer.writerow(row_data)
-
-        def check_and_write_annotation_json_head(path):
-            if not os.path.exists(path):
-                with open(path, 'w') as f:
-                    f.write("[\r\n")
-                return False
-            else:
-                return True
-
-        def write_annotation_json(path, annotation_data, write_comma=True):
-            # annotation_data is actually an array of potential annotations. We'll loop through them & write them out
-            with open(path, 'a') as f:
-                for this_annotation in annotation_data:
-                    if write_comma:  # We only want to do this once per run, regardless of the size of annotation_data
-                        f.write(',\r\n')
-                        write_comma = False
-                    f.write('  {')
-                    f.write('"series": "{}", "x": "{}",'.format(this_annotation['series'], this_annotation['x']))
-                    f.write(' "shortText": "{}", "text": "{}"'.format(this_annotation['shortText'],
-                                                                      this_annotation['text']))
-                    f.write('}')
+    def binary_values(self) -> dict:
+        # Unlike the CSVs, missing values are stored as missing (NaN) rather than 0 in the binary log
+        return {
+            'log_time': binary_log.to_epoch_ms(self.log_time), 'beer_temp': self.beer_temp, 'beer_set': self.beer_set,
+            'fridge_temp': self.fridge_temp, 'fridge_set': self.fridge_set, 'room_temp': self.room_temp,
+            'state': self.state, 'gravity': self.gravity, 'grav_temp': self.gravity_temp,
+        }
 
+    def save(self, *args, **kwargs):
         # This really isn't the right place to do this, but I don't know of anywhere else to add this check.
         # TODO - Figure out if there is somewhere better to do this
         if self.has_gravity_enabled() and self.associated_beer.device.gravity_sensor is None:
@@ -1579,28 +1637,39 @@ class BeerLogPoint(models.Model):
                 return False
 
         if self.associated_beer_id is not None:
-            file_name_base = settings.ROOT_DIR / settings.DATA_ROOT
-
-            base_csv_file = file_name_base / self.associated_beer.full_filename('base_csv')
-            full_csv_file = file_name_base / self.associated_beer.full_filename('full_csv')
-            annotation_json = file_name_base / self.associated_beer.full_filename('annotation_json')
-
-            # Write out headers (if the files don't exist)
-            check_and_write_headers(base_csv_file, self.associated_beer.column_headers('base_csv'))
-            check_and_write_headers(full_csv_file, self.associated_beer.column_headers('full_csv'))
+            layout = self.associated_beer.row_layout()
+            rows, annotations = self.log_rows(layout)
 
-            # And then write out the data
-            write_data(base_csv_file, self.data_point('base_csv'))
-            write_data(full_csv_file, self.data_point('full_csv'))
-
-            # Next, do the json file
-            annotation_data = self.data_point('annotation_json')
-            if len(annotation_data) > 0:  # Not all log points come with annotation data
-                json_existed = check_and_write_annotation_json_head(annotation_json)
-                write_annotation_json(annotation_json, annotation_data, json_existed)
+            # The headers are only written out if the files don't exist yet. Annotations are optional - not all log
+            # points come with annotation data.
+            log_writer.write_point(layout.key, layout.paths, rows=rows, headers=layout.headers,
+                                   annotations=annotations, layout=layout.binary_layout,
+                                   binary_values=self.binary_values())
 
         # super(BeerLogPoint, self).save(*args, **kwargs)
 
+    @staticmethod
+    def save_points(points: list) -> int:
+        """
+        Writes out a batch of points (which can belong to several beers) with a single buffered append per log file,
+        in the order given. Unlike save(), the points are expected to have already been enriched with gravity data.
+        Returns the number of points written.
+        """
+        points_by_beer = {}
+        for point in points:
+            if point.associated_beer_id is not None:
+                points_by_beer.setdefault(point.associated_beer_id, []).append(point)
+
+        for beer_points in points_by_beer.values():
+            layout = beer_points[0].associated_beer.row_layout()
+            batch = []
+            for point in beer_points:
+                rows, annotations = point.log_rows(layout)
+                batch.append((rows, annotations, point.binary_values()))
+            log_writer.write_points(layout.key, layout.paths, batch, headers=layout.headers,
+                                    layout=layout.binary_layout)
+        return sum(len(beer_points) for beer_points in points_by_beer.values())
+
 
 # A model representing the fermentation profile as a whole
 class FermentationProfile(models.Model):
@@ -1739,58 +1808,18 @@ class FermentationProfile(models.Model):
     # get_profile_temp from BrewPiDevice
     def profile_temp(self, time_started, temp_format) -> float:
         # temp_format in this case is the temperature format active on BrewPiDevice. This will force conversion from
-        # the profile point's format to the device's format.
-        profile_points = self.fermentationprofilepoint_set.order_by('ttl')
-
-        previous_setpoint = Decimal("0.0")
-        previous_ttl = timezone.timedelta(seconds=0)
-        current_time = timezone.now()
-
-        # If the first point in the profile has a TTL other than 0, then we assume we hold that temp from assignment
-        # until then.
-        if current_time <= (time_started + profile_points[0].ttl):
-            return float(profile_points[0].convert_temp(temp_format))
-
-        for this_point in profile_points:
-            # Test if we are in this period
-            if current_time < (time_started + this_point.ttl):
-                # this_point is in the future. Check if this is a "hold temp" block or a "ramp" block
-                if this_point.convert_temp(temp_format) == previous_setpoint:  # We can just use the static temperature
-                    # This is a "hold temp" block (previous point's temp = current point's temp)
-                    return float(previous_setpoint)
-                else:  # We have to interpolate
-                    duration = this_point.ttl.total_seconds() - previous_ttl.total_seconds()
-                    delta = (this_point.convert_temp(temp_format) - previous_setpoint)
-                    slope = float(delta) / duration
-
-                    seconds_into_point = (current_time - (time_started + previous_ttl)).total_seconds()
-
-                    return round(seconds_into_point * slope + float(previous_setpoint), 1)
-
-            previous_setpoint = this_point.convert_temp(temp_format)
-            previous_ttl = this_point.ttl
-
-        # If we hit this point, we looped through all the setpoints & aren't between two (or on the first one)
-        # That is to say - we're at the end. Just return the last setpoint.
-        return float(previous_setpoint)
+        # the profile point's format to the device's format. The profile is compiled (and cached) for that format so
+        # that checking it doesn't need to touch the database - see profile_cache.py
+        compiled = profile_cache.get(self, temp_format)
+        return compiled.temp_at((timezone.now() - time_started).total_seconds())
 
     # past_end_of_profile allows us to test if we're in the last stage of a profile (which is effectively beer constant
     # mode) so we can switch to explicitly be in beer constant mode
-    def past_end_of_profile(self, time_started):
-        current_time = timezone.now()
-
-        last_profile_point = self.fermentationprofilepoint_set.order_by('-ttl')[:1]
-
-        if last_profile_point:
-            if current_time >= (time_started + last_profile_point[0].ttl):
-                return True
-            else:
-                return False
-        else:
-            # There are no profile points for us to test against
-            return None
-
-
+    def past_end_of_profile(self, time_started, temp_format='C'):
+        # The temperature format doesn't matter here, but using the one the profile is checked with means that the
+        # same compiled profile is reused
+        compiled = profile_cache.get(self, temp_format)
+        return compiled.past_end((timezone.now() - time_started).total_seconds())
 
     def to_export(self):
         # to_export generates a somewhat readable, machine interpretable representation of a fermentation profile
@@ -2149,6 +2178,24 @@ class FermentationProfilePoint(models.Model):
         )
         return point
 
+
+# Drop the compiled copies of a profile (see profile_cache.py) whenever it or one of its points changes
+@receiver(post_save, sender=FermentationProfile)
+@receiver(post_delete, sender=FermentationProfile)
+def invalidate_compiled_profile(sender, instance, **kwargs):
+    profile_cache.invalidate(instance.id)
+    profile_id = instance.id
+    transaction.on_commit(lambda: brewpi_changes.publish_profile_change(profile_id))  # Including in BrewPi-Script
+
+
+@receiver(post_save, sender=FermentationProfilePoint)
+@receiver(post_delete, sender=FermentationProfilePoint)
+def invalidate_compiled_profile_point(sender, instance, **kwargs):
+    profile_cache.invalidate(instance.profile_id)
+    profile_id = instance.profile_id
+    transaction.on_commit(lambda: brewpi_changes.publish_profile_change(profile_id))
+
+
 # The old (0.2.x/Arduino) Control Constants Model
 class OldControlConstants(models.Model):
     # class Meta:
@@ -0,0 +1,75 @@
+"""
+Compiled fermentation profiles, for evaluating the profile temperature without going to the database
+
+A profile is compiled into a sorted list of point times (seconds after the profile was started) and the matching
+temperatures, already converted to the device's temperature format, so that the temperature at any time can be found
+with a binary search. Compiled profiles are cached per (profile, temp_format) and dropped whenever the profile or one of
+its points is saved or deleted (see the receivers at the end of models.py). As profiles can be edited from a different
+process than the one evaluating them, cached profiles are also recompiled once they are MAX_AGE seconds old.
+"""
+
+import bisect
+import threading
+import time
+
+MAX_AGE = 60  # seconds
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class CompiledProfile:
+    def __init__(self, profile_points, temp_format):
+        # profile_points must be ordered by ttl
+        self.ttls = []
+        self.temps = []
+        self.holds = []  # Whether each point holds the previous point's temperature (rather than ramping to it)
+        previous_temp = None
+        for point in profile_points:
+            temp = point.convert_temp(temp_format)
+            self.ttls.append(point.ttl.total_seconds())
+            self.temps.append(float(temp))
+            self.holds.append(temp == previous_temp)
+            previous_temp = temp
+        self.compiled_at = time.monotonic()
+
+    def temp_at(self, elapsed: float) -> float:
+        """Returns the profile temperature elapsed seconds after it was started. Raises IndexError if it has no points"""
+        # Until the first point is reached, we hold its temperature
+        if elapsed <= self.ttls[0]:
+            return self.temps[0]
+
+        # Find the first point that's still in the future
+        i = bisect.bisect_right(self.ttls, elapsed)
+        if i == len(self.ttls):
+            # We're past the last point - just hold its temperature
+            return self.temps[-1]
+        if self.holds[i]:
+            return self.temps[i - 1]
+
+        # Otherwise we're ramping between the previous point and this one, so interpolate
+        slope = (self.temps[i] - self.temps[i - 1]) / (self.ttls[i] - self.ttls[i - 1])
+        return round((elapsed - self.ttls[i - 1]) * slope + self.temps[i - 1], 1)
+
+    def past_end(self, elapsed: float) -> bool or None:
+        """Returns whether the last point has been reached, or None if there are no points to test against"""
+        if not self.ttls:
+            return None
+        return elapsed >= self.ttls[-1]
+
+
+def get(profile, temp_format: str) -> CompiledProfile:
+    key = (profile.id, temp_format)
+    with _cache_lock:
+        compiled = _cache.get(key)
+    if compiled is None or time.monotonic() - compiled.compiled_at > MAX_AGE:
+        compiled = CompiledProfile(profile.fermentationprofilepoint_set.order_by('ttl'), temp_format)
+        with _cache_lock:
+            _cache[key] = compiled
+    return compiled
+
+
+def invalidate(profile_id: int):
+    with _cache_lock:
+        for key in [key for key in _cache if key[0] == profile_id]:
+            del _cache[key]
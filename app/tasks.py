@@ -1,6 +1,18 @@
 # Create your tasks here
 from __future__ import absolute_import, unicode_literals
+from huey import crontab
 from huey.contrib.djhuey import periodic_task, task, db_periodic_task, db_task
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from redis.exceptions import RedisError
+
+from app.models import Beer, BrewPiDevice
+from gravity.models import GravityLog, GravitySensor
+from . import log_archive, log_journal, log_writer
+
+import datetime, logging
+
+logger = logging.getLogger(__name__)
 
 # Note - Huey is being installed/set up, but the functionality will remain latent for the time being. The plan is to
 # use it to create tasks later that run independent from user input (such as controller montioring, etc.)
@@ -17,4 +29,112 @@ from huey.contrib.djhuey import periodic_task, task, db_periodic_task, db_task
 #
 # @task
 # def xsum(numbers):
-#     return sum(numbers)
\ No newline at end of file
+#     return sum(numbers)
+
+
+def print_for_logs(log_string):
+    print(f"[{str(datetime.datetime.now())}] {log_string}")
+
+
+def schedule_log_archive(archive_task, log_id):
+    """
+    Queues a log to be archived once logging has stopped. The delay gives any other process that was writing to the log
+    (e.g. the Tilt monitor) time to close its files - see LOG_WRITER_IDLE_SECONDS.
+    """
+    if not settings.LOG_ARCHIVE_ENABLED:
+        return
+    try:
+        archive_task.schedule((log_id,), delay=settings.LOG_ARCHIVE_DELAY)
+    except RedisError:
+        # Not being able to archive a log shouldn't prevent logging from being stopped. The periodic task below will
+        # pick it up later.
+        logger.exception("Unable to queue log {} to be archived".format(log_id))
+
+
+@db_task()
+def build_beer_log_files(beer_id):
+    try:
+        beer = Beer.objects.get(id=beer_id)
+    except ObjectDoesNotExist:
+        return None
+    return log_writer.build_derived_files(beer)
+
+
+@db_task()
+def build_gravity_log_files(log_id):
+    try:
+        gravity_log = GravityLog.objects.get(id=log_id)
+    except ObjectDoesNotExist:
+        return None
+    return log_writer.build_derived_files(gravity_log)
+
+
+def schedule_log_build(log):
+    """
+    Queues the derived files (binary log, rollups, stats & indexes) for a Beer or GravityLog to be built in the
+    background
+    """
+    build_task = build_beer_log_files if isinstance(log, Beer) else build_gravity_log_files
+    try:
+        build_task(log.id)
+    except RedisError:
+        logger.exception("Unable to queue the log files for {} to be built".format(log))
+
+
+@db_task()
+def archive_beer_log(beer_id):
+    try:
+        beer = Beer.objects.get(id=beer_id)
+    except ObjectDoesNotExist:
+        return None  # The beer was deleted before we got to it
+
+    if BrewPiDevice.objects.filter(active_beer=beer).exists():
+        return None  # Logging was resumed to this beer in the meantime
+
+    paths = beer.log_file_paths()
+    with log_journal.lock(paths):  # Nothing can start writing to the log while it's being archived
+        if not log_archive.is_idle(paths, settings.LOG_WRITER_IDLE_SECONDS):
+            return None  # Something may still have the log open
+
+        log_journal.recover(paths)  # Don't archive a log that is still waiting to be recovered from a crash
+        archived = log_archive.archive_log_files(paths)
+    if archived > 0:
+        print_for_logs(f"Archived {archived} log files for beer {beer.name}")
+    return True
+
+
+@db_task()
+def archive_gravity_log(log_id):
+    try:
+        gravity_log = GravityLog.objects.get(id=log_id)
+    except ObjectDoesNotExist:
+        return None
+
+    if GravitySensor.objects.filter(active_log=gravity_log).exists():
+        return None
+
+    paths = gravity_log.log_file_paths()
+    with log_journal.lock(paths):
+        if not log_archive.is_idle(paths, settings.LOG_WRITER_IDLE_SECONDS):
+            return None
+
+        log_journal.recover(paths)
+        archived = log_archive.archive_log_files(paths)
+    if archived > 0:
+        print_for_logs(f"Archived {archived} log files for gravity log {gravity_log.name}")
+    return True
+
+
+@db_periodic_task(crontab(hour="3", minute="45"))
+def archive_inactive_logs():
+    """Archives any logs that aren't being logged to but weren't archived when they were stopped (e.g. older logs)"""
+    if not settings.LOG_ARCHIVE_ENABLED:
+        return None
+    active_beers = BrewPiDevice.objects.exclude(active_beer=None).values_list('active_beer_id', flat=True)
+    for beer in Beer.objects.exclude(id__in=list(active_beers)):
+        archive_beer_log.call_local(beer.id)
+
+    active_logs = GravitySensor.objects.exclude(active_log=None).values_list('active_log_id', flat=True)
+    for gravity_log in GravityLog.objects.exclude(id__in=list(active_logs)):
+        archive_gravity_log.call_local(gravity_log.id)
+    return True
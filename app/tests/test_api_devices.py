@@ -0,0 +1,126 @@
+import datetime
+import json
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from app import binary_log, log_rows, log_writer
+from app.api import devices
+from app.models import Beer, BeerLogPoint, BrewPiDevice
+
+
+class BeerLogPointsTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        # The models use fermentrack_django.settings directly, so override_settings() has no effect on the log paths
+        data_root = mock.patch('fermentrack_django.settings.DATA_ROOT', self.dir)
+        data_root.start()
+        self.addCleanup(data_root.stop)
+
+        self.beers = []
+        self.devices = [self.logging_device("Device {}".format(i)) for i in range(2)]
+        self.start = timezone.now().replace(microsecond=0) - datetime.timedelta(hours=2)
+
+    def tearDown(self):
+        log_writer.registry.release_all()
+        for beer in self.beers:
+            log_rows.forget(beer.log_key())
+        shutil.rmtree(self.dir)
+
+    def logging_device(self, name: str) -> BrewPiDevice:
+        device = BrewPiDevice.objects.create(device_name=name, temp_format='C', socketPort=2222)
+        device.active_beer = Beer.objects.create(name=name, device=device)
+        device.save()
+        self.beers.append(device.active_beer)
+        return device
+
+    def point(self, device_id: int, minute: int, beer_temp: float = 20.0) -> dict:
+        return {'brewpi_device_id': device_id, 'beer_temp': beer_temp, 'beer_set': 20, 'fridge_temp': 18,
+                'fridge_set': 18, 'room_temp': 22, 'state': 1,
+                'log_time': binary_log.to_epoch_ms(self.start + datetime.timedelta(minutes=minute))}
+
+    def post(self, data):
+        return self.client.post('/api/save_points/', json.dumps(data), content_type='application/json')
+
+    def logged_temps(self, beer: Beer) -> list:
+        path = beer.log_file_paths()['binary']
+        return [record['beer_temp'] for record in binary_log.iter_records(path)]
+
+    def test_all_saved(self):
+        response = self.post([self.point(self.devices[i % 2].id, i, 20 + i) for i in range(6)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['saved'], 6)
+        self.assertEqual(self.logged_temps(self.beers[0]), [20, 22, 24])
+        self.assertEqual(self.logged_temps(self.beers[1]), [21, 23, 25])
+
+    def test_points_wrapped_in_object(self):
+        response = self.post({'points': [self.point(self.devices[0].id, 0)]})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.logged_temps(self.beers[0])), 1)
+
+    def test_unknown_device_is_rejected(self):
+        response = self.post([self.point(self.devices[0].id, 0), self.point(9999, 1), self.point(self.devices[0].id, 2)])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json()['rejected'], [1])
+        self.assertEqual(response.json()['failed'], [])
+        self.assertEqual(len(self.logged_temps(self.beers[0])), 2)
+
+    def test_failed_device_can_be_resent(self):
+        # Enriching the second device's points fails, which shouldn't stop the first device's points being written
+        original = BeerLogPoint.enrich_gravity_data
+
+        def enrich_gravity_data(point, *args):
+            if point.associated_beer_id == self.beers[1].id:
+                raise ValueError("Gravity sensor unavailable")
+            return original(point, *args)
+
+        with mock.patch.object(BeerLogPoint, 'enrich_gravity_data', enrich_gravity_data):
+            response = self.post([self.point(self.devices[i % 2].id, i) for i in range(4)])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json()['failed'], [1, 3])
+        self.assertEqual(response.json()['rejected'], [])
+        self.assertEqual(len(self.logged_temps(self.beers[0])), 2)
+
+    def test_device_not_logging(self):
+        self.devices[1].active_beer = None
+        self.devices[1].save()
+        response = self.post([self.point(self.devices[1].id, 0)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['saved'], 0)
+
+    def test_no_devices_found(self):
+        response = self.post([self.point(9998, 0), self.point(9999, 1)])
+        self.assertEqual(response.status_code, 404)
+
+    def test_empty_batch(self):
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertEqual(self.post({'points': []}).status_code, 400)
+
+    def test_invalid_point(self):
+        response = self.post([self.point(self.devices[0].id, 0), {'brewpi_device_id': 'x'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(binary_log.exists(self.beers[0]))  # Nothing is written if any point is invalid
+
+    def test_too_many_points(self):
+        with mock.patch.object(devices, 'MAX_POINTS_PER_REQUEST', 3):
+            response = self.post([self.point(self.devices[0].id, i) for i in range(4)])
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.json()['max_points'], 3)
+
+    def test_save_points(self):
+        points = []
+        for i in range(6):
+            point = BeerLogPoint(beer_temp=20 + i, beer_set=20, fridge_temp=18, fridge_set=18, room_temp=22, state=1,
+                                 temp_format='C', associated_beer=self.beers[i % 2])
+            point.log_time = self.start + datetime.timedelta(minutes=i)
+            points.append(point)
+        points.append(BeerLogPoint(beer_temp=30, temp_format='C'))  # Not associated with a beer, so it isn't written
+
+        self.assertEqual(BeerLogPoint.save_points(points), 6)
+        self.assertEqual(self.logged_temps(self.beers[0]), [20, 22, 24])
+        self.assertEqual(self.logged_temps(self.beers[1]), [21, 23, 25])
+        with open(self.beers[0].log_file_paths()['base_csv']) as f:
+            self.assertEqual(len(f.read().splitlines()), 4)  # The header, then one row per point
@@ -0,0 +1,107 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from app.api import metrics
+from app.models import BrewPiDevice
+
+SCRIPT_METRICS = {
+    "uptime": 3600.5,
+    "loop_lag": {"count": 7200, "total": 1.25, "max": 0.05},
+    "since_temperatures": 2.5,
+    "serial": {"bytes_in": 102400, "bytes_out": 2048, "lines_queued": 0, "messages_queued": 1},
+    "messages": {"lcd": {"count": 10, "total": 0.02, "max": 0.005},
+                 "getDashInfo": {"count": 4, "total": 0.01, "max": 0.004}},
+    "sender": {"post_latency": {"count": 120, "total": 6.0, "max": 0.5}, "queued": 0, "dropped": 2, "spooled": 3},
+    "error_count": 0,
+}
+
+EXPECTED = """\
+# HELP brewpi_up Whether BrewPi-Script answered the request for its metrics
+# TYPE brewpi_up gauge
+brewpi_up{LABELS} 1
+# HELP brewpi_uptime_seconds Time since BrewPi-Script started
+# TYPE brewpi_uptime_seconds gauge
+brewpi_uptime_seconds{LABELS} 3600.5
+# HELP brewpi_loop_lag_seconds How late the script's event loop was in waking up a timer
+# TYPE brewpi_loop_lag_seconds summary
+brewpi_loop_lag_seconds_sum{LABELS} 1.25
+brewpi_loop_lag_seconds_count{LABELS} 7200
+# HELP brewpi_loop_lag_max_seconds Longest loop lag since the script started
+# TYPE brewpi_loop_lag_max_seconds gauge
+brewpi_loop_lag_max_seconds{LABELS} 0.05
+# HELP brewpi_seconds_since_temperatures Time since the controller last sent temperatures
+# TYPE brewpi_seconds_since_temperatures gauge
+brewpi_seconds_since_temperatures{LABELS} 2.5
+# HELP brewpi_serial_received_bytes_total Bytes received from the controller
+# TYPE brewpi_serial_received_bytes_total counter
+brewpi_serial_received_bytes_total{LABELS} 102400
+# HELP brewpi_serial_sent_bytes_total Bytes sent to the controller
+# TYPE brewpi_serial_sent_bytes_total counter
+brewpi_serial_sent_bytes_total{LABELS} 2048
+# HELP brewpi_serial_queue_depth Lines and log messages from the controller waiting to be processed
+# TYPE brewpi_serial_queue_depth gauge
+brewpi_serial_queue_depth{LABELS,queue="lines"} 0
+brewpi_serial_queue_depth{LABELS,queue="messages"} 1
+# HELP brewpi_message_seconds Time taken to handle messages from Fermentrack, by message type
+# TYPE brewpi_message_seconds summary
+brewpi_message_seconds_sum{LABELS,message_type="getDashInfo"} 0.01
+brewpi_message_seconds_count{LABELS,message_type="getDashInfo"} 4
+brewpi_message_seconds_sum{LABELS,message_type="lcd"} 0.02
+brewpi_message_seconds_count{LABELS,message_type="lcd"} 10
+# HELP brewpi_message_max_seconds Longest time taken to handle a message, by message type
+# TYPE brewpi_message_max_seconds gauge
+brewpi_message_max_seconds{LABELS,message_type="getDashInfo"} 0.004
+brewpi_message_max_seconds{LABELS,message_type="lcd"} 0.005
+# HELP brewpi_point_post_seconds Time taken to save a batch of log points
+# TYPE brewpi_point_post_seconds summary
+brewpi_point_post_seconds_sum{LABELS} 6.0
+brewpi_point_post_seconds_count{LABELS} 120
+# HELP brewpi_point_post_max_seconds Longest time taken to save a batch of log points
+# TYPE brewpi_point_post_max_seconds gauge
+brewpi_point_post_max_seconds{LABELS} 0.5
+# HELP brewpi_point_queue_depth Log points waiting to be saved
+# TYPE brewpi_point_queue_depth gauge
+brewpi_point_queue_depth{LABELS} 0
+# HELP brewpi_point_spool_depth Log points spooled to disk while they couldn't be saved
+# TYPE brewpi_point_spool_depth gauge
+brewpi_point_spool_depth{LABELS} 3
+# HELP brewpi_points_dropped_total Log points that were dropped without being saved
+# TYPE brewpi_points_dropped_total counter
+brewpi_points_dropped_total{LABELS} 2
+# HELP brewpi_error_count Consecutive errors (the script restarts once there are too many)
+# TYPE brewpi_error_count gauge
+brewpi_error_count{LABELS} 0
+"""
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        self.device = BrewPiDevice.objects.create(device_name='Fridge "1"', temp_format='C', socketPort=2222,
+                                                  status=BrewPiDevice.STATUS_ACTIVE)
+
+    def get_metrics(self, script_metrics) -> str:
+        with mock.patch.object(BrewPiDevice, 'retrieve_metrics', return_value=script_metrics):
+            response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        return response.content.decode()
+
+    def test_device_metrics(self):
+        labels = 'device_id="{}",device_name="Fridge \\"1\\""'.format(self.device.id)
+        self.assertEqual(self.get_metrics(SCRIPT_METRICS), EXPECTED.replace("LABELS", labels))
+
+    def test_script_not_answering(self):
+        BrewPiDevice.objects.create(device_name="Disabled", temp_format='C', socketPort=2223,
+                                    status=BrewPiDevice.STATUS_DISABLED)
+        self.assertEqual(self.get_metrics(None),
+                         "# HELP brewpi_up Whether BrewPi-Script answered the request for its metrics\n"
+                         "# TYPE brewpi_up gauge\n"
+                         'brewpi_up{{device_id="{}",device_name="Fridge \\"1\\""}} 0\n'.format(self.device.id))
+
+    def test_script_without_sender_or_serial(self):
+        script_metrics = dict(SCRIPT_METRICS, since_temperatures=None, serial={}, messages={}, sender={})
+        names = {line.split("{")[0] for line in self.get_metrics(script_metrics).splitlines()
+                 if not line.startswith("#")}
+        self.assertEqual(names, {'brewpi_up', 'brewpi_uptime_seconds', 'brewpi_loop_lag_seconds_sum',
+                                 'brewpi_loop_lag_seconds_count', 'brewpi_loop_lag_max_seconds', 'brewpi_error_count'})
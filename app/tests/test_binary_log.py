@@ -0,0 +1,149 @@
+import math
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from app import binary_log, log_archive, log_index, log_writer
+from app.api import logs
+
+
+BASE_HEADER = "log_time,beer_temp,beer_set,beer_ann,fridge_temp,fridge_set,fridge_ann,room_temp,state\r\n"
+
+
+def base_row(second: int, beer_temp="20.5") -> str:
+    return "2000/01/01 00:00:{:02d}Z,{},20,,18.25,18,,22,{}\r\n".format(second, beer_temp, second % 3)
+
+
+class OldBeerLog:
+    """Stands in for a Beer that was logged before the binary store existed"""
+
+    def __init__(self, directory):
+        self.paths = {which: os.path.join(directory, "beer_" + which) for which in log_writer.LOG_FILES}
+
+    def log_file_paths(self) -> dict:
+        return self.paths
+
+    def binary_layout(self) -> binary_log.RecordLayout:
+        return binary_log.BEER_LAYOUT
+
+    def base_filename(self) -> str:
+        return "beer"
+
+
+class BinaryLogConversionTestCase(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.log = OldBeerLog(self.dir)
+        self.write('base_csv', BASE_HEADER + "".join(base_row(second) for second in range(10)))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, which: str, text: str):
+        with open(self.log.paths[which], 'w', newline='') as f:
+            f.write(text)
+
+    def write_annotations(self, *annotations: tuple):
+        # In the same "almost JSON" format as LogWriter.format_annotations
+        self.write('annotation_json', "[\r\n" + ",\r\n".join(
+            '  {{"series": "beer_temp", "x": "2000/01/01 00:00:{:02d}Z", "shortText": "{}", "text": "{}"}}'.format(
+                second, text[:1], text) for second, text in annotations))
+
+    def records(self) -> list:
+        return list(binary_log.iter_records(self.log.paths['binary']))
+
+    def test_conversion(self):
+        self.assertTrue(binary_log.ensure_exists(self.log))
+        records = self.records()
+        self.assertEqual(len(records), 10)
+        self.assertEqual(records[3]['log_time'], 946684803000)
+        self.assertEqual(records[3]['beer_temp'], 20.5)
+        self.assertEqual(records[3]['fridge_temp'], 18.25)
+        self.assertEqual(records[3]['state'], 0)
+        # Columns that aren't in the CSV are missing
+        self.assertTrue(math.isnan(records[3]['gravity']))
+
+    def test_torn_and_malformed_rows_are_skipped(self):
+        self.write('base_csv', BASE_HEADER + base_row(0) + "2000/01/01 00:00:01Z,20\r\n" + "not a time" +
+                   base_row(2)[10:] + base_row(3) + base_row(4)[:20])
+        binary_log.ensure_exists(self.log)
+        self.assertEqual([record['log_time'] for record in self.records()], [946684800000, 946684803000])
+
+    def test_annotations_are_converted(self):
+        self.write_annotations((2, "Dry hopped"), (7, "Cold crash"), (30, "Not in the log"))
+        binary_log.ensure_exists(self.log)
+        annotations = binary_log.read_annotations(self.log.paths['binary_annotations'])
+        self.assertEqual(annotations, [
+            {'row': 2, 'series': 'beer_temp', 'shortText': 'D', 'text': 'Dry hopped'},
+            {'row': 7, 'series': 'beer_temp', 'shortText': 'C', 'text': 'Cold crash'},
+        ])
+
+    def test_annotation_attaches_to_the_first_point_in_its_second(self):
+        self.write('base_csv', BASE_HEADER + base_row(0) + base_row(1, "19") + base_row(1, "21") + base_row(2))
+        self.write_annotations((1, "Pitched"))
+        binary_log.ensure_exists(self.log)
+        self.assertEqual(binary_log.read_annotations(self.log.paths['binary_annotations'])[0]['row'], 1)
+
+    def test_without_annotations(self):
+        binary_log.ensure_exists(self.log)
+        self.assertEqual(binary_log.read_annotations(self.log.paths['binary_annotations']), [])
+
+    def test_archived_log(self):
+        self.write_annotations((4, "Archived"))
+        log_archive.archive_log_files(self.log.paths)
+        self.assertTrue(binary_log.ensure_exists(self.log))
+        self.assertEqual(len(self.records()), 10)
+        self.assertEqual(binary_log.read_annotations(self.log.paths['binary_annotations'])[0]['row'], 4)
+
+    def test_no_temporary_files_are_left(self):
+        binary_log.ensure_exists(self.log)
+        self.write('base_csv', "")
+        os.remove(self.log.paths['binary'])
+        with self.assertRaises(binary_log.BinaryLogError):
+            binary_log.ensure_exists(self.log)
+        self.assertFalse(os.path.exists(self.log.paths['binary']))
+        self.assertEqual([name for name in os.listdir(self.dir) if name.endswith(".tmp")], [])
+
+    def test_nothing_logged(self):
+        os.remove(self.log.paths['base_csv'])
+        self.assertFalse(binary_log.ensure_exists(self.log))
+        self.assertFalse(binary_log.exists(self.log))
+
+    def test_existing_binary_log_is_kept(self):
+        binary_log.ensure_exists(self.log)
+        self.write('base_csv', BASE_HEADER)
+        self.assertTrue(binary_log.ensure_exists(self.log))
+        self.assertEqual(len(self.records()), 10)
+
+    def test_build_derived_files(self):
+        self.assertTrue(log_writer.build_derived_files(self.log))
+        self.assertEqual(len(self.records()), 10)
+        self.assertTrue(log_index.has_index(self.log, 'base_csv'))
+        self.assertFalse(log_index.has_index(self.log, 'full_csv'))  # Nothing was logged to it
+
+    def test_export_csv(self):
+        self.assertEqual(list(binary_log.export_csv(self.log)), [])  # Not converted yet
+        binary_log.ensure_exists(self.log)
+        lines = list(binary_log.export_csv(self.log, ['beer_temp', 'gravity', 'unknown', 'state']))
+        self.assertEqual(lines[0], "log_time,beer_temp,gravity,state\r\n")
+        self.assertEqual(lines[4], "2000/01/01 00:00:03Z,20.5,,0\r\n")
+        self.assertEqual(len(lines), 11)
+
+    def test_export_response_converts_in_the_background(self):
+        with mock.patch.object(logs.tasks, 'schedule_log_build') as schedule_log_build:
+            response = logs.log_csv_export_response(self.log)
+        self.assertEqual(response.status_code, 503)
+        schedule_log_build.assert_called_once_with(self.log)
+        self.assertFalse(binary_log.exists(self.log))
+
+        binary_log.ensure_exists(self.log)
+        response = logs.log_csv_export_response(self.log)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b"".join(response.streaming_content).splitlines()), 11)
+
+    def test_export_response_without_data(self):
+        os.remove(self.log.paths['base_csv'])
+        self.assertEqual(logs.log_csv_export_response(self.log).status_code, 404)
@@ -0,0 +1,132 @@
+import datetime
+import json
+import sys
+from decimal import Decimal
+from unittest import mock
+
+import redis
+from django.conf import settings
+from django.test import TestCase
+
+from app import brewpi_changes, brewpi_state
+from app.models import BrewPiDevice, FermentationProfile, FermentationProfilePoint
+
+# The BrewPi-Script side, which reloads the fields that changed from the same database
+sys.path.append(str(settings.ROOT_DIR / 'brewpi-script'))
+import fermentrack_config_loader  # noqa: E402
+
+
+class FakeRedis:
+    def __init__(self):
+        self.published = []
+        self.available = True
+
+    def publish(self, channel, message):
+        if not self.available:
+            raise redis.exceptions.ConnectionError("Connection refused")
+        self.published.append((channel, message))
+
+
+class BrewPiChangesTestCase(TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch.object(brewpi_state, '_client', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            device_id = BrewPiDevice.objects.create(device_name="Changes Test", temp_format='C',
+                                                    data_point_log_interval=30, socketPort=2222).id
+        self.device = BrewPiDevice.objects.get(id=device_id)
+        self.channel = brewpi_changes.device_channel(device_id)
+
+    def save(self, device, **kwargs) -> list:
+        """Saves a device, returning the fields that were published as having changed (if any)"""
+        self.redis.published = []
+        with self.captureOnCommitCallbacks(execute=True):
+            device.save(**kwargs)
+        return [json.loads(message) for channel, message in self.redis.published if channel == self.channel]
+
+    def test_new_device_is_not_published(self):
+        self.assertEqual(self.redis.published, [])
+
+    def test_unchanged_device_is_not_published(self):
+        self.assertEqual(self.save(self.device), [])
+
+    def test_changed_fields_are_published(self):
+        self.device.data_point_log_interval = 60
+        self.device.temp_format = 'F'
+        self.assertEqual(self.save(self.device), [['temp_format', 'data_point_log_interval']])
+        self.assertEqual(self.save(self.device), [])  # Nothing has changed since it was last saved
+
+    def test_foreign_keys_are_published_by_attname(self):
+        profile = FermentationProfile.objects.create(name="Changes Test")
+        self.device.active_profile = profile
+        self.assertEqual(self.save(self.device), [['active_profile_id']])
+
+    def test_only_update_fields_are_published(self):
+        self.device.data_point_log_interval = 60
+        self.device.temp_format = 'F'
+        self.assertEqual(self.save(self.device, update_fields=['temp_format']), [['temp_format']])
+        self.assertEqual(self.save(self.device), [['data_point_log_interval']])
+
+    def test_nothing_is_published_until_committed(self):
+        self.device.data_point_log_interval = 60
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.device.save()
+        self.assertEqual(self.redis.published, [])
+        self.assertEqual(len(callbacks), 1)
+
+    def test_profile_changes_are_published(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = FermentationProfile.objects.create(name="Changes Test")
+            FermentationProfilePoint.objects.create(profile=profile, ttl=datetime.timedelta(days=1),
+                                                    temperature_setting=Decimal("18.0"), temp_format='C')
+        self.assertEqual(self.redis.published, [(brewpi_changes.PROFILE_CHANNEL, str(profile.id))] * 2)
+
+    def test_redis_unavailable(self):
+        self.redis.available = False
+        self.device.data_point_log_interval = 60
+        self.assertEqual(self.save(self.device), [])  # The script falls back to reloading the whole device
+        self.assertEqual(BrewPiDevice.objects.get(id=self.device.id).data_point_log_interval, 60)
+
+
+class ReloadFieldsTestCase(TestCase):
+    def setUp(self):
+        self.device = BrewPiDevice.objects.create(device_name="Reload Test", temp_format='C',
+                                                  data_point_log_interval=30, socketPort=2222)
+        self.config_obj = fermentrack_config_loader.FermentrackBrewPiScriptConfig(self.device.id)
+        self.config_obj.load_from_fermentrack()
+
+    def test_reload_fields(self):
+        profile = FermentationProfile.objects.create(name="Reload Test")
+        BrewPiDevice.objects.filter(id=self.device.id).update(data_point_log_interval=60, temp_format='F',
+                                                              active_profile=profile, device_name="Renamed")
+        with self.assertNumQueries(1):
+            self.config_obj.reload_fields(['data_point_log_interval', 'active_profile_id'])
+        self.assertEqual(self.config_obj.data_point_log_interval, 60)
+        self.assertEqual(self.config_obj.brewpi_device.active_profile, profile)
+        # Only the fields that changed are reloaded
+        self.assertEqual(self.config_obj.temp_format, 'C')
+        self.assertEqual(self.config_obj.name, "Reload Test")
+
+    def test_socket_fields_are_not_reloaded(self):
+        BrewPiDevice.objects.filter(id=self.device.id).update(socketPort=2223)
+        with self.assertNumQueries(0):
+            self.config_obj.reload_fields(['socketPort'])
+        self.assertEqual(self.config_obj.socket_port, 2222)
+
+    def test_deleted_device(self):
+        BrewPiDevice.objects.filter(id=self.device.id).delete()
+        self.config_obj.reload_fields(['data_point_log_interval'])
+        self.assertEqual(self.config_obj.data_point_log_interval, 30)
+
+    def test_changes_from_listener(self):
+        changes = []
+        with mock.patch.object(fermentrack_config_loader, 'ChangeListener') as change_listener:
+            self.config_obj.watch_changes(changes.append)
+        handle_change = change_listener.call_args[0][2]
+        handle_change(None, None)
+        handle_change(brewpi_changes.device_channel(self.device.id), '["temp_format"]')
+        handle_change(brewpi_changes.PROFILE_CHANNEL, "3")
+        self.assertEqual(changes, [None, {'fields': ['temp_format']}, {'profile': 3}])
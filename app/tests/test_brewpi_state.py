@@ -0,0 +1,99 @@
+import json
+import time
+from unittest import mock
+
+import redis
+from django.test import SimpleTestCase
+
+from app import brewpi_state
+from app.models import BrewPiDevice
+
+
+class FakeRedis:
+    """Just enough of redis.Redis to hold the state hashes - or to act as though Redis is down"""
+
+    def __init__(self):
+        self.hashes = {}
+        self.available = True
+        self.reads = 0
+
+    def hgetall(self, key):
+        self.reads += 1
+        if not self.available:
+            raise redis.exceptions.ConnectionError("Connection refused")
+        return {field.encode(): str(value).encode() for field, value in self.hashes.get(key, {}).items()}
+
+
+class BrewPiStateTestCase(SimpleTestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch.object(brewpi_state, '_client', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.device = BrewPiDevice(id=7, device_name="State Test")
+        send_message = mock.patch.object(BrewPiDevice, 'send_message', return_value="from socket")
+        self.send_message = send_message.start()
+        self.addCleanup(send_message.stop)
+
+    def publish(self, age=0, **fields):
+        self.redis.hashes[brewpi_state.state_key(self.device.id)] = dict(fields, updated_at=time.time() - age)
+
+    def test_load(self):
+        self.publish(age=3, mode="b", beer_set="19.5")
+        state = brewpi_state.load(self.device.id)
+        self.assertEqual((state['mode'], state['beer_set']), ("b", "19.5"))
+        self.assertAlmostEqual(state['age'], 3, delta=1)
+        self.assertFalse(state['stale'])
+
+    def test_load_stale(self):
+        self.publish(age=brewpi_state.MAX_AGE + 1, mode="b")
+        self.assertTrue(brewpi_state.load(self.device.id)['stale'])
+
+    def test_load_missing_or_invalid(self):
+        self.assertIsNone(brewpi_state.load(self.device.id))
+        self.redis.hashes[brewpi_state.state_key(self.device.id)] = {'mode': "b"}  # Never marked as updated
+        self.assertIsNone(brewpi_state.load(self.device.id))
+        self.publish(mode="b")
+        self.redis.hashes[brewpi_state.state_key(self.device.id)]['updated_at'] = "never"
+        self.assertIsNone(brewpi_state.load(self.device.id))
+
+    def test_read_from_snapshot(self):
+        self.publish(mode="f", fridge_set="17.0")
+        self.assertEqual(self.device.read_state(brewpi_state.MODE, "getMode"), "f")
+        self.assertEqual(self.device.read_state(brewpi_state.FRIDGE_SET, "getFridge"), "17.0")
+        self.send_message.assert_not_called()
+        self.assertEqual(self.redis.reads, 1)  # Reads in quick succession share a lookup
+        self.assertEqual(self.device.state_snapshot_age(), 0)
+
+    def test_read_missing_field_from_socket(self):
+        self.publish(mode="f")
+        self.assertEqual(self.device.read_state(brewpi_state.CONTROL_VARIABLES, "getControlVariables"), "from socket")
+        self.send_message.assert_called_once_with("getControlVariables", read_response=True)
+
+    def test_read_stale_snapshot_from_socket(self):
+        self.publish(age=brewpi_state.MAX_AGE + 1, mode="f")
+        self.assertEqual(self.device.read_state(brewpi_state.MODE, "getMode"), "from socket")
+        self.send_message.assert_called_once_with("getMode", read_response=True)
+        self.assertIsNone(self.device.state_snapshot_age())
+
+    def test_read_without_redis(self):
+        self.publish(mode="f")
+        self.redis.available = False
+        self.assertEqual(self.device.read_state(brewpi_state.MODE, "getMode"), "from socket")
+        self.send_message.assert_called_once_with("getMode", read_response=True)
+
+    def test_snapshot_is_refreshed(self):
+        self.publish(mode="f")
+        self.assertEqual(self.device.read_state(brewpi_state.MODE, "getMode"), "f")
+        self.publish(mode="o")
+        with mock.patch('time.time', return_value=time.time() + 2):
+            self.assertEqual(self.device.read_state(brewpi_state.MODE, "getMode"), "o")
+        self.assertEqual(self.redis.reads, 2)
+
+    def test_read_lcd(self):
+        degrees = bytes([0xB0]).decode(encoding="cp437")  # The degree symbol, as it comes from the controller
+        self.publish(lcd=json.dumps(["Mode   Beer Const.", "Beer   19.5 " + degrees + "C", "Idling", " "]))
+        self.assertEqual(self.device.read_lcd()[1], "Beer   19.5 &deg;C")
+        self.assertTrue(self.device.is_connected())
+        self.send_message.assert_not_called()
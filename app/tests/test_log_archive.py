@@ -0,0 +1,90 @@
+import io
+import lzma
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from app import log_archive
+
+
+class LogArchiveTestCase(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "log_full.csv")
+        # Rows of varying length, so that frames don't split evenly on row boundaries
+        self.data = b"".join("2000/01/01 00:00:{:02d}Z,{},{}\r\n".format(i % 60, i, "x" * (i % 7)).encode('utf-8')
+                             for i in range(2000))
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_archive_and_restore_round_trip(self):
+        self.assertTrue(log_archive.archive_file(self.path, frame_size=4096))
+        self.assertFalse(os.path.isfile(self.path))
+        self.assertTrue(log_archive.is_archived(self.path))
+        self.assertTrue(log_archive.exists(self.path))
+        self.assertEqual(log_archive.size(self.path), len(self.data))
+
+        self.assertTrue(log_archive.restore_file(self.path))
+        self.assertFalse(log_archive.is_archived(self.path))
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_archive_is_a_normal_xz_file(self):
+        log_archive.archive_file(self.path, frame_size=4096)
+        with open(log_archive.archive_path(self.path), 'rb') as f:
+            self.assertEqual(lzma.decompress(f.read()), self.data)
+
+    def test_read_archived_file(self):
+        log_archive.archive_file(self.path, frame_size=4096)
+        with log_archive.open_log_file(self.path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        with log_archive.open_log_file(self.path, 'r') as f:
+            # Text mode keeps the CSV's line endings as they are
+            self.assertEqual(f.read(), self.data.decode('utf-8'))
+
+    def test_seek_across_frames(self):
+        log_archive.archive_file(self.path, frame_size=4096)
+        with log_archive.open_log_file(self.path, 'rb') as f:
+            for offset in [0, 1, 4095, 4096, 4097, 12000, len(self.data) - 10]:
+                f.seek(offset)
+                self.assertEqual(f.read(100), self.data[offset:offset + 100])
+                self.assertEqual(f.tell(), min(offset + 100, len(self.data)))
+
+            f.seek(-10, io.SEEK_END)
+            self.assertEqual(f.read(), self.data[-10:])
+            f.seek(len(self.data) + 100)
+            self.assertEqual(f.read(), b"")
+
+    def test_readline_after_seek(self):
+        log_archive.archive_file(self.path, frame_size=4096)
+        # The start of a row that straddles a frame boundary
+        offset = self.data.rfind(b"\n", 0, 4096) + 1
+        with log_archive.open_log_file(self.path, 'rb') as f:
+            f.seek(offset)
+            self.assertEqual(f.readline(), self.data[offset:self.data.index(b"\n", offset) + 1])
+
+    def test_uncompressed_copy_is_preferred(self):
+        log_archive.archive_file(self.path, frame_size=4096)
+        with open(self.path, 'wb') as f:
+            f.write(b"restored\r\n")
+        self.assertFalse(log_archive.is_archived(self.path))
+        with log_archive.open_log_file(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b"restored\r\n")
+
+    def test_missing_file(self):
+        self.assertFalse(log_archive.archive_file(os.path.join(self.dir, "missing.csv")))
+        self.assertFalse(log_archive.restore_file(self.path))
+        self.assertFalse(log_archive.exists(os.path.join(self.dir, "missing.csv")))
+
+    def test_empty_file(self):
+        with open(self.path, 'wb'):
+            pass
+        self.assertTrue(log_archive.archive_file(self.path))
+        self.assertEqual(log_archive.size(self.path), 0)
+        with log_archive.open_log_file(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b"")
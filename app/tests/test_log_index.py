@@ -0,0 +1,150 @@
+import datetime
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from app import binary_log, log_archive, log_index
+from app.api import logs
+
+
+START = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+HEADER = b"log_time,gravity,temp\r\n"
+
+
+class IndexedLog:
+    """Stands in for a Beer or GravityLog"""
+
+    def __init__(self, directory):
+        self.paths = {which: os.path.join(directory, which) for which in
+                      list(log_index.INDEX_FILES) + list(log_index.INDEX_FILES.values())}
+
+    def log_file_paths(self) -> dict:
+        return self.paths
+
+    def read_range(self, start=None, end=None, which: str = 'full_csv', include_header: bool = False):
+        return log_index.read_range(self, start, end, which, include_header)
+
+    def full_filename(self, which: str) -> str:
+        return which + ".csv"
+
+
+@override_settings(LOG_INDEX_INTERVAL=3)
+class LogIndexTestCase(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.log = IndexedLog(self.dir)
+        # Several rows share each second, so that index entries (every 3 rows) land part way through a second
+        self.rows = []
+        for i in range(200):
+            log_time = START + datetime.timedelta(milliseconds=400 * i)
+            self.rows.append((log_time.replace(microsecond=0), "{},{},20.0\r\n".format(
+                log_time.strftime(log_index.TIME_FORMAT), i).encode('utf-8')))
+        with open(self.log.paths['full_csv'], 'wb') as f:
+            f.write(HEADER + b"".join(line for _, line in self.rows))
+        log_index.ensure_index(self.log)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def expected(self, start, end) -> list:
+        return [line for log_time, line in self.rows
+                if (start is None or log_time >= start) and (end is None or log_time < end)]
+
+    def assertRange(self, start, end):
+        self.assertEqual(list(log_index.read_range(self.log, start, end)), self.expected(start, end))
+
+    def test_index_entries(self):
+        index_size = os.path.getsize(self.log.paths['full_csv_index'])
+        self.assertEqual(index_size, len(range(0, len(self.rows), 3)) * log_index.ENTRY.size)
+        self.assertEqual(list(log_index.read_range(self.log, include_header=True)),
+                         [HEADER] + [line for _, line in self.rows])
+
+    def test_read_range_without_index(self):
+        # Reading never builds the index (that's left to log_writer.build_derived_files) - the CSV is scanned instead
+        os.remove(self.log.paths['full_csv_index'])
+        for start_second in range(0, 80, 7):
+            start = START + datetime.timedelta(seconds=start_second)
+            self.assertRange(start, start + datetime.timedelta(seconds=5))
+        self.assertFalse(os.path.exists(self.log.paths['full_csv_index']))
+
+    def test_read_range_across_index_entries(self):
+        for start_second in range(0, 80, 3):
+            for length in [1, 2, 7]:
+                start = START + datetime.timedelta(seconds=start_second)
+                self.assertRange(start, start + datetime.timedelta(seconds=length))
+
+    def test_open_ended_ranges(self):
+        self.assertRange(None, START + datetime.timedelta(seconds=10))
+        self.assertRange(START + datetime.timedelta(seconds=70), None)
+        self.assertRange(START - datetime.timedelta(days=1), None)
+        self.assertEqual(list(log_index.read_range(self.log, START + datetime.timedelta(days=1))), [])
+
+    def test_bounds_are_truncated_to_the_second(self):
+        start, end = START + datetime.timedelta(seconds=5), START + datetime.timedelta(seconds=9)
+        expected = self.expected(start, end)
+        self.assertEqual(list(log_index.read_range(self.log, start + datetime.timedelta(milliseconds=750),
+                                                   end + datetime.timedelta(milliseconds=750))), expected)
+        # Bounds given as ms since the epoch are treated the same way
+        self.assertEqual(list(log_index.read_range(self.log, binary_log.to_epoch_ms(start) + 750,
+                                                   binary_log.to_epoch_ms(end) + 750)), expected)
+
+    def test_read_range_from_archive(self):
+        log_archive.archive_file(self.log.paths['full_csv'], frame_size=512)
+        for start_second in range(0, 80, 7):
+            start = START + datetime.timedelta(seconds=start_second)
+            self.assertRange(start, start + datetime.timedelta(seconds=5))
+
+    def test_torn_index(self):
+        with open(self.log.paths['full_csv_index'], 'ab') as f:
+            f.write(b"\x01\x02")
+        self.assertFalse(log_index.has_index(self.log))
+        self.assertRange(START + datetime.timedelta(seconds=20), START + datetime.timedelta(seconds=30))
+        log_index.ensure_index(self.log)
+        self.assertTrue(log_index.has_index(self.log))
+
+    def test_row_being_written_is_skipped(self):
+        with open(self.log.paths['full_csv'], 'ab') as f:
+            f.write(b"2000/01/01 00:05:00Z,1.0")
+        self.assertEqual(list(log_index.read_range(self.log, START + datetime.timedelta(seconds=79))),
+                         self.expected(START + datetime.timedelta(seconds=79), None))
+
+    def test_offset_after(self):
+        data = HEADER + b"".join(line for _, line in self.rows)
+        log_time = START + datetime.timedelta(seconds=30, milliseconds=500)
+        first_after = next(line for row_time, line in self.rows if row_time > log_time.replace(microsecond=0))
+        self.assertEqual(log_index.offset_after(self.log, log_time, 'full_csv'), data.index(first_after))
+        self.assertEqual(log_index.offset_after(self.log, START + datetime.timedelta(days=1), 'full_csv'), len(data))
+
+        os.remove(self.log.paths['full_csv_index'])
+        self.assertEqual(log_index.offset_after(self.log, log_time, 'full_csv'), data.index(first_after))
+        self.assertIsNone(log_index.offset_after(self.log, log_time, 'base_csv'))
+
+    def range_response(self, start, end):
+        req = RequestFactory().get('/', {'start': binary_log.to_epoch_ms(start), 'end': binary_log.to_epoch_ms(end)})
+        with mock.patch.object(logs.tasks, 'schedule_log_build') as schedule_log_build:
+            response = logs.log_range_response(req, self.log, 'full_csv')
+        return response, schedule_log_build
+
+    def test_range_response(self):
+        start, end = START + datetime.timedelta(seconds=20), START + datetime.timedelta(seconds=30)
+        response, schedule_log_build = self.range_response(start, end)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.streaming_content), [HEADER] + self.expected(start, end))
+        schedule_log_build.assert_not_called()
+
+    def test_range_response_without_index(self):
+        # The index is built in the background, and the whole CSV is scanned in the meantime
+        os.remove(self.log.paths['full_csv_index'])
+        start, end = START + datetime.timedelta(seconds=20), START + datetime.timedelta(seconds=30)
+        response, schedule_log_build = self.range_response(start, end)
+        self.assertEqual(list(response.streaming_content), [HEADER] + self.expected(start, end))
+        schedule_log_build.assert_called_once_with(self.log)
+        self.assertFalse(os.path.exists(self.log.paths['full_csv_index']))
+
+    def test_range_response_without_data(self):
+        os.remove(self.log.paths['full_csv'])
+        response, _ = self.range_response(START, START + datetime.timedelta(seconds=30))
+        self.assertEqual(response.status_code, 404)
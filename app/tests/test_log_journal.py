@@ -0,0 +1,125 @@
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from app import binary_log, log_journal, log_writer
+
+
+HEADER = b"log_time,gravity,temp\r\n"
+
+
+def row(second: int) -> bytes:
+    return "2000/01/01 00:00:{:02d}Z,1.050,20.0\r\n".format(second).encode('utf-8')
+
+
+class LogJournalTestCase(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.paths = {which: os.path.join(self.dir, "log_" + which) for which in log_writer.LOG_FILES}
+        self.write('base_csv', HEADER + row(0))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, which: str, data: bytes, mode: str = 'wb'):
+        with open(self.paths[which], mode) as f:
+            f.write(data)
+
+    def read(self, which: str) -> bytes:
+        with open(self.paths[which], 'rb') as f:
+            return f.read()
+
+    def journal(self, *records: list):
+        self.write('journal', b"".join(log_journal.format_record(appends) for appends in records))
+
+    def test_record_round_trip(self):
+        appends = [('base_csv', 10, row(1)), ('binary', 1024, b"\x00" * 48)]
+        self.journal(appends, [('full_csv', 0, b"")])
+        self.assertEqual(list(log_journal.read_records(self.paths['journal'])), [appends, [('full_csv', 0, b"")]])
+
+    def test_replay_missing_appends(self):
+        size = len(HEADER + row(0))
+        self.journal([('base_csv', size, row(1))], [('base_csv', size + len(row(1)), row(2))])
+
+        self.assertTrue(log_journal.recover(self.paths))
+        self.assertEqual(self.read('base_csv'), HEADER + row(0) + row(1) + row(2))
+        self.assertFalse(os.path.exists(self.paths['journal']))
+
+    def test_replay_completes_a_torn_append(self):
+        size = len(HEADER + row(0))
+        self.journal([('base_csv', size, row(1))])
+        self.write('base_csv', row(1)[:7], 'ab')
+
+        self.assertTrue(log_journal.recover(self.paths))
+        self.assertEqual(self.read('base_csv'), HEADER + row(0) + row(1))
+
+    def test_applied_appends_are_not_replayed(self):
+        size = len(HEADER)
+        self.journal([('base_csv', size, row(0))])
+
+        self.assertFalse(log_journal.recover(self.paths))
+        self.assertEqual(self.read('base_csv'), HEADER + row(0))
+        self.assertFalse(os.path.exists(self.paths['journal']))
+
+    def test_torn_journal_record_is_ignored(self):
+        size = len(HEADER + row(0))
+        complete = log_journal.format_record([('base_csv', size, row(1))])
+        torn = log_journal.format_record([('base_csv', size + len(row(1)), row(2))])
+        self.write('journal', complete + torn[:-3])
+
+        self.assertEqual(len(list(log_journal.read_records(self.paths['journal']))), 1)
+        log_journal.recover(self.paths)
+        self.assertEqual(self.read('base_csv'), HEADER + row(0) + row(1))
+
+    def test_corrupt_journal_record_is_ignored(self):
+        record = bytearray(log_journal.format_record([('base_csv', len(HEADER + row(0)), row(1))]))
+        record[-1] ^= 0xff
+        self.write('journal', bytes(record))
+
+        self.assertEqual(list(log_journal.read_records(self.paths['journal'])), [])
+        log_journal.recover(self.paths)
+        self.assertEqual(self.read('base_csv'), HEADER + row(0))
+
+    def test_repair_torn_csv_line(self):
+        self.write('base_csv', row(1)[:12], 'ab')
+
+        self.assertTrue(log_journal.recover(self.paths))
+        self.assertEqual(self.read('base_csv'), HEADER + row(0))
+
+    def test_repair_torn_annotation(self):
+        entry = b'[\r\n{"series": "temp", "x": "2000/01/01 00:00:00Z", "shortText": "a", "text": "a"}'
+        self.write('annotation_json', entry + b',\r\n{"series": "te')
+
+        self.assertTrue(log_journal.recover(self.paths))
+        self.assertEqual(self.read('annotation_json'), entry)
+
+    def test_repair_torn_binary_record(self):
+        layout = binary_log.GRAVITY_LAYOUT
+        records = layout.pack({'log_time': 0, 'gravity': 1.05, 'temp': 20}) * 2
+        self.write('binary', layout.header() + records + records[:5])
+
+        self.assertTrue(log_journal.recover(self.paths))
+        self.assertEqual(self.read('binary'), layout.header() + records)
+
+    def test_repair_torn_binary_header(self):
+        self.write('binary', binary_log.GRAVITY_LAYOUT.header()[:100])
+
+        self.assertTrue(log_journal.recover(self.paths))
+        self.assertEqual(self.read('binary'), b"")
+
+    def test_intact_files_are_left_alone(self):
+        self.write('binary', binary_log.GRAVITY_LAYOUT.header())
+        self.assertFalse(log_journal.recover(self.paths))
+        self.assertEqual(self.read('base_csv'), HEADER + row(0))
+
+    def test_lock_is_shared_and_reentrant(self):
+        lock = log_journal.lock(self.paths)
+        self.assertIs(lock, log_journal.lock(dict(self.paths)))
+        with lock:
+            with log_journal.lock(self.paths):
+                # recover() takes the lock as well
+                log_journal.recover(self.paths)
+            self.assertEqual(lock.depth, 1)
+        self.assertEqual(lock.depth, 0)
@@ -0,0 +1,99 @@
+import datetime
+import json
+import shutil
+import tempfile
+from unittest import mock
+
+import redis
+from django.test import TestCase
+from django.utils import timezone
+
+from app import binary_log, log_rows, log_stream, log_writer
+from app.api.devices import build_beer_log_points
+from app.models import Beer, BeerLogPoint, BrewPiDevice
+
+
+class FakePipeline:
+    def __init__(self, r):
+        self.r = r
+        self.commands = []
+
+    def xadd(self, *args):
+        self.commands.append(('xadd',) + args)
+
+    def xack(self, *args):
+        self.commands.append(('xack',) + args)
+
+    def xdel(self, *args):
+        self.commands.append(('xdel',) + args)
+
+    def execute(self):
+        if self.r.fail:
+            raise redis.exceptions.ConnectionError("Connection lost")
+        self.r.executed += self.commands
+
+
+class FakeRedis:
+    """Just enough of redis.Redis for log_stream.acknowledge(), which can be made to fail like a dropped connection"""
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.executed = []
+
+    def pipeline(self, transaction: bool = False):
+        return FakePipeline(self)
+
+
+class LogStreamReplayTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        # The models use fermentrack_django.settings directly, so override_settings() has no effect on the log paths
+        data_root = mock.patch('fermentrack_django.settings.DATA_ROOT', self.dir)
+        data_root.start()
+        self.addCleanup(data_root.stop)
+
+        self.device = BrewPiDevice.objects.create(device_name="Stream Test", temp_format='C', socketPort=2222)
+        self.beer = Beer.objects.create(name="Stream Test", device=self.device)
+        self.device.active_beer = self.beer
+        self.device.save()
+
+        start = timezone.now().replace(microsecond=0) - datetime.timedelta(hours=2)
+        self.entries = [(b"1-%d" % i, {b'point': json.dumps({
+            'brewpi_device_id': self.device.id, 'beer_temp': 20 + i, 'beer_set': 20, 'fridge_temp': 18, 'fridge_set': 18,
+            'room_temp': 22, 'state': 1, 'log_time': binary_log.to_epoch_ms(start + datetime.timedelta(minutes=i)),
+        })}) for i in range(10)]
+
+    def tearDown(self):
+        log_writer.registry.release_all()
+        log_rows.forget(self.beer.log_key())
+        shutil.rmtree(self.dir)
+
+    def logged_temps(self) -> list:
+        return [record['beer_temp'] for record in binary_log.iter_records(self.beer.log_file_paths()['binary'])]
+
+    def test_replay_after_partly_written_batch(self):
+        # An earlier attempt at the batch got as far as writing the first 6 points before the consumer was restarted
+        points_by_device, _ = log_stream.parse_entries(self.entries[:6])
+        BeerLogPoint.save_points(build_beer_log_points(points_by_device)[0])
+
+        r = FakeRedis()
+        self.assertEqual(log_stream.process_entries(r, self.entries, {}), 4)
+        self.assertEqual(self.logged_temps(), [20 + i for i in range(10)])
+        self.assertIn(('xack', log_stream.STREAM_KEY, log_stream.GROUP_NAME) + tuple(e for e, _ in self.entries),
+                      r.executed)
+
+    def test_replay_after_failed_acknowledge(self):
+        with self.assertRaises(redis.exceptions.ConnectionError):
+            log_stream.process_entries(FakeRedis(fail=True), self.entries, {})
+        self.assertEqual(len(self.logged_temps()), 10)
+
+        # Restarting the consumer starts it with nothing in written_until, and the same entries are read again
+        written_until = {}
+        self.assertEqual(log_stream.process_entries(FakeRedis(), self.entries, written_until), 0)
+        self.assertEqual(self.logged_temps(), [20 + i for i in range(10)])
+        self.assertEqual(written_until[self.beer.id], json.loads(self.entries[-1][1][b'point'])['log_time'])
+
+    def test_new_beer_is_written(self):
+        written_until = {}
+        self.assertEqual(log_stream.process_entries(FakeRedis(), self.entries, written_until), 10)
+        self.assertEqual(len(self.logged_temps()), 10)
@@ -0,0 +1,110 @@
+import datetime
+from decimal import Decimal
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from app import profile_cache
+from app.models import FermentationProfile, FermentationProfilePoint
+
+
+def original_profile_temp(profile, time_started, current_time, temp_format) -> float:
+    """FermentationProfile.profile_temp as it was before profiles were compiled, with the current time passed in"""
+    profile_points = profile.fermentationprofilepoint_set.order_by('ttl')
+
+    previous_setpoint = Decimal("0.0")
+    previous_ttl = datetime.timedelta(seconds=0)
+
+    if current_time <= (time_started + profile_points[0].ttl):
+        return float(profile_points[0].convert_temp(temp_format))
+
+    for this_point in profile_points:
+        if current_time < (time_started + this_point.ttl):
+            if this_point.convert_temp(temp_format) == previous_setpoint:
+                return float(previous_setpoint)
+            else:
+                duration = this_point.ttl.total_seconds() - previous_ttl.total_seconds()
+                delta = (this_point.convert_temp(temp_format) - previous_setpoint)
+                slope = float(delta) / duration
+
+                seconds_into_point = (current_time - (time_started + previous_ttl)).total_seconds()
+
+                return round(seconds_into_point * slope + float(previous_setpoint), 1)
+
+        previous_setpoint = this_point.convert_temp(temp_format)
+        previous_ttl = this_point.ttl
+
+    return float(previous_setpoint)
+
+
+class CompiledProfileTestCase(TestCase):
+    def setUp(self):
+        self.time_started = datetime.datetime(2020, 6, 1, 12, 0, tzinfo=datetime.timezone.utc)
+
+    def create_profile(self, points: list) -> FermentationProfile:
+        """points is a list of (ttl in hours, temperature, temp format)"""
+        profile = FermentationProfile.objects.create(name="Test Profile")
+        for hours, temp, temp_format in points:
+            FermentationProfilePoint.objects.create(profile=profile, ttl=datetime.timedelta(hours=hours),
+                                                    temperature_setting=Decimal(temp), temp_format=temp_format)
+        return profile
+
+    def elapsed_times(self, profile) -> list:
+        """Times (in seconds after the start) either side of, at, and between each point"""
+        ttls = [point.ttl.total_seconds() for point in profile.fermentationprofilepoint_set.order_by('ttl')]
+        times = [0, ttls[-1] + 86400]
+        for previous_ttl, ttl in zip([0] + ttls, ttls):
+            times += [ttl - 1, ttl - 0.5, ttl, ttl + 0.001, ttl + 1, (previous_ttl + ttl) / 2,
+                      previous_ttl + (ttl - previous_ttl) / 3]
+        return sorted(set(time for time in times if time >= 0))
+
+    def assertMatchesOriginal(self, profile):
+        for temp_format in ['C', 'F']:
+            compiled = profile_cache.CompiledProfile(profile.fermentationprofilepoint_set.order_by('ttl'), temp_format)
+            for elapsed in self.elapsed_times(profile):
+                current_time = self.time_started + datetime.timedelta(seconds=elapsed)
+                expected = original_profile_temp(profile, self.time_started, current_time, temp_format)
+                with self.subTest(temp_format=temp_format, elapsed=elapsed):
+                    self.assertEqual(compiled.temp_at(elapsed), expected)
+                    with mock.patch.object(timezone, 'now', return_value=current_time):
+                        self.assertEqual(profile.profile_temp(self.time_started, temp_format), expected)
+
+    def test_ramps_and_holds(self):
+        self.assertMatchesOriginal(self.create_profile([
+            (0, "18.00", 'C'), (48, "18.00", 'C'), (72, "21.50", 'C'), (96, "21.50", 'C'), (100, "2.00", 'C'),
+        ]))
+
+    def test_first_point_after_the_start(self):
+        self.assertMatchesOriginal(self.create_profile([(12, "64.00", 'F'), (36, "68.00", 'F'), (37, "68.00", 'F')]))
+
+    def test_mixed_temp_formats(self):
+        # Holds are detected after conversion, so 64.4F followed by 18C is a hold in both formats
+        self.assertMatchesOriginal(self.create_profile([
+            (0, "64.40", 'F'), (24, "18.00", 'C'), (30, "66.13", 'F'), (31.5, "19.07", 'C'), (200, "35.00", 'F'),
+        ]))
+
+    def test_single_point(self):
+        self.assertMatchesOriginal(self.create_profile([(5, "20.00", 'C')]))
+
+    def test_uneven_ramps(self):
+        points, temp = [], Decimal("17.3")
+        for i in range(1, 12):
+            temp += Decimal("0.37") * (i % 3 - 1)
+            points.append((i * 7.3, str(temp), 'C' if i % 2 else 'F'))
+        self.assertMatchesOriginal(self.create_profile(points))
+
+    def test_past_end(self):
+        profile = self.create_profile([(0, "18.00", 'C'), (48, "20.00", 'C')])
+        compiled = profile_cache.get(profile, 'C')
+        self.assertFalse(compiled.past_end(48 * 3600 - 1))
+        self.assertTrue(compiled.past_end(48 * 3600))
+        self.assertIsNone(profile_cache.CompiledProfile([], 'C').past_end(0))
+
+    def test_cache_is_invalidated_when_a_point_changes(self):
+        profile = self.create_profile([(0, "18.00", 'C'), (48, "20.00", 'C')])
+        self.assertEqual(profile_cache.get(profile, 'C').temp_at(48 * 3600), 20.0)
+        point = profile.fermentationprofilepoint_set.get(ttl=datetime.timedelta(hours=48))
+        point.temperature_setting = Decimal("22.00")
+        point.save()
+        self.assertEqual(profile_cache.get(profile, 'C').temp_at(48 * 3600), 22.0)
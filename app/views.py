@@ -6,6 +6,7 @@ from django.shortcuts import redirect
 from django.contrib import auth
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse, HttpResponse, FileResponse
+from django.urls import reverse
 from django.utils import timezone
 from django.core.exceptions import ObjectDoesNotExist
 
@@ -14,7 +15,7 @@ from .decorators import site_is_configured, login_if_required_for_dashboard
 
 
 from . import device_forms, profile_forms, beer_forms, setup_forms
-from . import setup_views, mdnsLocator, almost_json, git_integration, connection_debug, udev_integration
+from . import setup_views, mdnsLocator, almost_json, git_integration, connection_debug, udev_integration, log_archive
 
 import datetime, os, random, subprocess
 
@@ -375,7 +376,8 @@ def device_dashboard(request, device_id, beer_id=None):
         # TODO - Determine if we want to load some fake "example" data (similar to what brewpi-www does)
         beer_file_url = "/data/fake.csv"
     else:
-        beer_file_url = beer_obj.data_file_url('base_csv')
+        # The graph data is rolled up to fit the width of the graph (the width gets appended in the template)
+        beer_file_url = reverse('beer_graph_csv', kwargs={'beer_id': beer_obj.id})
 
     # if beer_obj is None:
     #     column_headers = {}
@@ -970,8 +972,8 @@ def almost_json_view(request, device_id, beer_id):
 
     filename = settings.ROOT_DIR / settings.DATA_ROOT / beer_obj.full_filename("annotation_json")
 
-    if os.path.isfile(filename):  # If there are no annotations, return an empty JsonResponse
-        f = open(filename, 'r')
+    if log_archive.exists(filename):  # If there are no annotations, return an empty JsonResponse
+        f = log_archive.open_log_file(filename, 'r')  # Transparently decompresses the file if the log was archived
         wrapper = almost_json.AlmostJsonWrapper(f, closing_string=json_close)
         response = FileResponse(wrapper, content_type="application/json")
         # response['Content-Length'] = os.path.getsize(filename) + len(json_close)
@@ -21,6 +21,7 @@ from django.dispatch import receiver
 from pathlib import Path
 
 from app.models import Beer
+from app import log_archive, log_writer
 from backups import backup_funcs, restore_funcs
 from gravity.models import GravityLog
 
@@ -111,10 +112,18 @@ class Backup(TimeStampedModel):
 
         # Loop through each of the three log types for each of the beer objects, and add the CSV file to the tarfile
         for obj in t_cls.objects.all():
+            log_writer.registry.flush(obj.log_key())  # Make sure anything buffered for this log makes it into the backup
             for log_type in log_types:
                 csv_path = file_name_base / obj.full_filename(log_type)
+                arcname = f"{arc_prefix}{obj.uuid}_{log_type}.csv"
                 if os.path.isfile(csv_path):
-                    f.add(csv_path, arcname=f"{arc_prefix}{obj.uuid}_{log_type}.csv")
+                    f.add(csv_path, arcname=arcname)
+                elif log_archive.is_archived(csv_path):
+                    # Archived logs are stored uncompressed within the backup so that older versions can restore them
+                    tar_info = f.gettarinfo(log_archive.archive_path(csv_path), arcname=arcname)
+                    tar_info.size = log_archive.size(csv_path)
+                    with log_archive.open_log_file(csv_path, 'rb') as log_f:
+                        f.addfile(tar_info, log_f)
 
 
     @property
@@ -152,13 +161,22 @@ class Backup(TimeStampedModel):
         backup_root = settings.BACKUP_STAGING_DIR / "data"
         for cls in [Beer, GravityLog]:
             for obj in cls.objects.all():
+                log_writer.release_log(obj.log_key())  # Don't keep appending to the files we're about to replace
+                for derived_file in log_writer.DERIVED_FILES:
+                    # The binary log & rollups are rebuilt from the restored CSV the next time they're needed
+                    try:
+                        os.remove(obj.log_file_paths()[derived_file])
+                    except OSError:
+                        pass
                 for log_type in ['base_csv', 'full_csv', 'annotation_json']:
                     if Backup.is_legacy():
                         csv_path = backup_root / obj.full_filename(log_type)
                     else:
                         csv_path = backup_root / f"{obj.uuid}_{log_type}.csv"
                     if os.path.isfile(csv_path):
-                        shutil.copy(csv_path, settings.ROOT_DIR / settings.DATA_ROOT / obj.full_filename(log_type))
+                        restored_path = settings.ROOT_DIR / settings.DATA_ROOT / obj.full_filename(log_type)
+                        shutil.copy(csv_path, restored_path)
+                        log_archive.remove_archive(restored_path)  # Otherwise the stale archive would be restored later
 
     def load_database_from_file(self):
         data_dump_file = settings.BACKUP_STAGING_DIR / settings.BACKUP_DATA_DUMP_FILE_NAME
@@ -15,8 +15,10 @@ import datetime
 # You should have received a copy of the GNU General Public License
 # along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import concurrent.futures
+import contextvars
 import os
-import socket
 import sys
 import time
 import traceback
@@ -34,7 +36,9 @@ from scriptlibs import BrewPiUtil
 from scriptlibs import brewpiVersion
 from scriptlibs import pinList
 from scriptlibs import expandLogMessage
+from scriptlibs import messageFraming
 from scriptlibs.backgroundserial import BackGroundSerial
+from scriptlibs.runtimeMetrics import LatencyStats
 
 import sentry_sdk
 sentry_sdk.init(
@@ -56,8 +60,8 @@ compatibleHwVersion = legacyHwVersion  # Minimum supported version is 'legacy'
 hwMode = ""  # Unused for now - either set to 'legacy' or 'modern'
 
 
-def start_new_brew(config_obj, new_name, run):
-    refresh_and_check(config_obj, run)  # Reload dbConfig from the database
+def start_new_brew(config_obj, new_name):
+    refresh_and_check(config_obj)  # Reload dbConfig from the database
 
     if config_obj.logging_status == config_obj.DATA_LOGGING_ACTIVE:
         logMessage(f"Notification: Started logging for beer '{urllib.unquote(new_name)}'.")
@@ -67,8 +71,8 @@ def start_new_brew(config_obj, new_name, run):
         return {'status': 1, 'statusMessage': "Logging not started on dbConfig object"}
 
 
-def stop_logging(config_obj, run):
-    refresh_and_check(config_obj, run)  # Reload dbConfig from the database
+def stop_logging(config_obj):
+    refresh_and_check(config_obj)  # Reload dbConfig from the database
 
     if config_obj.logging_status == config_obj.DATA_LOGGING_STOPPED:
         logMessage("Data logging stopped")
@@ -78,8 +82,8 @@ def stop_logging(config_obj, run):
         return {'status': 1, 'statusMessage': "Logging not stopped on dbConfig object"}
 
 
-def pause_logging(config_obj, run):
-    refresh_and_check(config_obj, run)  # Reload dbConfig from the database
+def pause_logging(config_obj):
+    refresh_and_check(config_obj)  # Reload dbConfig from the database
 
     if config_obj.logging_status == config_obj.DATA_LOGGING_PAUSED:
         logMessage("Data logging paused")
@@ -89,8 +93,8 @@ def pause_logging(config_obj, run):
         return {'status': 1, 'statusMessage': "Logging not paused on dbConfig object"}
 
 
-def resume_logging(config_obj, run):
-    refresh_and_check(config_obj, run)  # Reload dbConfig from the database
+def resume_logging(config_obj):
+    refresh_and_check(config_obj)  # Reload dbConfig from the database
 
     if config_obj.logging_status == config_obj.DATA_LOGGING_ACTIVE:
         logMessage(f"Notification: Successfully continued logging.")
@@ -100,652 +104,923 @@ def resume_logging(config_obj, run):
         return {'status': 1, 'statusMessage': "Logging not resumed on dbConfig object"}
 
 
-def refresh_and_check(config_obj, run):
-    if not config_obj.refresh():
-        run = 0
+def refresh_and_check(config_obj):
+    # TODO - refresh() returning False (connection settings changed) was meant to restart the script, but has never
+    #  actually done so. Keep it that way until load_from_fermentrack reliably returns True on success.
+    config_obj.refresh()
 
-def BrewPiScript(config_obj):
-    lcd_text = ['Script starting up', ' ', ' ', ' ']
-    run = 1
 
-    cs = dict(mode='b', beerSet=20.0, fridgeSet=20.0)  # Control Settings
-    cc = dict()  # Control Constants
-    es = dict()  # Extended Settings
-    cv = "{}"  # Control variables (json string, sent directly to browser without decoding)
+def rename_temp_key(temp_key):
+    rename = {
+        "Log1Temp": "RoomTemp",  # Allows a configured OEM BrewPi to log room temp with Log1Temp
+        "bt": "BeerTemp",
+        "bs": "BeerSet",
+        "ba": "BeerAnn",
+        "ft": "FridgeTemp",
+        "fs": "FridgeSet",
+        "fa": "FridgeAnn",
+        "rt": "RoomTemp",
+        "s": "State",
+        "t": "Time"}
+    return rename.get(temp_key, temp_key)
 
-    # listState = "", "d", "h", "dh" to reflect whether the list is up to date for installed (d) and available (h)
-    device_list = dict(listState="", installed=[], available=[])
-    
-    if config_obj.status != BrewPiScriptConfig.STATUS_ACTIVE and \
-            config_obj.status != BrewPiScriptConfig.STATUS_UNMANAGED:
-        logMessage("This instance of BrewPi is currently disabled in the web interface. Reenable it and relaunch "
-                   "this script. This instance will now exit.")
-        time.sleep(1)
-        exit(0)
 
-    if config_obj.stdout_path:
-        sys.stdout = open(config_obj.stdout_path, 'w')  # overwrite stdout file on script start
-    if config_obj.stderr_path:
-        sys.stderr = open(config_obj.stderr_path, 'a')  # append to stderr file
+class ScriptExit(Exception):
+    """Raised to stop a BrewPiEngine. code is the exit code the process should use (0 for a requested stop)."""
+    def __init__(self, code, reason=None):
+        super().__init__(reason)
+        self.code = code
+        self.reason = reason
 
-    # bytes are read from nonblocking serial into this buffer and processed when the buffer contains a full line.
-    ser = BrewPiUtil.setupSerial(dbConfig=config_obj, time_out=0)
-    
-    if not ser:
-        exit(1)
-    
-    if config_obj.active_beer_name:
-        logMessage(f"Notification: Script started for beer '{config_obj.active_beer_name}'")
-    else:
-        logMessage("Notification: Script started, with no active beer being logged")
-    
-    # wait for 10 seconds to allow an Uno to reboot (in case an Uno is being used)
-    time.sleep(10)
-    
-    logMessage("Checking software version on controller... ")
-    hw_version = brewpiVersion.getVersionFromSerial(ser)
-    hw_mode = "legacy"
-    if hw_version is None:
-        logMessage("Error: Cannot receive version number from controller. Your controller is either not programmed or "
-                   "not responding.")
-        lcd_text = ['Could not receive', 'version from controller', 'Please (re)program', 'your controller']
-        exit(1)
-    else:
-        logMessage("Found " + hw_version.toExtendedString() + " on port " + ser.name + "\n")
+
+class BrewPiEngine:
+    """
+    Runs BrewPi-Script for a single controller as a set of asyncio tasks: one dispatches lines from the controller as
+    they arrive, the socket server answers the web interface as soon as a message comes in, and separate timers keep
+    the LCD, settings, temperatures and profile up to date. Anything that would block the event loop (database access
+    through config_obj, connecting to the controller) runs in an executor.
+    """
+
+    LCD_INTERVAL = 5  # seconds between LCD requests (legacy controllers only)
+    SETTINGS_CHECK_INTERVAL = 5
+    SETTINGS_INTERVAL = 60  # Request settings if the controller hasn't sent any in this long
+    TEMPERATURE_CHECK_INTERVAL = 0.5
+    TEMPERATURE_REQUEST_INTERVAL = 5  # Minimum seconds between requests for new temperatures
+    PROFILE_CHECK_INTERVAL = 1
+    PROFILE_INTERVAL = 5  # Profiles are compiled and cached (see app/profile_cache.py) so checking them is cheap
+    DEVICE_LIST_TIMEOUT = 5  # seconds to wait for the controller to send an updated device list
+    MAX_ERROR_COUNT = 5
+    STARTUP_TIMEOUT = 30  # Time allowed for the controller to (re)boot and report its version
+    LOOP_MONITOR_INTERVAL = 0.5  # How often the event loop is checked for falling behind
+    MAX_MESSAGE_TYPES = 100  # Message types timed separately - anything past this is counted as "other"
+
+    def __init__(self, config_obj, on_started=None):
+        """on_started, if given, is called once connecting to the controller has finished - successfully or not"""
+        self.config_obj = config_obj
+        self.on_started = on_started
+
+        self.lcd_text = ['Script starting up', ' ', ' ', ' ']
+        self.cs = dict(mode='b', beerSet=20.0, fridgeSet=20.0)  # Control Settings
+        self.cc = dict()  # Control Constants
+        self.es = dict()  # Extended Settings
+        self.cv = "{}"  # Control variables (json string, sent directly to browser without decoding)
+
+        # listState = "", "d", "h", "dh" to reflect whether the list is up to date for installed (d) and available (h)
+        self.device_list = dict(listState="", installed=[], available=[])
+        self.device_list_ready = None  # Future resolved when both halves of a requested device list have arrived
+
+        self.prev_temp_json = {
+            "BeerTemp": 0,
+            "FridgeTemp": 0,
+            "BeerAnn": None,
+            "FridgeAnn": None,
+            "RoomTemp": None,
+            "State": None,
+            "BeerSet": 0,
+            "FridgeSet": 0}
+
+        self.prev_data_time = 0.0  # keep track of time between new data requests
+        self.prev_time_out_req = self.prev_data_time  # Using this to fix the prevDataTime tracking
+        self.prev_settings_update = time.time()
+        self.output_temperature = True
+        self.last_temperature_time = None  # When the controller last sent temperatures (a "T:" line)
+
+        # Runtime metrics (see metrics())
+        self.started_time = time.time()
+        self.loop_lag = LatencyStats()  # How late the loop monitor woke up each time - i.e. how far the loop is behind
+        self.message_latency = {}  # message_type -> LatencyStats for handling messages from the web interface
+
+        self.ser = None
+        self.bg_ser = None
+        self.hw_version = None
+        self.hw_mode = "legacy"
+        self.server = None
+        self.connections = set()  # Writers for the long-lived (framed) connections from Fermentrack
+        self.loop = None
+        self.serial_event = None
+        self.stopped = None
+        # Database access through config_obj isn't thread-safe, so it is serialized on a single worker thread
+        self.db_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    # Helpers
+    async def run_blocking(self, executor, func, *args):
+        """
+        Runs a blocking call in an executor, in the current context (so that anything it logs goes to this controller's
+        log). Parts of scriptlibs still call exit() on errors - that is turned into a ScriptExit so that it only stops
+        this engine, rather than the whole process.
+        """
+        def call():
+            try:
+                return func(*args)
+            except SystemExit as e:
+                raise ScriptExit(e.code if isinstance(e.code, int) else 1)
+
+        return await self.loop.run_in_executor(executor, contextvars.copy_context().run, call)
+
+    async def db(self, func, *args):
+        """Runs a (blocking) call that uses config_obj - typically a database query - without blocking the loop"""
+        return await self.run_blocking(self.db_executor, func, *args)
+
+    def stop(self, code=0, reason=None):
+        """Stops the engine. The first reason given is the one that is reported."""
+        if reason:
+            logMessage(reason)
+        if not self.stopped.done():
+            self.stopped.set_result(code)
+
+    def writeln(self, data):
+        if self.bg_ser.fatal_error is not None:
+            self.stop(1, self.bg_ser.fatal_error)
+            return
+        try:
+            self.bg_ser.writeln(data)
+        except SystemExit:
+            self.stop(1, self.bg_ser.fatal_error)  # bg_ser lost the port while we were writing
+
+    # Startup
+    def connect(self):
+        """Connects to the controller & checks its version. Blocking - run in an executor."""
+        config_obj = self.config_obj
+        start_time = time.time()
+
+        if config_obj.status != BrewPiScriptConfig.STATUS_ACTIVE and \
+                config_obj.status != BrewPiScriptConfig.STATUS_UNMANAGED:
+            raise ScriptExit(0, "This instance of BrewPi is currently disabled in the web interface. Reenable it and "
+                                "relaunch this script. This instance will now exit.")
+
+        # bytes are read from nonblocking serial into this buffer and processed when the buffer contains a full line.
+        self.ser = BrewPiUtil.setupSerial(dbConfig=config_obj, time_out=0)
+        if not self.ser:
+            raise ScriptExit(1)
+
+        if config_obj.active_beer_name:
+            logMessage(f"Notification: Script started for beer '{config_obj.active_beer_name}'")
+        else:
+            logMessage("Notification: Script started, with no active beer being logged")
+
+        # Rather than waiting a fixed time for an Uno to reboot (in case an Uno is being used), keep asking for the
+        # version until the controller answers
+        connected_time = time.time()
+        logMessage("Checking software version on controller... ")
+        hw_version = brewpiVersion.getVersionFromSerial(self.ser, timeout=self.STARTUP_TIMEOUT)
+        if hw_version is None:
+            self.lcd_text = ['Could not receive', 'version from controller', 'Please (re)program', 'your controller']
+            raise ScriptExit(1, "Error: Cannot receive version number from controller. Your controller is either not "
+                                "programmed or not responding.")
+
+        logMessage("Found " + hw_version.toExtendedString() + " on port " + self.ser.name + "\n")
+        ready_time = time.time()
+        logMessage(f"Controller ready after {ready_time - start_time:.1f}s (connecting took "
+                   f"{connected_time - start_time:.1f}s, waiting for its version took "
+                   f"{ready_time - connected_time:.1f}s)")
         if LooseVersion(hw_version.toString()) < LooseVersion(compatibleHwVersion):
             # Completely incompatible. Unlikely to ever be triggered, as it requires pre-legacy code.
-            logMessage(f"Warning: minimum BrewPi version compatible with this script is {compatibleHwVersion} but "
-                       f"version number received is {hw_version.toString()}. Exiting.")
-            exit(1)
+            raise ScriptExit(1, f"Warning: minimum BrewPi version compatible with this script is "
+                                f"{compatibleHwVersion} but version number received is {hw_version.toString()}. "
+                                f"Exiting.")
         elif LooseVersion(hw_version.toString()) < LooseVersion(legacyHwVersion):
             # Compatible, but only with pre-legacy (!) code. This should never happen as legacy support is the "oldest"
             # codebase we provide for.
             # This will generally never happen given that we are setting compatible = legacy above
-            logMessage(f"Warning: minimum BrewPi version compatible with this script for legacy support is "
-                       f"{legacyHwVersion} but version number received is {hw_version.toString()}. Exiting.")
-            exit(1)
+            raise ScriptExit(1, f"Warning: minimum BrewPi version compatible with this script for legacy support is "
+                                f"{legacyHwVersion} but version number received is {hw_version.toString()}. Exiting.")
         elif LooseVersion(hw_version.toString()) >= LooseVersion(developHwVersion):
-            hw_mode = "modern"
+            self.hw_mode = "modern"
 
         logMessage(f"BrewPi version received was {hw_version.toString()} which this script supports in "
-                   f"'{hw_mode}' branch mode.")
-
-    if int(hw_version.log) != int(expandLogMessage.getVersion()):
-        logMessage("Warning: version number of local copy of logMessages.h " +
-                   "does not match log version number received from controller." +
-                   "controller version = " + str(hw_version.log) +
-                   ", local copy version = " + str(expandLogMessage.getVersion()) +
-                   ". This is generally a non-issue, as thus far log messages have only been added - not changed.")
-    
-    bg_ser = None
-    
-    if ser is not None:
-        ser.flush()
-    
-        # set up background serial processing, which will continuously read data from serial and put whole lines in a 
-        # queue
-        bg_ser = BackGroundSerial(ser)
-        bg_ser.start()
+                   f"'{self.hw_mode}' branch mode.")
+
+        if int(hw_version.log) != int(expandLogMessage.getVersion()):
+            logMessage("Warning: version number of local copy of logMessages.h " +
+                       "does not match log version number received from controller." +
+                       "controller version = " + str(hw_version.log) +
+                       ", local copy version = " + str(expandLogMessage.getVersion()) +
+                       ". This is generally a non-issue, as thus far log messages have only been added - not changed.")
+        self.hw_version = hw_version
+
+    def start_serial(self):
+        self.ser.flush()
+
+        # set up background serial processing, which will continuously read data from serial and put whole lines in a
+        # queue. The serial task is woken up whenever something is queued.
+        self.bg_ser = BackGroundSerial(self.ser)
+        self.bg_ser.on_receive = lambda: self.loop.call_soon_threadsafe(self.serial_event.set)
+        self.bg_ser.start()
         # request settings from controller, processed later when reply is received
-        bg_ser.writeln('s')  # request control settings cs
-        bg_ser.writeln('c')  # request control constants cc
-        bg_ser.writeln('v')  # request control variables cv
-        bg_ser.writeln('x')  # request control constants es
+        self.writeln('s')  # request control settings cs
+        self.writeln('c')  # request control constants cc
+        self.writeln('v')  # request control variables cv
+        self.writeln('x')  # request control constants es
 
         # refresh the device list
-        bg_ser.writeln("d{r:1}")  # request installed devices
-        bg_ser.writeln("h{u:-1,v:1}")  # request available, but not installed devices
-    
+        self.request_device_list(True)
+
         # answer from controller is received asynchronously later.
-    
-    # create a listening socket to communicate with the web interface (socket for systems that support it, otherwise
-    # an inetsocket (e.g. for windows))
-    if sys.platform.startswith('win'):
-        use_inet_socket = True
-    else:
-        use_inet_socket = config_obj.use_inet_socket
-    
-    if use_inet_socket:
-        if config_obj.socket_host is None or config_obj.socket_port is None:
-            logMessage('use_inet_socket is true, but socket_host or socket_port not set. Exiting.')
-            exit(1)
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        socket_port = config_obj.socket_port
-        socket_host = config_obj.socket_host
-        s.bind((socket_host, int(socket_port)))
-        logMessage('Bound to TCP socket on port {}, interface {} '.format(int(socket_port), socket_host))
-    else:
-        if config_obj.socket_name is None:
-            logMessage('use_inet_socket is false, but socket_name is not set. Exiting')
-            exit(1)
-        socket_file = BrewPiUtil.addSlash(BrewPiUtil.scriptPath()) + config_obj.socket_name
-        if os.path.exists(socket_file):
-            # if socket already exists, remove it
-            os.remove(socket_file)
-        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind(socket_file)  # Bind BEERSOCKET
-        # set all permissions for socket
-        os.chmod(socket_file, 0o0777)
-    
-    serial_check_interval = 0.5
-    s.setblocking(True)  # set socket functions to be blocking
-    s.listen(10)  # Create a backlog queue for up to 10 connections
-    # blocking socket functions wait 'serialCheckInterval' seconds
-    s.settimeout(serial_check_interval)
-    
-    prev_data_time = 0.0  # keep track of time between new data requests
-    prev_time_out_req = prev_data_time  # Using this to fix the prevDataTime tracking
-    prev_time_out = time.time()
-    prev_lcd_update = time.time()
-    prev_settings_update = time.time()
-    
-
-    output_temperature = True
-    
-    prev_temp_json = {
-        "BeerTemp": 0,
-        "FridgeTemp": 0,
-        "BeerAnn": None,
-        "FridgeAnn": None,
-        "RoomTemp": None,
-        "State": None,
-        "BeerSet": 0,
-        "FridgeSet": 0}
-
-    def rename_temp_key(temp_key):
-        rename = {
-            "Log1Temp": "RoomTemp",  # Allows a configured OEM BrewPi to log room temp with Log1Temp
-            "bt": "BeerTemp",
-            "bs": "BeerSet",
-            "ba": "BeerAnn",
-            "ft": "FridgeTemp",
-            "fs": "FridgeSet",
-            "fa": "FridgeAnn",
-            "rt": "RoomTemp",
-            "s": "State",
-            "t": "Time"}
-        return rename.get(temp_key, temp_key)
 
-    # At startup force synchronization of temperature format
-    def sync_temp_format(control_constants):
-        db_temp_format = config_obj.temp_format
-    
-        if control_constants['tempFormat'] != db_temp_format:
-            # j{"tempFormat": "C"}
-            settings_dict = {'tempFormat': config_obj.temp_format}
-            bg_ser.writeln("j" + json.dumps(settings_dict))
-            # TODO - Set min/max temp if necessary
-    
-    def trigger_refresh(read_values=False):
-        # We want to keep the deviceList cache updated. Invalidate the cache, send a request to update the list to
-        # the controller, then give it a few seconds to respond before raising socket.timeout & processing the
-        # result.
-    
-        device_list['listState'] = ""  # invalidate local copy
-        if read_values:
-            bg_ser.writeln("d{r:1}")  # request installed devices
-            bg_ser.writeln("h{u:-1,v:1}")  # request available, but not installed devices
+    async def start_server(self):
+        # create a listening socket to communicate with the web interface (socket for systems that support it,
+        # otherwise an inetsocket (e.g. for windows))
+        config_obj = self.config_obj
+        if sys.platform.startswith('win'):
+            use_inet_socket = True
         else:
-            bg_ser.writeln("d{}")  # request installed devices
-            bg_ser.writeln("h{u:-1}")  # request available, but not installed devices
-        # Now, force a refresh of the device list (to keep it updated)
-        time.sleep(2.5)  # We'll give the controller 5 seconds to respond
-        raise socket.timeout
-
-    while run:
-        # Wait for incoming socket connections.
-        # When nothing is received, socket.timeout will be raised after
-        # serialCheckInterval seconds. Serial receive will be done then.
-        # When messages are expected on serial, the timeout is raised 'manually'
-        if config_obj.error_count > 5:
-            exit(1)
+            use_inet_socket = config_obj.use_inet_socket
+
+        if use_inet_socket:
+            if config_obj.socket_host is None or config_obj.socket_port is None:
+                raise ScriptExit(1, 'use_inet_socket is true, but socket_host or socket_port not set. Exiting.')
+            self.server = await asyncio.start_server(self.handle_connection, config_obj.socket_host,
+                                                     int(config_obj.socket_port), reuse_address=True, backlog=10)
+            logMessage('Bound to TCP socket on port {}, interface {} '.format(int(config_obj.socket_port),
+                                                                              config_obj.socket_host))
+        else:
+            if config_obj.socket_name is None:
+                raise ScriptExit(1, 'use_inet_socket is false, but socket_name is not set. Exiting')
+            socket_file = BrewPiUtil.addSlash(BrewPiUtil.scriptPath()) + config_obj.socket_name
+            if os.path.exists(socket_file):
+                # if socket already exists, remove it
+                os.remove(socket_file)
+            self.server = await asyncio.start_unix_server(self.handle_connection, socket_file, backlog=10)
+            # set all permissions for socket
+            os.chmod(socket_file, 0o0777)
+
+    async def run(self) -> int:
+        """Runs until the script is stopped, returning the exit code"""
+        self.loop = asyncio.get_running_loop()
+        self.serial_event = asyncio.Event()
+        self.stopped = self.loop.create_future()
+        tasks = []
         try:
-            conn, addr = s.accept()
-            conn.setblocking(True)
-            # blocking receive, times out in serialCheckInterval
-            message = conn.recv(4096)
-            message = message.decode(encoding="cp437")
-            if "=" in message:
-                message_type, value = message.split("=", 1)
-            else:
-                message_type = message
-                value = ""
-            if message_type == "ack":  # acknowledge request
-                conn.send(b'ack')
-            elif message_type == "lcd":  # lcd contents requested
-                if hw_mode == "modern":
-                    # TODO - Emulate lcdText for modern controllers
-                    pass
-                conn.send(json.dumps(lcd_text).encode(encoding="cp437"))
-            elif message_type == "getMode":  # echo cs['mode'] setting
-                conn.send(cs['mode'].encode(encoding="cp437"))
-            elif message_type == "getFridge":  # echo fridge temperature setting
-                conn.send(json.dumps(cs['fridgeSet']).encode(encoding="cp437"))
-            elif message_type == "getBeer":  # echo fridge temperature setting
-                conn.send(json.dumps(cs['beerSet']).encode(encoding="cp437"))
-            elif message_type == "getControlConstants":
-                conn.send(json.dumps(cc).encode(encoding="cp437"))
-            elif message_type == "getExtendedSettings":
-                conn.send(json.dumps(es).encode(encoding="cp437"))
-            elif message_type == "getControlSettings":
-                # TODO - See where/if we call getControlSettings (and fix the cs['profile'] response below)
-                # if cs['mode'] == "p":
-                #     profileFile = BrewPiUtil.addSlash(BrewPiUtil.scriptPath()) + 'settings/tempProfile.csv'
-                #     with file(profileFile, 'r') as prof:
-                #         cs['profile'] = prof.readline().split(",")[-1].rstrip("\n")
-                cs['dataLogging'] = config_obj.logging_status
-                conn.send(json.dumps(cs).encode(encoding="cp437"))
-            elif message_type == "getControlVariables":
-                conn.send(cv.encode(encoding="cp437"))
-            elif message_type == "refreshControlConstants":
-                bg_ser.writeln("c")
-                raise socket.timeout
-            elif message_type == "refreshControlSettings":
-                bg_ser.writeln("s")
-                raise socket.timeout
-            elif message_type == "refreshControlVariables":
-                bg_ser.writeln("v")
-                raise socket.timeout
-            elif message_type == "refreshExtendedSettings":
-                bg_ser.writeln("x")
-                raise socket.timeout
-            elif message_type == "loadDefaultControlSettings":
-                bg_ser.writeln("S")
-                raise socket.timeout
-            elif message_type == "loadDefaultControlConstants":
-                bg_ser.writeln("C")
-                raise socket.timeout
-            elif message_type == "setBeer":  # new constant beer temperature received
-                try:
-                    new_temp = float(value)
-                    cs['beerSet'] = round(new_temp, 2)
-                except ValueError:
-                    logMessage("Cannot convert temperature '" + value + "' to float")
-                    continue
-    
-                cs['mode'] = 'b'
-                # round to 2 dec, python will otherwise produce 6.999999999
-                bg_ser.writeln("j{{mode:\"b\", beerSet:{}}}".format(cs['beerSet']))
-                refresh_and_check(config_obj, run)  # Reload dbConfig from the database (in case we were using profiles)
-                logMessage("Notification: Beer temperature set to {} degrees in web interface".format(cs['beerSet']))
-                raise socket.timeout  # go to serial communication to update controller
-    
-            elif message_type == "setFridge":  # new constant fridge temperature received
-                try:
-                    new_temp = float(value)
-                except ValueError:
-                    logMessage("Cannot convert temperature '" + value + "' to float")
-                    continue
-    
-                cs['mode'] = 'f'
-                cs['fridgeSet'] = round(new_temp, 2)
-                cmd = f'"j{{mode:"f", fridgeSet:{json.dumps(cs["fridgeSet"])}}}"'
-                bg_ser.writeln(cmd)
-                # Reload dbConfig from the database (in case we were using profiles)
-                refresh_and_check(config_obj, run)  # Reload dbConfig from the database
-                logMessage(f"Notification: Sending command {cmd} to set fridge temperature to {str(cs['fridgeSet'])} "
-                           f"degrees from web interface")
-                raise socket.timeout  # go to serial communication to update controller
-    
-            elif message_type == "setOff":  # cs['mode'] set to OFF
-                cs['mode'] = 'o'
-                bg_ser.writeln("j{mode:\"o\"}")
-                refresh_and_check(config_obj, run)  # Reload dbConfig from the database (in case we were using profiles)
-                logMessage("Notification: Temperature control disabled")
-                raise socket.timeout
-            elif message_type == "setParameters":
-                # receive JSON key:value pairs to set parameters on the controller
-                try:
-                    decoded = json.loads(value)
-                    bg_ser.writeln("j" + json.dumps(decoded))
-                    if 'tempFormat' in decoded:
-                        refresh_and_check(config_obj, run)  # Reload dbConfig from the database
-                except ValueError:
-                    logMessage("Error: invalid JSON parameter string received: " + value)
-                raise socket.timeout
-            elif message_type == "setExtendedSettings":
-                # receive JSON key:value pairs to set extended settings on the controller
-                try:
-                    decoded = json.loads(value)
-                    bg_ser.writeln("X" + json.dumps(decoded))
-                except ValueError:
-                    logMessage("Error: invalid JSON parameter string received: " + value)
-                raise socket.timeout
-            elif message_type == "stopScript":  # exit instruction received. Stop script.
-                # voluntary shutdown.
-                log_message = "stopScript message received on socket. "
-                run = 0
-                log_message += "dbConfig in use - assuming device status was already properly updated "
-                log_message += "to prevent automatic restart"
-                logMessage(log_message)
-                continue
-            elif message_type == "quit":  # quit instruction received. Probably sent by another brewpi script instance
-                logMessage("quit message received on socket. Stopping script.")
-                run = 0
-                # Leave dontrunfile alone.
-                # This instruction is meant to restart the script or replace it with another instance.
-                continue
-            elif message_type == "eraseLogs":
-                logMessage('eraseLogs is not implemented for this version of brewpi-script')
-            elif message_type == "interval":  # new interval received
-                refresh_and_check(config_obj, run)  # Reload dbConfig from the database
-                # newInterval = int(value)
-                new_interval = int(config_obj.data_point_log_interval)
-                logMessage("Notification: Interval changed to " + str(new_interval) + " seconds")
-            elif message_type == "startNewBrew":  # new beer name
-                new_name = value
-                result = start_new_brew(config_obj, new_name, run)
-                conn.send(json.dumps(result).encode(encoding="cp437"))
-            elif message_type == "pauseLogging":
-                result = pause_logging(config_obj, run)
-                conn.send(json.dumps(result).encode(encoding="cp437"))
-            elif message_type == "stopLogging":
-                result = stop_logging(config_obj, run)
-                conn.send(json.dumps(result).encode(encoding="cp437"))
-            elif message_type == "resumeLogging":
-                result = resume_logging(config_obj, run)
-                conn.send(json.dumps(result).encode(encoding="cp437"))
-            elif message_type == "dateTimeFormatDisplay":
-                logMessage('dateTimeFormatDisplay is not implemetned for this version of brewpi-script')
-            elif message_type == "setActiveProfile":
-                # We're using a dbConfig object to manage everything. We aren't being passed anything by Fermentrack
-                logMessage("Setting controller to beer profile mode using database-configured profile")
-                conn.send(b"Profile successfully updated")
-                refresh_and_check(config_obj, run)  # Reload dbConfig from the database
-                if cs['mode'] != 'p':
-                    cs['mode'] = 'p'
-                    bg_ser.writeln("j{mode:\"p\"}")
-                    logMessage("Notification: Profile mode enabled")
-                    raise socket.timeout  # go to serial communication to update controller
-    
-            elif message_type == "programController" or message_type == "programArduino":
-                logMessage("programController action is not supported by this modified version of brewpi-script")
-            elif message_type == "refreshDeviceList":
-                # if value.find("readValues") != -1:
-                trigger_refresh(True)
-                # else:
-                #     trigger_refresh(False)
-            elif message_type == "getDeviceList":
-                if device_list['listState'] in ["dh", "hd"]:
-                    response = dict(board=hw_version.board,
-                                    shield=hw_version.shield,
-                                    deviceList=device_list,
-                                    pinList=pinList.getPinList(hw_version.board, hw_version.shield))
-                    conn.send(json.dumps(response).encode(encoding="cp437"))
-                else:
-                    # It's up to the web interface to track how often it requests an update
-                    conn.send(b"device-list-not-up-to-date")
-                    raise socket.timeout
-            elif message_type == "getDashInfo":
-                # This is a new messageType
-                response = {"BeerTemp": prev_temp_json['BeerTemp'],
-                            "FridgeTemp": prev_temp_json['FridgeTemp'],
-                            "BeerAnn": prev_temp_json['BeerAnn'],
-                            "FridgeAnn": prev_temp_json['FridgeAnn'],
-                            "RoomTemp": prev_temp_json['RoomTemp'],
-                            "State": prev_temp_json['State'],
-                            "BeerSet": prev_temp_json['BeerSet'],
-                            "FridgeSet": prev_temp_json['FridgeSet'],
-                            "LogInterval": float(config_obj.data_point_log_interval),
-                            "Mode": cs['mode']}
-                conn.send(json.dumps(response).encode(encoding="cp437"))
-            elif message_type == "applyDevice":
-                # applyDevice is used to apply settings to an existing device (pin/OneWire assignment, etc.)
-                try:
-                    json.loads(value)  # load as JSON to check syntax
-                except ValueError:
-                    logMessage("Error: invalid JSON parameter string received: " + value)
-                    continue
-                logMessage("Received applyDevice request, updating to: {}".format(value))
-                # bg_ser.writeln("U" + json.dumps(configStringJson))
-                # No need to re-encode to JSON if we received valid JSON in the first place.
-                bg_ser.writeln("U" + value)
-    
-                trigger_refresh(True)
-            elif message_type == "writeDevice":
-                # writeDevice is used to -create- "actuators" -- Specifically, (for now) buttons.
-                try:
-                    config_string_json = json.loads(value)  # load as JSON to check syntax
-                except ValueError:
-                    logMessage("Error: invalid JSON parameter string received: " + value)
-                    continue
-                bg_ser.writeln("d" + json.dumps(config_string_json))
-    
-                # We want to keep the deviceList cache updated. Invalidate the cache, send a request to update the list
-                # to the controller, then give it a few seconds to respond before raising socket.timeout & processing
-                # the result.
-                trigger_refresh(True)
-            elif message_type == "getVersion":
-                if hw_version:
-                    response = hw_version.__dict__
-                    # replace LooseVersion with string, because it is not JSON serializable
-                    response['version'] = hw_version.toString()
-                else:
-                    response = {}
-                response_str = json.dumps(response)
-                conn.send(response_str.encode(encoding="cp437"))
-    
-            elif message_type == "resetController":
-                logMessage("Resetting controller to factory defaults")
-                refresh_and_check(config_obj, run)  # Reload dbConfig from the database
-                bg_ser.writeln("E{\"confirmReset\": true}")
-                # request settings from controller, processed later when reply is received
-                bg_ser.writeln('s')  # request control settings cs
-                bg_ser.writeln('c')  # request control constants cc
-                bg_ser.writeln('v')  # request control variables cv
-                bg_ser.writeln('x')  # request control variables es
-                trigger_refresh(True)  # Refresh the device list cache (will also raise socket.timeout)
-    
-            elif message_type == "restartController":
-                logMessage("Restarting controller")
-                bg_ser.writeln("R")  # This tells the controller to restart
-                time.sleep(3)  # We'll give bg_ser 3 seconds for it to send/kick in
-                sys.exit(0)  # Exit BrewPi-script
-    
-            elif message_type == "resetWiFi":
-                logMessage("Resetting controller WiFi settings")
-                bg_ser.writeln("w")
-                time.sleep(3)  # We'll give bg_ser 3 seconds for it to send/kick in
-                sys.exit(0)  # Exit BrewPi-script
-            else:
-                logMessage("Error: Received invalid message on socket: " + message)
-    
-            if (time.time() - prev_time_out) < serial_check_interval:
-                continue
+            try:
+                await self.run_blocking(None, self.connect)
+            finally:
+                if self.on_started:
+                    self.on_started()
+            self.start_serial()
+            await self.start_server()
+            self.publish_state()
+            self.watch_changes()
+
+            tasks = [asyncio.ensure_future(self.supervise(task)) for task in
+                     [self.serial_task, self.lcd_task, self.settings_task, self.temperature_task, self.profile_task,
+                      self.loop_monitor_task]]
+            return await self.stopped
+        except ScriptExit as e:
+            if e.reason:
+                logMessage(e.reason)
+            return e.code
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.shutdown()
+
+    async def supervise(self, task):
+        """Runs one of the engine's tasks, stopping the engine if it fails"""
+        try:
+            await task()
+        except asyncio.CancelledError:
+            raise
+        except ScriptExit as e:
+            self.stop(e.code, e.reason)
+        except Exception:
+            logMessage("Unexpected error in {}:".format(task.__name__))
+            traceback.print_exc()
+            self.stop(1)
+
+    async def shutdown(self):
+        if self.server:
+            self.server.close()
+            for writer in list(self.connections):
+                writer.close()  # Fermentrack keeps connections open between messages - don't wait on them
+            await self.server.wait_closed()
+
+        if self.bg_ser:
+            self.bg_ser.stop()
+
+        # Finish sending any log points that are still queued
+        await self.db(self.config_obj.stop_sending)
+        await self.db(self.config_obj.stop_publishing)
+        await self.db(self.config_obj.stop_watching)
+        self.db_executor.shutdown(wait=False)
+
+        if self.ser:
+            if self.ser.isOpen():
+                self.ser.close()  # close port
+
+    # Configuration changes
+    def watch_changes(self):
+        def on_change(change):
+            # Called from the listener's thread
+            self.loop.call_soon_threadsafe(asyncio.ensure_future, self.apply_change(change))
+
+        self.config_obj.watch_changes(on_change)
+
+    async def apply_change(self, change):
+        """Applies a change to the configuration, as notified by config_obj.watch_changes"""
+        config_obj = self.config_obj
+        if change is not None and 'profile' in change:
+            config_obj.profile_changed(change['profile'])
+        else:
+            old_interval = config_obj.data_point_log_interval
+            if change is None:
+                await self.db(refresh_and_check, config_obj)  # Anything could have changed
             else:
-                # raise exception to check serial for data immediately
-                raise socket.timeout
-    
-        except socket.timeout:
-            # Do serial communication and update settings every SerialCheckInterval
-            prev_time_out = time.time()
-    
-            if hw_version is None:
-                continue  # do nothing with the serial port when the controller has not been recognized
-    
-            if (time.time() - prev_lcd_update) > 5:
-                # request new LCD text
-                prev_lcd_update += 5  # give the controller some time to respond
-                if hw_mode == "legacy":
-                    # 'l' is only recognized on legacy controllers and results in an error for 'modern' controllers.
-                    # We will need to emulate the LCD text
-                    bg_ser.writeln('l')
-    
-            if (time.time() - prev_settings_update) > 60:
-                # Request Settings from controller to stay up to date
-                # Controller should send updates on changes, this is a periodic update to ensure it is up to date
-                prev_settings_update += 5  # give the controller some time to respond
-                bg_ser.writeln('s')
-    
-            # if no new data has been received for serialRequestInteval seconds
-            if (time.time() - prev_data_time) >= float(config_obj.data_point_log_interval):
-                if (time.time() - prev_time_out_req) > 5:  # It's been more than 5 seconds since we last requested temps
-                    bg_ser.writeln("t")  # request new from controller
-                    prev_time_out_req = time.time()
-                    if prev_data_time == 0.0:  # If prevDataTime hasn't yet been set (it's 0.0 at startup), set it.
-                        prev_data_time = time.time()
-    
-            if (time.time() - prev_data_time) >= 3 * float(config_obj.data_point_log_interval):
-                # something is wrong: controller is not responding to data requests
-                logMessage("Error: controller is not responding to new data requests. Exiting.")
-    
-                # In this case, we can rely on the process manager relaunching this script.
-                # It's better to fail loudly (in this case with an exit) than silently.
-                sys.exit(1)
-    
+                await self.db(config_obj.reload_fields, change['fields'])
+            if config_obj.data_point_log_interval != old_interval:
+                logMessage("Notification: Interval changed to " + str(config_obj.data_point_log_interval) + " seconds")
+        # The active profile (or when it started) may have changed - check it now rather than waiting
+        config_obj.last_profile_temp_check = datetime.datetime.now() - datetime.timedelta(days=1)
+
+    async def reload_config(self):
+        """
+        Reloads config_obj from the database after a message from the web interface, unless config_obj is being
+        notified of changes (in which case anything the web interface changed has already been, or is about to be,
+        reloaded)
+        """
+        if not self.config_obj.changes_live():
+            await self.db(refresh_and_check, self.config_obj)
+
+    # Serial
+    async def serial_task(self):
+        while True:
+            try:
+                # Woken up as soon as bg_ser queues something. The timeout is just a safety net.
+                await asyncio.wait_for(self.serial_event.wait(), self.TEMPERATURE_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.serial_event.clear()
+
+            if self.bg_ser.fatal_error is not None:
+                raise ScriptExit(1, self.bg_ser.fatal_error)
+
             while True:
-                line = bg_ser.read_line()
-                message = bg_ser.read_message()
+                try:
+                    line = self.bg_ser.read_line()
+                    message = self.bg_ser.read_message()
+                except SystemExit:
+                    raise ScriptExit(1, self.bg_ser.fatal_error)
                 if line is None and message is None:
+                    self.publish_state()
                     break
                 if line is not None:
-                    try:
-                        if line[0] == 'T':
-                            # print it to stdout
-                            if output_temperature:
-                                print(time.strftime("%b %d %Y %H:%M:%S  ") + line[2:], flush=True)
-    
-                            # store time of last new data for interval check
-                            prev_data_time = time.time()
-    
-                            # process temperature line
-                            new_data = json.loads(line[2:])
-                            # copy/rename keys
-                            for key in new_data:
-                                prev_temp_json[rename_temp_key(key)] = new_data[key]
-    
-                            new_row = prev_temp_json
-    
-                            # Moved this so that the last read values is updated even if logging is off. Otherwise, the
-                            # getDashInfo will return the default temp values (0)
-                            if config_obj.logging_status == config_obj.DATA_LOGGING_ACTIVE:
-                                # All this is handled by the model
-                                try:
-                                    config_obj.save_beer_log_point(new_row)
-                                except StopIteration:
-                                    config_obj.error_count += 1
-                                    continue
-                                except RuntimeError:
-                                    config_obj.error_count += 1
-                                    continue
-
-                        elif line[0] == 'D':
-                            # debug message received, should already been filtered out, but print anyway here.
-                            logMessage("Finding a log message here should not be possible, report to the devs!")
-                            logMessage("Line received was: {0}".format(line))
-                        elif line[0] == 'L':
-                            # lcd content received
-                            prev_lcd_update = time.time()
-                            lcd_text = json.loads(asciiToUnicode(line[2:]))
-                        elif line[0] == 'C':
-                            # Control constants received
-                            cc = json.loads(line[2:])
-                            sync_temp_format(control_constants=cc)  # Check the temp format just in case
-                        elif line[0] == 'S':
-                            # Control settings received
-                            prev_settings_update = time.time()
-                            cs = json.loads(line[2:])
-                        # do not print this to the log file. This is requested continuously.
-                        elif line[0] == 'V':
-                            # Control settings received
-                            cv = line[2:]  # keep as string, do not decode
-                        elif line[0] == 'X':
-                            # Extended settings received
-                            es = json.loads(line[2:])
-                        elif line[0] == 'N':
-                            pass  # version number received. Do nothing, just ignore
-                        elif line[0] == 'h':
-                            device_list['available'] = json.loads(line[2:])
-                            old_list_state = device_list['listState']
-                            device_list['listState'] = old_list_state.strip('h') + "h"
-                            logMessage("Available devices received: " + json.dumps(device_list['available']))
-                        elif line[0] == 'd':
-                            device_list['installed'] = json.loads(line[2:])
-                            old_list_state = device_list['listState']
-                            device_list['listState'] = old_list_state.strip('d') + "d"
-                            logMessage("Installed devices received: " + json.dumps(device_list['installed']))
-                        elif line[0] == 'U':
-                            logMessage("Device updated to: " + line[2:])
-                        else:
-                            logMessage("Cannot process line from controller: " + line)
-                        # end or processing a line
-                    except ValueError as e:
-                        logMessage("JSON decode error: %s" % str(e))
-                        logMessage("Line received was: " + line)
-                    bg_ser.line_was_processed()  # Clean out the queue
+                    self.process_line(line)
+                    self.bg_ser.line_was_processed()  # Clean out the queue
                 if message is not None:
                     try:
                         expanded_message = expandLogMessage.expandLogMessage(message)
                         logMessage("Controller debug message: " + expanded_message)
                     except Exception as e:  # catch all exceptions, because out of date file could cause errors
                         logMessage("Error while expanding log message '" + message + "'" + str(e))
-                    bg_ser.message_was_processed()  # Clean out the queue
-    
-            # Check for update from temperature profile
-            if 'mode' not in cs:
-                logMessage("Error receiving mode from controller - restarting")
-                sys.exit(1)
-            if cs['mode'] == 'p':
-                # Limit profile updates to once every 30 seconds (prevents hammering the database)
-                if datetime.datetime.now() > (config_obj.last_profile_temp_check + datetime.timedelta(seconds=30)):
-                    try:
-                        new_temp = config_obj.get_profile_temp()
-                    except StopIteration:
-                        config_obj.error_count += 1
-                        continue
-                    except RuntimeError:
-                        config_obj.error_count += 1
-                        continue
-                    else:
-                        config_obj.error_count = 0  # Reset the error count
-                    config_obj.last_profile_temp_check = datetime.datetime.now()  # Update the last check time
-
-                    if new_temp is None:  # If we had an error loading a temperature (from dbConfig) disable temp control
-                        cs['mode'] = 'o'
-                        bg_ser.writeln("j{mode:\"o\"}")
-                        logMessage("Notification: Error in profile mode - turning off temp control")
-                        # raise socket.timeout  # go to serial communication to update controller
-                    elif round(new_temp, 2) != cs['beerSet']:
-                        try:
-                            new_temp = float(new_temp)
-                            cs['beerSet'] = round(new_temp, 2)
-                        except ValueError:
-                            logMessage("Cannot convert temperature '" + new_temp + "' to float")
-                            continue
-                        # if temperature has to be updated send settings to controller
-                        bg_ser.writeln("j{beerSet:" + json.dumps(cs['beerSet']) + "}")
+                    self.bg_ser.message_was_processed()  # Clean out the queue
+
+    def process_line(self, line):
+        config_obj = self.config_obj
+        try:
+            if line[0] == 'T':
+                # print it to stdout
+                if self.output_temperature:
+                    print(time.strftime("%b %d %Y %H:%M:%S  ") + line[2:], flush=True)
 
+                # store time of last new data for interval check
+                self.prev_data_time = time.time()
+                self.last_temperature_time = self.prev_data_time
 
+                # process temperature line
+                new_data = json.loads(line[2:])
+                # copy/rename keys
+                for key in new_data:
+                    self.prev_temp_json[rename_temp_key(key)] = new_data[key]
+
+                # Moved this so that the last read values is updated even if logging is off. Otherwise, the
+                # getDashInfo will return the default temp values (0)
+                if config_obj.logging_status == config_obj.DATA_LOGGING_ACTIVE:
+                    # All this is handled by the model. The point is queued and sent in the background.
                     try:
-                        if config_obj.is_past_end_of_profile():
-                            bg_ser.writeln("j{mode:\"b\", beerSet:" + json.dumps(cs['beerSet']) + "}")
-                            cs['mode'] = 'b'
-                            refresh_and_check(config_obj, run)  # Reload dbConfig from the database
-                            config_obj.reset_profile()
-                            logMessage("Notification: Beer temperature set to constant " + str(cs['beerSet']) +
-                                       " degrees at end of profile")
-                    except StopIteration:
-                        config_obj.error_count += 1
-                        continue
-                    except RuntimeError:
+                        config_obj.save_beer_log_point(self.prev_temp_json)
+                    except (StopIteration, RuntimeError):
                         config_obj.error_count += 1
-                        continue
-                    else:
-                        config_obj.error_count = 0  # Reset the error count
 
-        except socket.error as e:
-            logMessage("Socket error(%d): %s" % (e.errno, e.strerror))
-            traceback.print_exc()
-    
-    if bg_ser:
-        bg_ser.stop()
-    
-    if ser:
-        if ser.isOpen():
-            ser.close()  # close port
-            
-    if conn:
-        conn.shutdown(socket.SHUT_RDWR)  # close socket
-        conn.close()
+            elif line[0] == 'D':
+                # debug message received, should already been filtered out, but print anyway here.
+                logMessage("Finding a log message here should not be possible, report to the devs!")
+                logMessage("Line received was: {0}".format(line))
+            elif line[0] == 'L':
+                # lcd content received
+                self.lcd_text = json.loads(asciiToUnicode(line[2:]))
+            elif line[0] == 'C':
+                # Control constants received
+                self.cc = json.loads(line[2:])
+                self.sync_temp_format()  # Check the temp format just in case
+            elif line[0] == 'S':
+                # Control settings received
+                self.prev_settings_update = time.time()
+                self.cs = json.loads(line[2:])
+                if 'mode' not in self.cs:
+                    raise ScriptExit(1, "Error receiving mode from controller - restarting")
+            # do not print this to the log file. This is requested continuously.
+            elif line[0] == 'V':
+                # Control settings received
+                self.cv = line[2:]  # keep as string, do not decode
+            elif line[0] == 'X':
+                # Extended settings received
+                self.es = json.loads(line[2:])
+            elif line[0] == 'N':
+                pass  # version number received. Do nothing, just ignore
+            elif line[0] == 'h':
+                self.device_list['available'] = json.loads(line[2:])
+                self.device_list['listState'] = self.device_list['listState'].strip('h') + "h"
+                logMessage("Available devices received: " + json.dumps(self.device_list['available']))
+                self.check_device_list()
+            elif line[0] == 'd':
+                self.device_list['installed'] = json.loads(line[2:])
+                self.device_list['listState'] = self.device_list['listState'].strip('d') + "d"
+                logMessage("Installed devices received: " + json.dumps(self.device_list['installed']))
+                self.check_device_list()
+            elif line[0] == 'U':
+                logMessage("Device updated to: " + line[2:])
+            else:
+                logMessage("Cannot process line from controller: " + line)
+            # end or processing a line
+        except ValueError as e:
+            logMessage("JSON decode error: %s" % str(e))
+            logMessage("Line received was: " + line)
+
+    # At startup force synchronization of temperature format
+    def sync_temp_format(self):
+        if self.cc['tempFormat'] != self.config_obj.temp_format:
+            # j{"tempFormat": "C"}
+            settings_dict = {'tempFormat': self.config_obj.temp_format}
+            self.writeln("j" + json.dumps(settings_dict))
+            # TODO - Set min/max temp if necessary
+
+    # Device list
+    def request_device_list(self, read_values=False):
+        # Invalidate the cache and ask the controller for the installed & available devices. device_list_ready is
+        # resolved once both have been received.
+        self.device_list['listState'] = ""  # invalidate local copy
+        if self.device_list_ready is None or self.device_list_ready.done():
+            self.device_list_ready = self.loop.create_future()
+        if read_values:
+            self.writeln("d{r:1}")  # request installed devices
+            self.writeln("h{u:-1,v:1}")  # request available, but not installed devices
+        else:
+            self.writeln("d{}")  # request installed devices
+            self.writeln("h{u:-1}")  # request available, but not installed devices
+
+    def check_device_list(self):
+        if self.device_list['listState'] in ["dh", "hd"] and self.device_list_ready is not None and \
+                not self.device_list_ready.done():
+            self.device_list_ready.set_result(True)
+
+    async def wait_for_device_list(self) -> bool:
+        """Waits (up to DEVICE_LIST_TIMEOUT) for a requested device list to arrive. Returns True if it's up to date."""
+        if self.device_list['listState'] in ["dh", "hd"]:
+            return True
+        if self.device_list_ready is None:
+            return False
+        try:
+            await asyncio.wait_for(asyncio.shield(self.device_list_ready), self.DEVICE_LIST_TIMEOUT)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def trigger_refresh(self, read_values=False):
+        # We want to keep the deviceList cache updated. Invalidate the cache, send a request to update the list to
+        # the controller, then wait for it to respond (rather than for a fixed time).
+        self.request_device_list(read_values)
+        await self.wait_for_device_list()
+
+    # Timers
+    async def lcd_task(self):
+        while True:
+            await asyncio.sleep(self.LCD_INTERVAL)
+            if self.hw_mode == "legacy":
+                # 'l' is only recognized on legacy controllers and results in an error for 'modern' controllers.
+                # TODO - Emulate lcdText for modern controllers
+                self.writeln('l')
+
+    async def settings_task(self):
+        while True:
+            await asyncio.sleep(self.SETTINGS_CHECK_INTERVAL)
+            if (time.time() - self.prev_settings_update) > self.SETTINGS_INTERVAL:
+                # Request Settings from controller to stay up to date
+                # Controller should send updates on changes, this is a periodic update to ensure it is up to date
+                self.prev_settings_update += 5  # give the controller some time to respond
+                self.writeln('s')
+
+    async def temperature_task(self):
+        config_obj = self.config_obj
+        while True:
+            if config_obj.error_count > self.MAX_ERROR_COUNT:
+                raise ScriptExit(1, "Error: too many errors communicating with Fermentrack. Exiting.")
+
+            # if no new data has been received for serialRequestInteval seconds
+            if (time.time() - self.prev_data_time) >= float(config_obj.data_point_log_interval):
+                # Only ask again if it's been more than 5 seconds since we last requested temps
+                if (time.time() - self.prev_time_out_req) > self.TEMPERATURE_REQUEST_INTERVAL:
+                    self.writeln("t")  # request new from controller
+                    self.prev_time_out_req = time.time()
+                    if self.prev_data_time == 0.0:  # If prevDataTime hasn't yet been set (it's 0.0 at startup), set it
+                        self.prev_data_time = time.time()
+
+            if (time.time() - self.prev_data_time) >= 3 * float(config_obj.data_point_log_interval):
+                # something is wrong: controller is not responding to data requests
+                # In this case, we can rely on the process manager relaunching this script.
+                # It's better to fail loudly (in this case with an exit) than silently.
+                raise ScriptExit(1, "Error: controller is not responding to new data requests. Exiting.")
+
+            await asyncio.sleep(self.TEMPERATURE_CHECK_INTERVAL)
+
+    async def profile_task(self):
+        config_obj = self.config_obj
+        while True:
+            if self.cs['mode'] == 'p' and \
+                    datetime.datetime.now() > (config_obj.last_profile_temp_check +
+                                               datetime.timedelta(seconds=self.PROFILE_INTERVAL)):
+                await self.update_from_profile()
+            await asyncio.sleep(self.PROFILE_CHECK_INTERVAL)
+
+    async def update_from_profile(self):
+        config_obj = self.config_obj
+        try:
+            new_temp = await self.db(config_obj.get_profile_temp)
+        except (StopIteration, RuntimeError):
+            config_obj.error_count += 1
+            return
+        else:
+            config_obj.error_count = 0  # Reset the error count
+        config_obj.last_profile_temp_check = datetime.datetime.now()  # Update the last check time
+
+        if new_temp is None:  # If we had an error loading a temperature (from dbConfig) disable temp control
+            self.cs['mode'] = 'o'
+            self.writeln("j{mode:\"o\"}")
+            logMessage("Notification: Error in profile mode - turning off temp control")
+        elif round(new_temp, 2) != self.cs['beerSet']:
+            try:
+                new_temp = float(new_temp)
+                self.cs['beerSet'] = round(new_temp, 2)
+            except ValueError:
+                logMessage("Cannot convert temperature '" + new_temp + "' to float")
+                return
+            # if temperature has to be updated send settings to controller
+            self.writeln("j{beerSet:" + json.dumps(self.cs['beerSet']) + "}")
+
+        try:
+            if await self.db(config_obj.is_past_end_of_profile):
+                self.writeln("j{mode:\"b\", beerSet:" + json.dumps(self.cs['beerSet']) + "}")
+                self.cs['mode'] = 'b'
+                await self.reload_config()  # Reload dbConfig from the database
+                await self.db(config_obj.reset_profile)
+                logMessage("Notification: Beer temperature set to constant " + str(self.cs['beerSet']) +
+                           " degrees at end of profile")
+        except (StopIteration, RuntimeError):
+            config_obj.error_count += 1
+        else:
+            config_obj.error_count = 0  # Reset the error count
+
+    async def loop_monitor_task(self):
+        # Anything that holds up the event loop (a blocking call, a flood of lines from the controller...) delays every
+        # other task, and shows up here as waking up late
+        while True:
+            expected = self.loop.time() + self.LOOP_MONITOR_INTERVAL
+            await asyncio.sleep(self.LOOP_MONITOR_INTERVAL)
+            self.loop_lag.record(max(self.loop.time() - expected, 0))
+
+    # Web interface
+    async def handle_connection(self, reader, writer):
+        try:
+            data = await reader.read(4096)
+            while data and len(data) < len(messageFraming.MAGIC) and messageFraming.MAGIC.startswith(data):
+                more = await reader.read(4096)  # Not enough yet to tell whether this is a framed connection
+                if not more:
+                    break
+                data += more
+
+            if messageFraming.is_framed(data):
+                await self.handle_framed_connection(reader, writer, data)
+            else:
+                # A single unframed message: reply (if there is a reply) and close the connection
+                response = await self.handle_request(data)
+                if response is not None:
+                    writer.write(response.encode(encoding="cp437"))
+                    await writer.drain()
+        except (ConnectionError, OSError) as e:
+            logMessage("Socket error: %s" % str(e))
+        finally:
+            writer.close()
+
+    async def handle_framed_connection(self, reader, writer, data):
+        """Handles requests on a long-lived connection until the other end closes it (see scriptlibs/messageFraming)"""
+        decoder = messageFraming.FrameDecoder()
+        self.connections.add(writer)
+        try:
+            while data:
+                try:
+                    frames = decoder.feed(data)
+                except ValueError as e:
+                    logMessage("Socket error: %s" % str(e))
+                    return
+                # Requests are handled one at a time, in the order they were sent
+                for request_id, flags, payload in frames:
+                    response = await self.handle_request(payload)
+                    if not flags & messageFraming.FLAG_NO_REPLY:
+                        if response is None:
+                            writer.write(messageFraming.pack_frame(request_id, messageFraming.FLAG_NO_RESPONSE, b''))
+                        else:
+                            writer.write(messageFraming.pack_frame(request_id, 0, response))
+                        await writer.drain()
+                data = await reader.read(65536)
+        finally:
+            self.connections.discard(writer)
+
+    async def handle_request(self, data) -> str or None:
+        message = data.decode(encoding="cp437")
+        if "=" in message:
+            message_type, value = message.split("=", 1)
+        else:
+            message_type = message
+            value = ""
+        started = time.monotonic()
+        response = await self.handle_message(message_type, value)
+        self.publish_state()  # In case the message changed anything
+        self.message_stats(message_type).record(time.monotonic() - started)
+        return response
+
+    def message_stats(self, message_type):
+        if message_type not in self.message_latency and len(self.message_latency) >= self.MAX_MESSAGE_TYPES:
+            message_type = "other"  # Don't let a stream of invalid messages grow this without limit
+        if message_type not in self.message_latency:
+            self.message_latency[message_type] = LatencyStats()
+        return self.message_latency[message_type]
+
+    def metrics(self):
+        """
+        How the script is doing, for Fermentrack to collect (see app/api/metrics.py). Latencies are in seconds, as the
+        count, total and max since the script started.
+        """
+        since_temperatures = None
+        if self.last_temperature_time is not None:
+            since_temperatures = round(time.time() - self.last_temperature_time, 1)
+        return {"uptime": round(time.time() - self.started_time, 1),
+                "loop_lag": self.loop_lag.as_dict(),
+                "since_temperatures": since_temperatures,
+                "serial": self.bg_ser.metrics() if self.bg_ser else {},
+                "messages": {message_type: stats.as_dict() for message_type, stats in self.message_latency.items()},
+                "sender": self.config_obj.sender_metrics(),
+                "error_count": self.config_obj.error_count}
+
+    def dash_info(self):
+        prev_temp_json = self.prev_temp_json
+        return {"BeerTemp": prev_temp_json['BeerTemp'],
+                "FridgeTemp": prev_temp_json['FridgeTemp'],
+                "BeerAnn": prev_temp_json['BeerAnn'],
+                "FridgeAnn": prev_temp_json['FridgeAnn'],
+                "RoomTemp": prev_temp_json['RoomTemp'],
+                "State": prev_temp_json['State'],
+                "BeerSet": prev_temp_json['BeerSet'],
+                "FridgeSet": prev_temp_json['FridgeSet'],
+                "LogInterval": float(self.config_obj.data_point_log_interval),
+                "Mode": self.cs['mode'],
+                "SpoolDepth": self.config_obj.spool_depth()}
+
+    def publish_state(self):
+        """
+        Publishes the responses to the read-only messages below, so that Fermentrack can read them without asking (see
+        app/brewpi_state.py for the fields). Only fields that have changed are actually written.
+        """
+        self.config_obj.publish_state({
+            "lcd": json.dumps(self.lcd_text),
+            "dash": json.dumps(self.dash_info()),
+            "mode": self.cs['mode'],
+            "beer_set": json.dumps(self.cs['beerSet']),
+            "fridge_set": json.dumps(self.cs['fridgeSet']),
+            "cs": json.dumps(dict(self.cs, dataLogging=self.config_obj.logging_status)),
+            "cc": json.dumps(self.cc),
+            "es": json.dumps(self.es),
+            "cv": self.cv,
+        })
+
+    async def handle_message(self, message_type, value) -> str or None:
+        """Handles a message from the web interface, returning the response to send (if any)"""
+        config_obj = self.config_obj
+
+        if message_type == "ack":  # acknowledge request
+            return 'ack'
+        elif message_type == "lcd":  # lcd contents requested
+            return json.dumps(self.lcd_text)
+        elif message_type == "getMode":  # echo self.cs['mode'] setting
+            return self.cs['mode']
+        elif message_type == "getFridge":  # echo fridge temperature setting
+            return json.dumps(self.cs['fridgeSet'])
+        elif message_type == "getBeer":  # echo fridge temperature setting
+            return json.dumps(self.cs['beerSet'])
+        elif message_type == "getControlConstants":
+            return json.dumps(self.cc)
+        elif message_type == "getExtendedSettings":
+            return json.dumps(self.es)
+        elif message_type == "getControlSettings":
+            # TODO - See where/if we call getControlSettings (and fix the self.cs['profile'] response below)
+            self.cs['dataLogging'] = config_obj.logging_status
+            return json.dumps(self.cs)
+        elif message_type == "getControlVariables":
+            return self.cv
+        elif message_type == "refreshControlConstants":
+            self.writeln("c")
+        elif message_type == "refreshControlSettings":
+            self.writeln("s")
+        elif message_type == "refreshControlVariables":
+            self.writeln("v")
+        elif message_type == "refreshExtendedSettings":
+            self.writeln("x")
+        elif message_type == "loadDefaultControlSettings":
+            self.writeln("S")
+        elif message_type == "loadDefaultControlConstants":
+            self.writeln("C")
+        elif message_type == "setBeer":  # new constant beer temperature received
+            try:
+                new_temp = float(value)
+                self.cs['beerSet'] = round(new_temp, 2)
+            except ValueError:
+                logMessage("Cannot convert temperature '" + value + "' to float")
+                return None
+
+            self.cs['mode'] = 'b'
+            # round to 2 dec, python will otherwise produce 6.999999999
+            self.writeln("j{{mode:\"b\", beerSet:{}}}".format(self.cs['beerSet']))
+            # Reload dbConfig from the database (in case we were using profiles)
+            await self.reload_config()
+            logMessage("Notification: Beer temperature set to {} degrees in web interface".format(self.cs['beerSet']))
+
+        elif message_type == "setFridge":  # new constant fridge temperature received
+            try:
+                new_temp = float(value)
+            except ValueError:
+                logMessage("Cannot convert temperature '" + value + "' to float")
+                return None
+
+            self.cs['mode'] = 'f'
+            self.cs['fridgeSet'] = round(new_temp, 2)
+            cmd = f'"j{{mode:"f", fridgeSet:{json.dumps(self.cs["fridgeSet"])}}}"'
+            self.writeln(cmd)
+            # Reload dbConfig from the database (in case we were using profiles)
+            await self.reload_config()
+            logMessage(f"Notification: Sending command {cmd} to set fridge temperature to {str(self.cs['fridgeSet'])} "
+                       f"degrees from web interface")
+
+        elif message_type == "setOff":  # self.cs['mode'] set to OFF
+            self.cs['mode'] = 'o'
+            self.writeln("j{mode:\"o\"}")
+            # Reload dbConfig from the database (in case we were using profiles)
+            await self.reload_config()
+            logMessage("Notification: Temperature control disabled")
+        elif message_type == "setParameters":
+            # receive JSON key:value pairs to set parameters on the controller
+            try:
+                decoded = json.loads(value)
+                self.writeln("j" + json.dumps(decoded))
+                if 'tempFormat' in decoded:
+                    await self.reload_config()  # Reload dbConfig from the database
+            except ValueError:
+                logMessage("Error: invalid JSON parameter string received: " + value)
+        elif message_type == "setExtendedSettings":
+            # receive JSON key:value pairs to set extended settings on the controller
+            try:
+                decoded = json.loads(value)
+                self.writeln("X" + json.dumps(decoded))
+            except ValueError:
+                logMessage("Error: invalid JSON parameter string received: " + value)
+        elif message_type == "stopScript":  # exit instruction received. Stop script.
+            # voluntary shutdown.
+            log_message = "stopScript message received on socket. "
+            log_message += "dbConfig in use - assuming device status was already properly updated "
+            log_message += "to prevent automatic restart"
+            self.stop(0, log_message)
+        elif message_type == "quit":  # quit instruction received. Probably sent by another brewpi script instance
+            # Leave dontrunfile alone.
+            # This instruction is meant to restart the script or replace it with another instance.
+            self.stop(0, "quit message received on socket. Stopping script.")
+        elif message_type == "eraseLogs":
+            logMessage('eraseLogs is not implemented for this version of brewpi-script')
+        elif message_type == "interval":  # new interval received
+            if not config_obj.changes_live():  # Otherwise the change is logged when it's received
+                await self.db(refresh_and_check, config_obj)  # Reload dbConfig from the database
+                new_interval = int(config_obj.data_point_log_interval)
+                logMessage("Notification: Interval changed to " + str(new_interval) + " seconds")
+        elif message_type == "startNewBrew":  # new beer name
+            return json.dumps(await self.db(start_new_brew, config_obj, value))
+        elif message_type == "pauseLogging":
+            return json.dumps(await self.db(pause_logging, config_obj))
+        elif message_type == "stopLogging":
+            return json.dumps(await self.db(stop_logging, config_obj))
+        elif message_type == "resumeLogging":
+            return json.dumps(await self.db(resume_logging, config_obj))
+        elif message_type == "dateTimeFormatDisplay":
+            logMessage('dateTimeFormatDisplay is not implemetned for this version of brewpi-script')
+        elif message_type == "setActiveProfile":
+            # We're using a dbConfig object to manage everything. We aren't being passed anything by Fermentrack
+            logMessage("Setting controller to beer profile mode using database-configured profile")
+            # Reload dbConfig from the database - always, as the new profile is needed before the profile task next
+            # runs (which could be before the notification of the change arrives)
+            await self.db(refresh_and_check, config_obj)
+            if self.cs['mode'] != 'p':
+                self.cs['mode'] = 'p'
+                self.writeln("j{mode:\"p\"}")
+                logMessage("Notification: Profile mode enabled")
+            return "Profile successfully updated"
+
+        elif message_type == "programController" or message_type == "programArduino":
+            logMessage("programController action is not supported by this modified version of brewpi-script")
+        elif message_type == "refreshDeviceList":
+            await self.trigger_refresh(True)
+        elif message_type == "getDeviceList":
+            # If a refresh is in progress, wait for the controller to finish sending the list rather than making the
+            # web interface poll for it
+            if await self.wait_for_device_list():
+                response = dict(board=self.hw_version.board,
+                                shield=self.hw_version.shield,
+                                deviceList=self.device_list,
+                                pinList=pinList.getPinList(self.hw_version.board, self.hw_version.shield))
+                return json.dumps(response)
+            else:
+                # It's up to the web interface to track how often it requests an update
+                return "device-list-not-up-to-date"
+        elif message_type == "getDashInfo":
+            # This is a new messageType
+            return json.dumps(self.dash_info())
+        elif message_type == "getMetrics":
+            return json.dumps(self.metrics())
+        elif message_type == "applyDevice":
+            # applyDevice is used to apply settings to an existing device (pin/OneWire assignment, etc.)
+            try:
+                json.loads(value)  # load as JSON to check syntax
+            except ValueError:
+                logMessage("Error: invalid JSON parameter string received: " + value)
+                return None
+            logMessage("Received applyDevice request, updating to: {}".format(value))
+            # No need to re-encode to JSON if we received valid JSON in the first place.
+            self.writeln("U" + value)
+
+            await self.trigger_refresh(True)
+        elif message_type == "writeDevice":
+            # writeDevice is used to -create- "actuators" -- Specifically, (for now) buttons.
+            try:
+                config_string_json = json.loads(value)  # load as JSON to check syntax
+            except ValueError:
+                logMessage("Error: invalid JSON parameter string received: " + value)
+                return None
+            self.writeln("d" + json.dumps(config_string_json))
+
+            # Keep the deviceList cache updated
+            await self.trigger_refresh(True)
+        elif message_type == "getVersion":
+            if self.hw_version:
+                response = dict(self.hw_version.__dict__)
+                # replace LooseVersion with string, because it is not JSON serializable
+                response['version'] = self.hw_version.toString()
+            else:
+                response = {}
+            return json.dumps(response)
+
+        elif message_type == "resetController":
+            logMessage("Resetting controller to factory defaults")
+            await self.reload_config()  # Reload dbConfig from the database
+            self.writeln("E{\"confirmReset\": true}")
+            # request settings from controller, processed later when reply is received
+            self.writeln('s')  # request control settings cs
+            self.writeln('c')  # request control constants cc
+            self.writeln('v')  # request control variables cv
+            self.writeln('x')  # request control variables es
+            await self.trigger_refresh(True)  # Refresh the device list cache
+
+        elif message_type == "restartController":
+            logMessage("Restarting controller")
+            self.writeln("R")  # This tells the controller to restart
+            await asyncio.sleep(3)  # We'll give bg_ser 3 seconds for it to send/kick in
+            self.stop(0)  # Exit BrewPi-script
+
+        elif message_type == "resetWiFi":
+            logMessage("Resetting controller WiFi settings")
+            self.writeln("w")
+            await asyncio.sleep(3)  # We'll give bg_ser 3 seconds for it to send/kick in
+            self.stop(0)  # Exit BrewPi-script
+        else:
+            logMessage("Error: Received invalid message on socket: " + message_type)
+        return None
+
+
+def BrewPiScript(config_obj, started_event=None):
+    """
+    Runs BrewPi-Script for one controller as the only thing in this process (see controller_host.py for the
+    alternative of running several controllers in one process). started_event (a multiprocessing.Event) is set once
+    the script has finished connecting to the controller.
+    """
+    if config_obj.stdout_path:
+        sys.stdout = open(config_obj.stdout_path, 'w')  # overwrite stdout file on script start
+    if config_obj.stderr_path:
+        sys.stderr = open(config_obj.stderr_path, 'a')  # append to stderr file
+
+    on_started = started_event.set if started_event is not None else None
+    exit_code = asyncio.run(BrewPiEngine(config_obj, on_started=on_started).run())
+    if exit_code:
+        sys.exit(exit_code)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+# Runs BrewPi-Script for every active controller inside a single process. This is the alternative to
+# fermentrack_caller.py's default of spawning a separate process (each with its own copy of Django) per controller,
+# and is enabled with BREWPI_HOST_MODE=True (or `fermentrack_caller.py --host`).
+#
+# Each controller is a ControllerSession - a BrewPiEngine running as a task on a shared event loop. A session that
+# fails is logged and restarted (with a backoff if it keeps failing) without affecting the other sessions, and still
+# logs to its own dev-N-stdout.log/dev-N-stderr.log via scriptlibs.contextStreams.
+
+import asyncio
+import concurrent.futures
+import os
+import resource
+import traceback
+
+import sentry_sdk
+
+from brewpi import BrewPiEngine
+from scriptlibs import contextStreams
+from scriptlibs.BrewPiUtil import logMessage
+
+
+def current_rss_mb() -> float:
+    """Returns the resident memory of this process in MB"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Peak rather than current, but close enough
+
+
+class ControllerSession():
+    MIN_RESTART_DELAY = 5  # seconds
+    MAX_RESTART_DELAY = 300
+
+    def __init__(self, device_id, load_config, startup_slots):
+        self.device_id = device_id
+        self.load_config = load_config
+        self.startup_slots = startup_slots  # Semaphore limiting how many sessions connect to their controllers at once
+        self.task = None
+        self.engine = None
+        self.restarts = 0
+
+    def start(self):
+        # Tasks run in a copy of the context they were created in, so redirecting the session's output in run_once()
+        # doesn't affect the other sessions
+        self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def run_once(self) -> int:
+        loop = asyncio.get_running_loop()
+        config_obj = await loop.run_in_executor(None, self.load_config, self.device_id)
+        if config_obj is None:
+            return 1
+
+        streams = contextStreams.open_streams(config_obj.stdout_path, config_obj.stderr_path)
+        try:
+            # The slot is held until the engine has finished connecting (successfully or not)
+            await self.startup_slots.acquire()
+            self.engine = BrewPiEngine(config_obj, on_started=self.startup_slots.release)
+            return await self.engine.run()
+        finally:
+            self.engine = None
+            contextStreams.close_streams(streams)
+
+    async def run(self):
+        delay = self.MIN_RESTART_DELAY
+        while True:
+            try:
+                exit_code = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                sentry_sdk.capture_exception(e)
+                logMessage(f"BrewPi-Script for BrewPiDevice #{self.device_id} failed:")
+                traceback.print_exc()
+                exit_code = 1
+
+            if exit_code == 0:
+                delay = self.MIN_RESTART_DELAY  # Stopped on purpose (e.g. stopScript) - relaunch as the caller would
+            else:
+                delay = min(delay * 2, self.MAX_RESTART_DELAY) if self.restarts else self.MIN_RESTART_DELAY
+            self.restarts += 1
+            logMessage(f"BrewPi-Script for BrewPiDevice #{self.device_id} exited with code {exit_code} - "
+                       f"restarting in {delay} seconds")
+            await asyncio.sleep(delay)
+
+
+class ControllerHost():
+    POLL_INTERVAL = 5  # seconds between checks for controllers being added or removed
+
+    def __init__(self, load_config, get_active_device_ids, max_starting=4):
+        """
+        load_config(device_id) returns a loaded BrewPiScriptConfig for a controller (or None), and
+        get_active_device_ids() returns the IDs of the controllers that should be running (or None if that can't be
+        determined right now). Both are blocking, and are run in an executor. At most max_starting controllers are
+        connected to at once.
+        """
+        self.load_config = load_config
+        self.get_active_device_ids = get_active_device_ids
+        self.max_starting = max_starting
+        self.startup_slots = None
+        self.sessions = {}
+
+    def start_session(self, device_id):
+        session = ControllerSession(device_id, self.load_config, self.startup_slots)
+        self.sessions[device_id] = session
+        session.start()
+        logMessage(f"Started BrewPi-Script for BrewPiDevice #{device_id} - now hosting {len(self.sessions)} "
+                   f"controller(s) in {current_rss_mb():.1f}MB")
+
+    async def stop_session(self, device_id):
+        session = self.sessions.pop(device_id)
+        await session.stop()
+        logMessage(f"Stopped BrewPi-Script for BrewPiDevice #{device_id} - now hosting {len(self.sessions)} "
+                   f"controller(s) in {current_rss_mb():.1f}MB")
+
+    async def run(self):
+        contextStreams.install()
+        loop = asyncio.get_running_loop()
+        self.startup_slots = asyncio.Semaphore(self.max_starting)  # Created here so that it belongs to this loop
+        # Connecting to a controller blocks a thread in the default executor, so make sure there are enough of them for
+        # max_starting connections alongside the config loads & polling
+        loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=self.max_starting + 4))
+        try:
+            while True:
+                active_device_ids = await loop.run_in_executor(None, self.get_active_device_ids)
+                # If Fermentrack isn't reachable (it may be restarting) leave the running sessions alone
+                if active_device_ids is not None:
+                    for device_id in list(self.sessions):
+                        if device_id not in active_device_ids:
+                            await self.stop_session(device_id)
+                    for device_id in active_device_ids:
+                        if device_id not in self.sessions:
+                            self.start_session(device_id)
+                await asyncio.sleep(self.POLL_INTERVAL)
+        finally:
+            for device_id in list(self.sessions):
+                await self.stop_session(device_id)
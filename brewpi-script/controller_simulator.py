@@ -0,0 +1,574 @@
+#!/usr/bin/env python
+
+# Simulates BrewPi controllers, so that BrewPi-Script (and Fermentrack behind it) can be exercised - and load/latency
+# tested - without real hardware. Each simulated controller speaks the serial protocol as BrewPi-Script uses it (n, t,
+# s, c, v, x, l, d{}, h{}, j{}, X{}, U{}, E{}, S, C, R, w - with D:{...} log messages interleaved) over a pty, which
+# can be used as a serial port, and/or a TCP port, like a WiFi controller.
+#
+#   python controller_simulator.py --count 50 --tcp-port 7000      # 50 controllers, on TCP ports 7000-7049
+#   python controller_simulator.py --count 4 --pty --speed 60      # 4 controllers on ptys, an hour passing a minute
+#
+# Temperatures follow a simple thermal model of a fridge (with a heater and a cooler) holding a beer in a room, under
+# a simple on/off version of BrewPi's control algorithm. Faults - slow, dropped, garbled or split responses, log
+# message floods, disconnected sensors, dropped connections, hangs and reboots - can be injected at configurable
+# rates. See --help for the options.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import time
+import tty
+
+from scriptlibs import expandLogMessage, parseEnum
+
+# Controller states, as reported in the State field of temperature lines
+IDLE = 0
+STATE_OFF = 1
+HEATING = 3
+COOLING = 4
+
+STATE_NAMES = {IDLE: "Idling for", STATE_OFF: "Temp. control OFF", HEATING: "Heating for", COOLING: "Cooling for"}
+MODE_NAMES = {'b': "Beer Const.", 'f': "Fridge Const.", 'p': "Beer Profile", 'o': "Off"}
+
+DEFAULT_CONTROL_SETTINGS = {"mode": "b", "beerSet": 20.0, "fridgeSet": 20.0, "heatEst": 0.199, "coolEst": 5.0}
+DEFAULT_CONTROL_CONSTANTS = {
+    "tempFormat": "C", "tempSetMin": 1.0, "tempSetMax": 30.0, "pidMax": 10.0, "Kp": 5.0, "Ki": 0.25, "Kd": -1.5,
+    "iMaxErr": 0.5, "idleRangeH": 1.0, "idleRangeL": -1.0, "heatTargetH": 0.301, "heatTargetL": -0.199,
+    "coolTargetH": 0.199, "coolTargetL": -0.301, "maxHeatTimeForEst": 600, "maxCoolTimeForEst": 1200,
+    "fridgeFastFilt": 1, "fridgeSlowFilt": 4, "fridgeSlopeFilt": 3, "beerFastFilt": 3, "beerSlowFilt": 4,
+    "beerSlopeFilt": 4, "lah": 0, "hs": 0}
+DEFAULT_EXTENDED_SETTINGS = {"invertTFT": 0, "glycol": 0, "lowDelay": 0}
+
+# Commands that are followed by a JSON object (the rest are a single character)
+JSON_COMMANDS = "jXUdhE"
+
+# BrewPi-Script sends JSON with unquoted keys (e.g. j{mode:"b", beerSet:20.0}), which the firmware accepts
+UNQUOTED_KEY = re.compile(r'([{,]\s*)([A-Za-z_][A-Za-z0-9_]*)\s*:')
+
+
+def load_log_ids():
+    """Returns a dict of log message key (e.g. 'INFO_RECEIVED_SETTING') -> (log type, log ID), from LogMessages.h"""
+    log_ids = {}
+    for log_type, enum_name in expandLogMessage.messageEnums.items():
+        for log_id, message in parseEnum.parseEnumInFile(expandLogMessage.logMessagesFile, enum_name).items():
+            log_ids[message['logKey']] = (log_type, log_id)
+    return log_ids
+
+
+def parse_json(text):
+    return json.loads(UNQUOTED_KEY.sub(r'\1"\2":', text))
+
+
+def exponential_due(mean_interval, now):
+    """Returns when a random event with the given mean interval (in seconds, 0 for never) next happens"""
+    return now + random.expovariate(1 / mean_interval) if mean_interval > 0 else None
+
+
+class CommandParser():
+    """Splits the bytes received from BrewPi-Script into (command, JSON payload or None) tuples"""
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, data):
+        self.buffer += data.decode(encoding="cp437")
+        commands = []
+        i = 0
+        while i < len(self.buffer):
+            command = self.buffer[i]
+            if command.isspace():
+                i += 1
+                continue
+            if command in JSON_COMMANDS and self.buffer[i + 1:i + 2] in ("{", ""):
+                # Wait for the whole object (which can't contain nested objects) to arrive
+                end = self.buffer.find("}", i)
+                if end < 0:
+                    break
+                commands.append((command, self.buffer[i + 1:end + 1]))
+                i = end + 1
+            else:
+                commands.append((command, None))
+                i += 1
+        self.buffer = self.buffer[i:]
+        return commands
+
+
+class SimulatedController():
+    def __init__(self, number, options, log_ids):
+        self.number = number
+        self.options = options
+        self.log_ids = log_ids
+        self.connections = []  # ControllerConnections, which also receive unsolicited output (e.g. log messages)
+        self.stats = {'commands': 0, 'lines': 0, 'dropped': 0, 'garbled': 0}
+        self.boot()
+
+    def boot(self):
+        now = time.monotonic()
+        self.cs = dict(DEFAULT_CONTROL_SETTINGS)
+        self.cc = dict(DEFAULT_CONTROL_CONSTANTS)
+        self.es = dict(DEFAULT_EXTENDED_SETTINGS)
+        self.room_temp = self.options.room_temp
+        self.fridge_temp = self.options.room_temp
+        self.beer_temp = self.options.room_temp
+        self.beer_slope = 0.0
+        self.state = IDLE
+        self.state_since = 0.0  # in simulated seconds
+        self.sim_time = 0.0
+        self.last_update = now
+        self.installed = [
+            {"i": 0, "t": 1, "c": 1, "b": 0, "f": 5, "h": 2, "d": 0, "p": 12, "a": "28FF%012X" % self.number, "j": 0.0},
+            {"i": 1, "t": 1, "c": 1, "b": 1, "f": 9, "h": 2, "d": 0, "p": 12, "a": "28EE%012X" % self.number, "j": 0.0},
+            {"i": 2, "t": 2, "c": 1, "b": 0, "f": 2, "h": 1, "d": 0, "p": 14, "x": 1},
+            {"i": 3, "t": 2, "c": 1, "b": 0, "f": 3, "h": 1, "d": 0, "p": 13, "x": 1},
+        ]
+        self.available = [{"c": 0, "b": 0, "f": 0, "h": 2, "d": 0, "p": 12, "a": "28DD%012X" % self.number, "j": 0.0},
+                          {"c": 0, "b": 0, "f": 0, "h": 1, "d": 0, "p": 15, "x": 0}]
+        # Faults - each is the time (by time.monotonic()) it next happens, or None if it's disabled
+        self.ready_at = now + self.options.boot_delay
+        self.hang_until = 0.0
+        self.next_hang = exponential_due(self.options.hang_interval, now)
+        self.next_reboot = exponential_due(self.options.reboot_interval, now)
+        self.next_disconnect = exponential_due(self.options.disconnect_interval, now)
+        self.next_log_message = exponential_due(1 / self.options.log_rate if self.options.log_rate else 0, now)
+
+    # Temperatures
+    def to_format(self, temp_c):
+        return temp_c * 9 / 5 + 32 if self.cc['tempFormat'] == 'F' else temp_c
+
+    def from_format(self, temp):
+        return (temp - 32) * 5 / 9 if self.cc['tempFormat'] == 'F' else temp
+
+    def reading(self, temp_c):
+        return round(self.to_format(temp_c + random.gauss(0, self.options.noise)), 2)
+
+    def fridge_target(self):
+        """The fridge temperature to aim for (in C), or None if temperature control is off"""
+        mode = self.cs['mode']
+        if mode == 'f':
+            return self.from_format(self.cs['fridgeSet'])
+        elif mode in ('b', 'p'):
+            beer_set = self.from_format(self.cs['beerSet'])
+            # Proportional control - push the fridge past the beer setting to bring the beer to it faster
+            difference = max(min(self.cc['Kp'] * (beer_set - self.beer_temp), self.cc['pidMax']), -self.cc['pidMax'])
+            self.cs['fridgeSet'] = round(self.to_format(beer_set + difference), 2)
+            return beer_set + difference
+        return None
+
+    def update(self):
+        """Advances the thermal model (and the control algorithm) to the current time"""
+        now = time.monotonic()
+        elapsed = (now - self.last_update) * self.options.speed
+        self.last_update = now
+        while elapsed > 0:
+            dt = min(elapsed, 10)  # Simulated seconds per step - larger steps would make the model unstable
+            elapsed -= dt
+            self.sim_time += dt
+
+            target = self.fridge_target()
+            if target is None:
+                new_state = STATE_OFF
+            elif self.state == COOLING:
+                new_state = COOLING if self.fridge_temp > target else IDLE
+            elif self.state == HEATING:
+                new_state = HEATING if self.fridge_temp < target else IDLE
+            elif self.fridge_temp > target + self.options.hysteresis:
+                new_state = COOLING
+            elif self.fridge_temp < target - self.options.hysteresis:
+                new_state = HEATING
+            else:
+                new_state = IDLE
+            if new_state != self.state:
+                self.state = new_state
+                self.state_since = self.sim_time
+
+            heat = self.options.heater_power if self.state == HEATING else 0
+            cool = self.options.cooler_power if self.state == COOLING else 0
+            beer_to_fridge = (self.beer_temp - self.fridge_temp) * self.options.beer_coupling
+            self.fridge_temp += dt * ((self.room_temp - self.fridge_temp) * self.options.room_coupling +
+                                      beer_to_fridge * self.options.beer_mass + heat - cool)
+            previous_beer_temp = self.beer_temp
+            self.beer_temp -= dt * beer_to_fridge
+            self.beer_slope = (self.beer_temp - previous_beer_temp) / dt * 3600  # per hour, as BrewPi reports it
+
+    # Output
+    def log_line(self, log_key, *values):
+        log_type, log_id = self.log_ids[log_key]
+        return "D:" + json.dumps({"logType": log_type, "logID": log_id, "V": list(values)})
+
+    def temperature_line(self):
+        beer_temp = None if random.random() < self.options.sensor_dropout else self.reading(self.beer_temp)
+        return "T:" + json.dumps({
+            "BeerTemp": beer_temp, "BeerSet": self.cs['beerSet'] if self.cs['mode'] in ('b', 'p') else None,
+            "BeerAnn": None, "FridgeTemp": self.reading(self.fridge_temp),
+            "FridgeSet": self.cs['fridgeSet'] if self.cs['mode'] != 'o' else None, "FridgeAnn": None,
+            "RoomTemp": self.reading(self.room_temp), "State": self.state})
+
+    def lcd_lines(self):
+        unit = "°" + self.cc['tempFormat']
+        beer_set = "%5.1f" % self.cs['beerSet'] if self.cs['mode'] in ('b', 'p') else "  --.-"
+        fridge_set = "%5.1f" % self.cs['fridgeSet'] if self.cs['mode'] != 'o' else "  --.-"
+        minutes, seconds = divmod(int(self.sim_time - self.state_since), 60)
+        state_line = STATE_NAMES[self.state]
+        if self.state != STATE_OFF:
+            state_line += " %02dm%02d" % (minutes % 100, seconds)
+        return [f"Mode   {MODE_NAMES.get(self.cs['mode'], '')}",
+                f"Beer  {self.to_format(self.beer_temp):5.1f} {beer_set} {unit}",
+                f"Fridge{self.to_format(self.fridge_temp):5.1f} {fridge_set} {unit}",
+                state_line]
+
+    def control_variables(self):
+        beer_diff = self.cs['beerSet'] - self.to_format(self.beer_temp)
+        return {"beerDiff": round(beer_diff, 2), "diffIntegral": 0.0, "beerSlope": round(self.beer_slope, 3),
+                "p": round(self.cc['Kp'] * beer_diff, 2), "i": 0.0, "d": 0.0, "estPeak": self.reading(self.fridge_temp),
+                "negPeakEst": 0.0, "posPeakEst": 0.0, "negPeak": 0.0, "posPeak": 0.0}
+
+    def version_line(self):
+        return "N:" + json.dumps({"v": self.options.firmware_version, "n": "sim", "c": "%07x" % self.number, "s": 1,
+                                  "y": 1, "b": self.options.board, "l": str(expandLogMessage.getVersion())})
+
+    # Commands
+    def apply_settings(self, settings):
+        lines = []
+        for key, value in settings.items():
+            if key == 'tempFormat' and value in ('C', 'F') and value != self.cc['tempFormat']:
+                # Convert the settings to the new format along with the readings
+                for setting in ('beerSet', 'fridgeSet'):
+                    self.cs[setting] = round(self.from_format(self.cs[setting]), 2)
+                self.cc['tempFormat'] = value
+                for setting in ('beerSet', 'fridgeSet'):
+                    self.cs[setting] = round(self.to_format(self.cs[setting]), 2)
+            elif key in self.cs:
+                self.cs[key] = value
+            elif key in self.cc:
+                self.cc[key] = value
+            else:
+                lines.append(self.log_line('WARNING_COULD_NOT_PROCESS_SETTING'))
+                continue
+            lines.append(self.log_line('INFO_RECEIVED_SETTING', key, str(value)))
+        return lines
+
+    def update_device(self, device):
+        slot = device.get('i')
+        for installed in self.installed:
+            if installed['i'] == slot:
+                installed.update(device)
+                if installed.get('f', 0) == 0:
+                    self.installed.remove(installed)
+                    return [self.log_line('INFO_UNINSTALL_TEMP_SENSOR', 0), "U:" + json.dumps(installed)]
+                return ["U:" + json.dumps(installed)]
+        device.setdefault('i', len(self.installed))
+        self.installed.append(device)
+        return [self.log_line('INFO_INSTALL_DEVICE', device.get('f', 0)), "U:" + json.dumps(device)]
+
+    def device_value(self, device):
+        if device.get('t') == 1:  # Temperature sensor
+            return self.reading(self.beer_temp if device.get('f') == 9 else self.fridge_temp)
+        return int((device.get('f') == 2 and self.state == HEATING) or (device.get('f') == 3 and self.state == COOLING))
+
+    def device_list(self, devices, request):
+        if request.get('r'):
+            # Include the current value of each device
+            devices = [dict(device, v=self.device_value(device)) for device in devices]
+        return json.dumps(devices)
+
+    def handle(self, command, payload):
+        """Returns the lines to send in response to a command, or None if it reboots the controller"""
+        self.update()
+        try:
+            request = parse_json(payload) if payload else {}
+        except ValueError:
+            return [self.log_line('WARNING_COULD_NOT_PROCESS_SETTING')]
+
+        if command == 'n':
+            return [self.version_line()]
+        elif command == 't':
+            return [self.temperature_line()]
+        elif command == 'l':
+            return ["L:" + json.dumps(self.lcd_lines(), ensure_ascii=False)]
+        elif command == 's':
+            return ["S:" + json.dumps(self.cs)]
+        elif command == 'c':
+            return ["C:" + json.dumps(self.cc)]
+        elif command == 'v':
+            return ["V:" + json.dumps(self.control_variables())]
+        elif command == 'x':
+            return ["X:" + json.dumps(self.es)]
+        elif command == 'j':
+            return self.apply_settings(request)
+        elif command == 'X':
+            self.es.update(request)
+            return []
+        elif command == 'S':
+            self.cs = dict(DEFAULT_CONTROL_SETTINGS)
+            return [self.log_line('INFO_DEFAULT_SETTINGS_LOADED')]
+        elif command == 'C':
+            self.cc = dict(DEFAULT_CONTROL_CONSTANTS)
+            return [self.log_line('INFO_DEFAULT_CONSTANTS_LOADED')]
+        elif command == 'E':
+            if request.get('confirmReset'):
+                self.cs, self.cc = dict(DEFAULT_CONTROL_SETTINGS), dict(DEFAULT_CONTROL_CONSTANTS)
+                self.es = dict(DEFAULT_EXTENDED_SETTINGS)
+                return [self.log_line('INFO_EEPROM_INITIALIZED')]
+            return []
+        elif command == 'd':
+            return ["d:" + self.device_list(self.installed, request)]
+        elif command == 'h':
+            return ["h:" + self.device_list(self.available, request)]
+        elif command == 'U':
+            return self.update_device(request)
+        elif command in ('R', 'w'):
+            return None
+        else:
+            return [self.log_line('WARNING_INVALID_COMMAND', ord(command))]
+
+    # Faults
+    def is_responsive(self):
+        now = time.monotonic()
+        return now >= self.ready_at and now >= self.hang_until
+
+    def garble(self, line):
+        if random.random() < self.options.split_rate and len(line) > 4:
+            # A log message printed in the middle of another line
+            split_at = random.randrange(2, len(line))
+            return line[:split_at] + self.log_line('INFO_SETTING_ACTUATOR_VALUE', 0) + "\n" + line[split_at:]
+        if random.random() < self.options.garble_rate:
+            self.stats['garbled'] += 1
+            return line[:random.randrange(1, len(line) + 1)]  # Truncated
+        return line
+
+    def check_faults(self):
+        """Triggers any faults that are due, returning 'reboot' or 'disconnect' if one of those happened"""
+        now = time.monotonic()
+        if self.next_log_message is not None:
+            while now >= self.next_log_message:
+                self.next_log_message = exponential_due(1 / self.options.log_rate, self.next_log_message)
+                if self.is_responsive():
+                    actuator_value = int(self.state in (HEATING, COOLING))
+                    self.broadcast([self.log_line('INFO_SETTING_ACTUATOR_VALUE', actuator_value)])
+        if self.next_hang is not None and now >= self.next_hang:
+            self.hang_until = now + self.options.hang_duration
+            self.next_hang = exponential_due(self.options.hang_interval, self.hang_until)
+        if self.next_reboot is not None and now >= self.next_reboot:
+            return 'reboot'
+        if self.next_disconnect is not None and now >= self.next_disconnect:
+            self.next_disconnect = exponential_due(self.options.disconnect_interval, now)
+            return 'disconnect'
+        return None
+
+    def reboot(self):
+        # Rebooting drops TCP connections (as the ESP8266/ESP32 firmware's would be) and resets the settings
+        for connection in list(self.connections):
+            connection.close()
+        self.boot()
+
+    def broadcast(self, lines):
+        for connection in list(self.connections):
+            connection.write_lines(lines)
+
+
+class ControllerConnection():
+    """A connection to a simulated controller (a pty, or a TCP client) - subclasses implement write() and close()"""
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.parser = CommandParser()
+        self.commands = asyncio.Queue()
+        self.task = None
+
+    def attach(self):
+        """Starts handling commands (and receiving unsolicited output) once the connection is open"""
+        self.task = asyncio.ensure_future(self.process_commands())
+        self.controller.connections.append(self)
+
+    def received(self, data):
+        for command in self.parser.feed(data):
+            self.commands.put_nowait(command)
+
+    async def process_commands(self):
+        controller = self.controller
+        options = controller.options
+        while True:
+            command, payload = await self.commands.get()
+            if not controller.is_responsive():
+                continue  # Commands sent while the controller is (re)booting or hung are lost
+            controller.stats['commands'] += 1
+            if random.random() < options.drop_rate:
+                controller.stats['dropped'] += 1
+                continue
+            lines = controller.handle(command, payload)
+            if lines is None:
+                controller.reboot()
+                continue
+            if options.response_delay:
+                await asyncio.sleep(max(random.gauss(options.response_delay, options.response_delay / 4), 0) / 1000)
+            self.write_lines(lines)
+
+    def write_lines(self, lines):
+        if lines:
+            self.controller.stats['lines'] += len(lines)
+            self.write("".join(self.controller.garble(line) + "\n" for line in lines).encode(encoding="cp437",
+                                                                                              errors="replace"))
+
+    def detach(self):
+        if self.task:
+            self.task.cancel()
+        if self in self.controller.connections:
+            self.controller.connections.remove(self)
+
+
+class PtyConnection(ControllerConnection):
+    def __init__(self, controller):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)  # The slave is kept open so that the pty survives BrewPi-Script disconnecting
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        super().__init__(controller)
+        self.attach()
+        asyncio.get_event_loop().add_reader(self.master, self.read)
+
+    def read(self):
+        try:
+            data = os.read(self.master, 4096)
+        except (BlockingIOError, OSError):
+            return
+        self.received(data)
+
+    def write(self, data):
+        try:
+            os.write(self.master, data)
+        except BlockingIOError:
+            pass  # Nothing is reading from the port - like a serial port, the output is lost
+
+    def close(self):
+        pass  # A pty can't be disconnected
+
+
+class TCPConnection(ControllerConnection, asyncio.Protocol):
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.attach()
+
+    def data_received(self, data):
+        self.received(data)
+
+    def connection_lost(self, exc):
+        self.detach()
+
+    def write(self, data):
+        if not self.transport.is_closing():
+            self.transport.write(data)
+
+    def close(self):
+        self.transport.close()
+
+
+async def tick(controllers):
+    """Runs each controller's faults (and keeps its model updated) once a second"""
+    while True:
+        for controller in controllers:
+            controller.update()
+            fault = controller.check_faults()
+            if fault == 'reboot':
+                controller.reboot()
+            elif fault == 'disconnect':
+                for connection in list(controller.connections):
+                    if isinstance(connection, TCPConnection):
+                        connection.close()
+        await asyncio.sleep(1)
+
+
+async def report_stats(controllers, interval):
+    previous = None
+    while True:
+        await asyncio.sleep(interval)
+        totals = {key: sum(controller.stats[key] for controller in controllers) for key in controllers[0].stats}
+        if previous is not None:
+            print(time.strftime("%H:%M:%S ") + ", ".join(
+                "{0}: {1:.1f}/s".format(key, (totals[key] - previous[key]) / interval) for key in totals), flush=True)
+        previous = totals
+
+
+async def run(options):
+    log_ids = load_log_ids()
+    loop = asyncio.get_event_loop()
+    controllers = []
+    for number in range(options.count):
+        controller = SimulatedController(number + 1, options, log_ids)
+        controllers.append(controller)
+        endpoints = []
+        if options.pty:
+            endpoints.append(PtyConnection(controller).port)
+        if options.tcp_port:
+            port = options.tcp_port + number
+            await loop.create_server(lambda c=controller: TCPConnection(c), options.host, port)
+            endpoints.append(f"{options.host}:{port}")
+        print(f"Controller {number + 1}: " + ", ".join(endpoints), flush=True)
+
+    tasks = [tick(controllers)]
+    if options.stats_interval:
+        tasks.append(report_stats(controllers, options.stats_interval))
+    await asyncio.gather(*tasks)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulates BrewPi controllers for testing BrewPi-Script")
+    parser.add_argument('--count', type=int, default=1, help="Number of controllers to simulate")
+    parser.add_argument('--pty', action='store_true', help="Expose each controller on a pty (i.e. a serial port)")
+    parser.add_argument('--tcp-port', type=int, default=0,
+                        help="Expose each controller on a TCP port, starting from this one")
+    parser.add_argument('--host', default="127.0.0.1", help="Address to listen on for TCP connections")
+    parser.add_argument('--stats-interval', type=float, default=0,
+                        help="Print commands/lines per second (across all controllers) this often, in seconds")
+
+    firmware = parser.add_argument_group("firmware")
+    firmware.add_argument('--firmware-version', default="0.2.11")
+    firmware.add_argument('--board', default="s", help="Board type, as reported in the version (e.g. s, e, c)")
+    firmware.add_argument('--boot-delay', type=float, default=0,
+                          help="Seconds after starting (or rebooting) before the controller responds")
+
+    model = parser.add_argument_group("temperature model (temperatures in C, rates per simulated second)")
+    model.add_argument('--speed', type=float, default=1, help="Simulated seconds per real second")
+    model.add_argument('--room-temp', type=float, default=22.0)
+    model.add_argument('--room-coupling', type=float, default=0.0005,
+                       help="Rate heat leaks between the room and the fridge")
+    model.add_argument('--beer-coupling', type=float, default=0.0002,
+                       help="Rate heat moves between the fridge and the beer")
+    model.add_argument('--beer-mass', type=float, default=5.0,
+                       help="How much more the beer takes to heat up or cool down than the fridge air")
+    model.add_argument('--heater-power', type=float, default=0.01, help="Degrees per second the heater adds")
+    model.add_argument('--cooler-power', type=float, default=0.015, help="Degrees per second the cooler removes")
+    model.add_argument('--hysteresis', type=float, default=0.3,
+                       help="How far the fridge can drift from its target before heating or cooling starts")
+    model.add_argument('--noise', type=float, default=0.02, help="Standard deviation of noise on sensor readings")
+
+    faults = parser.add_argument_group("fault injection (intervals are mean seconds between events, 0 for never)")
+    faults.add_argument('--response-delay', type=float, default=0, help="Mean milliseconds before responding")
+    faults.add_argument('--drop-rate', type=float, default=0, help="Probability of ignoring a command")
+    faults.add_argument('--garble-rate', type=float, default=0, help="Probability of truncating a response line")
+    faults.add_argument('--split-rate', type=float, default=0,
+                        help="Probability of printing a log message in the middle of a response line")
+    faults.add_argument('--log-rate', type=float, default=0, help="Unsolicited log messages per second")
+    faults.add_argument('--sensor-dropout', type=float, default=0,
+                        help="Probability of the beer sensor reading as disconnected")
+    faults.add_argument('--hang-interval', type=float, default=0, help="Controller stops responding...")
+    faults.add_argument('--hang-duration', type=float, default=10, help="...for this many seconds")
+    faults.add_argument('--disconnect-interval', type=float, default=0, help="TCP connections are dropped")
+    faults.add_argument('--reboot-interval', type=float, default=0,
+                        help="Controller reboots, dropping TCP connections and resetting its settings")
+    options = parser.parse_args()
+    if not options.pty and not options.tcp_port:
+        parser.error("At least one of --pty or --tcp-port is required")
+    return options
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.get_event_loop().run_until_complete(run(parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -3,11 +3,15 @@
 # This is a process manager used for launching individual instances of BrewPi-script for each valid configuration in
 # a Fermentrack database.
 
+import asyncio
+import sys
 import time
 import atexit
-from multiprocessing import Process
+from multiprocessing import Event, Process
 from fermentrack_config_loader import FermentrackBrewPiScriptConfig, get_active_brewpi_devices
 from brewpi import BrewPiScript
+from controller_host import ControllerHost
+from django.conf import settings
 import sentry_sdk
 
 sentry_sdk.init(
@@ -15,6 +19,8 @@ sentry_sdk.init(
     traces_sample_rate=0.0
 )
 
+STARTUP_TIMEOUT = 60  # Seconds a controller can take to start before it no longer counts against the parallelism limit
+
 
 def cleanup(process_list):
     """Ensures all child processes are terminated and joined before exiting."""
@@ -24,9 +30,29 @@ def cleanup(process_list):
             process.join()
 
 
+def load_config(brewpi_device_id):
+    config = FermentrackBrewPiScriptConfig(brewpi_device_id=brewpi_device_id)
+    if config.load_from_fermentrack(False) is False:
+        return None  # The device was deleted (or changed out from under us)
+    return config
+
+
+def run_host():
+    """Runs every controller in this process, rather than spawning a process for each (see controller_host.py)"""
+    try:
+        asyncio.run(ControllerHost(load_config, get_active_brewpi_devices, settings.BREWPI_STARTUP_PARALLELISM).run())
+    except KeyboardInterrupt:
+        pass
+
+
 if __name__ == '__main__':
+    if settings.BREWPI_HOST_MODE or '--host' in sys.argv:
+        run_host()
+        sys.exit(0)
+
     process_list = {}
     config_list = {}
+    starting = {}  # device id -> (started Event, launch time) for the processes that are still connecting
 
     atexit.register(cleanup, process_list)
 
@@ -43,11 +69,34 @@ if __name__ == '__main__':
                 process_list[this_process].terminate()  # Force terminate if it's still alive
             del process_list[this_process]
 
+        # Check in on the controllers that are starting up
+        for this_id in list(starting):
+            started_event, launch_time = starting[this_id]
+            elapsed = time.time() - launch_time
+            if started_event.is_set():
+                print(f"BrewPiDevice #{this_id} started in {elapsed:.1f}s", flush=True)
+            elif this_id not in process_list:
+                print(f"BrewPiDevice #{this_id} exited after {elapsed:.1f}s while starting up", flush=True)
+            elif elapsed > STARTUP_TIMEOUT:
+                print(f"BrewPiDevice #{this_id} hasn't started after {elapsed:.1f}s - no longer waiting on it",
+                      flush=True)
+            else:
+                continue
+            del starting[this_id]
+
         active_device_ids = get_active_brewpi_devices()
+        if active_device_ids is None:
+            # Fermentrack isn't reachable (it may be restarting). Leave the running processes alone - they will spool
+            # any log points until it's back - and try again shortly.
+            time.sleep(5)
+            continue
 
         # Launch any processes that are missing from the process list
         for this_id in active_device_ids:
             if this_id not in process_list:
+                if len(starting) >= settings.BREWPI_STARTUP_PARALLELISM:
+                    break  # Wait for one of the controllers that are starting up before launching any more
+
                 # The process hasn't been spawned. Spawn it.
                 # print(f"Launching process for BrewPiDevice #{this_id}")
                 if this_id in config_list:
@@ -55,13 +104,15 @@ if __name__ == '__main__':
                 try:
                     config_list[this_id] = FermentrackBrewPiScriptConfig(brewpi_device_id=this_id)
                     config_list[this_id].load_from_fermentrack(False)
-                    process_list[this_id] = Process(target=BrewPiScript, args=(config_list[this_id], ))
+                    started_event = Event()
+                    process_list[this_id] = Process(target=BrewPiScript, args=(config_list[this_id], started_event))
                     process_list[this_id].start()
-                    time.sleep(10)  # Give each controller 10 seconds to start up
+                    starting[this_id] = (started_event, time.time())
                 except StopIteration:
                     pass
                 except Exception as e:  # Handle other exceptions
                     sentry_sdk.capture_exception(e)  # Send the exception to Sentry
                     print(f"Error while launching process for BrewPiDevice #{this_id}: {e}")
 
-        time.sleep(5)  # Wait 5 seconds in each loop
+        # Check back sooner while controllers are starting up
+        time.sleep(1 if starting else 5)
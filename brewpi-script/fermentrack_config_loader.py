@@ -4,7 +4,7 @@ import json
 import os
 import sys
 from pathlib import Path
-from time import sleep
+from time import time
 from typing import List
 
 import requests
@@ -22,17 +22,50 @@ sys.path.append(BASE_DIR)
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
 import app.models
+from app import brewpi_changes, brewpi_state, log_stream, profile_cache
+from django.conf import settings
 
 from scriptlibs.brewpiScriptConfig import BrewPiScriptConfig
+from scriptlibs.changeListener import ChangeListener
+from scriptlibs.pointSender import PointSender
+from scriptlibs.pointSpool import PointSpool
+from scriptlibs.statePublisher import StatePublisher
+from scriptlibs.streamPointSender import StreamPointSender
+
+API_TIMEOUT = (5, 30)  # (connect, read) timeouts for requests to the Fermentrack API, in seconds
+
+# Reused for each request the process manager makes, so that the connection to the API is kept alive between them
+api_session = requests.Session()
 
 
 class FermentrackBrewPiScriptConfig(BrewPiScriptConfig):
+    # BrewPiDevice fields that are copied to the config object, and the attribute each is copied to
+    FIELD_ATTRIBUTES = {
+        'device_name': 'name',
+        'status': 'status',
+        'logging_status': 'logging_status',
+        'temp_format': 'temp_format',
+        'data_point_log_interval': 'data_point_log_interval',
+        'connection_type': 'connection_type',
+        'prefer_connecting_via_udev': 'prefer_connecting_via_udev',
+        'serial_port': 'serial_port',
+        'serial_alt_port': 'serial_alt_port',
+        'udev_serial_number': 'udev_serial_number',
+        'wifi_host': 'wifi_host',
+        'wifi_host_ip': 'wifi_host_ip',
+        'wifi_port': 'wifi_port',
+    }
+    # Changing these would interrupt the connection to the script, so (as with refresh()) they aren't reloaded
+    SOCKET_FIELDS = ['useInetSocket', 'socket_name', 'socketHost', 'socketPort']
 
     def __init__(self, brewpi_device_id):
         super().__init__()
         self.brewpi_device_id = brewpi_device_id
         self.brewpi_device = None
         self.uuid = None
+        self.point_sender = None
+        self.state_publisher = None
+        self.change_listener = None
 
     def load_from_fermentrack(self, false_on_connection_changes=False) -> bool:
         try:
@@ -170,7 +203,8 @@ class FermentrackBrewPiScriptConfig(BrewPiScriptConfig):
 
     def save_beer_log_point(self, beer_row):
         """
-        Saves a row of data to the database (mapping the data row we are passed to Django's BeerLogPoint model)
+        Queues a row of data to be saved to the database (mapping the data row we are passed to Django's BeerLogPoint
+        model). The row is sent to the Fermentrack API by a background thread, so this never waits on the web server.
         :param beer_row:
         :return:
         """
@@ -184,32 +218,108 @@ class FermentrackBrewPiScriptConfig(BrewPiScriptConfig):
             'room_temp': beer_row['RoomTemp'],
             'state': beer_row['State'],
             'brewpi_device_id': self.brewpi_device_id,
+            # Points are sent in the background (and may be batched up with others) so they are timestamped here
+            'log_time': int(time() * 1000),
         }
 
-        url = f"http://127.0.0.1:{api_port}/api/save_point/"
-
+        if self.point_sender is None:
+            # Started on first use so that the sender thread belongs to the BrewPi-Script process, not the caller.
+            # Points are spooled to disk while the API (or Redis) is unreachable (e.g. while Fermentrack is restarting)
+            spool = PointSpool(f"{BASE_DIR}/data/spool/dev-{self.brewpi_device_id}-points.jsonl")
+            if settings.BREWPI_LOG_TRANSPORT == "redis":
+                self.point_sender = StreamPointSender(settings.REDIS_URL, log_stream.STREAM_KEY,
+                                                      settings.LOG_STREAM_MAXLEN, spool)
+            else:
+                self.point_sender = PointSender(f"http://127.0.0.1:{api_port}/api/save_points/", spool)
+            self.point_sender.start()
+        self.point_sender.send(point_repr)
+
+    def spool_depth(self) -> int:
+        return self.point_sender.spool_depth() if self.point_sender is not None else 0
+
+    def sender_metrics(self) -> dict:
+        return self.point_sender.metrics() if self.point_sender is not None else {}
+
+    def stop_sending(self):
+        """Sends any points that are still queued, then stops the background sender"""
+        if self.point_sender is not None:
+            self.point_sender.stop()
+            self.point_sender = None
+
+    def publish_state(self, fields):
+        """Publishes the script's state to Redis for Fermentrack to read (see app/brewpi_state.py)"""
+        if self.state_publisher is None:
+            # As with the point sender, started on first use so that the thread belongs to the BrewPi-Script process
+            self.state_publisher = StatePublisher(settings.REDIS_URL, brewpi_state.state_key(self.brewpi_device_id),
+                                                  brewpi_state.TTL)
+            self.state_publisher.start()
+        self.state_publisher.update(fields)
+
+    def stop_publishing(self):
+        if self.state_publisher is not None:
+            self.state_publisher.stop()
+            self.state_publisher = None
+
+    def watch_changes(self, on_change):
+        """Listens for the changes Fermentrack publishes to Redis (see app/brewpi_changes.py)"""
+        device_channel = brewpi_changes.device_channel(self.brewpi_device_id)
+
+        def handle_change(channel, data):
+            if channel is None:
+                on_change(None)
+            elif channel == device_channel:
+                on_change({'fields': json.loads(data)})
+            else:
+                on_change({'profile': int(data)})
+
+        if self.change_listener is None:
+            self.change_listener = ChangeListener(settings.REDIS_URL, [device_channel, brewpi_changes.PROFILE_CHANNEL],
+                                                  handle_change)
+            self.change_listener.start()
+
+    def changes_live(self) -> bool:
+        return self.change_listener is not None and self.change_listener.is_live()
+
+    def reload_fields(self, fields):
+        fields = [field for field in fields if field not in self.SOCKET_FIELDS]
+        if not fields:
+            return
         try:
-            response = requests.post(url, json=point_repr)
-        except requests.exceptions.ConnectionError:
-            print(f"Unable to access Fermentrack API at {url} - Exiting.")
-            sleep(5)
-            exit(1)
+            values = app.models.BrewPiDevice.objects.filter(id=self.brewpi_device_id).values(*fields).get()
+        except ObjectDoesNotExist:
+            return  # cannot load the object from the database (deleted?)
 
-        if response.status_code != 201:
-            print(f"Unable to save point to Fermentrack API at {url} - Exiting.")
-            sleep(5)
-            exit(1)
+        for field, value in values.items():
+            # Changing a foreign key's ID (e.g. active_profile_id) also drops the cached object it refers to
+            setattr(self.brewpi_device, field, value)
+            if field in self.FIELD_ATTRIBUTES:
+                setattr(self, self.FIELD_ATTRIBUTES[field], value)
+
+    def profile_changed(self, profile_id):
+        profile_cache.invalidate(profile_id)
+
+    def stop_watching(self):
+        if self.change_listener is not None:
+            self.change_listener.stop()
+            self.change_listener = None
 
 
-def get_active_brewpi_devices() -> List[int]:
+def get_active_brewpi_devices() -> List[int] or None:
+    """
+    Returns the IDs of the BrewPiDevices that should have BrewPi-Script running, or None if the Fermentrack API can't be
+    reached (e.g. while it is being restarted)
+    """
     url = f"http://127.0.0.1:{api_port}/api/devices/"
 
     try:
-        response = requests.get(url)
-    except requests.exceptions.ConnectionError:
-        print(f"Unable to access Fermentrack API at {url} - Exiting.")
-        sleep(5)
-        exit(1)
+        response = api_session.get(url, timeout=API_TIMEOUT)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        print(f"Unable to access Fermentrack API at {url}")
+        return None
+
+    if response.status_code >= 500:
+        print(f"Fermentrack API at {url} returned HTTP {response.status_code}")
+        return None
 
     # Ensure the request was successful and the content type is JSON
     response.raise_for_status()
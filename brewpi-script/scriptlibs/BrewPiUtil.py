@@ -19,6 +19,7 @@ import time
 import sys
 import os
 import serial
+import socket
 from . import autoSerial
 from . import tcpSerial
 from .brewpiScriptConfig import BrewPiScriptConfig
@@ -146,7 +147,12 @@ def setupSerial(dbConfig: BrewPiScriptConfig, baud_rate: int = 57600, time_out:
 
                 # The way TCPSerial is implemented, hostname is just a memo field. We always connect to the host (which
                 # in this case is a resolved IP address)
-                ser = tcpSerial.TCPSerial(host=ip_address, port=port, hostname=hostname)
+                try:
+                    ser = tcpSerial.TCPSerial(host=ip_address, port=port, hostname=hostname)
+                except (socket.timeout, OSError) as e:
+                    logMessage(f"Unable to connect to BrewPi {ip_address} on port {port}: {e}")
+                    error += str(e) + '\n'
+                    ser = None
 
                 if ser:
                     break
@@ -1,3 +1,5 @@
+import contextvars
+import select
 import threading
 
 import queue as Queue
@@ -5,13 +7,63 @@ import sys
 import time
 
 from . import BrewPiUtil
-from . import expandLogMessage
 
 from serial import SerialException
 
+
+class SerialTokenizer():
+    """
+    Splits the bytes received from the controller into lines and log messages, in a single pass as they arrive.
+
+    Log messages (D:{...}) end with a newline, but can be printed by the controller in the middle of another line
+    (e.g. part way through a d: device list). A log message is cut out of the line it interrupted, and the rest of that
+    line is picked up where it left off - the same result as expandLogMessage.filterOutLogMessages, but without
+    rescanning the buffer for every line.
+    """
+    LOG_MESSAGE_START = b'D:{'
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.scanned = 0  # How much of the buffer has already been searched for a newline
+        self.message_start = -1  # Where the current (partial) line's log message starts, if it has one
+
+    def feed(self, data):
+        """Adds newly received data, returning a list of the complete lines and a list of the log messages in it"""
+        if hasattr(data, 'encode'):
+            data = data.encode(encoding="cp437")
+        self.buffer += data
+
+        lines = []
+        messages = []
+        while True:
+            newline = self.buffer.find(b'\n', self.scanned)
+            if self.message_start < 0:
+                # Only search what hasn't been searched before (backing up in case the start was split across reads)
+                self.message_start = self.buffer.find(self.LOG_MESSAGE_START, max(self.scanned - 2, 0),
+                                                      len(self.buffer) if newline < 0 else newline)
+            if newline < 0:
+                self.scanned = len(self.buffer)
+                return lines, messages
+
+            end = newline - 1 if newline > 0 and self.buffer[newline - 1] == ord('\r') else newline
+            if self.message_start >= 0 and end - 1 > self.message_start + 2 and self.buffer[end - 1] == ord('}'):
+                # The newline ends a log message - cut it out & carry on with the line it interrupted
+                messages.append(self.buffer[self.message_start + 2:newline + 1].decode(encoding="cp437"))
+                del self.buffer[self.message_start:newline + 1]
+                self.scanned = self.message_start
+            else:
+                if newline > 0:  # Blank lines (a bare newline) are dropped, as there is nothing in them to process
+                    lines.append(self.buffer[:newline].decode(encoding="cp437"))
+                del self.buffer[:newline + 1]  # Deleting from the front of a bytearray doesn't copy the rest of it
+                self.scanned = 0
+            self.message_start = -1
+
+
 class BackGroundSerial():
+    WAIT_TIMEOUT = 0.5  # How often the background thread wakes up to check if it has been stopped when no data arrives
+
     def __init__(self, serial_port):
-        self.buffer = ''
+        self.tokenizer = SerialTokenizer()
         self.ser = serial_port
         self.queue = Queue.Queue()
         self.messages = Queue.Queue()
@@ -19,6 +71,11 @@ class BackGroundSerial():
         self.error = False
         self.fatal_error = None
         self.run = False
+        self.bytes_in = 0  # Totals since the script started, for the runtime metrics
+        self.bytes_out = 0
+        # Optional callable, called from the background thread whenever lines or messages are queued (or the port is
+        # lost) so that a consumer can wait for data rather than polling read_line. Must be thread-safe.
+        self.on_receive = None
 
     # public interface only has 4 functions: start/stop/read_line/write
     def start(self):
@@ -27,7 +84,8 @@ class BackGroundSerial():
         self.ser.write_timeout = 2
         self.run = True
         if not self.thread:
-            self.thread = threading.Thread(target=self.__listenThread)
+            # The thread runs in a copy of the caller's context so that it logs wherever the caller does
+            self.thread = threading.Thread(target=contextvars.copy_context().run, args=(self.__listenThread,))
             self.thread.setDaemon(True)
             self.thread.start()
 
@@ -66,6 +124,12 @@ class BackGroundSerial():
         except Queue.Empty:
             return None
 
+    def metrics(self):
+        return {'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'lines_queued': self.queue.qsize(),
+                'messages_queued': self.messages.qsize()}
+
     def writeln(self, data):
         self.write(data + "\n")
 
@@ -76,9 +140,9 @@ class BackGroundSerial():
             try:
                 if hasattr(data, 'encode'):
                     # TODO - Refactor brewpi.py to encode as needed, rather than relying on the class to do so
-                    self.ser.write(data.encode(encoding='cp437'))
-                else:
-                    self.ser.write(data)
+                    data = data.encode(encoding='cp437')
+                self.ser.write(data)
+                self.bytes_out += len(data)
             except (IOError, OSError, SerialException) as e:
                 BrewPiUtil.logMessage('Serial Error: {0})'.format(str(e)))
                 self.error = True
@@ -93,31 +157,52 @@ class BackGroundSerial():
             del self.ser # this helps to fully release the port to the OS
             sys.exit("Terminating due to fatal serial error")
 
+    def __fileno(self):
+        # Serial ports on Linux (and sockets) can be waited on with select(). Anything else is polled.
+        try:
+            return self.ser.fileno()
+        except (AttributeError, ValueError, OSError, SerialException):
+            return None
+
+    def __read(self, fileno):
+        if fileno is None:
+            in_waiting = self.ser.inWaiting()
+            if in_waiting > 0:
+                return self.ser.read(in_waiting)
+            time.sleep(0.01)  # max 10 ms delay. At baud 57600, max 576 characters are received while waiting
+            return None
+
+        # Sleep until there is something to read, rather than waking up to poll for it. Data that was already buffered
+        # by the port (e.g. left over from the version check) is picked up first, as select() won't report it.
+        in_waiting = self.ser.inWaiting()
+        if in_waiting == 0:
+            readable, _, _ = select.select([fileno], [], [], self.WAIT_TIMEOUT)
+            if not readable:
+                return None
+            in_waiting = max(self.ser.inWaiting(), 1)
+        return self.ser.read(in_waiting)
+
     def __listenThread(self):
         while self.run:
-            in_waiting = None
+            # Looked up each time, as reopening the port (or a TCP reconnect) gives it a new file descriptor
+            fileno = self.__fileno()
             new_data = None
             if not self.error:
                 try:
-                    in_waiting = self.ser.inWaiting()
-                    if in_waiting > 0:
-                        new_data = self.ser.read(in_waiting)
-                except (IOError, OSError, SerialException) as e:
+                    new_data = self.__read(fileno)
+                except (IOError, OSError, SerialException, ValueError) as e:
                     BrewPiUtil.logMessage('Serial Error: {0})'.format(str(e)))
                     self.error = True
 
             if new_data:
-                if hasattr(new_data, 'decode'):
-                    self.buffer = self.buffer + new_data.decode(encoding="cp437")
-                else:
-                    self.buffer = self.buffer + new_data
-
-                while True:
-                    line = self.__get_line_from_buffer()
-                    if line:
-                        self.queue.put(line)
-                    else:
-                        break
+                self.bytes_in += len(new_data)
+                lines, messages = self.tokenizer.feed(new_data)
+                for message in messages:
+                    self.messages.put(message)
+                for line in lines:
+                    self.queue.put(self.__asciiToUnicode(line))
+                if lines or messages:
+                    self.__notify()
             if self.error:
                 try:
                     # try to restore serial by closing and opening again
@@ -131,27 +216,11 @@ class BackGroundSerial():
                     self.ser.close()
                     self.fatal_error = 'Lost serial connection. Error: {0})'.format(str(e))
                     self.run = False
+                    self.__notify()
 
-            # max 10 ms delay. At baud 57600, max 576 characters are received while waiting
-            time.sleep(0.01)
-
-    def __get_line_from_buffer(self):
-        while '\n' in self.buffer:
-            stripped_buffer, messages = expandLogMessage.filterOutLogMessages(self.buffer)
-            if len(messages) > 0:
-                for message in messages:
-                    self.messages.put(message[2:]) # remove D: and add to queue
-                self.buffer = stripped_buffer
-                continue
-            lines = self.buffer.partition('\n') # returns 3-tuple with line, separator, rest
-            if not lines[1]:
-                # '\n' not found, first element is incomplete line
-                self.buffer = lines[0]
-                return None
-            else:
-                # complete line received, [0] is complete line [1] is separator [2] is the rest
-                self.buffer = lines[2]
-                return self.__asciiToUnicode(lines[0])
+    def __notify(self):
+        if self.on_receive is not None:
+            self.on_receive()
 
     # remove extended ascii characters from string, because they can raise UnicodeDecodeError later
     def __asciiToUnicode(self, s):
@@ -169,3 +169,47 @@ class BrewPiScriptConfig:
     def save_beer_log_point(self, beer_row):
         raise NotImplementedError("Must implement in subclass!")
 
+    def spool_depth(self) -> int:
+        # The number of log points that are waiting to be saved (e.g. because Fermentrack is unreachable)
+        return 0
+
+    def sender_metrics(self) -> dict:
+        # Implemented by subclasses that save log points in the background - how the sender is doing (see
+        # PointSender.metrics)
+        return {}
+
+    def stop_sending(self):
+        # Implemented by subclasses that save log points in the background - called when BrewPi-Script exits
+        pass
+
+    def publish_state(self, fields):
+        # Implemented by subclasses that make the script's state (a dict of field -> string) available to readers
+        # directly, so they don't have to ask the script for it over its socket
+        pass
+
+    def stop_publishing(self):
+        # Called when BrewPi-Script exits
+        pass
+
+    def watch_changes(self, on_change):
+        # Implemented by subclasses that can be told when the configuration changes, rather than having to refresh()
+        # whenever it might have. on_change is called (from any thread) with {'fields': [names of changed fields]},
+        # {'profile': ID of an edited profile} or None if anything could have changed.
+        pass
+
+    def changes_live(self) -> bool:
+        # Whether changes are currently being received by watch_changes - if not, BrewPi-Script refreshes instead
+        return False
+
+    def reload_fields(self, fields):
+        # Reloads just the given fields - by default, everything is reloaded
+        return self.refresh()
+
+    def profile_changed(self, profile_id):
+        # Called when a profile has been edited, to drop anything cached about it
+        pass
+
+    def stop_watching(self):
+        # Called when BrewPi-Script exits
+        pass
+
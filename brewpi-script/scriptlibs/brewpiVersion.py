@@ -21,7 +21,12 @@ from distutils.version import LooseVersion
 from .BrewPiUtil import asciiToUnicode
 from serial import SerialException
 
-def getVersionFromSerial(ser):
+def getVersionFromSerial(ser, timeout=10):
+    """
+    Asks the controller for its version, repeating the request about once a second until it replies or timeout
+    seconds have passed. As the request is repeated, this doubles as a readiness probe for a controller that is still
+    (re)booting.
+    """
     version = None
     retries = 0
     oldTimeOut = ser.timeout
@@ -37,7 +42,7 @@ def getVersionFromSerial(ser):
 
     ser.write(b'n')
 
-    while retries < 10:
+    while retries < max(timeout, 10):
         retry = True
         while 1:  # Read all lines from serial
             loopTime = time.time()
@@ -59,8 +64,8 @@ def getVersionFromSerial(ser):
             if time.time() - loopTime >= ser.timeout:
                 # Have read entire buffer, now just reading data as it comes in. Break to prevent an endless loop
                 break
-            if time.time() - startTime >= 10:
-                # Try max 10 seconds
+            if time.time() - startTime >= timeout:
+                # Try max timeout seconds
                 retry = False
                 break
 
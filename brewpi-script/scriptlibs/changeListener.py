@@ -0,0 +1,79 @@
+import contextvars
+import threading
+
+import redis
+
+from . import BrewPiUtil
+
+
+class ChangeListener():
+    """
+    Listens for notifications of changes made in Fermentrack, published to Redis channels (see app/brewpi_changes.py),
+    and calls on_change(channel, data) from a background thread for each one. Notifications sent while the listener
+    isn't subscribed are lost, so on_change(None, None) is called each time it (re)subscribes to say that anything
+    could have changed.
+    """
+
+    POLL_TIMEOUT = 1  # seconds - how often the thread checks whether it has been stopped
+    RECONNECT_DELAY = 5  # seconds between attempts to resubscribe after losing the connection to Redis
+    TIMEOUT = 5
+
+    def __init__(self, redis_url, channels, on_change):
+        self.redis_url = redis_url
+        self.channels = channels
+        self.on_change = on_change
+        self.subscribed = False  # Whether notifications are currently being received
+        self.thread = None
+        self.run = False
+        self.stopped = threading.Event()
+        self.failing = False
+
+    # public interface is start/stop/is_live
+    def start(self):
+        self.run = True
+        self.stopped.clear()
+        if not self.thread:
+            # The thread runs in a copy of the caller's context so that it logs wherever the caller does
+            self.thread = threading.Thread(target=contextvars.copy_context().run, args=(self.__listenThread,))
+            self.thread.setDaemon(True)
+            self.thread.start()
+
+    def stop(self):
+        self.run = False
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def is_live(self):
+        return self.subscribed
+
+    def __listen(self, client):
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(*self.channels)
+            self.subscribed = True
+            if self.failing:
+                BrewPiUtil.logMessage("Listening for changes from Fermentrack again")
+                self.failing = False
+            self.on_change(None, None)
+            while self.run:
+                message = pubsub.get_message(timeout=self.POLL_TIMEOUT)
+                if message and message['type'] == 'message':
+                    self.on_change(message['channel'].decode(encoding="utf-8"),
+                                   message['data'].decode(encoding="utf-8"))
+        finally:
+            self.subscribed = False
+            pubsub.close()
+
+    def __listenThread(self):
+        client = redis.Redis.from_url(url=self.redis_url, socket_timeout=None, socket_connect_timeout=self.TIMEOUT)
+        while self.run:
+            try:
+                self.__listen(client)
+            except redis.exceptions.RedisError as e:
+                if not self.failing:
+                    BrewPiUtil.logMessage("Unable to listen for changes from Fermentrack: {0}".format(str(e)))
+                self.failing = True
+                self.stopped.wait(self.RECONNECT_DELAY)
+        client.close()
@@ -0,0 +1,60 @@
+import contextvars
+import sys
+
+# When several controllers are hosted in one process (see controller_host.py), each one still logs to its own
+# dev-N-stdout.log/dev-N-stderr.log. sys.stdout/sys.stderr are replaced with ContextStreams, which write to whichever
+# file has been set for the current context - asyncio tasks inherit the context of the task that created them, and
+# the background threads copy it when they are started.
+_stdout = contextvars.ContextVar('brewpi_stdout', default=None)
+_stderr = contextvars.ContextVar('brewpi_stderr', default=None)
+
+
+class ContextStream():
+    def __init__(self, var, default):
+        self.var = var
+        self.default = default
+
+    def target(self):
+        stream = self.var.get()
+        return stream if stream is not None else self.default
+
+    def write(self, s):
+        return self.target().write(s)
+
+    def flush(self):
+        return self.target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.target(), name)
+
+
+def install():
+    """Replaces sys.stdout & sys.stderr with ContextStreams. Safe to call more than once."""
+    if not isinstance(sys.stdout, ContextStream):
+        sys.stdout = ContextStream(_stdout, sys.stdout)
+    if not isinstance(sys.stderr, ContextStream):
+        sys.stderr = ContextStream(_stderr, sys.stderr)
+
+
+def open_streams(stdout_path, stderr_path):
+    """
+    Opens the log files for a controller and directs the current context's output to them (paths that are empty are
+    left going to the process' stdout/stderr). Returns the list of files that were opened, to be passed to close_streams.
+    """
+    opened = []
+    if stdout_path:
+        stdout = open(stdout_path, 'w')  # overwrite stdout file on script start
+        _stdout.set(stdout)
+        opened.append(stdout)
+    if stderr_path:
+        stderr = open(stderr_path, 'a')  # append to stderr file
+        _stderr.set(stderr)
+        opened.append(stderr)
+    return opened
+
+
+def close_streams(opened):
+    _stdout.set(None)
+    _stderr.set(None)
+    for stream in opened:
+        stream.close()
@@ -16,6 +16,7 @@
 
 from __future__ import print_function, absolute_import
 
+import hashlib
 import json
 from . import parseEnum
 import os
@@ -23,37 +24,60 @@ import re
 
 logMessagesFile = os.path.dirname(__file__) + '/LogMessages.h'
 
-errorDict = parseEnum.parseEnumInFile(logMessagesFile, 'errorMessages')
-infoDict = parseEnum.parseEnumInFile(logMessagesFile, 'infoMessages')
-warningDict = parseEnum.parseEnumInFile(logMessagesFile, 'warningMessages')
+# Parsing LogMessages.h is slow, so the parsed messages are cached in a JSON file (keyed by a hash of the header, so
+# that it is rebuilt whenever the header changes) and only loaded the first time a message is expanded
+cacheFile = os.path.join(os.path.dirname(__file__), '__pycache__', 'LogMessages.json')
+messageEnums = {'E': 'errorMessages', 'W': 'warningMessages', 'I': 'infoMessages'}
+logTypeStrings = {'E': "ERROR", 'W': "WARNING", 'I': "INFO MESSAGE"}
+
+# Populated by loadMessages() - log type -> log ID -> (prefix, format string, parameter converters, number of
+# parameters), where the prefix is e.g. "ERROR 2: "
+messageTables = None
+messagesVersion = None
+
+
+deviceFunctions = ['None',  # 0
+                   'Chamber Door',  # 1
+                   'Chamber Heater',  # 2
+                   'Chamber Cooler',  # 3
+                   'Chamber Light',  # 4
+                   'Chamber Temp',  # 5
+                   'Room Temp',  # 6
+                   'Chamber Fan',  # 7
+                   'Chamber Reserved 1',  # 8
+                   'Beer Temp',  # 9
+                   'Beer Temperature 2',  # 10
+                   'Beer Heater',  # 11
+                   'Beer Cooler',  # 12
+                   'Beer S.G.',  # 13
+                   'Beer Reserved 1',  # 14
+                   'Beer Reserved 2']  # 15
 
 
 def valToFunction(val):
-    functions = ['None',  # 0
-                 'Chamber Door',  # 1
-                 'Chamber Heater',  # 2
-                 'Chamber Cooler',  # 3
-                 'Chamber Light',  # 4
-                 'Chamber Temp',  # 5
-                 'Room Temp',  # 6
-                 'Chamber Fan',  # 7
-                 'Chamber Reserved 1',  # 8
-                 'Beer Temp',  # 9
-                 'Beer Temperature 2',  # 10
-                 'Beer Heater',  # 11
-                 'Beer Cooler',  # 12
-                 'Beer S.G.',  # 13
-                 'Beer Reserved 1',  # 14
-                 'Beer Reserved 2']  # 15
-    if val < len(functions):
-        return functions[val]
+    if val < len(deviceFunctions):
+        return deviceFunctions[val]
     else:
         return 'Unknown Device Function'
 
 
-def getVersion():
-    hFile = open(logMessagesFile)
-    for line in hFile:
+def convertCharacter(val):
+    if val == -1:
+        # No character received
+        return 'END OF INPUT'
+    return chr(val)
+
+
+# Functions to convert the values of parameters (by name) to something more readable before they're formatted
+paramConverters = {"config.deviceFunction": valToFunction, "character": convertCharacter}
+
+
+def noConversion(val):
+    return val
+
+
+def parseVersion(hFileContents):
+    for line in hFileContents.splitlines():
         if 'BREWPI_LOG_MESSAGES_VERSION ' in line:
             splitLine = line.split('BREWPI_LOG_MESSAGES_VERSION')
             return int(splitLine[1])  # return version number
@@ -61,53 +85,84 @@ def getVersion():
     return 0
 
 
+def compileMessages(hFileContents):
+    # Returns the messages in the header, in a form that can be saved as JSON
+    messages = {}
+    for logType, enumName in messageEnums.items():
+        messages[logType] = {}
+        for logId, message in parseEnum.parseEnumInFile(logMessagesFile, enumName).items():
+            printString = message['logString'].replace("%d", "%s").replace("%c", "%s")
+            messages[logType][logId] = {'format': printString, 'paramNames': message['paramNames'],
+                                        'numVars': printString.count("%s")}
+    return {'version': parseVersion(hFileContents), 'messages': messages}
+
+
+def loadCompiledMessages():
+    with open(logMessagesFile, 'rb') as hFile:
+        hFileContents = hFile.read()
+    headerHash = hashlib.sha1(hFileContents).hexdigest()
+
+    try:
+        with open(cacheFile) as f:
+            compiled = json.load(f)
+        if compiled.get('hash') == headerHash:
+            return compiled
+    except (OSError, ValueError):
+        pass  # No (valid) cache yet
+
+    compiled = compileMessages(hFileContents.decode(encoding="utf-8", errors="replace"))
+    compiled['hash'] = headerHash
+    try:
+        # Write to a temporary file first, as other scripts could be reading the cache at the same time
+        os.makedirs(os.path.dirname(cacheFile), exist_ok=True)
+        tempFile = "{0}.{1}".format(cacheFile, os.getpid())
+        with open(tempFile, 'w') as f:
+            json.dump(compiled, f)
+        os.replace(tempFile, cacheFile)
+    except OSError:
+        pass  # We can still use what we parsed - it just won't be cached for next time
+    return compiled
+
+
+def loadMessages():
+    global messageTables, messagesVersion
+    if messageTables is None:
+        compiled = loadCompiledMessages()
+        tables = {}
+        for logType, messages in compiled['messages'].items():
+            tables[logType] = {int(logId): ("{0} {1}: ".format(logTypeStrings[logType], logId), message['format'],
+                                            tuple(paramConverters.get(name, noConversion)
+                                                  for name in message['paramNames']),
+                                            message['numVars'])
+                               for logId, message in messages.items()}
+        messagesVersion = compiled['version']
+        messageTables = tables
+    return messageTables
+
+
+def getVersion():
+    loadMessages()
+    return messagesVersion
+
+
 def expandLogMessage(logMessageJsonString):
-    expanded = ""
     logMessageJson = json.loads(logMessageJsonString)
     logId = int(logMessageJson['logID'])
     logType = logMessageJson['logType']
     values = logMessageJson['V']
-    dict = 0
-    logTypeString = "**UNKNOWN MESSAGE TYPE**"
-    if logType == "E":
-        dict = errorDict
-        logTypeString = "ERROR"
-    elif logType == "W":
-        dict = warningDict
-        logTypeString = "WARNING"
-    elif logType == "I":
-        dict = infoDict
-        logTypeString = "INFO MESSAGE"
-
-    if logId in dict:
-        expanded += logTypeString + " "
-        expanded += str(logId) + ": "
-        count = 0
-        for v in values:
-            try:
-                if dict[logId]['paramNames'][count] == "config.deviceFunction":
-                    values[count] = valToFunction(v)
-                elif dict[logId]['paramNames'][count] == "character":
-                    if values[count] == -1:
-                        # No character received
-                        values[count] = 'END OF INPUT'
-                    else:
-                        values[count] = chr(values[count])
-            except IndexError:
-                pass
-            count += 1
-        printString = dict[logId]['logString'].replace("%d", "%s").replace("%c", "%s")
-        numVars = printString.count("%s")
-        numReceived = len(values)
-        if numVars == numReceived:
-            expanded += printString % tuple(values)
-        else:
-            expanded += printString + "  | Number of arguments mismatch!, expected " + str(
-                numVars) + "arguments, received " + str(values)
+    message = loadMessages().get(logType, {}).get(logId)
+    if message is None:
+        return logTypeStrings.get(logType, "**UNKNOWN MESSAGE TYPE**") + " with unknown ID " + str(logId)
+
+    prefix, printString, converters, numVars = message
+    if converters:
+        # Convert the values we know how to - any beyond the named parameters are left as they are
+        values = [convert(v) for convert, v in zip(converters, values)] + values[len(converters):]
+    if numVars == len(values):
+        return prefix + printString % tuple(values)
     else:
-        expanded += logTypeString + " with unknown ID " + str(logId)
-
-    return expanded
+        return prefix + printString + "  | Number of arguments mismatch!, expected " + str(
+            numVars) + "arguments, received " + str(values)
 
 
 def filterOutLogMessages(input_string):
@@ -127,5 +182,3 @@ if __name__ == '__main__':
     stripped, messages = filterOutLogMessages(test_string)
     print('Stripped line: {0}'.format(stripped))
     print('messages: {0}'.format(messages))
-
-getVersion()
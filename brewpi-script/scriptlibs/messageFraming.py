@@ -0,0 +1,46 @@
+# Framing for messages between Fermentrack and BrewPi-Script over the script's socket. The same format is implemented
+# on the Fermentrack side in app/brewpi_socket.py - keep the two in step.
+#
+# Each frame is a header (MAGIC, request ID, flags, payload length) followed by the payload - for a request the
+# message ("setBeer=20.0"), and for a response the reply to it. Responses carry the ID of the request they answer. A
+# connection that starts with MAGIC stays open for any number of requests; anything else is treated as a single
+# unframed message, as sent by older versions of Fermentrack.
+
+import struct
+
+MAGIC = b'BPF1'
+HEADER = struct.Struct(">4sIBI")  # magic, request ID, flags, payload length
+MAX_PAYLOAD = 16 * 1024 * 1024
+
+FLAG_NO_REPLY = 0x01  # Request: the sender isn't waiting for a response, so don't send one
+FLAG_NO_RESPONSE = 0x02  # Response: the message doesn't have a response (rather than having an empty one)
+
+
+def is_framed(data):
+    return data.startswith(MAGIC)
+
+
+def pack_frame(request_id, flags, payload):
+    if hasattr(payload, 'encode'):
+        payload = payload.encode(encoding="cp437")
+    return HEADER.pack(MAGIC, request_id, flags, len(payload)) + payload
+
+
+class FrameDecoder():
+    """Collects received data, returning each complete frame as a (request ID, flags, payload) tuple"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        while len(self.buffer) >= HEADER.size:
+            magic, request_id, flags, length = HEADER.unpack_from(self.buffer)
+            if magic != MAGIC or length > MAX_PAYLOAD:
+                raise ValueError("Invalid message frame")
+            if len(self.buffer) < HEADER.size + length:
+                break
+            frames.append((request_id, flags, bytes(self.buffer[HEADER.size:HEADER.size + length])))
+            del self.buffer[:HEADER.size + length]
+        return frames
@@ -0,0 +1,189 @@
+import contextvars
+import threading
+
+import queue as Queue
+import time
+
+import requests
+
+from . import BrewPiUtil
+from .runtimeMetrics import LatencyStats
+
+
+class PointSender():
+    """
+    Sends log points to an HTTP API from a background thread so that a slow (or restarting) web server never holds up
+    the main BrewPi-Script loop. Points are queued by send(), and the background thread posts them as a JSON list -
+    coalescing everything that has built up in the queue into a single request - over a keep-alive session.
+
+    If a PointSpool is provided, points that can't be sent because the API is unreachable (or returns a server error)
+    are written to it instead, and are sent - oldest first, and ahead of any new points - once the API is back. While
+    the API is down, attempts to reach it are spaced out with an exponential backoff. If the API only saves some of a
+    batch (HTTP 207), just the points that it lists as failed are retried.
+    """
+
+    MAX_QUEUED_POINTS = 1000  # Once full, the oldest points are dropped to make room for new ones
+    MAX_BATCH_SIZE = 100
+    TIMEOUT = (5, 30)  # (connect, read) timeouts for each request, in seconds
+    MIN_BACKOFF = 2  # seconds
+    MAX_BACKOFF = 300
+
+    # Results of trying to send a batch of points
+    SENT = 0
+    RETRY = 1  # The API couldn't be reached (or had an error) - try again later
+    REJECTED = 2  # The API refused the points (e.g. the device was deleted) - sending them again won't help
+    PARTIAL = 3  # Some of the points weren't saved - only those that failed (rather than were rejected) are retried
+
+    def __init__(self, url, spool=None):
+        self.url = url
+        self.spool = spool
+        self.session = None
+        self.queue = Queue.Queue(maxsize=self.MAX_QUEUED_POINTS)
+        self.thread = None
+        self.dropped = 0
+        self.backoff = 0
+        self.retry_at = 0
+        self.run = False
+        self.post_latency = LatencyStats()  # How long each attempt to deliver a batch took
+
+    # public interface is start/stop/send/spool_depth/metrics
+    def start(self):
+        self.run = True
+        if not self.thread:
+            # Connections are opened here (rather than in __init__) so that they belong to the process that uses them
+            self._open()
+            # The thread runs in a copy of the caller's context so that it logs wherever the caller does
+            self.thread = threading.Thread(target=contextvars.copy_context().run, args=(self.__sendThread,))
+            self.thread.setDaemon(True)
+            self.thread.start()
+
+    def stop(self):
+        """Stops the background thread once anything that is already queued has been sent (or spooled)"""
+        self.run = False
+        if self.thread:
+            self.thread.join()  # wait for background thread to terminate
+            self.thread = None
+        self._close()
+
+    def send(self, point):
+        while True:
+            try:
+                self.queue.put_nowait(point)
+                return
+            except Queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                    BrewPiUtil.logMessage("Point queue for {0} is full - dropped the oldest point".format(self.url))
+                except Queue.Empty:
+                    pass
+
+    def spool_depth(self):
+        """Returns the number of points waiting in the spool for the API to come back"""
+        return len(self.spool) if self.spool is not None else 0
+
+    def metrics(self):
+        return {'post_latency': self.post_latency.as_dict(),
+                'queued': self.queue.qsize(),
+                'dropped': self.dropped,
+                'spooled': self.spool_depth()}
+
+    def __get_batch(self, timeout):
+        try:
+            batch = [self.queue.get(timeout=timeout) if timeout else self.queue.get_nowait()]
+        except Queue.Empty:
+            return []
+        while len(batch) < self.MAX_BATCH_SIZE:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+        return batch
+
+    def _open(self):
+        self.session = requests.Session()
+
+    def _close(self):
+        if self.session:
+            self.session.close()
+            self.session = None
+
+    def _deliver(self, batch):
+        """
+        Sends a batch of points, returning one of SENT/RETRY/REJECTED along with a description of any error - or PARTIAL
+        along with the indexes (within the batch) of the points to retry
+        """
+        try:
+            response = self.session.post(self.url, json=batch, timeout=self.TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            return self.RETRY, str(e)
+
+        if response.status_code == 201:
+            return self.SENT, None
+        if response.status_code == 207:
+            try:
+                return self.PARTIAL, [int(index) for index in response.json()['failed']]
+            except (KeyError, TypeError, ValueError):
+                return self.RETRY, "HTTP 207 without a list of the points that failed"
+        if 400 <= response.status_code < 500 and response.status_code not in [408, 429]:
+            return self.REJECTED, "HTTP {0}".format(response.status_code)
+        return self.RETRY, "HTTP {0}".format(response.status_code)
+
+    def __post(self, batch):
+        """Tries to send a batch of points, returning the points that should be sent again later"""
+        if time.time() < self.retry_at:
+            return batch  # Still backing off from the last failure
+
+        started = time.monotonic()
+        result, error = self._deliver(batch)
+        self.post_latency.record(time.monotonic() - started)
+        unsent = batch if result == self.RETRY else []
+        if result == self.REJECTED:
+            BrewPiUtil.logMessage("{0} rejected {1} point(s) ({2}) - dropping them".format(self.url, len(batch), error))
+        elif result == self.PARTIAL:
+            unsent = [batch[index] for index in error if 0 <= index < len(batch)]
+            BrewPiUtil.logMessage("{0} only saved some of {1} point(s) - retrying the {2} that failed".format(
+                self.url, len(batch), len(unsent)))
+
+        if not unsent:
+            if self.backoff:
+                BrewPiUtil.logMessage("{0} is reachable again".format(self.url))
+            self.backoff = 0
+            self.retry_at = 0
+        else:
+            self.backoff = min(max(self.backoff * 2, self.MIN_BACKOFF), self.MAX_BACKOFF)
+            self.retry_at = time.time() + self.backoff
+            if result == self.RETRY:
+                BrewPiUtil.logMessage("Unable to save points to {0} ({1}) - retrying in {2} seconds".format(
+                    self.url, error, self.backoff))
+        return unsent
+
+    def __drain_spool(self):
+        points, end_offset = self.spool.peek(self.MAX_BATCH_SIZE)
+        unsent = self.__post(points)
+        if unsent is not points:
+            self.spool.remove(end_offset)
+            if unsent:
+                # Points that failed are sent again after anything else that is spooled
+                self.spool.append(unsent)
+
+    def __sendThread(self):
+        while self.run or not self.queue.empty():
+            spool_waiting = self.spool_depth() > 0 and time.time() >= self.retry_at
+            # Don't wait on the queue if there is a backlog in the spool that can be worked through
+            batch = self.__get_batch(0 if spool_waiting else 1)
+
+            if batch:
+                if self.spool_depth() > 0:
+                    # Keep the points in order by sending new ones after anything that is already spooled
+                    self.spool.append(batch)
+                else:
+                    unsent = self.__post(batch)
+                    if unsent and self.spool is not None:
+                        self.spool.append(unsent)
+                    else:
+                        self.dropped += len(unsent)
+
+            if self.spool_depth() > 0 and time.time() >= self.retry_at:
+                self.__drain_spool()
+        self.run = False
@@ -0,0 +1,125 @@
+import json
+import os
+
+from . import BrewPiUtil
+
+
+class PointSpool():
+    """
+    An append-only, size-capped file of log points that couldn't be sent yet, stored one JSON object per line. Points
+    are read back in the order they were added, and how far the spool has been sent is kept in a small ".offset"
+    sidecar so that a restart picks up where it left off. Once everything has been sent the spool is emptied.
+
+    A point that was sent just before a crash (but before the offset was saved) will be sent again after the restart.
+    """
+
+    def __init__(self, path, max_bytes=16 * 1024 * 1024):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.max_bytes = max_bytes
+        self.dropped = 0
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.__repair()
+        self.offset = self.__load_offset()
+        self.depth = self.__count_points()
+
+    def __len__(self):
+        return self.depth
+
+    def __size(self):
+        return os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+
+    def __repair(self):
+        # A point that was being appended when the power was cut leaves a torn last line - drop it
+        size = self.__size()
+        if size == 0:
+            return
+        with open(self.path, 'rb+') as f:
+            f.seek(0)
+            data = f.read()
+            if not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def __load_offset(self):
+        try:
+            with open(self.offset_path, 'r') as f:
+                offset = int(f.read().strip())
+        except (OSError, ValueError):
+            return 0
+        return offset if 0 <= offset <= self.__size() else 0
+
+    def __save_offset(self):
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(str(self.offset))
+        os.replace(tmp_path, self.offset_path)
+
+    def __count_points(self):
+        if self.__size() <= self.offset:
+            return 0
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            return sum(1 for _ in f)
+
+    def __compact(self):
+        """Rewrites the spool without the points that have already been sent"""
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            unsent = f.read()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(unsent)
+            f.flush()
+            os.fsync(f.fileno())
+        # The offset is reset first - if the replace is then interrupted, points are sent twice rather than lost
+        self.offset = 0
+        self.__save_offset()
+        os.replace(tmp_path, self.path)
+
+    def append(self, points):
+        data = b"".join(json.dumps(point).encode('utf-8') + b"\n" for point in points)
+        if self.__size() + len(data) > self.max_bytes and self.offset > 0:
+            self.__compact()
+        if self.__size() + len(data) > self.max_bytes:
+            # The oldest points are kept so that the log doesn't have gaps in the middle of it
+            self.dropped += len(points)
+            BrewPiUtil.logMessage("Point spool {0} is full - dropped {1} point(s)".format(self.path, len(points)))
+            return 0
+
+        with open(self.path, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.depth += len(points)
+        return len(points)
+
+    def peek(self, max_points):
+        """Returns up to max_points of the oldest unsent points, along with the offset to pass to remove() once sent"""
+        points = []
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            end_offset = self.offset
+            for line in f:
+                if len(points) >= max_points:
+                    break
+                end_offset += len(line)
+                try:
+                    points.append(json.loads(line))
+                except ValueError:
+                    BrewPiUtil.logMessage("Skipping unreadable point in spool {0}".format(self.path))
+        return points, end_offset
+
+    def remove(self, end_offset):
+        """Marks everything before end_offset (as returned by peek()) as sent"""
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            self.depth -= f.read(end_offset - self.offset).count(b"\n")
+        self.offset = end_offset
+        if self.depth <= 0:
+            self.depth = 0
+            # Everything has been sent - start the spool over rather than letting it grow
+            with open(self.path, 'wb'):
+                pass
+            self.offset = 0
+        self.__save_offset()
@@ -0,0 +1,26 @@
+import threading
+
+
+class LatencyStats():
+    """
+    Keeps the count, total and maximum of a series of durations (in seconds) - enough for a reader to work out the
+    average over any period by comparing two readings, without keeping the durations themselves. Durations can be
+    recorded from any thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        with self.lock:
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def as_dict(self):
+        with self.lock:
+            return {'count': self.count, 'total': round(self.total, 6), 'max': round(self.max, 6)}
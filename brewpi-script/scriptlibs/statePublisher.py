@@ -0,0 +1,109 @@
+import contextvars
+import threading
+import time
+
+import redis
+
+from . import BrewPiUtil
+
+
+class StatePublisher():
+    """
+    Publishes a snapshot of the script's state (LCD, temperatures, settings...) to a Redis hash so that Fermentrack can
+    read it without asking the script over its socket. Fields are passed to update() as strings, and only those that
+    have changed are written, from a background thread, along with an "updated_at" timestamp. The timestamp is
+    refreshed every HEARTBEAT_INTERVAL even if nothing has changed, so that readers can tell whether the snapshot is
+    current.
+    """
+
+    HEARTBEAT_INTERVAL = 5  # seconds
+    FULL_REFRESH_INTERVAL = 60  # Every field is rewritten this often, in case Redis lost them (e.g. on a restart)
+    TIMEOUT = 5
+
+    def __init__(self, redis_url, key, ttl):
+        self.redis_url = redis_url
+        self.key = key
+        self.ttl = ttl  # The hash expires if it isn't updated for this long (e.g. if the script is killed)
+        self.client = None
+        self.published = {}  # The value of each field, as of the last update() call
+        self.pending = {}  # Fields that have changed but haven't been written yet
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.run = False
+        self.failing = False
+        self.last_full_refresh = 0
+
+    # public interface is start/stop/update
+    def start(self):
+        self.run = True
+        if not self.thread:
+            self.client = redis.Redis.from_url(url=self.redis_url, socket_timeout=self.TIMEOUT,
+                                               socket_connect_timeout=self.TIMEOUT)
+            # The thread runs in a copy of the caller's context so that it logs wherever the caller does
+            self.thread = threading.Thread(target=contextvars.copy_context().run, args=(self.__publishThread,))
+            self.thread.setDaemon(True)
+            self.thread.start()
+
+    def stop(self):
+        """Stops the background thread and removes the snapshot, so that it isn't mistaken for a running script"""
+        self.run = False
+        self.wake.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        if self.client:
+            try:
+                self.client.delete(self.key)
+            except redis.exceptions.RedisError:
+                pass
+            self.client.close()
+            self.client = None
+
+    def update(self, fields):
+        with self.lock:
+            for field, value in fields.items():
+                if self.published.get(field) != value:
+                    self.published[field] = value
+                    self.pending[field] = value
+            if self.pending:
+                self.wake.set()
+
+    def __take_pending(self):
+        with self.lock:
+            if time.time() - self.last_full_refresh >= self.FULL_REFRESH_INTERVAL:
+                self.last_full_refresh = time.time()
+                pending = dict(self.published)
+            else:
+                pending = self.pending
+            self.pending = {}
+            return pending
+
+    def __restore_pending(self, pending):
+        # Writing failed - put the fields back (unless they've changed again since) to be retried
+        with self.lock:
+            for field, value in pending.items():
+                self.pending.setdefault(field, value)
+
+    def __publishThread(self):
+        while self.run:
+            self.wake.wait(self.HEARTBEAT_INTERVAL)
+            self.wake.clear()
+            if not self.run:
+                break
+
+            pending = self.__take_pending()
+            pipe = self.client.pipeline(transaction=False)
+            pipe.hset(self.key, mapping=dict(pending, updated_at=repr(time.time())))
+            pipe.expire(self.key, self.ttl)
+            try:
+                pipe.execute()
+            except redis.exceptions.RedisError as e:
+                if not self.failing:
+                    BrewPiUtil.logMessage("Unable to publish state to Redis: {0}".format(str(e)))
+                self.failing = True
+                self.__restore_pending(pending)
+                continue
+            if self.failing:
+                BrewPiUtil.logMessage("Publishing state to Redis again")
+                self.failing = False
@@ -0,0 +1,49 @@
+import json
+
+import redis
+
+from .pointSender import PointSender
+
+
+class StreamPointSender(PointSender):
+    """
+    A PointSender that adds each point to a Redis stream rather than posting it to the Fermentrack API. The points are
+    read back & written to the logs by Fermentrack's `manage.py consume_log_points`. Points are spooled (if a spool is
+    provided) while Redis is unreachable, exactly as they are for the API - or while the stream already holds max_length
+    points that haven't been consumed.
+    """
+
+    TIMEOUT = 5  # seconds
+
+    def __init__(self, redis_url, stream_key, max_length, spool=None):
+        # The stream key stands in for the URL in messages, as the Redis URL can include a password
+        super().__init__("Redis stream {0}".format(stream_key), spool)
+        self.redis_url = redis_url
+        self.stream_key = stream_key
+        self.max_length = max_length
+        self.client = None
+
+    def _open(self):
+        self.client = redis.Redis.from_url(url=self.redis_url, socket_timeout=self.TIMEOUT,
+                                           socket_connect_timeout=self.TIMEOUT)
+
+    def _close(self):
+        if self.client:
+            self.client.close()
+            self.client = None
+
+    def _deliver(self, batch):
+        try:
+            # Entries are never trimmed from the stream, as that would lose points the consumer hasn't written yet.
+            # Once the stream is full, points are spooled until the consumer catches up.
+            if self.client.xlen(self.stream_key) + len(batch) > self.max_length:
+                return self.RETRY, "stream is full"
+            # The batch is added in a single transaction, so one that failed part way never needs to be resent (and
+            # duplicated) in part
+            pipe = self.client.pipeline(transaction=True)
+            for point in batch:
+                pipe.xadd(self.stream_key, {'point': json.dumps(point)})
+            pipe.execute()
+        except redis.exceptions.RedisError as e:
+            return self.RETRY, str(e)
+        return self.SENT, None
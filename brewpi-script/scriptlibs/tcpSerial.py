@@ -1,10 +1,12 @@
 # wraps a tcp socket stream in a object that looks like a serial port
 # this allows seemless integration with exsiting brewpi-script code
 
-import socket, errno
+import socket, errno, select
 from . import mdnsLocator
 import os, sys, time
 
+from serial import SerialException
+
 
 # Copying this in from BrewPiUtil to prevent chained imports
 def printStdErr(*objs):
@@ -17,13 +19,34 @@ def logMessage(message):
     printStdErr(time.strftime("%b %d %Y %H:%M:%S   ") + message)
 
 class TCPSerial(object):
+    """
+    A buffered TCP connection to a controller (ESP8266/ESP32) that behaves like a pyserial Serial object, so that it can
+    be used interchangeably with one by BackGroundSerial and getVersionFromSerial.
+
+    Received data is read from the socket in blocks into a buffer, which read(), readline() and in_waiting work from.
+    timeout follows pyserial - None blocks until the read is complete, 0 returns immediately with whatever has been
+    received, and anything else is the maximum number of seconds to wait. If the connection drops it is reestablished,
+    backing off exponentially between attempts, and a SerialException is raised if that fails.
+    """
+
+    CONNECT_TIMEOUT = 5  # seconds
+    RECV_SIZE = 4096
+    MIN_RECONNECT_DELAY = 0.5  # seconds - doubled after each failed attempt to reconnect...
+    MAX_RECONNECT_DELAY = 30  # ...up to this
+    KEEPALIVE_IDLE = 10  # seconds of silence before keepalive probes are sent...
+    KEEPALIVE_INTERVAL = 5  # ...how far apart they are...
+    KEEPALIVE_COUNT = 3  # ...and how many can go unanswered before the connection is considered dead
+
     def __init__(self, host=None, port=None, hostname=None):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock = None
+        self.rx_buffer = bytearray()
         # find BrewPi's via mdns lookup
         self.host=host
         self.port=port
         self.retries=10 # max reconnect attempts to try when doing a read or write operation
         self.retryCount=0 # count of reconnect attempts performed
+        self.timeout = 0.5
+        self._write_timeout = None
 
         if host is None:
             logMessage(f"No IP address provided - cannot connect to BrewPi")  # This -should- never get tripped
@@ -33,93 +56,127 @@ class TCPSerial(object):
             logMessage("Connecting to BrewPi " + hostname + " (via " + host + ") on port " + str(port))
         else:
             logMessage("Connecting to BrewPi " + host + " on port " + str(port))
-        self.open()
-        self.setTimeout(0.5)
-        # self.timeout=self.sock.gettimeout()
         self.name=host + ':' + str(port)
-        return      
-        
-    def flushInput(self):
-        # this has no meaning to tcp
+        self.open()
         return
-    
+
+    @property
+    def write_timeout(self):
+        return self._write_timeout
+
+    @write_timeout.setter
+    def write_timeout(self, value):
+        # Reads never block on the socket itself (they wait in select()) so the socket's timeout only applies to writes
+        self._write_timeout = value
+        if self.sock:
+            self.sock.settimeout(value)
+
+    @property
+    def in_waiting(self):
+        # Return the number of bytes in the receive buffer, after picking up anything that has arrived on the socket
+        self._fill(0)
+        return len(self.rx_buffer)
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def fileno(self):
+        # Lets BackGroundSerial wait on the socket with select() rather than polling
+        if not self.sock:
+            raise SerialException("Connection to " + self.name + " is not open")
+        return self.sock.fileno()
+
+    def flushInput(self):
+        # Discard anything that has been received but not read
+        self._fill(0)
+        self.rx_buffer.clear()
+
+    reset_input_buffer = flushInput
+
     def flushOutput(self):
         #Clear output buffer, aborting the current output and discarding all that is in the buffer.
         # this has no meaning to tcp
         return
 
+    def _deadline(self):
+        return None if self.timeout is None else time.monotonic() + self.timeout
+
+    def _remaining(self, deadline):
+        return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+    def _fill(self, timeout):
+        """Waits up to timeout seconds (None for forever) for data, and adds whatever is received to the buffer"""
+        if not self.sock:
+            raise SerialException("Connection to " + self.name + " is not open")
+        try:
+            readable, _, _ = select.select([self.sock], [], [], timeout)
+            if not readable:
+                return 0
+            data = self.sock.recv(self.RECV_SIZE)
+        except (socket.error, ValueError):  # socket errors probably mean we lost our connection.  try to recover it.
+            data = b''
+        if not data:
+            # A socket that is readable but returns nothing has been closed by the other end
+            logMessage("Lost connection to controller on read. Attempting to reconnect.")
+            self.reconnect()
+            return 0
+        self.rx_buffer += data
+        return len(data)
+
+    def _take(self, size):
+        data = bytes(self.rx_buffer[:size])
+        del self.rx_buffer[:size]
+        return data
+
     def read(self, size=1):
         # Returns:    Bytes read from the port.
-        # Read size bytes_read from the serial port. If a timeout is set it may return less characters as requested. With no timeout it will block until the requested number of bytes_read is read.
-        bytes_read = None
-        try: 
-            bytes_read = self.sock.recv(size)
-        except socket.timeout:  # timeout on receive just means there is nothing in the buffer.  This is not an error
-            return None
-        except socket.error:  # other socket errors probably mean we lost our connection.  try to recover it.
-            bytes_read = b''
-        # Because an empty buffer returns socket.timeout, bytes_read being none or a blank bytestring means that we're
-        # disconnected. Print a message & attempt to reconnect
-        if bytes_read is None or bytes_read == b'':
-            logMessage("Lost connection to controller on read. Attempting to reconnect.")
-            self.close()
-            self.open()
-            # TODO - add another "read" here
+        # Read size bytes from the connection. If a timeout is set it may return less characters as requested. With no
+        # timeout it will block until the requested number of bytes is read.
+        deadline = self._deadline()
+        while len(self.rx_buffer) < size:
+            remaining = self._remaining(deadline)
+            if self._fill(remaining) == 0 and remaining is not None and time.monotonic() >= deadline:
+                break
+        return self._take(size)
+
+    def readline(self, size=None, eol=b'\n'):
+        # Read a line which is terminated with end-of-line (eol) character (\n by default) or until timeout. As with
+        # pyserial, the eol character is included in the line returned.
+        deadline = self._deadline()
+        searched = 0
+        while True:
+            end = self.rx_buffer.find(eol, searched)
+            if end >= 0:
+                return self._take(end + len(eol) if size is None else min(end + len(eol), size))
+            if size is not None and len(self.rx_buffer) >= size:
+                return self._take(size)
+            searched = len(self.rx_buffer)
+            remaining = self._remaining(deadline)
+            if self._fill(remaining) == 0 and remaining is not None and time.monotonic() >= deadline:
+                return self._take(len(self.rx_buffer))  # Timed out - return the partial line, as pyserial does
 
-        if hasattr(bytes_read, 'decode'):
-            return bytes_read.decode(encoding="cp437")
-        else:
-            return bytes_read
-
-    def readline(self, size=None, eol='\n'):
-        #Parameters:    
-        #Read a line which is terminated with end-of-line (eol) character (\n by default) or until timeout.
-        buf=self.read(1)
-        line=buf
-        while buf is not None and buf!='\n':
-            buf=self.read(1)
-            if buf is not None and buf!='\n':
-                line+=buf
-        return line
-            
-   
     def write(self, data):
         #Returns:    Number of bytes written.
-        #Raises SerialTimeoutException:
-        #     In case a write timeout is configured for the port and the time is exceeded.
         #Write the string data to the port.
+        if hasattr(data, 'encode'):
+            # This feels so wrong...
+            bytes_data = data.encode(encoding="cp437")
+        else:
+            bytes_data = data
+        if not self.sock:
+            raise SerialException("Connection to " + self.name + " is not open")
         try:
-            if hasattr(data, 'encode'):
-                # This feels so wrong...
-                bytes_data = data.encode(encoding="cp437")
-            else:
-                bytes_data = data
-            bytes_returned=self.sock.sendall(bytes_data)
-        except socket.timeout: # A write timeout is probably a connection issue
-            logMessage("Lost connection to controller on write. Attempting to reconnect.")
-            self.close()
-            self.open()
-            bytes_returned=self.write(data)
-        except socket.error: # general errors are most likely to be a timeout disconnect from BrewPi, so try to recover.
+            self.sock.sendall(bytes_data)
+        except (socket.timeout, socket.error):  # general errors are most likely to be a disconnect from BrewPi
             logMessage("Lost connection to controller on write. Attempting to reconnect.")
-            self.close()
-            self.open()
-            bytes_returned=self.write(data)
-
+            self.reconnect()
+            self.sock.sendall(bytes_data)
         return len(data)
-    
-    def inWaiting(self):
-        #Return the number of chars in the receive buffer.
-        # Note: the value returned by inWaiting should be greater than the send buffer size on BrewPi firmware
-        # If not, brewpi.py may not grab the next whole buffered message.
-        return 4096  #tcp socket doesnt give us a way to know how much is in the buffer, so we assume there is always something
 
     def setTimeout(self, value=0.1):
-        if value:
-            self.sock.settimeout(value)
-            self.timeout=self.sock.gettimeout()
-        return self.sock.gettimeout()
-    
+        self.timeout = value
+        return self.timeout
+
     def flush(self):
         # Flush of file like objects. In this case, wait until all data is written.
         # This has no meaning for TCP
@@ -127,14 +184,17 @@ class TCPSerial(object):
 
     def close(self):
         # Shutdown, then close port
+        if self.sock is None:
+            return
         try:
             self.sock.shutdown(socket.SHUT_RDWR)
         except OSError as exc:
-            if exc.errno == errno.ENOTCONN:
-                pass  # Socket is not connected, so can't send FIN packet.
-            else:
-                raise
-        return self.sock.close()
+            if exc.errno != errno.ENOTCONN:
+                logMessage("Error shutting down connection to controller: " + str(exc))
+        finally:
+            self.sock.close()
+            self.sock = None
+            self.rx_buffer.clear()
 
     def isOpen(self):
         if self.sock:
@@ -142,29 +202,47 @@ class TCPSerial(object):
         else:
             return False
 
+    @property
+    def is_open(self):
+        return self.isOpen()
+
+    def _set_keepalive(self, sock):
+        # Detect a controller that has gone away (e.g. lost power) without closing the connection
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, 'TCP_KEEPIDLE'):  # These are Linux specific
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.KEEPALIVE_IDLE)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, self.KEEPALIVE_INTERVAL)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, self.KEEPALIVE_COUNT)
+
     def open(self):
+        """Makes a single attempt to connect, raising OSError (or socket.timeout) if it fails"""
         mdnsLocator.locate_brewpi_services()  # This causes all the BrewPi devices to resend their mDNS info
 
-        connected = False
-
-        # TODO - Debug this. Currently, reconnection doesn't actually work.
-        while self.retryCount < self.retries:
+        sock = socket.create_connection((self.host, self.port), timeout=self.CONNECT_TIMEOUT)
+        try:
+            self._set_keepalive(sock)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Commands are short - send them immediately
+            sock.settimeout(self._write_timeout)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+        self.rx_buffer.clear()
+        logMessage("Successfully connected to controller.")
+
+    def reconnect(self):
+        """Reconnects, backing off exponentially between attempts. Raises SerialException if it can't reconnect."""
+        self.close()
+        delay = self.MIN_RECONNECT_DELAY
+        for self.retryCount in range(1, self.retries + 1):
             try:
-                self.sock.connect((self.host, self.port))
-                connected = True
-                break
-            except (socket.gaierror) as e:
-                self.retryCount += 1
-                # time.sleep(1)
-            except (socket.error) as e:  # Catches "bad file descriptor" error
-                self.retryCount += 1
-                # time.sleep(1)
-
-        if connected:
-            logMessage("Successfully connected to controller.")
-            self.retryCount = 0
-        else:
-            logMessage("Unable to connect to BrewPi " + self.host + " on port " + str(self.port) + ". Exiting.")
-            sys.exit(1)
-
-
+                self.open()
+                self.retryCount = 0
+                return
+            except OSError as e:
+                logMessage(f"Unable to reconnect to BrewPi {self.host} on port {self.port} ({e}) - "
+                           f"attempt {self.retryCount} of {self.retries}")
+            if self.retryCount < self.retries:
+                time.sleep(delay)
+                delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
+        raise SerialException("Unable to reconnect to BrewPi " + self.host + " on port " + str(self.port))
@@ -0,0 +1,314 @@
+import asyncio
+import collections
+import json
+import threading
+import unittest
+from unittest import mock
+
+import brewpi
+from scriptlibs import messageFraming
+from scriptlibs.brewpiScriptConfig import BrewPiScriptConfig
+
+
+class FakeConfig(BrewPiScriptConfig):
+    """A BrewPiScriptConfig that records what the engine asks of it, in the order it was asked"""
+
+    def __init__(self, calls):
+        super().__init__()
+        self.calls = calls
+        self.temp_format = self.TEMP_FORMAT_CELSIUS
+        self.use_inet_socket = True
+        self.socket_host = "127.0.0.1"
+        self.socket_port = 0  # Any free port
+        self.live = False
+        self.on_change = None
+        self.points = []
+        self.published = {}
+
+    def get_profile_temp(self):
+        return 20.0
+
+    def is_past_end_of_profile(self):
+        return False
+
+    def reset_profile(self):
+        pass
+
+    def refresh(self):
+        self.calls.append('refresh')
+        return True
+
+    def reload_fields(self, fields):
+        self.calls.append(('reload_fields', fields))
+        if 'data_point_log_interval' in fields:
+            self.data_point_log_interval = 60
+
+    def profile_changed(self, profile_id):
+        self.calls.append(('profile_changed', profile_id))
+
+    def save_beer_log_point(self, beer_row):
+        self.points.append(dict(beer_row))
+
+    def publish_state(self, fields):
+        self.published.update(fields)
+
+    def watch_changes(self, on_change):
+        self.on_change = on_change
+
+    def changes_live(self):
+        return self.live
+
+    def stop_sending(self):
+        self.calls.append('stop_sending')
+
+    def stop_publishing(self):
+        self.calls.append('stop_publishing')
+
+    def stop_watching(self):
+        self.calls.append('stop_watching')
+
+
+class FakeSerial:
+    name = "/dev/fake"
+
+    def __init__(self, calls):
+        self.calls = calls
+        self.open = True
+
+    def flush(self):
+        pass
+
+    def isOpen(self):
+        return self.open
+
+    def close(self):
+        self.calls.append('ser.close')
+        self.open = False
+
+
+class FakeController:
+    """Stands in for BackGroundSerial, answering commands the way a controller would"""
+
+    REPLIES = {
+        's': 'S:{"mode": "b", "beerSet": 19.0, "fridgeSet": 18.0, "heatEst": 0.2, "coolEst": 5}',
+        'c': 'C:{"tempFormat": "C", "tempSetMin": 1.0, "tempSetMax": 30.0}',
+        'v': 'V:{"beer": [{}], "fridge": [{}]}',
+        'x': 'X:{"invertTFT": 0, "glycol": 0}',
+        't': 'T:{"BeerTemp": 19.5, "BeerSet": 19.0, "BeerAnn": null, "FridgeTemp": 18.25, "FridgeSet": 18.0, '
+             '"FridgeAnn": null, "RoomTemp": 22.0, "State": 4}',
+        'd{r:1}': 'd:[{"c": 1, "b": 0, "f": 0, "h": 1, "p": 5, "x": 0, "d": 0, "a": "28FF0000", "j": 0.0}]',
+        'h{u:-1,v:1}': 'h:[]',
+    }
+
+    calls = None  # Set by the test case
+
+    def __init__(self, ser):
+        self.ser = ser
+        self.on_receive = None
+        self.fatal_error = None
+        self.lines = collections.deque()
+        self.written = []
+
+    def start(self):
+        pass
+
+    def send(self, line):
+        self.lines.append(line)
+        self.on_receive()
+
+    def writeln(self, data):
+        self.written.append(data)
+        if data in self.REPLIES:
+            self.send(self.REPLIES[data])
+
+    def read_line(self):
+        return self.lines[0] if self.lines else None
+
+    def line_was_processed(self):
+        self.lines.popleft()
+
+    def read_message(self):
+        return None
+
+    def metrics(self):
+        return {}
+
+    def stop(self):
+        self.calls.append('bg_ser.stop')
+
+
+class BrewPiEngineTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.calls = []
+        self.config = FakeConfig(self.calls)
+        self.engine = brewpi.BrewPiEngine(self.config)
+        self.engine.output_temperature = False
+        self.logged = []
+        for patcher in [mock.patch.object(brewpi, 'logMessage', self.logged.append),
+                        mock.patch.object(brewpi, 'BackGroundSerial', FakeController),
+                        mock.patch.object(FakeController, 'calls', self.calls)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def connect(self):
+        self.engine.ser = FakeSerial(self.calls)
+
+    async def wait_until(self, condition):
+        for _ in range(200):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        self.fail("Timed out waiting for the engine")
+
+    async def start(self):
+        with mock.patch.object(self.engine, 'connect', self.connect):
+            self.run_task = asyncio.ensure_future(self.engine.run())
+            self.addAsyncCleanup(self.stop_engine)
+            await self.wait_until(lambda: self.run_task.done() or self.engine.server is not None)
+        self.assertFalse(self.run_task.done())
+        self.port = self.engine.server.sockets[0].getsockname()[1]
+        # Everything requested at startup has been answered
+        await self.wait_until(lambda: self.engine.cs['beerSet'] == 19.0 and self.engine.es and self.config.points)
+
+    async def stop_engine(self):
+        # So that a failed test doesn't leave the engine running
+        if not self.run_task.done():
+            self.engine.stop(1)
+        await asyncio.gather(self.run_task, return_exceptions=True)
+
+    async def request(self, message: str) -> str:
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        writer.write(message.encode())
+        response = await reader.read()
+        writer.close()
+        return response.decode()
+
+    async def stop(self, message: str = "stopScript") -> int:
+        await self.request(message)
+        return await asyncio.wait_for(self.run_task, 5)
+
+    # Lines from the controller
+    def test_temperature_line_is_logged(self):
+        self.engine.process_line(FakeController.REPLIES['t'])
+        self.assertEqual(self.config.points, [self.engine.prev_temp_json])
+        self.assertEqual(self.config.points[0]['BeerTemp'], 19.5)
+        self.assertEqual(self.config.points[0]['State'], 4)
+        self.assertIsNotNone(self.engine.last_temperature_time)
+
+        self.config.logging_status = self.config.DATA_LOGGING_PAUSED
+        self.engine.process_line(FakeController.REPLIES['t'].replace("19.5", "19.75"))
+        self.assertEqual(len(self.config.points), 1)
+        self.assertEqual(self.engine.dash_info()['BeerTemp'], 19.75)  # Still shown, even though it isn't logged
+
+    def test_settings_lines(self):
+        self.engine.process_line(FakeController.REPLIES['s'])
+        self.assertEqual(self.engine.cs['beerSet'], 19.0)
+        self.engine.process_line('V:{"beer": []}')
+        self.assertEqual(self.engine.cv, '{"beer": []}')
+        self.engine.process_line('L:["Mode   Beer Const.", "Beer   19.5", "Fridge 18.2", "Cooling for 01m01"]')
+        self.assertEqual(self.engine.lcd_text[0], "Mode   Beer Const.")
+        with self.assertRaises(brewpi.ScriptExit):
+            self.engine.process_line('S:{"beerSet": 19.0}')
+
+    def test_temp_format_is_synchronised(self):
+        self.engine.bg_ser = FakeController(None)
+        self.engine.process_line('C:{"tempFormat": "C"}')
+        self.assertEqual(self.engine.bg_ser.written, [])
+        self.engine.process_line('C:{"tempFormat": "F"}')
+        self.assertEqual(self.engine.bg_ser.written, ['j{"tempFormat": "C"}'])
+
+    def test_invalid_lines_are_logged(self):
+        self.engine.process_line('S:{"mode": ')
+        self.engine.process_line('Q:unknown')
+        self.assertTrue(self.logged[0].startswith("JSON decode error"))
+        self.assertEqual(self.logged[-1], "Cannot process line from controller: Q:unknown")
+
+    # Configuration changes
+    async def test_apply_change(self):
+        self.engine.loop = asyncio.get_running_loop()
+        self.config.last_profile_temp_check = brewpi.datetime.datetime.now()
+
+        await self.engine.apply_change({'fields': ['data_point_log_interval']})
+        self.assertEqual(self.calls, [('reload_fields', ['data_point_log_interval'])])
+        self.assertEqual(self.logged, ["Notification: Interval changed to 60 seconds"])
+        # The profile is checked again straight away
+        self.assertLess(self.config.last_profile_temp_check, brewpi.datetime.datetime.now() -
+                        brewpi.datetime.timedelta(hours=1))
+
+        await self.engine.apply_change({'profile': 3})
+        await self.engine.apply_change(None)  # Anything could have changed
+        self.assertEqual(self.calls[1:], [('profile_changed', 3), 'refresh'])
+
+    async def test_reload_config(self):
+        self.engine.loop = asyncio.get_running_loop()
+        await self.engine.reload_config()
+        self.config.live = True
+        await self.engine.reload_config()  # Changes are already being received, so there is nothing to reload
+        self.assertEqual(self.calls, ['refresh'])
+
+    # Running
+    async def test_unframed_requests(self):
+        await self.start()
+        self.assertEqual(await self.request("getMode"), "b")
+        self.assertEqual(json.loads(await self.request("getDashInfo"))['BeerTemp'], 19.5)
+        self.assertEqual(await self.request("setBeer=21.5"), "")
+        self.assertEqual(self.engine.bg_ser.written[-1], 'j{mode:"b", beerSet:21.5}')
+        self.assertEqual(json.loads(self.config.published['beer_set']), 21.5)
+        self.assertIn('refresh', self.calls)
+        self.assertEqual(await self.stop(), 0)
+
+    async def test_framed_requests(self):
+        await self.start()
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        writer.write(messageFraming.pack_frame(1, 0, "getMode") +
+                     messageFraming.pack_frame(2, messageFraming.FLAG_NO_REPLY, "setFridge=17.0") +
+                     messageFraming.pack_frame(3, 0, "refreshControlVariables"))
+        writer.write(messageFraming.pack_frame(4, 0, "getFridge"))
+        decoder = messageFraming.FrameDecoder()
+        frames = []
+        while len(frames) < 3:
+            data = await asyncio.wait_for(reader.read(4096), 5)
+            self.assertTrue(data)
+            frames += decoder.feed(data)
+        self.assertEqual(frames, [(1, 0, b"b"), (3, messageFraming.FLAG_NO_RESPONSE, b""), (4, 0, b"17.0")])
+        self.assertEqual(self.engine.cs['mode'], 'f')
+
+        # The connection is left open between requests, and closed when the engine stops
+        self.assertEqual(await self.stop(), 0)
+        self.assertEqual(await asyncio.wait_for(reader.read(), 5), b"")
+        writer.close()
+
+    async def test_changes_are_applied(self):
+        await self.start()
+        thread = threading.Thread(target=self.config.on_change, args=({'fields': ['data_point_log_interval']},))
+        thread.start()
+        thread.join()
+        await self.wait_until(lambda: ('reload_fields', ['data_point_log_interval']) in self.calls)
+        self.assertEqual(await self.stop(), 0)
+
+    async def test_shutdown_order(self):
+        await self.start()
+        self.assertEqual(await self.stop("quit"), 0)
+        # Queued points are sent after the controller is let go, and the port is closed last
+        self.assertEqual([call for call in self.calls if call != 'refresh'],
+                         ['bg_ser.stop', 'stop_sending', 'stop_publishing', 'stop_watching', 'ser.close'])
+        with self.assertRaises(OSError):
+            await asyncio.open_connection("127.0.0.1", self.port)
+
+    async def test_lost_controller_stops_the_engine(self):
+        await self.start()
+        self.engine.bg_ser.fatal_error = "Lost connection to the controller"
+        self.engine.serial_event.set()
+        self.assertEqual(await asyncio.wait_for(self.run_task, 5), 1)
+        self.assertIn("Lost connection to the controller", self.logged)
+        self.assertEqual(self.calls[-1], 'ser.close')
+
+    async def test_first_stop_reason_is_reported(self):
+        await self.start()
+        self.engine.stop(1, "Controller error")
+        self.engine.stop(0, "Stop requested")
+        self.assertEqual(await asyncio.wait_for(self.run_task, 5), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import queue
+import threading
+import unittest
+from unittest import mock
+
+import redis
+
+from scriptlibs import BrewPiUtil, changeListener
+from scriptlibs.changeListener import ChangeListener
+
+
+class FakePubSub:
+    def __init__(self, client):
+        self.client = client
+        self.messages = queue.Queue()
+        self.channels = ()
+        self.closed = False
+
+    def subscribe(self, *channels):
+        if self.client.failures:
+            self.client.failures -= 1
+            raise redis.exceptions.ConnectionError("Connection refused")
+        self.channels = channels
+        self.client.subscribers.append(self)
+
+    def get_message(self, timeout=None):
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.closed = True
+        if self in self.client.subscribers:
+            self.client.subscribers.remove(self)
+
+
+class FakeRedis:
+    """Just enough of redis.Redis for publishing to channels, which can be made to fail a number of times first"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.subscribers = []
+        self.closed = False
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return FakePubSub(self)
+
+    def publish(self, channel, message):
+        for pubsub in list(self.subscribers):
+            if channel in pubsub.channels:
+                pubsub.messages.put({'type': 'message', 'channel': channel.encode(), 'data': message.encode()})
+
+    def close(self):
+        self.closed = True
+
+
+class ChangeListenerTestCase(unittest.TestCase):
+    CHANNELS = ["fermentrack:brewpi_changes:1", "fermentrack:profile_changes"]
+
+    def setUp(self):
+        self.changes = queue.Queue()
+        self.logged = []
+        for patcher in [mock.patch.object(ChangeListener, 'POLL_TIMEOUT', 0.01),
+                        mock.patch.object(ChangeListener, 'RECONNECT_DELAY', 0.01),
+                        mock.patch.object(BrewPiUtil, 'logMessage', self.logged.append)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def start(self, client):
+        listener = ChangeListener("redis://localhost", self.CHANNELS, lambda *change: self.changes.put(change))
+        with mock.patch.object(changeListener.redis.Redis, 'from_url', return_value=client):
+            listener.start()
+            self.addCleanup(listener.stop)
+            self.assertEqual(self.next_change(), (None, None))  # Once subscribed, anything could have changed
+        return listener
+
+    def next_change(self):
+        return self.changes.get(timeout=5)
+
+    def test_changes_are_passed_on(self):
+        client = FakeRedis()
+        listener = self.start(client)
+        self.assertTrue(listener.is_live())
+        client.publish(self.CHANNELS[0], '["data_point_log_interval"]')
+        client.publish(self.CHANNELS[1], "3")
+        client.publish("fermentrack:brewpi_changes:2", '["temp_format"]')  # Another device
+        self.assertEqual(self.next_change(), (self.CHANNELS[0], '["data_point_log_interval"]'))
+        self.assertEqual(self.next_change(), (self.CHANNELS[1], "3"))
+        listener.stop()
+        self.assertTrue(self.changes.empty())
+
+    def test_stop(self):
+        client = FakeRedis()
+        listener = self.start(client)
+        pubsub = client.subscribers[0]
+        listener.stop()
+        self.assertIsNone(listener.thread)
+        self.assertFalse(listener.is_live())
+        self.assertTrue(pubsub.closed)
+        self.assertTrue(client.closed)
+
+    def test_resubscribes_after_losing_redis(self):
+        client = FakeRedis(failures=3)
+        listener = self.start(client)
+        self.assertTrue(listener.is_live())
+        # The failure is only logged once, rather than on every attempt
+        self.assertEqual(self.logged, ["Unable to listen for changes from Fermentrack: Connection refused",
+                                       "Listening for changes from Fermentrack again"])
+
+    def test_not_live_until_subscribed(self):
+        client = FakeRedis(failures=1000000)
+        subscribing = threading.Event()
+        original_subscribe = FakePubSub.subscribe
+
+        def subscribe(pubsub, *channels):
+            subscribing.set()
+            original_subscribe(pubsub, *channels)
+
+        with mock.patch.object(FakePubSub, 'subscribe', subscribe), \
+                mock.patch.object(changeListener.redis.Redis, 'from_url', return_value=client):
+            listener = ChangeListener("redis://localhost", self.CHANNELS, lambda *change: self.changes.put(change))
+            listener.start()
+            subscribing.wait(5)
+            self.assertFalse(listener.is_live())
+            listener.stop()
+        self.assertTrue(self.changes.empty())
+
+
+if __name__ == '__main__':
+    unittest.main()
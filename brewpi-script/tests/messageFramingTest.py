@@ -0,0 +1,68 @@
+import unittest
+
+from scriptlibs import messageFraming
+from scriptlibs.messageFraming import FrameDecoder, pack_frame
+
+
+class MessageFramingTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        frame = pack_frame(42, messageFraming.FLAG_NO_REPLY, b"setBeer=20.0")
+        self.assertTrue(messageFraming.is_framed(frame))
+        self.assertEqual(FrameDecoder().feed(frame), [(42, messageFraming.FLAG_NO_REPLY, b"setBeer=20.0")])
+
+    def test_text_payload_is_encoded_as_cp437(self):
+        self.assertEqual(FrameDecoder().feed(pack_frame(1, 0, "18\xb0C")), [(1, 0, b"18\xf8C")])
+
+    def test_empty_payload(self):
+        self.assertEqual(FrameDecoder().feed(pack_frame(7, messageFraming.FLAG_NO_RESPONSE, b"")),
+                         [(7, messageFraming.FLAG_NO_RESPONSE, b"")])
+
+    def test_several_frames_in_one_read(self):
+        data = b"".join(pack_frame(request_id, 0, "message {}".format(request_id)) for request_id in range(5))
+        self.assertEqual(FrameDecoder().feed(data),
+                         [(request_id, 0, "message {}".format(request_id).encode()) for request_id in range(5)])
+
+    def test_frames_split_across_reads(self):
+        payload = bytes(range(256)) * 100
+        data = pack_frame(1, 0, payload) + pack_frame(2, 0, b"lcd")
+        decoder = FrameDecoder()
+        frames = []
+        for start in range(0, len(data), 7):  # Splits the headers as well as the payloads
+            frames += decoder.feed(data[start:start + 7])
+        self.assertEqual(frames, [(1, 0, payload), (2, 0, b"lcd")])
+        self.assertEqual(decoder.buffer, bytearray())
+
+    def test_incomplete_frame_is_kept(self):
+        decoder = FrameDecoder()
+        frame = pack_frame(3, 0, b"getLcd")
+        self.assertEqual(decoder.feed(frame[:messageFraming.HEADER.size - 1]), [])
+        self.assertEqual(decoder.feed(frame[messageFraming.HEADER.size - 1:-1]), [])
+        self.assertEqual(decoder.feed(frame[-1:]), [(3, 0, b"getLcd")])
+
+    def test_unframed_message(self):
+        self.assertFalse(messageFraming.is_framed(b"getLcd"))
+        self.assertFalse(messageFraming.is_framed(b""))
+
+    def test_bad_magic_is_rejected(self):
+        frame = bytearray(pack_frame(1, 0, b"getLcd"))
+        frame[0:4] = b"BPF2"
+        with self.assertRaises(ValueError):
+            FrameDecoder().feed(bytes(frame))
+
+    def test_unframed_data_after_a_frame_is_rejected(self):
+        decoder = FrameDecoder()
+        with self.assertRaises(ValueError):
+            decoder.feed(pack_frame(1, 0, b"getLcd") + b"setParameters={\"beerSet\": 20.0}")
+
+    def test_oversized_payload_is_rejected(self):
+        header = messageFraming.HEADER.pack(messageFraming.MAGIC, 1, 0, messageFraming.MAX_PAYLOAD + 1)
+        with self.assertRaises(ValueError):
+            FrameDecoder().feed(header)
+
+    def test_largest_payload_is_accepted(self):
+        header = messageFraming.HEADER.pack(messageFraming.MAGIC, 1, 0, messageFraming.MAX_PAYLOAD)
+        self.assertEqual(FrameDecoder().feed(header), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+from scriptlibs import BrewPiUtil
+from scriptlibs.pointSender import PointSender
+from scriptlibs.pointSpool import PointSpool
+
+
+def points(first, count):
+    return [{'n': n, 'beer_temp': 20.0} for n in range(first, first + count)]
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        if self.body is None:
+            raise ValueError("No JSON")
+        return self.body
+
+
+class FakeSession:
+    """Records each batch posted, and answers with the responses it's given (then 201s)"""
+
+    def __init__(self, delay=0):
+        self.posted = []
+        self.responses = []
+        self.delay = delay
+        self.closed = False
+
+    def post(self, url, json, timeout):
+        time.sleep(self.delay)
+        self.posted.append(list(json))
+        response = self.responses.pop(0) if self.responses else FakeResponse(201)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def close(self):
+        self.closed = True
+
+
+class FakePointSender(PointSender):
+    def __init__(self, url, spool=None, session=None):
+        super().__init__(url, spool)
+        self.fake_session = session or FakeSession()
+
+    def _open(self):
+        self.session = self.fake_session
+
+    def post(self, batch):
+        return self._PointSender__post(batch)
+
+    def drain_spool(self):
+        self._PointSender__drain_spool()
+
+
+class PointSenderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.spool = PointSpool(os.path.join(self.dir, "points.jsonl"))
+        self.sender = FakePointSender("http://fermentrack/api/save_points/", self.spool)
+        self.sender._open()
+        self.session = self.sender.fake_session
+        self.logged = []
+        patcher = mock.patch.object(BrewPiUtil, 'logMessage', self.logged.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def unreachable(self, times=1):
+        self.session.responses += [requests.exceptions.ConnectionError("Connection refused")] * times
+
+    def test_partial_save_retries_only_failed_points(self):
+        self.session.responses.append(FakeResponse(207, {'failed': [1, 3], 'rejected': [2]}))
+        batch = points(0, 5)
+        self.assertEqual(self.sender.post(batch), [batch[1], batch[3]])
+        self.assertEqual(self.sender.backoff, PointSender.MIN_BACKOFF)
+
+    def test_partial_save_without_failed_list_retries_everything(self):
+        self.session.responses.append(FakeResponse(207))
+        batch = points(0, 5)
+        self.assertEqual(self.sender.post(batch), batch)
+
+    def test_partial_save_from_spool_respools_failed_points(self):
+        self.spool.append(points(0, 8))
+        self.session.responses.append(FakeResponse(207, {'failed': [0, 4], 'rejected': []}))
+        with mock.patch.object(PointSender, 'MAX_BATCH_SIZE', 5):
+            self.sender.drain_spool()
+        self.assertEqual(self.session.posted, [points(0, 5)])
+        # The failed points go to the back of the spool, behind the points that haven't been tried yet
+        batch, _ = self.spool.peek(10)
+        self.assertEqual(batch, points(5, 3) + [points(0, 1)[0], points(4, 1)[0]])
+
+    def test_rejected_points_are_dropped(self):
+        self.session.responses.append(FakeResponse(404))
+        self.assertEqual(self.sender.post(points(0, 3)), [])
+        self.assertEqual(self.sender.backoff, 0)
+
+    def test_backoff_grows_and_resets(self):
+        batch = points(0, 3)
+        self.unreachable(10)
+        backoffs = []
+        for _ in range(10):
+            self.assertEqual(self.sender.post(batch), batch)
+            backoffs.append(self.sender.backoff)
+            self.assertGreater(self.sender.retry_at, time.time())
+            # Nothing is sent while backing off
+            self.assertEqual(self.sender.post(batch), batch)
+            self.sender.retry_at = 0  # As though the backoff has passed
+        self.assertEqual(backoffs, [2, 4, 8, 16, 32, 64, 128, 256, 300, 300])
+        self.assertEqual(len(self.session.posted), 10)
+
+        self.assertEqual(self.sender.post(batch), [])
+        self.assertEqual((self.sender.backoff, self.sender.retry_at), (0, 0))
+        self.assertEqual(self.logged[-1], "http://fermentrack/api/save_points/ is reachable again")
+
+    def test_server_errors_are_retried(self):
+        self.session.responses += [FakeResponse(500), FakeResponse(429)]
+        batch = points(0, 3)
+        self.assertEqual(self.sender.post(batch), batch)
+        self.sender.retry_at = 0
+        self.assertEqual(self.sender.post(batch), batch)
+        self.assertEqual(self.sender.backoff, 4)
+
+    def test_queued_points_are_sent_on_stop(self):
+        sender = FakePointSender("http://fermentrack/api/save_points/", self.spool, FakeSession(delay=0.05))
+        sender.start()
+        for point in points(0, 20):
+            sender.send(point)
+        sender.stop()
+        self.assertIsNone(sender.thread)
+        self.assertEqual([point for batch in sender.fake_session.posted for point in batch], points(0, 20))
+        self.assertTrue(sender.fake_session.closed)
+        self.assertEqual(len(self.spool), 0)
+
+    def test_unsent_points_are_spooled_on_stop(self):
+        session = FakeSession()
+        session.responses = [requests.exceptions.ConnectionError("Connection refused")]
+        sender = FakePointSender("http://fermentrack/api/save_points/", self.spool, session)
+        sender.start()
+        for point in points(0, 5):
+            sender.send(point)
+        sender.stop()
+        # Nothing is lost: the points are sent once BrewPi-Script starts again
+        batch, _ = self.spool.peek(10)
+        self.assertEqual(batch, points(0, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
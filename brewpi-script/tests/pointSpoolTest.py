@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from scriptlibs.pointSpool import PointSpool
+
+
+def points(first, count):
+    return [{'n': n, 'beer_temp': 20.0} for n in range(first, first + count)]
+
+
+def spooled_size(spooled):
+    return sum(len(json.dumps(point)) + 1 for point in spooled)
+
+
+class PointSpoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "spool", "points.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def drain(self, spool, batch_size=3):
+        sent = []
+        while len(spool):
+            batch, end_offset = spool.peek(batch_size)
+            sent += batch
+            spool.remove(end_offset)
+        return sent
+
+    def test_points_are_replayed_in_order(self):
+        spool = PointSpool(self.path)
+        spool.append(points(0, 5))
+        spool.append(points(5, 5))
+        self.assertEqual(len(spool), 10)
+        self.assertEqual(self.drain(spool), points(0, 10))
+        self.assertEqual(len(spool), 0)
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+    def test_peek_does_not_remove(self):
+        spool = PointSpool(self.path)
+        spool.append(points(0, 5))
+        self.assertEqual(spool.peek(2)[0], points(0, 2))
+        self.assertEqual(spool.peek(2)[0], points(0, 2))
+        self.assertEqual(len(spool), 5)
+
+    def test_position_survives_a_restart(self):
+        spool = PointSpool(self.path)
+        spool.append(points(0, 10))
+        spool.remove(spool.peek(4)[1])
+
+        spool = PointSpool(self.path)
+        self.assertEqual(len(spool), 6)
+        self.assertEqual(self.drain(spool), points(4, 6))
+
+    def test_points_appended_while_draining_come_last(self):
+        spool = PointSpool(self.path)
+        spool.append(points(0, 4))
+        spool.remove(spool.peek(2)[1])
+        spool.append(points(4, 4))
+        self.assertEqual(self.drain(spool), points(2, 6))
+
+    def test_cap_drops_the_newest_points(self):
+        max_bytes = spooled_size(points(0, 8) + points(12, 2))
+        spool = PointSpool(self.path, max_bytes=max_bytes)
+        self.assertEqual(spool.append(points(0, 8)), 8)
+        self.assertEqual(spool.append(points(8, 4)), 0)  # Doesn't fit - the oldest points are kept
+        self.assertEqual(spool.dropped, 4)
+        self.assertEqual(spool.append(points(12, 2)), 2)
+        self.assertEqual(len(spool), 10)
+        self.assertEqual(os.path.getsize(self.path), max_bytes)
+        self.assertEqual(self.drain(spool), points(0, 8) + points(12, 2))
+
+    def test_sent_points_are_compacted_to_make_room(self):
+        max_bytes = spooled_size(points(0, 10))
+        spool = PointSpool(self.path, max_bytes=max_bytes)
+        spool.append(points(0, 10))
+        spool.remove(spool.peek(6)[1])
+        self.assertEqual(spool.append(points(10, 3)), 3)
+        self.assertEqual(spool.dropped, 0)
+        self.assertEqual(self.drain(spool), points(6, 7))
+
+        # A restart after compacting picks up from the right place
+        spool.append(points(20, 3))
+        spool.remove(spool.peek(1)[1])
+        self.assertEqual(self.drain(PointSpool(self.path, max_bytes=max_bytes)), points(21, 2))
+
+    def test_torn_last_point_is_dropped(self):
+        spool = PointSpool(self.path)
+        spool.append(points(0, 3))
+        with open(self.path, 'ab') as f:
+            f.write(b'{"n": 3, "beer_te')
+
+        spool = PointSpool(self.path)
+        self.assertEqual(len(spool), 3)
+        self.assertEqual(self.drain(spool), points(0, 3))
+
+    def test_invalid_offset_is_ignored(self):
+        spool = PointSpool(self.path)
+        spool.append(points(0, 3))
+        with open(self.path + ".offset", 'w') as f:
+            f.write("999999")
+        self.assertEqual(self.drain(PointSpool(self.path)), points(0, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
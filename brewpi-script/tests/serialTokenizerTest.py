@@ -0,0 +1,64 @@
+import unittest
+
+from scriptlibs.backgroundserial import SerialTokenizer
+from scriptlibs.expandLogMessage import filterOutLogMessages
+
+
+class SerialTokenizerTestCase(unittest.TestCase):
+    def feed_in_pieces(self, data, size):
+        tokenizer = SerialTokenizer()
+        lines, messages = [], []
+        for start in range(0, len(data), size):
+            new_lines, new_messages = tokenizer.feed(data[start:start + size])
+            lines += new_lines
+            messages += new_messages
+        return lines, messages
+
+    def test_lines(self):
+        self.assertEqual(SerialTokenizer().feed(b'T:{"BeerTemp":20.1}\nC:{"beerFast":1}\n'),
+                         (['T:{"BeerTemp":20.1}', 'C:{"beerFast":1}'], []))
+
+    def test_blank_lines_are_dropped(self):
+        self.assertEqual(SerialTokenizer().feed(b'\nT:{"a":1}\n\n\nN:{"v":"0.2.4"}\n'),
+                         (['T:{"a":1}', 'N:{"v":"0.2.4"}'], []))
+        self.assertEqual(SerialTokenizer().feed(b'\n'), ([], []))
+
+    def test_crlf_and_lf_line_endings(self):
+        # The carriage return is left on the line, as it always has been - json.loads ignores it
+        self.assertEqual(SerialTokenizer().feed(b'T:{"a":1}\r\nT:{"a":2}\n'), (['T:{"a":1}\r', 'T:{"a":2}'], []))
+
+    def test_partial_line_is_held_back(self):
+        tokenizer = SerialTokenizer()
+        self.assertEqual(tokenizer.feed(b'T:{"a"'), ([], []))
+        self.assertEqual(tokenizer.feed(b':1}\n'), (['T:{"a":1}'], []))
+
+    def test_log_messages(self):
+        self.assertEqual(SerialTokenizer().feed(b'D:{"logType":"I","logID":1,"V":[]}\r\nT:{"a":1}\n'),
+                         (['T:{"a":1}'], ['{"logType":"I","logID":1,"V":[]}\r\n']))
+
+    def test_log_message_inside_a_line(self):
+        data = b'd:[{"c":1,"b":0,"f":0,D:{"logType":"W","logID":3}\n"h":1,"p":5}]\n'
+        self.assertEqual(SerialTokenizer().feed(data),
+                         (['d:[{"c":1,"b":0,"f":0,"h":1,"p":5}]'], ['{"logType":"W","logID":3}\n']))
+
+    def test_log_message_split_across_reads(self):
+        data = b'T:{"a":1}\nD:{"logType":"E","logID":7,"V":[2]}\r\nd:[{"c":1,D:{"logType":"I","logID":4}\n"p":5}]\n'
+        expected = (['T:{"a":1}', 'd:[{"c":1,"p":5}]'],
+                    ['{"logType":"E","logID":7,"V":[2]}\r\n', '{"logType":"I","logID":4}\n'])
+        for size in range(1, 12):
+            with self.subTest(size=size):
+                self.assertEqual(self.feed_in_pieces(data, size), expected)
+
+    def test_matches_filter_out_log_messages(self):
+        data = 'd:[{"c":1,D:{"logType":"I","logID":4}\n"p":5}]\nD:{"logType":"E","logID":7}\r\nT:{"a":1}\n'
+        stripped, messages = filterOutLogMessages(data)
+        lines, tokenized_messages = SerialTokenizer().feed(data)
+        self.assertEqual(lines, [line for line in stripped.split('\n') if line])
+        self.assertEqual(tokenized_messages, [message[2:] for message in messages])
+
+    def test_text_is_encoded_as_cp437(self):
+        self.assertEqual(SerialTokenizer().feed('T:{"a":"18\xb0C"}\n'), (['T:{"a":"18\xb0C"}'], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
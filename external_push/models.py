@@ -211,6 +211,12 @@ class GenericPushTarget(models.Model):
                     except:
                         pass
 
+                    # The running stats for the active beer are kept up to date as points are logged, so they're cheap
+                    if brewpi.active_beer is not None:
+                        beer_stats = brewpi.active_beer.stats()
+                        if beer_stats is not None:
+                            data_to_send['beer_stats'] = beer_stats
+
                     to_send['brewpi_devices'].append(data_to_send)
 
             if grav_sensors_to_send is not None:
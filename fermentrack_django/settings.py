@@ -187,6 +187,24 @@ MEDIA_ROOT = ROOT_DIR / 'media'
 DATA_URL = '/data/'
 DATA_ROOT = ROOT_DIR / 'data'
 
+# Log file writers (see app/log_writer.py). Every point is handed to the OS as it is written (so the dashboards - and
+# any other process writing the same log - see it immediately) but not fsync'd. LOG_WRITER_FLUSH_ROWS/SECONDS control
+# how often the stats sidecar is saved (and the files fsync'd, if LOG_WRITER_FSYNC is set to trade speed for
+# durability).
+LOG_WRITER_FLUSH_ROWS = env.int("LOG_WRITER_FLUSH_ROWS", default=1)
+LOG_WRITER_FLUSH_SECONDS = env.float("LOG_WRITER_FLUSH_SECONDS", default=30.0)
+LOG_WRITER_FSYNC = env.bool("LOG_WRITER_FSYNC", default=False)
+LOG_WRITER_MAX_OPEN_LOGS = env.int("LOG_WRITER_MAX_OPEN_LOGS", default=32)
+LOG_WRITER_IDLE_SECONDS = env.float("LOG_WRITER_IDLE_SECONDS", default=600.0)
+# Rows between entries in the sparse time index kept alongside each CSV log (see app/log_index.py)
+LOG_INDEX_INTERVAL = env.int("LOG_INDEX_INTERVAL", default=100)
+# Journals larger than this are cut back once everything they cover has been synced to disk (see app/log_journal.py)
+LOG_JOURNAL_MAX_BYTES = env.int("LOG_JOURNAL_MAX_BYTES", default=64 * 1024)
+# Once logging stops, the CSVs for a log are compressed after LOG_ARCHIVE_DELAY seconds (see app/log_archive.py). This
+# should be longer than LOG_WRITER_IDLE_SECONDS so that every process has closed the log by then.
+LOG_ARCHIVE_ENABLED = env.bool("LOG_ARCHIVE_ENABLED", default=True)
+LOG_ARCHIVE_DELAY = env.float("LOG_ARCHIVE_DELAY", default=900.0)
+
 
 # Backups
 # ------------------------------------------------------------------------------
@@ -297,6 +315,21 @@ CONSTANCE_SETUP_URL = 'setup_config'    # Used in @site_is_configured decorator
 REDIS_URL = env("REDIS_URL", default=f"redis://127.0.0.1:6379/0")
 
 
+# How BrewPi-Script saves beer log points - "http" posts them to /api/save_points/, while "redis" adds them to a Redis
+# stream that is drained by `manage.py consume_log_points` (see app/log_stream.py). Only one of the two writes to a
+# given beer's log, so BrewPi-Script needs to be restarted after this is changed.
+BREWPI_LOG_TRANSPORT = env("BREWPI_LOG_TRANSPORT", default="http")
+# Cap on the number of unconsumed points in the stream (e.g. if the consumer isn't running). Once it's reached,
+# BrewPi-Script spools points to disk until the consumer catches up.
+LOG_STREAM_MAXLEN = env.int("LOG_STREAM_MAXLEN", default=100000)
+
+# When True, fermentrack_caller runs BrewPi-Script for every controller inside a single process (sharing one copy of
+# Django) rather than spawning a process per controller
+BREWPI_HOST_MODE = env.bool("BREWPI_HOST_MODE", default=False)
+# Maximum number of controllers fermentrack_caller connects to at the same time when starting up
+BREWPI_STARTUP_PARALLELISM = env.int("BREWPI_STARTUP_PARALLELISM", default=4)
+
+
 # Huey Configuration
 HUEY = {
     'name': 'fermentrack_huey',
@@ -12,6 +12,8 @@ import app.beer_views
 import app.api.lcd
 import app.api.clog
 import app.api.devices
+import app.api.logs
+import app.api.metrics
 
 import firmware_flash.urls
 import gravity.urls
@@ -101,17 +103,24 @@ urlpatterns = [
     url(r'^api/lcd/(?P<device_id>\d{1,20})/$', app.api.lcd.getLCD, name="getLCD"),  # For a single device
     url(r'^api/lcd/$', app.api.lcd.getLCDs, name="getLCDs"),  # For all devices/LCDs
     url(r'^api/panel/(?P<device_id>\d{1,20})/$', app.api.lcd.getPanel, name="getPanel"),  # For a single device
+    url(r'^api/metrics/$', app.api.metrics.get_metrics, name="getMetrics"),  # BrewPi-Script metrics, for Prometheus
     # Read controller log files
     # for the /api/log endpoint, converting to /api/log/<returntype>/<devicetype>/<logtype>/d<device_id>/l<lines>/
     url(r'^api/log/(?P<return_type>text|json)/(?P<device_type>\w{1,20})/(?P<logfile>stdout|stderr)/d(?P<device_id>\d{1,20})/$', app.api.clog.get_device_log_combined, name="get_device_log"),
     url(r'^api/log/(?P<return_type>text|json)/(?P<device_type>\w{1,20})/(?P<logfile>stdout|stderr)/d(?P<device_id>\d{1,20})/l(?P<lines>\d{1,20})/$', app.api.clog.get_device_log_combined, name="get_device_log_lines"),
     url(r'^api/log/(?P<return_type>text|json)/(?P<device_type>\w{1,20})/(?P<logfile>stdout|stderr)/$', app.api.clog.get_device_log_combined, name="get_app_log"),
     url(r'^api/log/(?P<return_type>text|json)/(?P<device_type>\w{1,20})/(?P<logfile>stdout|stderr)/l(?P<lines>\d{1,20})/$', app.api.clog.get_device_log_combined, name="get_app_log_lines"),
+    url(r'^api/beer/(?P<beer_id>\d{1,20})/graph.csv$', app.api.logs.beer_graph_csv, name="beer_graph_csv"),  # Rolled up data sized for the dashboard graph
+    url(r'^api/beer/(?P<beer_id>\d{1,20})/(?P<which>base_csv|full_csv)/$', app.api.logs.beer_range_csv, name="beer_range_csv"),  # Rows between start & end
+    url(r'^api/beer/(?P<beer_id>\d{1,20})/rows/$', app.api.logs.beer_rows, name="beer_rows"),  # Rows appended since an offset/timestamp
+    url(r'^api/beer/(?P<beer_id>\d{1,20})/export.csv$', app.api.logs.export_beer_csv, name="export_beer_csv"),  # CSV generated from the binary log
+    url(r'^api/beer/(?P<beer_id>\d{1,20})/stats/$', app.api.logs.beer_stats, name="beer_stats"),  # Running statistics summary
     # api/gravity views are located in the gravity app
 
     # These API endpoints are used by the BrewPi Script Caller
     url(r'^api/devices/$', app.api.devices.get_devices, name="getDevices"),  # To retrieve a BrewPiDevice
     url(r'^api/save_point/$', app.api.devices.create_beer_log_point, name="savePoint"),  # To create a BeerLogPoint
+    url(r'^api/save_points/$', app.api.devices.create_beer_log_points, name="savePoints"),  # To create a batch of BeerLogPoints
 
     # Login/Logout Views
     url(r'^accounts/login/$', app.views.login, name='login'),  # This is also settings.LOGIN_URL
@@ -0,0 +1,47 @@
+from django.http import HttpResponse
+
+from app.api.logs import log_csv_export_response, log_graph_response, log_range_response, log_rows_response, \
+    log_stats_response
+from gravity.models import GravityLog
+
+
+def export_gravity_log_csv(req, log_id):
+    try:
+        gravity_log = GravityLog.objects.get(id=log_id)
+    except GravityLog.DoesNotExist:
+        return HttpResponse("Gravity log not found", status=404, content_type="text/plain")
+
+    columns = req.GET.get('columns', None)
+    return log_csv_export_response(gravity_log, columns.split(",") if columns else None)
+
+
+def gravity_log_graph_csv(req, log_id):
+    try:
+        gravity_log = GravityLog.objects.get(id=log_id)
+    except GravityLog.DoesNotExist:
+        return HttpResponse("Gravity log not found", status=404, content_type="text/plain")
+    return log_graph_response(req, gravity_log)
+
+
+def gravity_log_range_csv(req, log_id, which):
+    try:
+        gravity_log = GravityLog.objects.get(id=log_id)
+    except GravityLog.DoesNotExist:
+        return HttpResponse("Gravity log not found", status=404, content_type="text/plain")
+    return log_range_response(req, gravity_log, which)
+
+
+def gravity_log_rows(req, log_id):
+    try:
+        gravity_log = GravityLog.objects.get(id=log_id)
+    except GravityLog.DoesNotExist:
+        return HttpResponse("Gravity log not found", status=404, content_type="text/plain")
+    return log_rows_response(req, gravity_log)
+
+
+def gravity_log_stats(req, log_id):
+    try:
+        gravity_log = GravityLog.objects.get(id=log_id)
+    except GravityLog.DoesNotExist:
+        return HttpResponse("Gravity log not found", status=404, content_type="text/plain")
+    return log_stats_response(gravity_log)
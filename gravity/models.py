@@ -6,6 +6,7 @@ from django.core.validators import MinValueValidator, MaxValueValidator, RegexVa
 from django.utils import timezone
 from django.db.models.signals import pre_delete
 from django.dispatch import receiver
+from django.urls import reverse
 from django.core import serializers
 
 from pathlib import Path
@@ -17,6 +18,7 @@ import re
 import redis
 
 from app.models import BrewPiDevice
+from app import log_writer, binary_log, log_archive, log_index, log_rollups, log_rows, log_stats
 
 # if typing.TYPE_CHECKING:
 from decimal import Decimal
@@ -186,6 +188,27 @@ class GravitySensor(models.Model):
         else:
             return round(point.temp, 1), point.temp_format
 
+    def retrieve_logged_readings(self, start: datetime.datetime, end: datetime.datetime) -> list:
+        """
+        Returns the readings recorded to the active log between start & end (oldest first) as a list of
+        (log_time, gravity, temp, temp_format) - rounded & filtered like the loggable readings above. Used to enrich
+        beer log points that are saved long after they were taken. Empty if nothing is being logged.
+        """
+        if self.active_log is None:
+            return []
+        readings = []
+        for line in self.active_log.read_range(start, end, 'full_csv'):
+            try:
+                row = next(csv.reader([line.decode('utf-8')]))
+                log_time = binary_log.parse_csv_time(row[0])
+                gravity = round(Decimal(row[1]), 3) if self.log_gravity and row[1] else None
+                # Missing temps are written out as 0
+                temp = round(Decimal(row[2]), 1) if self.log_temp and row[2] and Decimal(row[2]) != 0 else None
+            except (ArithmeticError, IndexError, ValueError):
+                continue  # A row we can't make sense of is no more use than a missing one
+            readings.append((log_time, gravity, temp, row[3] if temp is not None else None))
+        return readings
+
     def create_log_and_start_logging(self, name: str):
         # First, create the new gravity log
         new_log = GravityLog(
@@ -341,20 +364,69 @@ class GravityLog(models.Model):
             return base_name + "_full.csv"
         elif which_file == 'annotation_json':
             return base_name + "_annotations.almost_json"
+        elif which_file == 'binary':
+            return base_name + "_data.bin"
+        elif which_file == 'binary_annotations':
+            return base_name + "_annotations.jsonl"
+        elif which_file in log_rollups.LEVEL_NAMES:
+            return base_name + "_{}.bin".format(which_file)
+        elif which_file in log_index.INDEX_FILES.values():
+            return base_name + "_{}.idx".format(which_file)
+        elif which_file == 'journal':
+            return base_name + "_journal.bin"
+        elif which_file == 'stats':
+            return base_name + "_stats.json"
+        elif which_file == 'lock':
+            return base_name + "_write.lock"
         else:
             return ""
 
     def data_file_url(self, which_file: str) -> str:
         return settings.DATA_URL + self.full_filename(which_file)
 
+    def log_file_paths(self) -> dict:
+        """Returns the paths to each of the log files for this gravity log, keyed by file type"""
+        file_name_base = settings.ROOT_DIR / settings.DATA_ROOT
+        return {which_file: file_name_base / self.full_filename(which_file)
+                for which_file in log_writer.LOG_FILES}
+
+    def log_key(self) -> str:
+        return log_writer.gravity_log_key(self.id)
+
+    def binary_layout(self) -> binary_log.RecordLayout:
+        return binary_log.GRAVITY_LAYOUT
+
+    def read_range(self, start=None, end=None, which: str = 'full_csv', include_header: bool = False):
+        """Yields the raw CSV lines logged between start (inclusive) and end (exclusive). See log_index.read_range."""
+        return log_index.read_range(self, start, end, which, include_header)
+
+    def load_binary_log(self):
+        """
+        Returns the binary log for this gravity log (see binary_log.load), or None if nothing has been logged yet or the log
+        hasn't been converted to the binary store yet (see log_writer.build_derived_files)
+        """
+        if not binary_log.exists(self):
+            return None
+        return binary_log.load(self.log_file_paths()['binary'])
+
+    def row_layout(self) -> log_rows.RowLayout:
+        """Returns the precompiled layout used to write points to this log's files (see log_rows.py)"""
+        addl_data_cols = self.device.addl_data_cols()
+        return log_rows.layout_for(self, (self.name, self.device_id, addl_data_cols), addl_data_cols=addl_data_cols)
+
+    def stats(self) -> dict or None:
+        """Returns the running statistics for this log (see log_stats.LogStats.summary), or None if nothing was logged"""
+        return log_stats.summary(self)
+
     def full_csv_url(self) -> str:
-        return self.data_file_url('full_csv')
+        # Served through the range API rather than directly from DATA_URL so that archived logs are decompressed
+        return reverse('gravity_log_range_csv', kwargs={'log_id': self.id, 'which': 'full_csv'})
 
     def full_csv_exists(self) -> bool:
         # This is so that we can test if the log exists before presenting the user the option to download it
         file_name_base = settings.ROOT_DIR / settings.DATA_ROOT
         full_csv_file = file_name_base / self.full_filename('full_csv')
-        return os.path.isfile(full_csv_file)
+        return log_archive.exists(full_csv_file)
 
     # def base_csv_url(self):
     #     return self.data_file_url('base_csv')
@@ -407,17 +479,16 @@ class GravityLog(models.Model):
 # When the user attempts to delete a gravity log, also delete the log files associated with it.
 @receiver(pre_delete, sender=GravityLog)
 def delete_gravity_log(sender, instance, **kwargs):
-    file_name_base = settings.ROOT_DIR / settings.DATA_ROOT
+    # Make sure we're not holding the files open (and don't write anything buffered back out after they're deleted)
+    log_writer.release_log(instance.log_key())
+    log_rows.forget(instance.log_key())
 
-    base_csv_file = file_name_base / instance.full_filename('base_csv')
-    full_csv_file = file_name_base / instance.full_filename('full_csv')
-    annotation_json = file_name_base / instance.full_filename('annotation_json')
-
-    for this_filepath in [base_csv_file, full_csv_file, annotation_json]:
+    for this_filepath in instance.log_file_paths().values():
         try:
             os.remove(this_filepath)
         except OSError:
             pass
+        log_archive.remove_archive(this_filepath)
 
 
 class GravityLogPoint(models.Model):
@@ -476,11 +547,14 @@ class GravityLogPoint(models.Model):
         else:
             return (self.temp-32) * 5 / 9
 
-    def data_point(self, data_format: str='base_csv', set_defaults: bool=True) -> list:
+    def log_rows(self, layout: log_rows.RowLayout, set_defaults: bool=True) -> tuple:
+        """
+        Generates the base & full CSV rows and the annotations for this point in a single pass, using the precompiled
+        layout for the associated log (see GravityLog.row_layout). Returns ({'base_csv': row, 'full_csv': row},
+        annotations)
+        """
         # Everything gets stored in UTC and then converted back on the fly
-
-        utc_tz = pytz.timezone("UTC")
-        time_value = self.log_time.astimezone(utc_tz).strftime('%Y/%m/%d %H:%M:%SZ')  # Adding 'Zulu' designation
+        time_value = log_rows.format_log_time(self.log_time)  # Includes the 'Zulu' designation
 
         if set_defaults:
             temp = self.temp or 0
@@ -495,73 +569,43 @@ class GravityLogPoint(models.Model):
             gravity_latest = self.gravity_latest or None
             temp_latest = self.temp_latest or None
 
-        if data_format == 'base_csv':
-            return [time_value, self.gravity, temp]
-        elif data_format == 'full_csv':
-            data_list = [time_value, self.gravity, temp, temp_format, self.temp_is_estimate, gravity_latest,
-                         temp_latest, extra_data, self.associated_log]
-            # For devices that have additional data columns, append them to the full_csv
-            if self.associated_device.addl_data_cols() >= 1:
-                data_list.append(self.addl_data_point1)
-            if self.associated_device.addl_data_cols() >= 2:
-                data_list.append(self.addl_data_point2)
-            return data_list
-
-        elif data_format == 'annotation_json':
-            # Annotations are just the extra data (for now)
-            retval = []
-            if self.extra_data is not None:
-                try:
-                    if isinstance(self.extra_data, str):
-                        shortText = self.extra_data[:1]
-                    else:
-                        # If the extra_data isn't a string (the angle that we're saving for iSpindels, for example) then
-                        # we need to manually determine the shortText.
-                        # That said, I could argue that we shouldn't be saving anything out at all (annotation wise) if
-                        # this is the case. Question for later.
-                        shortText = "f"
-                except:
+        base_row = [time_value, self.gravity, temp]
+        full_row = [time_value, self.gravity, temp, temp_format, self.temp_is_estimate, gravity_latest, temp_latest,
+                    extra_data, self.associated_log]
+        # For devices that have additional data columns, append them to the full_csv
+        if layout.addl_data_cols >= 1:
+            full_row.append(self.addl_data_point1)
+        if layout.addl_data_cols >= 2:
+            full_row.append(self.addl_data_point2)
+
+        # Annotations are just the extra data (for now)
+        annotations = []
+        if self.extra_data is not None:
+            try:
+                if isinstance(self.extra_data, str):
+                    shortText = self.extra_data[:1]
+                else:
+                    # If the extra_data isn't a string (the angle that we're saving for iSpindels, for example) then
+                    # we need to manually determine the shortText.
+                    # That said, I could argue that we shouldn't be saving anything out at all (annotation wise) if
+                    # this is the case. Question for later.
                     shortText = "f"
-                retval.append({'series': 'temp', 'x': time_value, 'shortText': shortText,
-                               'text': self.extra_data})
-            return retval
-        else:
-            pass
+            except:
+                shortText = "f"
+            annotations.append({'series': 'temp', 'x': time_value, 'shortText': shortText, 'text': self.extra_data})
 
-    def save(self, *args, **kwargs):
-        # Don't repeat yourself
-        def check_and_write_headers(path, col_headers: list):
-            if not os.path.exists(path):
-                with open(path, 'w') as f:
-                    writer = csv.writer(f)
-                    writer.writerow(col_headers)
-
-        def write_data(path, row_data: list):
-            with open(path, 'a') as f:
-                writer = csv.writer(f)
-                writer.writerow(row_data)
-
-        def check_and_write_annotation_json_head(path: str):
-            if not os.path.exists(path):
-                with open(path, 'w') as f:
-                    f.write("[\r\n")
-                return False
-            else:
-                return True
+        return {'base_csv': base_row, 'full_csv': full_row}, annotations
+
+    def data_point(self, data_format: str='base_csv', set_defaults: bool=True) -> list:
+        rows, annotations = self.log_rows(self.associated_log.row_layout(), set_defaults)
+        if data_format == 'annotation_json':
+            return annotations
+        return rows.get(data_format)
 
-        def write_annotation_json(path: str, annotation_data: list, write_comma: bool=True):
-            # annotation_data is actually an array of potential annotations. We'll loop through them & write them out
-            with open(path, 'a') as f:
-                for this_annotation in annotation_data:
-                    if write_comma:  # We only want to do this once per run, regardless of the size of annotation_data
-                        f.write(',\r\n')
-                        write_comma = False
-                    f.write('  {')
-                    f.write('"series": "{}", "x": "{}",'.format(this_annotation['series'], this_annotation['x']))
-                    f.write(' "shortText": "{}", "text": "{}"'.format(this_annotation['shortText'],
-                                                                      this_annotation['text']))
-                    f.write('}')
+    def binary_values(self) -> dict:
+        return {'log_time': binary_log.to_epoch_ms(self.log_time), 'gravity': self.gravity, 'temp': self.temp}
 
+    def save(self, *args, **kwargs):
         # If we have a currently valid _gravity_ log, then write the data out. Otherwise, assume that we're just
         # collecting data to display on the dashboard.
         if self.associated_log is not None:
@@ -574,25 +618,14 @@ class GravityLogPoint(models.Model):
                     self.temp = self.temp_to_c()
                 self.temp_format = self.associated_log.format
 
-            file_name_base = settings.ROOT_DIR / settings.DATA_ROOT
-
-            base_csv_file = file_name_base / self.associated_log.full_filename('base_csv')
-            full_csv_file = file_name_base / self.associated_log.full_filename('full_csv')
-            annotation_json = file_name_base / self.associated_log.full_filename('annotation_json')
-
-            # Write out headers (if the files don't exist)
-            check_and_write_headers(base_csv_file, self.associated_log.column_headers('base_csv'))
-            check_and_write_headers(full_csv_file, self.associated_log.column_headers('full_csv'))
-
-            # And then write out the data
-            write_data(base_csv_file, self.data_point('base_csv'))
-            write_data(full_csv_file, self.data_point('full_csv'))
+            layout = self.associated_log.row_layout()
+            rows, annotations = self.log_rows(layout)
 
-            # Next, do the json file
-            annotation_data = self.data_point('annotation_json')
-            if len(annotation_data) > 0:  # Not all log points come with annotation data
-                json_existed = check_and_write_annotation_json_head(annotation_json)
-                write_annotation_json(annotation_json, annotation_data, json_existed)
+            # The headers are only written out if the files don't exist yet. Annotations are optional - not all log
+            # points come with annotation data.
+            log_writer.write_point(layout.key, layout.paths, rows=rows, headers=layout.headers,
+                                   annotations=annotations, layout=layout.binary_layout,
+                                   binary_values=self.binary_values())
 
             # super(BeerLogPoint, self).save(*args, **kwargs)
 
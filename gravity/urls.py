@@ -8,6 +8,7 @@ import gravity.views
 import gravity.views_ispindel
 import gravity.views_tilt
 import gravity.api.sensors
+import gravity.api.logs
 
 app_name = "gravity"
 
@@ -42,6 +43,11 @@ gravity_urlpatterns = [
     url(r'^api/gravity/$', gravity.api.sensors.get_gravity_sensors, name="getSensors"),  # For all sensors
     url(r'^api/gravity/ispindel/(?P<device_id>\d{1,20})/$', gravity.api.sensors.get_ispindel_extras, name="get_ispindel_extras"),  # Specific to iSpindel devices, allows for easy calibration
     url(r'^api/gravity/tilt/(?P<device_id>\d{1,20})/$', gravity.api.sensors.get_tilt_extras, name="get_tilt_extras"),  # Specific to Tilt Hydrometers, allows for easy calibration
+    url(r'^api/gravity/log/(?P<log_id>\d{1,20})/graph.csv$', gravity.api.logs.gravity_log_graph_csv, name="gravity_log_graph_csv"),  # Rolled up data sized for the dashboard graph
+    url(r'^api/gravity/log/(?P<log_id>\d{1,20})/(?P<which>base_csv|full_csv)/$', gravity.api.logs.gravity_log_range_csv, name="gravity_log_range_csv"),  # Rows between start & end
+    url(r'^api/gravity/log/(?P<log_id>\d{1,20})/rows/$', gravity.api.logs.gravity_log_rows, name="gravity_log_rows"),  # Rows appended since an offset/timestamp
+    url(r'^api/gravity/log/(?P<log_id>\d{1,20})/export.csv$', gravity.api.logs.export_gravity_log_csv, name="export_gravity_log_csv"),  # CSV generated from the binary log
+    url(r'^api/gravity/log/(?P<log_id>\d{1,20})/stats/$', gravity.api.logs.gravity_log_stats, name="gravity_log_stats"),  # Running statistics summary
 
     # iSpindel specific Views
     url(r'^i[sS]{1}pind[el]{2}/?$', gravity.views_ispindel.ispindel_handler, name="gravity_ispindel"),  # Handler for ispindel gravity readings
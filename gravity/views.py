@@ -5,7 +5,12 @@ from constance import config
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
 from django.http import JsonResponse, HttpResponse
+from django.urls import reverse
+from django.db import transaction
 import app.almost_json as almost_json
+import app.log_writer as log_writer
+import app.log_archive as log_archive
+import app.tasks as tasks
 from django.views.decorators.csrf import csrf_exempt
 from django.core.exceptions import ObjectDoesNotExist
 
@@ -198,7 +203,8 @@ def gravity_dashboard(request, sensor_id, log_id=None):
         # TODO - Determine if we want to load some fake "example" data (similar to what brewpi-www does)
         log_file_url = "/data/gravity_fake.csv"
     else:
-        log_file_url = active_log.data_file_url('base_csv')
+        # The graph data is rolled up to fit the width of the graph (the width gets appended in the template)
+        log_file_url = reverse('gravity_log_graph_csv', kwargs={'log_id': active_log.id})
 
     return render(request, template_name="gravity/gravity_dashboard.html",
                   context={'active_device': active_device, 'log_create_form': log_create_form,
@@ -268,8 +274,11 @@ def gravity_log_stop(request, sensor_id):
             messages.error(request, u'This sensor is currently assigned to a temperature controller. Please stop '
                                     u'logging for that temperature controller to stop logging for this sensor.')
         else:
+            log_id = sensor.active_log_id
+            log_writer.release_log(sensor.active_log.log_key())
             sensor.active_log = None
             sensor.save()
+            transaction.on_commit(lambda: tasks.schedule_log_archive(tasks.archive_gravity_log, log_id))
             messages.success(request, u'Logging has been stopped for sensor {}'.format(sensor))
 
     else:
@@ -547,11 +556,11 @@ def almost_json_view(request, sensor_id, log_id):
 
     filename = settings.ROOT_DIR / settings.DATA_ROOT / gravity_log.full_filename("annotation_json")
 
-    if os.path.isfile(filename):  # If there are no annotations, return an empty JsonResponse
-        f = open(filename, 'r')
+    if log_archive.exists(filename):  # If there are no annotations, return an empty JsonResponse
+        f = log_archive.open_log_file(filename, 'r')  # Transparently decompresses the file if the log was archived
         wrapper = almost_json.AlmostJsonWrapper(f, closing_string=json_close)
         response = HttpResponse(wrapper, content_type="application/json")
-        response['Content-Length'] = os.path.getsize(filename) + len(json_close)
+        response['Content-Length'] = log_archive.size(filename) + len(json_close)
         return response
     else:
         empty_array = []